@@ -9,13 +9,25 @@ import tkinter as tk
 from tkinter import messagebox, ttk
 import ttkbootstrap as tb
 from ttkbootstrap.constants import *
-from datetime import datetime
-import mysql.connector
-from mysql.connector import Error
+from datetime import datetime, date, timedelta
+try:
+    import mysql.connector
+    from mysql.connector import Error
+except ImportError:  # SQLite-only installs do not need the MySQL driver
+    mysql = None
+
+    class Error(Exception):
+        pass
+import sqlite3
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib import colors
 from reportlab.platypus import Table, TableStyle
+from reportlab.lib.utils import ImageReader
+from reportlab import rl_config
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfbase.pdfdoc import PDFArray, PDFDictionary, PDFName, PDFStream, PDFString
 import os
 import sys
 import textwrap
@@ -26,104 +38,1769 @@ import smtplib
 import ssl
 import mimetypes
 from email.message import EmailMessage
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import OrderedDict
+from collections.abc import Mapping
+from types import MappingProxyType
+import logging
+import threading
+import time
+import json
+import re
+import bisect
+import functools
+from abc import ABC, abstractmethod
+import gc
+import zlib
+import hashlib
+import random
+import zipfile
+import io
+import tempfile
+from array import array
+import asyncio
+from urllib.parse import urlsplit, parse_qs, unquote
+from xml.sax.saxutils import escape as xml_escape
+from tkinter import simpledialog
 
 # =============================================================================
 # 1. SYSTEM CONFIGURATION
 # =============================================================================
 
-COMPANY_CONFIG = {
-    "company_name": "NASCOMSOFT EMBEDED",  
-    "address": "Anguwan Cashew, Off Dass Road,\nOpposite Elim Church, 740102,\nYelwa, Bauchi State.",
-    "tin": "22843418-0001",
-    "currency_symbol": "N",
-    "vat_rate": 0.075,
-    "bank_name": "First Bank",
-    "account_number": "2037467351",
-    "account_name": "Nascomsoft Embedded"
+# Built-in defaults. Every setting the app reads is declared here; the config file, the
+# app_settings table and NASCOMSOFT_* environment variables may only override these keys
+# (pdf_profiles, whose entries are named by the user, is the exception).
+DEFAULT_CONFIG = {
+    'company': {
+        'company_name': "NASCOMSOFT EMBEDED",
+        'address': "Anguwan Cashew, Off Dass Road,\nOpposite Elim Church, 740102,\nYelwa, Bauchi State.",
+        'tin': "22843418-0001",
+        'currency_symbol': "N",
+        'vat_rate': 0.075,
+        'bank_name': "First Bank",
+        'account_number': "2037467351",
+        'account_name': "Nascomsoft Embedded"
+    },
+    'db': {
+        'backend': 'mysql',  # 'mysql' or 'sqlite' (embedded, no server needed)
+        'host': 'localhost',
+        'user': 'root',
+        'password': '',
+        'database': 'nascomsoft_billing_db',
+        'sqlite_path': 'nascomsoft_billing.db',
+        'sqlite_timeout': 10,           # seconds to wait for another client's write lock
+        'statement_cache_size': 256     # compiled statements kept per SQLite connection
+    },
+    # SMTP/email settings; saved from the UI into app_settings so they survive restarts, except the
+    # password, which is kept in the config file (see DB_SECRET_KEYS). The default from-email is the company address.
+    'smtp': {
+        'host': '',
+        'port': 587,
+        'username': '',
+        'password': '',
+        'use_tls': True,
+        'from_email': 'info@nascomsoft.com'
+    },
+    # Archive & purge job: documents older than the retention window leave the live tables
+    'archive': {
+        'retention_days': 730,
+        'batch_size': 500,         # documents moved per transaction (keeps live-table locks short)
+        'pause_seconds': 0.05,     # breathing room for other clients between batches
+        'pdf_dir': '.',            # where Invoice_*.pdf / Quotation_*.pdf are written
+        'archive_dir': 'archive'   # zip bundles of archived PDFs
+    },
+    # Audit trail: events are queued in memory and written to audit_log in batches
+    'audit': {
+        'actor': os.environ.get('USERNAME') or os.environ.get('USER') or 'clerk',  # recorded as who did it
+        'batch_size': 50,          # queued events that force an immediate write
+        'flush_seconds': 2         # the app writes whatever is queued at least this often
+    },
+    # Multi-user coordination: every committed change is appended to change_feed, which open
+    # dashboards poll to apply incremental updates
+    'change_feed': {
+        'poll_seconds': 3,         # how often an open dashboard asks for new changes
+        'retention_hours': 24,     # older feed rows are pruned at startup
+        'renumber_attempts': 5     # retries when another user saved the previewed document number first
+    },
+    'pdf': {
+        'profile': 'standard',     # profile used for saved/emailed documents
+        'logo_cache_size': 8,      # downsampled logos kept in memory (one per path/dpi)
+        'statement_chunk': 200,    # invoices read (and held) at a time while rendering a statement
+        'statement_part_pages': 250,  # statement pages held on one canvas before they are written to a part file
+        'preview_width': 360,      # dashboard preview pane width in pixels
+        'preview_cache_size': 64   # rendered previews kept in memory (least recently used dropped first)
+    },
+    # PDF output profiles.
+    #   compress  - deflate page content streams
+    #   logo_dpi  - downsample the logo to this resolution at its printed size (None = embed as-is)
+    #   fonts     - TrueType files (regular, bold, italic) embedded as subsets; None = built-in Helvetica, not embedded
+    #   pdfa      - write PDF/A-2b identification (XMP metadata + sRGB output intent); needs embedded fonts
+    'pdf_profiles': {
+        'standard': {'compress': True, 'logo_dpi': None, 'fonts': None, 'pdfa': False},
+        'email-small': {'compress': True, 'logo_dpi': 96, 'fonts': None, 'pdfa': False},
+        'archive-pdfa': {'compress': True, 'logo_dpi': 300, 'fonts': ('Vera.ttf', 'VeraBd.ttf', 'VeraIt.ttf'), 'pdfa': True},
+    },
+    'app': {
+        'workers': 2,              # background threads for PDF rendering, previews and statements
+        'page_size': 25,           # dashboard rows per page (per document kind)
+        'reload_seconds': 5,       # how often the GUI checks the config file for edits
+        'tenant': ''               # code of the company/branch this workstation bills under ('' = the default company)
+    },
+    # Bulk invoice import from CSV / JSON (INVOICE_GENERATOR.py --import FILE, or Dashboard > Import...)
+    'import': {
+        'chunk_size': 1000,        # documents validated, checked and inserted per transaction
+        'match_clients': True      # map client names onto existing ones ignoring case and spacing
+    },
+    # Bank statement reconciliation (INVOICE_GENERATOR.py --reconcile FILE, or Dashboard > Reconcile...)
+    'reconcile': {
+        'date_window_days': 90,    # a credit matched by amount alone must come within this many days of the invoice
+        'chunk_size': 2000         # statement lines matched and recorded per transaction
+    },
+    # Documents in foreign currencies. Rates are entered under Dashboard > Rates... or loaded with --import-rates FILE
+    'currency': {
+        'base': 'NGN',             # currency the books are kept in: summaries, aging and statements convert to it
+        'rate_cache_size': 4096,   # resolved (currency, day) rate lookups kept in memory
+        'max_rate_age_days': 31    # a document may use the latest rate up to this many days old (0 = any age)
+    },
+    # Tax rules, compiled into TaxRules lookup tables (the VAT rate itself is company.vat_rate)
+    'tax': {
+        'exempt_types': [],        # line (service) types never charged VAT, e.g. ["Training"]; catalog products carry their own VAT flag
+        'wht_rates': {},           # WHT % by line (service) type, e.g. {"Consulting": 10, "Installation": 5};
+                                   # other lines take the rate entered on the document
+        'rounding': 'document'     # 'document': round each rate's tax once; 'line': round every line's tax, then add
+    },
+    # Stock of catalog products per company/branch, deducted when a Component invoice is saved
+    'stock': {
+        'shards': 8,               # counter rows per product; concurrent sales of one product update different rows
+        'allow_oversell': False    # True lets a sale take stock below zero instead of refusing the invoice
+    },
+    # Local HTTP/JSON API (INVOICE_GENERATOR.py --serve-api) for the storefront and ERP
+    'api': {
+        'host': '127.0.0.1',
+        'port': 8765,
+        'token': '',               # when set, requests must send "Authorization: Bearer <token>"
+        'db_connections': 4,       # pooled database connections, one per database worker thread
+        'render_workers': 2,       # threads rendering PDFs
+        'max_pending': 64,         # requests in progress before new ones are refused with 503 + Retry-After
+        'request_timeout': 30,     # seconds before a read (GET) is answered with 504
+        'max_body_kb': 1024,       # largest accepted request body
+        'max_page_size': 200       # largest page a list request may ask for
+    }
 }
 
-DB_SETTINGS = {
-    'host': 'localhost',
-    'user': 'root',
-    'password': '',
-    'database': 'nascomsoft_billing_db'
+# The company every document belonged to before multi-company support; it has no letterhead columns
+# of its own, so it always shows COMPANY_CONFIG
+DEFAULT_TENANT_ID = 1
+DEFAULT_TENANT_CODE = 'NSE'
+
+# Currencies a document can be issued in: code -> (symbol, decimal places). Symbols stay within what the
+# built-in PDF fonts can draw (no naira or cedi sign), and the base currency prints company.currency_symbol
+CURRENCIES = {
+    'NGN': ('N', 2), 'USD': ('$', 2), 'EUR': ('\u20ac', 2), 'GBP': ('\u00a3', 2), 'CNY': ('CN\u00a5', 2),
+    'JPY': ('\u00a5', 0), 'GHS': ('GH\u00a2', 2), 'XOF': ('CFA ', 0), 'ZAR': ('R', 2), 'KES': ('KSh', 2),
+}
+
+# Settings that are read once when the process (or its connection/worker pool) starts; a reload
+# that changes them is accepted but only takes effect after a restart.
+RESTART_REQUIRED = {('db', '*'), ('api', '*'), ('app', 'workers'), ('app', 'tenant'), ('pdf', 'logo_cache_size')}
+
+# Sections the app_settings table may override (the connection itself cannot come from the database)
+DB_CONFIG_SECTIONS = ('company', 'smtp', 'archive', 'audit', 'change_feed', 'pdf', 'pdf_profiles', 'app', 'import', 'reconcile',
+                      'currency', 'tax', 'stock')
+# Secrets are never stored in app_settings, where every database reader and workstation could see them;
+# they come from the config file or the environment (NASCOMSOFT_SMTP__PASSWORD) only
+DB_SECRET_KEYS = {('smtp', 'password')}
+
+CONFIG_FILE = os.environ.get('NASCOMSOFT_CONFIG', 'nascomsoft.json')
+CONFIG_ENV_PREFIX = 'NASCOMSOFT_'   # NASCOMSOFT_SMTP__HOST=mail.example.com overrides smtp.host
+
+# Extra checks beyond "same type as the default"; each returns True for a valid value
+CONFIG_RULES = {
+    ('company', 'vat_rate'): (lambda v: 0 <= v < 1, "must be a fraction between 0 and 1 (0.075 for 7.5%)"),
+    ('db', 'backend'): (lambda v: v in ('mysql', 'sqlite'), "must be 'mysql' or 'sqlite'"),
+    ('smtp', 'port'): (lambda v: 0 < v < 65536, "must be a TCP port"),
+    ('app', 'workers'): (lambda v: 1 <= v <= 32, "must be between 1 and 32"),
+    ('app', 'page_size'): (lambda v: 1 <= v <= 1000, "must be between 1 and 1000"),
+    ('import', 'chunk_size'): (lambda v: 1 <= v <= 10000, "must be between 1 and 10000"),
+    ('reconcile', 'date_window_days'): (lambda v: 0 <= v <= 3650, "must be between 0 and 3650"),
+    ('reconcile', 'chunk_size'): (lambda v: 1 <= v <= 10000, "must be between 1 and 10000"),
+    ('currency', 'base'): (lambda v: v in CURRENCIES, "must be one of the CURRENCIES codes (NGN, USD, ...)"),
+    ('currency', 'rate_cache_size'): (lambda v: v >= 1, "must be at least 1"),
+    ('currency', 'max_rate_age_days'): (lambda v: 0 <= v <= 3650, "must be between 0 and 3650"),
+    ('tax', 'exempt_types'): (lambda v: all(isinstance(t, str) and t.strip() for t in v), "must be a list of line type names"),
+    ('tax', 'wht_rates'): (lambda v: all(isinstance(r, (int, float)) and not isinstance(r, bool) and 0 <= r <= 100 for r in v.values()),
+                           "must map line types to percentages between 0 and 100"),
+    ('tax', 'rounding'): (lambda v: v in ('document', 'line'), "must be 'document' or 'line'"),
+    ('stock', 'shards'): (lambda v: 1 <= v <= 64, "must be between 1 and 64"),
+    ('api', 'port'): (lambda v: 0 <= v < 65536, "must be a TCP port (0 = any free port)"),
+    ('api', 'db_connections'): (lambda v: 1 <= v <= 64, "must be between 1 and 64"),
+    ('api', 'render_workers'): (lambda v: 1 <= v <= 32, "must be between 1 and 32"),
+    ('api', 'max_pending'): (lambda v: v >= 1, "must be at least 1"),
 }
+PROFILE_KEYS = {'compress': bool, 'logo_dpi': (int, type(None)), 'fonts': (tuple, type(None)), 'pdfa': bool}
+
+
+class ConfigError(ValueError):
+    """Raised with every problem found when a configuration layer does not validate."""
+
+    def __init__(self, problems):
+        self.problems = list(problems)
+        super().__init__("Invalid configuration:\n  " + "\n  ".join(self.problems))
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _coerce(value, default):
+    """Convert a file/env/DB value to the type of its default. Raises ValueError/TypeError."""
+    if isinstance(default, bool):
+        if isinstance(value, str):
+            if value.strip().lower() in ('1', 'true', 'yes', 'on'):
+                return True
+            if value.strip().lower() in ('0', 'false', 'no', 'off'):
+                return False
+            raise ValueError(f"expected true/false, got {value!r}")
+        if not isinstance(value, bool):
+            raise TypeError(f"expected true/false, got {value!r}")
+        return value
+    if isinstance(default, (int, float)):
+        if isinstance(value, bool):
+            raise TypeError(f"expected a number, got {value!r}")
+        number = type(default)(value) if isinstance(value, str) else value
+        if not isinstance(number, (int, float)) or (isinstance(default, int) and number != int(number)):
+            raise TypeError(f"expected {type(default).__name__}, got {value!r}")
+        return type(default)(number)
+    if isinstance(default, str):
+        if not isinstance(value, str):
+            raise TypeError(f"expected text, got {value!r}")
+        return value
+    if isinstance(default, (dict, list)):
+        if isinstance(value, str):
+            value = json.loads(value)  # environment values are JSON text
+        if isinstance(value, tuple):
+            value = list(value)
+        if not isinstance(value, type(default)):
+            raise TypeError(f"expected a JSON {'object' if isinstance(default, dict) else 'list'}, got {value!r}")
+        return value
+    return value
+
+
+def _validate_profile(name, profile, problems):
+    unknown = set(profile) - set(PROFILE_KEYS)
+    if unknown:
+        problems.append(f"pdf_profiles.{name}: unknown key(s) {', '.join(sorted(unknown))}")
+    merged = dict(DEFAULT_CONFIG['pdf_profiles']['standard'], **profile)
+    if isinstance(merged.get('fonts'), list):
+        merged['fonts'] = tuple(merged['fonts'])
+    for key, kind in PROFILE_KEYS.items():
+        if not isinstance(merged.get(key), kind) or (kind is bool) != isinstance(merged.get(key), bool):
+            problems.append(f"pdf_profiles.{name}.{key}: invalid value {merged.get(key)!r}")
+    if merged.get('fonts') is not None and len(merged['fonts']) != 3:
+        problems.append(f"pdf_profiles.{name}.fonts: needs (regular, bold, italic) font files")
+    return merged
+
+
+def validate_config(layers):
+    """Merge override layers (lowest first) over DEFAULT_CONFIG and check every value.
+
+    Each layer is {section: {key: value}}. Returns the merged plain dict; raises ConfigError listing
+    every unknown key, wrong type and out-of-range value rather than stopping at the first.
+    """
+    merged = {section: dict(values) for section, values in DEFAULT_CONFIG.items()}
+    problems = []
+    for source, layer in layers:
+        for section, values in (layer or {}).items():
+            if section not in DEFAULT_CONFIG or not isinstance(values, dict):
+                problems.append(f"{source}: unknown section {section!r}")
+                continue
+            for key, value in values.items():
+                if section == 'pdf_profiles':
+                    if isinstance(value, str):
+                        try:
+                            value = json.loads(value)
+                        except ValueError:
+                            value = None
+                    if not isinstance(value, dict):
+                        problems.append(f"{source}: pdf_profiles.{key} must be an object")
+                        continue
+                    merged[section][key] = _validate_profile(key, value, problems)
+                    continue
+                if key not in DEFAULT_CONFIG[section]:
+                    problems.append(f"{source}: unknown setting {section}.{key}")
+                    continue
+                try:
+                    merged[section][key] = _coerce(value, DEFAULT_CONFIG[section][key])
+                except (TypeError, ValueError) as e:
+                    problems.append(f"{source}: {section}.{key} {e}")
+    for (section, key), (ok, message) in CONFIG_RULES.items():
+        if not ok(merged[section][key]):
+            problems.append(f"{section}.{key} {message} (got {merged[section][key]!r})")
+    if merged['pdf']['profile'] not in merged['pdf_profiles']:
+        problems.append(f"pdf.profile {merged['pdf']['profile']!r} is not a defined PDF profile")
+    for key in ('logo_cache_size', 'statement_chunk', 'statement_part_pages', 'preview_width', 'preview_cache_size'):
+        if merged['pdf'][key] < 1:
+            problems.append(f"pdf.{key} must be positive")
+    if problems:
+        raise ConfigError(problems)
+    return merged
+
+
+def read_config_file(path):
+    """The config file layer ({} when the file does not exist)."""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ConfigError([f"{path}: top level must be an object"])
+    return data
+
+
+def read_config_env(environ=None):
+    """The environment layer: NASCOMSOFT_<SECTION>__<KEY>=value (pdf_profiles values are JSON)."""
+    layer = {}
+    for name, value in (os.environ if environ is None else environ).items():
+        if not name.startswith(CONFIG_ENV_PREFIX) or '__' not in name:
+            continue
+        section, _, key = name[len(CONFIG_ENV_PREFIX):].partition('__')
+        layer.setdefault(section.lower(), {})[key.lower() if section.lower() != 'pdf_profiles' else key] = value
+    return layer
+
+
+class ConfigSnapshot(Mapping):
+    """One validated, read-only view of the whole configuration. Never changes after creation;
+    a reload builds a new snapshot and swaps it in, so a reader holding one sees consistent values."""
+
+    def __init__(self, data, version, sources):
+        self._data = _freeze(data)
+        self.version = version
+        self.sources = tuple(sources)
+
+    def __getitem__(self, section):
+        return self._data[section]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class Config:
+    """Layered settings: defaults < config file < app_settings table < environment < overrides.
+
+    Layers are validated together once per (re)load into an immutable ConfigSnapshot. reload() re-reads
+    the file and environment (and the database when given a DatabaseManager) and swaps the snapshot in
+    only if it validates; otherwise the running snapshot stays and the ConfigError is returned.
+    Readers use CONFIG.snapshot or the live section views (COMPANY_CONFIG, SMTP_SETTINGS, ...).
+    """
+
+    def __init__(self, path=CONFIG_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db_layer = {}
+        self._overrides = {}
+        self._listeners = []
+        self.file_mtime = None
+        self.snapshot = None
+        self.reload()
+
+    def _layers(self):
+        return [(self.path, read_config_file(self.path)), ('database', self._db_layer),
+                ('environment', read_config_env()), ('override', self._overrides)]
+
+    def reload(self, db=None):
+        """Rebuild the snapshot. Returns (changed_keys, None) or (set(), ConfigError) if rejected."""
+        with self._lock:
+            mtime = os.path.getmtime(self.path) if self.path and os.path.exists(self.path) else None
+            try:
+                if db is not None:
+                    db_layer = db.load_settings()
+                    if db_layer is not None:
+                        self._db_layer = {s: v for s, v in db_layer.items() if s in DB_CONFIG_SECTIONS}
+                layers = self._layers()
+                data = validate_config(layers)
+            except (ConfigError, ValueError, OSError) as e:
+                if self.snapshot is None:
+                    raise
+                self.file_mtime = mtime  # report a bad edit once, not on every file check
+                return set(), e if isinstance(e, ConfigError) else ConfigError([str(e)])
+            old = self.snapshot
+            changed = {(section, key) for section in data for key in set(data[section]) | set(old[section] if old else ())
+                       if old is None or _freeze(data[section].get(key)) != old[section].get(key)}
+            self.file_mtime = mtime
+            if old is not None and not changed:
+                return set(), None
+            self.snapshot = ConfigSnapshot(data, (old.version + 1) if old else 1,
+                                           [name for name, layer in layers if layer])
+            listeners = list(self._listeners)
+        if old is not None:
+            for listener in listeners:
+                listener(self.snapshot, changed)
+        return changed, None
+
+    def check_db_layer(self, db_layer):
+        """Validate the running layers with `db_layer` in place of the stored settings (raises ConfigError)."""
+        layers = self._layers()
+        layers[1] = ('database', db_layer)
+        return validate_config(layers)
+
+    def save_file_values(self, section, values):
+        """Write `values` into `section` of this workstation's config file (created readable by its owner
+        only) and reload; used for DB_SECRET_KEYS. Returns (True, '') or (False, error)."""
+        if not self.path:
+            return False, "No configuration file is in use."
+        try:
+            data = read_config_file(self.path)
+            data[section] = dict(data.get(section) or {}, **values)
+            layers = self._layers()
+            layers[0] = (self.path, data)
+            validate_config(layers)
+            tmp = f"{self.path}.tmp"
+            with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp, self.path)
+        except ConfigError as e:
+            return False, "\n".join(e.problems)
+        except (OSError, ValueError) as e:
+            return False, str(e)
+        _, error = self.reload()
+        return (False, str(error)) if error else (True, '')
+
+    def file_changed(self):
+        mtime = os.path.getmtime(self.path) if self.path and os.path.exists(self.path) else None
+        return mtime != self.file_mtime
+
+    def override(self, **sections):
+        """Programmatic top layer for CLIs and benchmarks, e.g. CONFIG.override(db={'backend': 'sqlite'})."""
+        for section, values in sections.items():
+            self._overrides.setdefault(section, {}).update(values)
+        changed, error = self.reload()
+        if error:
+            for section, values in sections.items():
+                for key in values:
+                    self._overrides[section].pop(key, None)
+            raise error
+        return changed
+
+    def clear_override(self, *sections):
+        for section in sections or list(self._overrides):
+            self._overrides.pop(section, None)
+        return self.reload()[0]
+
+    def subscribe(self, listener):
+        """Call listener(snapshot, changed_keys) after every reload that changed something."""
+        self._listeners.append(listener)
+
+    def section(self, name):
+        return ConfigSection(self, name)
+
+
+def restart_required(changed):
+    return sorted(f"{s}.{k}" for s, k in changed if (s, '*') in RESTART_REQUIRED or (s, k) in RESTART_REQUIRED)
+
+
+class ConfigSection(Mapping):
+    """Read-only mapping over one section of the *current* snapshot, so module-level names such as
+    COMPANY_CONFIG always see the latest reload. Writes go through DatabaseManager.save_settings or
+    CONFIG.override."""
+    __slots__ = ('_config', '_name')
+
+    def __init__(self, config, name):
+        self._config = config
+        self._name = name
+
+    def __getitem__(self, key):
+        return self._config.snapshot[self._name][key]
+
+    def __iter__(self):
+        return iter(self._config.snapshot[self._name])
+
+    def __len__(self):
+        return len(self._config.snapshot[self._name])
+
+    def __repr__(self):
+        return f"ConfigSection({self._name!r}, {dict(self)!r})"
+
+
+CONFIG = Config()
+COMPANY_CONFIG = CONFIG.section('company')
+DB_SETTINGS = CONFIG.section('db')
+SMTP_SETTINGS = CONFIG.section('smtp')
+ARCHIVE_SETTINGS = CONFIG.section('archive')
+AUDIT_SETTINGS = CONFIG.section('audit')
+CHANGE_FEED_SETTINGS = CONFIG.section('change_feed')
+PDF_SETTINGS = CONFIG.section('pdf')
+PDF_PROFILES = CONFIG.section('pdf_profiles')
+APP_SETTINGS = CONFIG.section('app')
+IMPORT_SETTINGS = CONFIG.section('import')
+RECONCILE_SETTINGS = CONFIG.section('reconcile')
+CURRENCY_SETTINGS = CONFIG.section('currency')
+TAX_SETTINGS = CONFIG.section('tax')
+STOCK_SETTINGS = CONFIG.section('stock')
+API_SETTINGS = CONFIG.section('api')
 
 LOGO_FILENAME = "LOGO.png"  # Ensure this file exists in the same directory as the script
 if not os.path.exists(LOGO_FILENAME):
     LOGO_FILENAME = None  # Set to None if the file is missing to avoid runtime errors
 
-# Default SMTP/email settings (in-memory; configure via UI). The default from-email is the company address.
-SMTP_SETTINGS = {
-    'host': '',
-    'port': 587,
-    'username': '',
-    'password': '',
-    'use_tls': True,
-    'from_email': 'info@nascomsoft.com'
-}
+# =============================================================================
+# 2. METRICS & INSTRUMENTATION
+# =============================================================================
+
+logger = logging.getLogger("nascomsoft")
+
+
+class StructuredFormatter(logging.Formatter):
+    """Render log records as one JSON object per line (stage/error/duration fields included)."""
+    FIELDS = ("stage", "error", "duration_ms")
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).strftime('%Y-%m-%d %H:%M:%S'),
+            "level": record.levelname,
+            "msg": record.getMessage(),
+        }
+        for field in self.FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        return json.dumps(entry)
+
+
+def configure_logging(level=logging.INFO):
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _StageTimer:
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+        if exc_type is not None:
+            self.metrics.inc("errors_total", self.stage)
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+# (owner, attribute, stage). Owner None means a module-level function.
+# Wrappers are only installed while metrics are enabled, so a disabled build runs the original code.
+INSTRUMENTED_STAGES = [
+    ("DatabaseManager", "check_connection", "db.connect_probe"),
+    ("DatabaseManager", "get_connection", "db.connect"),
+    ("DatabaseManager", "create_tables", "db.migrate"),
+    ("DatabaseManager", "save_invoice", "db.save_invoice"),
+    ("DatabaseManager", "save_quotation", "db.save_quotation"),
+    ("DatabaseManager", "convert_quotation_to_invoice", "db.convert_quotation"),
+    ("DatabaseManager", "generate_invoice_number", "db.next_invoice_number"),
+    ("DatabaseManager", "generate_quotation_number", "db.next_quote_number"),
+    ("DatabaseManager", "fetch_invoices", "db.fetch_invoices"),
+    ("DatabaseManager", "fetch_quotations", "db.fetch_quotations"),
+    ("DatabaseManager", "summarize_documents", "db.summarize"),
+    ("DatabaseManager", "archive_documents", "db.archive"),
+    ("DatabaseManager", "fetch_archived", "db.fetch_archived"),
+    ("DatabaseManager", "restore_archived", "db.restore_archived"),
+    ("DatabaseManager", "delete_invoice", "db.delete_invoice"),
+    ("DatabaseManager", "delete_quotation", "db.delete_quotation"),
+    ("DatabaseManager", "save_email_log", "db.save_email_log"),
+    ("DatabaseManager", "fetch_email_logs", "db.fetch_email_logs"),
+    ("DatabaseManager", "fetch_document", "db.fetch_document"),
+    ("DatabaseManager", "fetch_changes", "db.change_feed"),
+    ("DatabaseManager", "fetch_dashboard_row", "db.fetch_dashboard_row"),
+    ("DatabaseManager", "fetch_audit_history", "db.fetch_audit"),
+    ("AuditLog", "flush", "db.audit_flush"),
+    ("InvoicePDF", "__init__", "pdf.open"),
+    ("InvoicePDF", "draw_header", "pdf.header"),
+    ("InvoicePDF", "draw_client_info", "pdf.client_info"),
+    ("InvoicePDF", "draw_items_table", "pdf.items_table"),
+    ("InvoicePDF", "draw_footer", "pdf.footer_and_save"),
+    (None, "render_document_pdf", "pdf.render"),
+    (None, "render_statement_pdf", "pdf.statement"),
+    (None, "render_preview_image", "pdf.preview"),
+    (None, "send_email", "email.send"),
+]
+
+
+class Metrics:
+    """Process-wide timing histograms and counters, exportable as Prometheus text or JSON."""
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._originals = {}
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}    # (name, stage) -> int
+            self.histograms = {}  # stage -> {'buckets': [...], 'sum': s, 'count': n, 'max': m}
+
+    def inc(self, name, stage="", value=1):
+        key = (name, stage)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, stage, seconds):
+        idx = bisect.bisect_left(self.BUCKETS, seconds)
+        with self._lock:
+            hist = self.histograms.get(stage)
+            if hist is None:
+                hist = {'buckets': [0] * (len(self.BUCKETS) + 1), 'sum': 0.0, 'count': 0, 'max': 0.0}
+                self.histograms[stage] = hist
+            hist['buckets'][idx] += 1
+            hist['sum'] += seconds
+            hist['count'] += 1
+            if seconds > hist['max']:
+                hist['max'] = seconds
+
+    def timer(self, stage):
+        """Context manager timing a block; a shared no-op when metrics are disabled."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self, stage)
+
+    def _wrap(self, func, stage):
+        metrics = self
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                metrics.inc("errors_total", stage)
+                raise
+            finally:
+                metrics.observe(stage, time.perf_counter() - start)
+        return wrapper
+
+    def enable(self):
+        if self.enabled:
+            return
+        module = sys.modules[__name__]
+        for owner_name, attr, stage in INSTRUMENTED_STAGES:
+            owner = module if owner_name is None else getattr(module, owner_name, None)
+            original = getattr(owner, attr, None) if owner is not None else None
+            if original is None:
+                continue
+            self._originals[(owner, attr)] = original
+            setattr(owner, attr, self._wrap(original, stage))
+        self.enabled = True
+
+    def disable(self):
+        if not self.enabled:
+            return
+        for (owner, attr), original in self._originals.items():
+            setattr(owner, attr, original)
+        self._originals = {}
+        self.enabled = False
+
+    def quantile(self, stage, q):
+        """Estimate a quantile (0..1) from histogram buckets (upper bound of the matching bucket)."""
+        hist = self.histograms.get(stage)
+        if not hist or not hist['count']:
+            return 0.0
+        target = q * hist['count']
+        running = 0
+        for idx, n in enumerate(hist['buckets']):
+            running += n
+            if running >= target:
+                return self.BUCKETS[idx] if idx < len(self.BUCKETS) else hist['max']
+        return hist['max']
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {k: {'buckets': list(v['buckets']), 'sum': v['sum'], 'count': v['count'], 'max': v['max']}
+                          for k, v in self.histograms.items()}
+        stages = []
+        for stage in sorted(set(histograms) | {st for (_, st) in counters if st}):
+            hist = histograms.get(stage, {'sum': 0.0, 'count': 0, 'max': 0.0})
+            stages.append({
+                'stage': stage,
+                'calls': hist['count'],
+                'errors': counters.get(("errors_total", stage), 0),
+                'avg_ms': (hist['sum'] / hist['count'] * 1000) if hist['count'] else 0.0,
+                'p50_ms': self.quantile(stage, 0.5) * 1000,
+                'p95_ms': self.quantile(stage, 0.95) * 1000,
+                'max_ms': hist['max'] * 1000,
+            })
+        return {
+            'enabled': self.enabled,
+            'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'stages': stages,
+            'counters': [{'name': n, 'stage': st, 'value': v} for (n, st), v in sorted(counters.items())],
+            'histograms': histograms,
+            'buckets': list(self.BUCKETS),
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        snap = self.snapshot()
+        lines = []
+        names = sorted({c['name'] for c in snap['counters']})
+        for name in names:
+            lines.append(f"# TYPE nascomsoft_{name} counter")
+            for c in snap['counters']:
+                if c['name'] == name:
+                    label = f'{{stage="{c["stage"]}"}}' if c['stage'] else ""
+                    lines.append(f"nascomsoft_{name}{label} {c['value']}")
+        lines.append("# TYPE nascomsoft_stage_seconds histogram")
+        for stage, hist in sorted(snap['histograms'].items()):
+            running = 0
+            for bound, n in zip(list(self.BUCKETS) + ["+Inf"], hist['buckets']):
+                running += n
+                lines.append(f'nascomsoft_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {running}')
+            lines.append(f'nascomsoft_stage_seconds_sum{{stage="{stage}"}} {hist["sum"]:.6f}')
+            lines.append(f'nascomsoft_stage_seconds_count{{stage="{stage}"}} {hist["count"]}')
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+def log_error(stage, message, exc=None):
+    """Structured replacement for print()-style error reporting; always counted per stage."""
+    METRICS.inc("errors_total", stage)
+    logger.error(message, extra={"stage": stage, "error": str(exc) if exc is not None else ""})
 
 # =============================================================================
-# 2. DATABASE MANAGER (AUTO-MIGRATING)
+# 3. STORAGE BACKENDS
 # =============================================================================
 
-class DatabaseManager:
+# Every database error DatabaseManager may see, whichever backend is active
+DB_ERRORS = (Error, sqlite3.Error)
+
+
+class StorageBackend(ABC):
+    """Connection handling and SQL dialect for one database engine.
+    DatabaseManager writes MySQL-flavoured DML with %s placeholders; DDL templates use
+    {pk} for the surrogate key column, {now} for a current-timestamp default and {blob}
+    for binary payloads.
+    """
+    name = ""
+    pk = "INT AUTO_INCREMENT PRIMARY KEY"
+    now = "DEFAULT CURRENT_TIMESTAMP"
+    blob = "LONGBLOB"
+    lock_clause = " FOR UPDATE"
+
+    def ensure_database(self):
+        return True
+
+    @abstractmethod
+    def connect(self):
+        """A new connection exposing the mysql.connector surface DatabaseManager uses."""
+
+    def cursor(self, conn):
+        return conn.cursor()
+
+    def ddl(self, template):
+        return template.format(pk=self.pk, now=self.now, blob=self.blob)
+
+    def prepared_cursor(self, conn):
+        """A cursor dedicated to one statement text, so the engine can reuse its compiled plan."""
+        return conn.cursor()
+
+    def stream_cursor(self, conn):
+        """A cursor that fetches rows incrementally instead of materialising the whole result."""
+        return conn.cursor()
+
+    def add_column_sql(self, table, column, definition, after=None):
+        return f"ALTER TABLE {table} ADD COLUMN {column} {definition}"
+
+    def create_index(self, cursor, name, table, columns, unique=False):
+        cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+    def drop_index(self, cursor, name, table):
+        cursor.execute(f"DROP INDEX IF EXISTS {name}")
+
+    def begin_write(self, conn):
+        """Start a transaction that will take write locks on the rows it reads."""
+        conn.commit()
+
+    @abstractmethod
+    def is_duplicate_key(self, exc):
+        """True if `exc` is this engine's unique-key violation (callers renumber and retry on it)."""
+
+    def accumulate_sql(self, table, keys, columns):
+        """INSERT that adds `columns` onto the existing row with the same `keys` (its primary key), in one
+        statement, so concurrent writers of a new aggregate row cannot both try to insert it."""
+        names = ", ".join(keys + columns)
+        return (f"INSERT INTO {table} ({names}) VALUES ({', '.join(['%s'] * len(keys + columns))}) "
+                f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET " + ", ".join(f"{c} = {c} + excluded.{c}" for c in columns))
+
+    def make_append_only(self, cursor, table):
+        """Reject UPDATE and DELETE on `table` at the database level."""
+        for event in ("UPDATE", "DELETE"):
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_no_{event.lower()} BEFORE {event} ON {table} "
+                           f"BEGIN SELECT RAISE(ABORT, '{table} is append-only'); END")
+
+
+class MySQLBackend(StorageBackend):
+    name = "mysql"
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    def ensure_database(self):
+        if mysql is None:
+            raise Error("mysql-connector-python is not installed.")
+        conn = mysql.connector.connect(
+            host=self.settings['host'],
+            user=self.settings['user'],
+            password=self.settings['password']
+        )
+        if not conn.is_connected():
+            return False
+        cursor = conn.cursor()
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS {self.settings['database']}")
+        conn.close()
+        return True
+
+    def connect(self):
+        if mysql is None:
+            raise Error("mysql-connector-python is not installed.")
+        return mysql.connector.connect(
+            host=self.settings['host'],
+            user=self.settings['user'],
+            password=self.settings['password'],
+            database=self.settings['database']
+        )
+
+    def cursor(self, conn):
+        return conn.cursor(buffered=True)
+
+    def prepared_cursor(self, conn):
+        # Server-side prepared statement: parsed once, then only parameters travel per call
+        return conn.cursor(prepared=True)
+
+    def stream_cursor(self, conn):
+        return conn.cursor(buffered=False)
+
+    def add_column_sql(self, table, column, definition, after=None):
+        sql = f"ALTER TABLE {table} ADD COLUMN {column} {definition}"
+        return f"{sql} AFTER {after}" if after else sql
+
+    def create_index(self, cursor, name, table, columns, unique=False):
+        # MySQL has no CREATE INDEX IF NOT EXISTS
+        cursor.execute(f"SHOW INDEX FROM {table} WHERE Key_name = %s", (name,))
+        if not cursor.fetchall():
+            cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON {table} ({columns})")
+
+    def drop_index(self, cursor, name, table):
+        cursor.execute(f"SHOW INDEX FROM {table} WHERE Key_name = %s", (name,))
+        if cursor.fetchall():
+            cursor.execute(f"DROP INDEX {name} ON {table}")
+
+    def is_duplicate_key(self, exc):
+        return getattr(exc, 'errno', None) == 1062  # ER_DUP_ENTRY
+
+    def accumulate_sql(self, table, keys, columns):
+        names = ", ".join(keys + columns)
+        return (f"INSERT INTO {table} ({names}) VALUES ({', '.join(['%s'] * len(keys + columns))}) "
+                "ON DUPLICATE KEY UPDATE " + ", ".join(f"{c} = {c} + VALUES({c})" for c in columns))
+
+    def make_append_only(self, cursor, table):
+        # Needs the TRIGGER privilege (and SUPER or log_bin_trust_function_creators when binary logging is on)
+        for event in ("UPDATE", "DELETE"):
+            name = f"{table}_no_{event.lower()}"
+            cursor.execute("SELECT 1 FROM information_schema.TRIGGERS WHERE TRIGGER_SCHEMA = DATABASE() AND TRIGGER_NAME = %s", (name,))
+            if not cursor.fetchall():
+                cursor.execute(f"CREATE TRIGGER {name} BEFORE {event} ON {table} FOR EACH ROW "
+                               f"SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = '{table} is append-only'")
+
+
+@functools.lru_cache(maxsize=1024)
+def _qmark(sql):
+    """Translate %s placeholders to sqlite3's ?; cached so each statement string is built once."""
+    return sql.replace("%s", "?")
+
+
+class _SQLiteCursor:
+    """Cursor adapter so DatabaseManager's %s-style SQL runs unchanged on sqlite3."""
+    __slots__ = ("_cur",)
+
+    def __init__(self, cur):
+        self._cur = cur
+
+    def execute(self, sql, params=()):
+        return self._cur.execute(_qmark(sql), params)
+
+    def executemany(self, sql, seq_of_params):
+        return self._cur.executemany(_qmark(sql), seq_of_params)
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    def fetchmany(self, size=None):
+        return self._cur.fetchmany(size or self._cur.arraysize)
+
+    def close(self):
+        self._cur.close()
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cur.lastrowid
+
+    @property
+    def description(self):
+        return self._cur.description
+
+
+class _SQLiteConnection:
+    """Gives a sqlite3 connection the small mysql.connector surface DatabaseManager relies on."""
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def is_connected(self):
+        return self.raw is not None
+
+    def cursor(self, buffered=True):
+        return _SQLiteCursor(self.raw.cursor())
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        if self.raw is not None:
+            self.raw.close()
+            self.raw = None
+
+
+sqlite3.register_adapter(datetime, lambda d: d.strftime('%Y-%m-%d %H:%M:%S'))
+sqlite3.register_converter("DATETIME", lambda b: datetime.fromisoformat(b.decode()))
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_converter("DATE", lambda b: date.fromisoformat(b.decode()))
+
+
+class SQLiteBackend(StorageBackend):
+    """Embedded single-file storage for single-user installs (WAL journal, cached statements)."""
+    name = "sqlite"
+    pk = "INTEGER PRIMARY KEY AUTOINCREMENT"
+    now = "DEFAULT (datetime('now', 'localtime'))"
+    blob = "BLOB"
+    lock_clause = ""
+
+    def __init__(self, path, timeout=10, statement_cache_size=256):
+        self.path = path
+        self.timeout = timeout
+        self.statement_cache_size = statement_cache_size
+
+    def connect(self):
+        raw = sqlite3.connect(self.path, timeout=self.timeout, detect_types=sqlite3.PARSE_DECLTYPES,
+                              cached_statements=self.statement_cache_size)
+        if self.path != ":memory:":
+            raw.execute("PRAGMA journal_mode=WAL")
+        raw.execute("PRAGMA synchronous=NORMAL")
+        return _SQLiteConnection(raw)
+
+    def begin_write(self, conn):
+        # BEGIN IMMEDIATE takes the database write lock up front, the SQLite analogue of SELECT ... FOR UPDATE
+        if conn.raw.in_transaction:
+            conn.raw.commit()
+        conn.raw.execute("BEGIN IMMEDIATE")
+
+    def is_duplicate_key(self, exc):
+        return isinstance(exc, sqlite3.IntegrityError) and "UNIQUE" in str(exc)
+
+
+def make_backend(settings=None):
+    settings = settings or DB_SETTINGS
+    if settings.get('backend', 'mysql') == 'sqlite':
+        return SQLiteBackend(settings.get('sqlite_path') or 'nascomsoft_billing.db',
+                             settings.get('sqlite_timeout', DB_SETTINGS['sqlite_timeout']),
+                             settings.get('statement_cache_size', DB_SETTINGS['statement_cache_size']))
+    return MySQLBackend(settings)
+
+# =============================================================================
+# 4. DATABASE MANAGER (AUTO-MIGRATING)
+# =============================================================================
+
+def _money(value):
+    return float(value) if value is not None else 0.0
+
+
+def _issue_day(value):
+    """The calendar day of a date_issued value (datetime, date or stored text)."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def currency_code(code=None):
+    """A document's currency code, upper-cased; blank (documents from before currencies) is the base currency."""
+    return str(code or '').strip().upper() or CURRENCY_SETTINGS['base']
+
+
+def currency_symbol(code=None):
+    code = currency_code(code)
+    if code == CURRENCY_SETTINGS['base']:
+        return COMPANY_CONFIG['currency_symbol']
+    return CURRENCIES[code][0] if code in CURRENCIES else f"{code} "
+
+
+def currency_places(code=None):
+    return CURRENCIES.get(currency_code(code), (None, 2))[1]
+
+
+def round_money(amount, code=None):
+    """`amount` rounded to the currency's minor unit (whole yen and CFA francs, cents otherwise)."""
+    return round(float(amount), currency_places(code))
+
+
+def format_money(amount, code=None):
+    """'$1,234.50' / 'N1,234.50' / '¥1,235': the currency's symbol and precision (base currency by default)."""
+    return f"{currency_symbol(code)}{float(amount or 0):,.{currency_places(code)}f}"
+
+
+def _to_base(amount, rate):
+    """A document-currency amount in the base currency at the document's exchange rate, to the kobo."""
+    return round(amount * rate, 2)
+
+
+class TaxRules:
+    """company.vat_rate and the tax section compiled into lookup tables: line type -> (VAT applies, WHT % or
+    None for the document's rate), resolved once per distinct type. compute() sorts a cart's lines into
+    buckets by (VAT rate, WHT rate) in one pass of lookups and additions, then works out each tax once per
+    bucket, so a 10,000-line cart costs little more than summing it. Get the current rules from tax_rules()."""
+
+    def __init__(self, vat_rate, exempt_types=(), wht_rates=None, rounding='document'):
+        self.vat_rate = vat_rate
+        self.exempt = frozenset(t.strip().lower() for t in exempt_types)
+        self.wht_rates = {t.strip().lower(): float(rate) for t, rate in (wht_rates or {}).items()}
+        self.round_lines = rounding == 'line'
+        self._by_type = {}
+
+    def rule(self, line_type):
+        """(VAT applies, WHT % or None) for a line type."""
+        found = self._by_type.get(line_type)
+        if found is None:
+            key = str(line_type or '').strip().lower()
+            found = self._by_type[line_type] = (key not in self.exempt, self.wht_rates.get(key))
+        return found
+
+    def compute(self, items, shipping=0.0, wht_rate=0.0, currency=None):
+        """Totals for a cart: VAT per line at company.vat_rate unless the line is exempt (its type, or a catalog
+        product without VAT), WHT on each line with its VAT at its type's rate or else `wht_rate`, and on shipping
+        at `wht_rate`. A line's type is its 'service' (project work) or 'type'. With a `currency`, amounts are
+        rounded to its minor unit. 'taxes' lists {'tax', 'rate' (%), 'taxable', 'amount'} per VAT and WHT rate."""
+        rnd = (lambda x: round_money(x, currency)) if currency else (lambda x: x)
+        round_lines = self.round_lines
+        buckets = {}  # (VAT rate, WHT %) -> [taxable, VAT, WHT] (the taxes summed here only when rounding per line)
+        for item in items:
+            taxed, line_wht = self.rule(item.get('service') or item.get('type'))
+            key = (self.vat_rate if taxed and item.get('vat', True) else 0.0, wht_rate if line_wht is None else line_wht)
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = [0, 0.0, 0.0]
+            bucket[0] += item['total']
+            if round_lines:
+                line_vat = rnd(item['total'] * key[0])
+                bucket[1] += line_vat
+                bucket[2] += rnd((item['total'] + line_vat) * (key[1] / 100))
+        subtotal, vat, vat_lines, wht_lines = 0, 0.0, {}, {}
+        for (rate, line_wht), (taxable, line_vat, wht_amount) in buckets.items():
+            if not round_lines:
+                line_vat = taxable * rate
+            subtotal += taxable
+            vat_line = vat_lines.setdefault(rate, [0, 0.0, 0.0])
+            vat_line[0] += taxable
+            vat_line[1] += line_vat
+            wht_line = wht_lines.setdefault(line_wht, [0, 0.0, 0.0])
+            wht_line[0] += taxable + line_vat
+            wht_line[2] += wht_amount
+        wht_line = wht_lines.setdefault(wht_rate, [0, 0.0, 0.0])
+        wht_line[0] += shipping
+        if round_lines:
+            wht_line[2] += rnd(shipping * (wht_rate / 100))
+        taxes = []
+        for rate, (taxable, amount, _) in sorted(vat_lines.items(), reverse=True):
+            amount = amount if round_lines else rnd(amount)
+            vat += amount
+            taxes.append({'tax': 'VAT', 'rate': round(rate * 100, 4), 'taxable': rnd(taxable), 'amount': amount})
+        vat = rnd(vat)
+        subtotal, shipping = rnd(subtotal), rnd(shipping)
+        grand_total = subtotal + vat + shipping
+        wht = 0.0
+        for rate, (taxable, _, amount) in sorted(wht_lines.items(), reverse=True):
+            amount = amount if round_lines else rnd(taxable * (rate / 100))
+            wht += amount
+            if rate:
+                taxes.append({'tax': 'WHT', 'rate': rate, 'taxable': rnd(taxable), 'amount': amount})
+        return {'subtotal': subtotal, 'vat': vat, 'shipping': shipping, 'grand_total': grand_total,
+                'wht_rate': wht_rate, 'wht': rnd(wht), 'taxes': taxes}
+
+
+_TAX_RULES = {}
+
+
+def service_types():
+    """Line types a project item can be billed as: plain 'Project' work plus every type the tax rules name."""
+    named = list(TAX_SETTINGS['wht_rates']) + list(TAX_SETTINGS['exempt_types'])
+    return ['Project'] + sorted({t for t in named if t.lower() != 'project'}, key=str.lower)
+
+
+def tax_rules():
+    """The TaxRules of the running configuration, compiled once per configuration version."""
+    snapshot = CONFIG.snapshot
+    rules = _TAX_RULES.get(snapshot.version)
+    if rules is None:
+        tax = snapshot['tax']
+        rules = TaxRules(snapshot['company']['vat_rate'], tax['exempt_types'], tax['wht_rates'], tax['rounding'])
+        _TAX_RULES.clear()
+        _TAX_RULES[snapshot.version] = rules
+    return rules
+
+
+# Receivables aging: bucket -> (youngest, oldest) age in days since issue; None = no upper bound
+AGING_BUCKETS = OrderedDict([("0-30", (0, 30)), ("31-60", (31, 60)), ("61-90", (61, 90)), ("90+", (91, None))])
+# The pre-aggregated open receivables: (table, keyed by client as well as issue day)
+RECEIVABLES_TABLES = (("receivables_daily", False), ("receivables_by_client", True))
+
+
+def aging_range(bucket, as_of=None):
+    """(first, last) issue dates of an aging bucket as of `as_of` (today); first is None for the open-ended one."""
+    as_of = _issue_day(as_of) if as_of else date.today()
+    youngest, oldest = AGING_BUCKETS[bucket]
+    return (as_of - timedelta(days=oldest) if oldest is not None else None), as_of - timedelta(days=youngest)
+
+
+def balance_condition(value, as_of=None):
+    """(SQL condition, params) on invoices for a balance filter: 'Unpaid', 'Paid' or an AGING_BUCKETS key
+    such as '31-60' (a trailing ' days' is allowed), case-insensitive. Raises ValueError for anything else."""
+    key = str(value).strip().lower()
+    if key == 'unpaid':
+        return "balance_due > 0", []
+    if key == 'paid':
+        return "balance_due <= 0", []
+    bucket = key[:-len(" days")] if key.endswith(" days") else key
+    if bucket not in AGING_BUCKETS:
+        raise ValueError(f"Unknown balance filter {value!r}")
+    first, last = aging_range(bucket, as_of)
+    if first is None:
+        return "balance_due > 0 AND date_issued <= %s", [date_bound(last, end_of_day=True)]
+    return "balance_due > 0 AND date_issued >= %s AND date_issued <= %s", [date_bound(first), date_bound(last, end_of_day=True)]
+
+
+def date_bound(value, end_of_day=False):
+    """Normalise a date filter (date, datetime or 'YYYY-MM-DD[ HH:MM:SS]' text) to a datetime.
+    Plain dates become the first or last second of that day, so date_to is inclusive and the
+    comparison stays a bare range on date_issued (index-friendly, no function on the column)."""
+    if isinstance(value, str):
+        text = value.strip()
+        value = datetime.fromisoformat(text)
+        if len(text) > 10:  # explicit time given
+            return value
+        value = value.date()
+    if isinstance(value, datetime):
+        return value
+    return datetime(value.year, value.month, value.day, 23, 59, 59) if end_of_day \
+        else datetime(value.year, value.month, value.day)
+
+
+def _format_timestamp(value):
+    try:
+        return value.strftime('%Y-%m-%d %H:%M:%S') if hasattr(value, 'strftime') else str(value)
+    except Exception:
+        return str(value)
+
+
+class _LazyRow(tuple):
+    """A DB row kept as its raw tuple. Named access (row['client_name'] or row.client_name)
+    decodes the one field asked for, so rows that are never displayed cost only the tuple."""
+    __slots__ = ()
+    FIELDS = ()
+    DECODERS = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.FIELDS else default
+
+    def keys(self):
+        return self.FIELDS
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+def _lazy_fields(row_cls):
+    """Attach one property per FIELDS entry, decoding with DECODERS[name] when present."""
+    getitem = tuple.__getitem__
+    for idx, name in enumerate(row_cls.FIELDS):
+        decode = row_cls.DECODERS.get(name)
+        if decode is None:
+            prop = property(lambda self, i=idx: getitem(self, i))
+        else:
+            prop = property(lambda self, i=idx, f=decode: f(getitem(self, i)))
+        setattr(row_cls, name, prop)
+    return row_cls
+
+
+@_lazy_fields
+class DocumentRow(_LazyRow):
+    """Dashboard row for an invoice or quotation (quotations select constant type/WHT columns)."""
+    __slots__ = ()
+    FIELDS = ('invoice_no', 'date_issued', 'client_name', 'client_email', 'invoice_type',
+              'subtotal', 'vat', 'shipping', 'wht', 'wht_rate', 'grand_total', 'version', 'balance_due', 'currency', 'adjusted')
+    DECODERS = {'date_issued': _format_timestamp, 'subtotal': _money, 'vat': _money, 'shipping': _money,
+                'wht': _money, 'wht_rate': _money, 'grand_total': _money, 'adjusted': _money,
+                'balance_due': lambda value: None if value is None else float(value), 'currency': currency_code}
+
+    @property
+    def issued_at(self):
+        """date_issued as stored (datetime), for sorting and date arithmetic."""
+        return tuple.__getitem__(self, 1)
+
+
+@_lazy_fields
+class EmailLogRow(_LazyRow):
+    __slots__ = ()
+    FIELDS = ('id', 'created_at', 'to_address', 'subject', 'attachment', 'status', 'error_message')
+    DECODERS = {'created_at': _format_timestamp}
+
+
+@_lazy_fields
+class AuditRow(_LazyRow):
+    __slots__ = ()
+    FIELDS = ('id', 'event_time', 'actor', 'action', 'doc_kind', 'doc_number', 'details')
+    DECODERS = {'event_time': _format_timestamp}
+
+
+class AuditLog:
+    """Append-only audit trail (create, delete, send/resend, convert, archive, restore).
+    record() only queues the event with its own timestamp, so the document write it follows pays no
+    extra round trip; queued events are written with one executemany when batch_size is reached,
+    on the app's flush timer, before any history query and at shutdown."""
+
+    def __init__(self, db, settings=None):
+        self.db = db
+        self.settings = dict(AUDIT_SETTINGS, **(settings or {}))
+        self._queue = []
+        self._lock = threading.Lock()
+
+    def record(self, action, doc_kind, doc_number, details=''):
+        with self._lock:
+            self._queue.append((datetime.now(), self.settings['actor'], action, doc_kind, doc_number, details or ''))
+            full = len(self._queue) >= self.settings['batch_size']
+        if full:
+            self.flush()
+
+    def pending(self):
+        return len(self._queue)
+
+    def flush(self):
+        """Write queued events. Returns the number written; on failure they stay queued for the next flush."""
+        with self._lock:
+            batch, self._queue = self._queue, []
+        if not batch:
+            return 0
+        db = self.db
+        try:
+            if not db.conn or not db.conn.is_connected():
+                db.get_connection()
+            db.cursor.executemany(
+                "INSERT INTO audit_log (event_time, actor, action, doc_kind, doc_number, details) VALUES (%s, %s, %s, %s, %s, %s)", batch
+            )
+            db.conn.commit()
+            return len(batch)
+        except Exception as e:
+            log_error("db.audit_flush", f"Could not write {len(batch)} audit events; will retry", e)
+            db._rollback()
+            with self._lock:
+                self._queue[:0] = batch
+            return 0
+
+
+class StockShortage(Exception):
+    """A sale asked for more of some products than the company/branch has; the caller rolls back."""
+
+    def __init__(self, shortages):
+        self.shortages = shortages  # (description, wanted, available) per product
+        super().__init__("Not enough stock: " + "; ".join(
+            f"{desc} (wanted {wanted}, {available} in stock)" for desc, wanted, available in shortages))
+
+
+class MissingExchangeRate(Exception):
+    """No usable rate for a foreign-currency document's day; nothing is saved until one is entered."""
+
+    def __init__(self, currency, day):
+        self.currency, self.day = currency, day
+        age = CURRENCY_SETTINGS['max_rate_age_days']
+        super().__init__(f"No {currency} exchange rate on or before {day:%Y-%m-%d}" + (f" (within {age} days)" if age else "")
+                         + "; enter one under Rates...")
+
+
+class Product:
+    """One catalog entry. `words` are the lower-cased SKU and description words it is found by."""
+    __slots__ = ('id', 'sku', 'description', 'unit_price', 'vat', 'active', 'version', 'reorder_level', 'words')
+
+    def __init__(self, id, sku, description, unit_price, vat=True, active=True, version=1, reorder_level=0):
+        self.id = id
+        self.sku = sku
+        self.description = description
+        self.unit_price = _money(unit_price)
+        self.vat = bool(vat)
+        self.active = bool(active)
+        self.version = version
+        self.reorder_level = int(reorder_level or 0)
+        self.words = tuple({*ProductCatalog.tokens(f"{sku} {description}"), sku.lower()})
+
+    @property
+    def label(self):
+        return f"{self.sku}  {self.description}  ({format_money(self.unit_price)})"
+
+
+class FeedCache:
+    """Base for the in-memory copies of a table that follow the change feed (ProductCatalog, ExchangeRates,
+    PriceRules). load() reads everything; refresh() and apply_changes() then re-read only the keys named in
+    FEED_KIND rows, and an 'import' row (a bulk load) triggers a full reload.
+
+    Subclasses set FEED_KIND and implement _load(db) (read the table and swap it in under _lock), _reread(db, keys)
+    and __len__."""
+    FEED_KIND = None
+    # Feed rows older than change_feed.retention_hours are pruned, so a copy this old reloads rather than risk
+    # catching up across a gap; half the retention leaves a margin for a copy loaded just before a prune
+    RELOAD_FRACTION = 0.5
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.change_cursor = 0
+        self.loaded_at = None
+        self.checked_at = None
+
+    def load(self, db):
+        cursor = db.latest_change_id()  # read first: a change saved during the load is re-read, not missed
+        self._load(db)
+        with self._lock:
+            self.change_cursor = cursor
+            self.loaded_at = self.checked_at = time.monotonic()
+        return len(self)
+
+    def refresh(self, db):
+        """Catch up with the change feed (or reload, if it may have been pruned past what this copy saw)."""
+        max_age = CHANGE_FEED_SETTINGS['retention_hours'] * 3600 * self.RELOAD_FRACTION
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > max_age:
+            return self.load(db)
+        self.checked_at = time.monotonic()
+        while True:
+            changes = db.fetch_changes(self.change_cursor)
+            if not changes:
+                return len(self)
+            self.apply_changes(db, changes)
+
+    def apply_changes(self, db, changes):
+        """Take change-feed rows (id, doc_kind, doc_number, action); only FEED_KIND rows matter, and rows this copy
+        has already seen (up to change_cursor) are ignored."""
+        changes = [change for change in changes if change[0] > self.change_cursor]
+        if any(kind == self.FEED_KIND and action == 'import' for _, kind, _, action in changes):
+            self.load(db)
+            return
+        keys = sorted({number for _, kind, number, _ in changes if kind == self.FEED_KIND})
+        if keys:
+            self._reread(db, keys)
+        if changes:
+            self.change_cursor = max(self.change_cursor, changes[-1][0])
+
+    def ensure_current(self, db, sync=True):
+        """Load on first use; then check the feed at most every change_feed.poll_seconds (never with sync=False)."""
+        if self.loaded_at is None:
+            self.load(db)
+        elif sync and time.monotonic() - self.checked_at >= CHANGE_FEED_SETTINGS['poll_seconds']:
+            self.refresh(db)
+
+
+class ProductCatalog(FeedCache):
+    """In-memory copy of the products table with a sorted (word, id) index, so lookups and
+    autocomplete are a dict hit or a bisect however many SKUs there are.
+
+    load() reads the whole table once; after that apply_changes() re-reads only the SKUs named in
+    the change feed (the GUI passes it every poll, other callers use refresh()). A bulk product
+    import is one feed entry and triggers a full reload, as does a cache older than the feed retention."""
+    FEED_KIND = 'products'
+
+    def __init__(self):
+        super().__init__()
+        self._by_id = {}
+        self._by_sku = {}
+        self._words = []
+
+    WORD = re.compile(r"[a-z0-9]+")
+
+    @classmethod
+    def tokens(cls, text):
+        return cls.WORD.findall(str(text).casefold())
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def _load(self, db):
+        products = db.fetch_products()
+        words = [(word, p.id) for p in products if p.active for word in p.words]
+        words.sort(key=lambda entry: entry[0])  # products come in id order, so this is (word, id) order, and faster
+        with self._lock:
+            self._by_id = {p.id: p for p in products}
+            self._by_sku = {p.sku: p for p in products}
+            self._words = words
+
+    def _reread(self, db, skus):
+        for product in db.fetch_products(skus=skus):
+            self.put(product)
+
+    def put(self, product):
+        """Add or replace one product (by id, so a renamed SKU drops its old entry)."""
+        with self._lock:
+            old = self._by_id.get(product.id)
+            if old is not None:
+                if self._by_sku.get(old.sku) is old:
+                    del self._by_sku[old.sku]
+                for word in old.words if old.active else ():
+                    idx = bisect.bisect_left(self._words, (word, old.id))
+                    if idx < len(self._words) and self._words[idx] == (word, old.id):
+                        del self._words[idx]
+            self._by_id[product.id] = product
+            self._by_sku[product.sku] = product
+            if product.active:
+                for word in product.words:
+                    bisect.insort(self._words, (word, product.id))
+
+    def get(self, product_id):
+        """Any product by id, inactive ones included (old line items still point at them)."""
+        return self._by_id.get(product_id)
+
+    def by_sku(self, sku, inactive=False):
+        product = self._by_sku.get(str(sku).strip().upper())
+        return product if product is not None and (product.active or inactive) else None
+
+    def search(self, text, limit=20):
+        """Active products whose SKU or description words start with every word typed, an exact
+        SKU first, then in index order. Walks only the index range of the longest word typed."""
+        terms = self.tokens(text)
+        if not terms:
+            return []
+        exact = self.by_sku(text)
+        results = [exact] if exact else []
+        longest = max(terms, key=len)
+        others = [t for t in terms if t != longest]
+        with self._lock:
+            words, by_id = self._words, self._by_id
+            idx = bisect.bisect_left(words, (longest,))
+            seen = {exact.id} if exact else set()
+            while idx < len(words) and len(results) < limit and words[idx][0].startswith(longest):
+                product_id = words[idx][1]
+                idx += 1
+                if product_id in seen:
+                    continue
+                seen.add(product_id)
+                product = by_id[product_id]
+                if all(any(w.startswith(t) for w in product.words) for t in others):
+                    results.append(product)
+        return results
+
+
+class ExchangeRates(FeedCache):
+    """In-memory copy of the exchange_rates table: per currency, the days a rate was entered for (sorted
+    ordinals) beside the rates, so the rate in force on a day is a bisect. Resolved (currency, day) lookups
+    are also kept, least recently used dropped past currency.rate_cache_size, since an import or a day of
+    invoicing asks for the same few again and again.
+
+    Rates are company-wide, so one copy (EXCHANGE_RATES) serves every DatabaseManager in the process. Like
+    ProductCatalog it follows the change feed: a 'rates' entry re-reads that currency. Lookups check the feed
+    at most every change_feed.poll_seconds, and never from inside a write transaction (see rate())."""
+    FEED_KIND = 'rates'
+
     def __init__(self):
+        super().__init__()
+        self._days = {}
+        self._rates = {}
+        self._lookups = OrderedDict()
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return sum(len(days) for days in self._days.values())
+
+    def _index(self, rows):
+        days, rates = {}, {}
+        for currency, day, rate in rows:  # in (currency, rate_date) order
+            days.setdefault(currency, []).append(_issue_day(day).toordinal())
+            rates.setdefault(currency, []).append(float(rate))
+        return days, rates
+
+    def _load(self, db):
+        days, rates = self._index(db.fetch_exchange_rates())
+        with self._lock:
+            self._days, self._rates = days, rates
+            self._lookups.clear()
+
+    def _reread(self, db, currencies):
+        days, rates = self._index(db.fetch_exchange_rates(currencies))
+        with self._lock:
+            for currency in currencies:
+                self._days[currency] = days.get(currency, [])
+                self._rates[currency] = rates.get(currency, [])
+            self._lookups.clear()
+
+    def rate(self, db, currency, day, sync=True):
+        """(rate, rate_day) in force for `currency` on `day`: the latest entered on or before it and no older
+        than currency.max_rate_age_days, or (None, None). The base currency is always (1.0, day). With
+        sync=False the feed is not consulted (the caller holds a transaction the feed read would end)."""
+        currency, day = currency_code(currency), _issue_day(day)
+        if currency == CURRENCY_SETTINGS['base']:
+            return 1.0, day
+        self.ensure_current(db, sync)
+        key = (currency, day)
+        with self._lock:
+            found = self._lookups.get(key)
+            if found is not None:
+                self._lookups.move_to_end(key)
+                self.hits += 1
+                return found
+            self.misses += 1
+            days = self._days.get(currency, ())
+            idx = bisect.bisect_right(days, day.toordinal()) - 1
+            age = CURRENCY_SETTINGS['max_rate_age_days']
+            if idx < 0 or (age and day.toordinal() - days[idx] > age):
+                found = (None, None)
+            else:
+                found = (self._rates[currency][idx], date.fromordinal(days[idx]))
+            self._lookups[key] = found
+            while len(self._lookups) > CURRENCY_SETTINGS['rate_cache_size']:
+                self._lookups.popitem(last=False)
+        return found
+
+    def forget(self):
+        """Drop everything (the next lookup reloads), e.g. after max_rate_age_days changes."""
+        with self._lock:
+            self._days, self._rates = {}, {}
+            self._lookups.clear()
+            self.loaded_at = None
+
+
+EXCHANGE_RATES = ExchangeRates()
+
+PRICE_RULE_KINDS = ('percent', 'fixed', 'price')
+
+
+class PriceRule:
+    """One price rule: `value` percent off, a fixed `value` off each unit, or a contract `price` of `value` per
+    unit (kind), for one product or any (product_id None) sold to one client or any (client_name None), from
+    min_qty units on a line (volume tiers are several rules), between starts_on and ends_on when given.
+    Amounts are in the base currency, like catalog prices."""
+    __slots__ = ('id', 'code', 'description', 'product_id', 'sku', 'client_name', 'kind', 'value', 'min_qty',
+                 'starts_on', 'ends_on', 'active', 'version', 'client_key', 'first_day', 'last_day')
+
+    def __init__(self, id, code, description, product_id, sku, client_name, kind, value, min_qty=1, starts_on=None,
+                 ends_on=None, active=True, version=1):
+        self.id = id
+        self.code = code
+        self.description = description or ''
+        self.product_id = product_id
+        self.sku = sku
+        self.client_name = client_name or None
+        self.kind = kind
+        self.value = float(value)
+        self.min_qty = int(min_qty or 1)
+        self.starts_on = _issue_day(starts_on) if starts_on else None
+        self.ends_on = _issue_day(ends_on) if ends_on else None
+        self.active = bool(active)
+        self.version = version
+        self.client_key = ClientMapper.normalise(client_name) if client_name else None
+        self.first_day = self.starts_on.toordinal() if self.starts_on else 0
+        self.last_day = self.ends_on.toordinal() if self.ends_on else date.max.toordinal()
+
+    def unit_price(self, list_price, rate=1.0):
+        """One unit listed at `list_price` under this rule, in a document currency worth `rate` base units."""
+        if self.kind == 'percent':
+            return list_price * (1 - self.value / 100)
+        if self.kind == 'fixed':
+            return max(0.0, list_price - self.value / rate)
+        return self.value / rate
+
+    @property
+    def label(self):
+        """How the rule is named on the document, e.g. 'BULK10 (10% off)'."""
+        if self.kind == 'percent':
+            return f"{self.code} ({self.value:g}% off)"
+        if self.kind == 'fixed':
+            return f"{self.code} ({format_money(self.value)} off each)"
+        return f"{self.code} (contract price)"
+
+
+class PriceRules(FeedCache):
+    """The active price rules indexed by (product id, client): a cart line looks in at most four buckets (this
+    product for this client, this product for anyone, any product for this client, any product for anyone),
+    so pricing it costs a few dict hits however many thousand rules there are. Of the rules that apply, the one
+    giving the lowest unit price wins (the most specific on a tie); rules do not stack.
+
+    Rules are company-wide, so one copy (PRICE_RULES) serves every DatabaseManager in the process. Like
+    ExchangeRates it follows the change feed: a 'prices' entry re-reads that rule, and a bulk load (one
+    'import' entry) reloads them all. Lookups check the feed at most every change_feed.poll_seconds."""
+    FEED_KIND = 'prices'
+
+    def __init__(self):
+        super().__init__()
+        self._by_code = {}
+        self._index = {}
+
+    def __len__(self):
+        return len(self._by_code)
+
+    def _load(self, db):
+        rules = db.fetch_price_rules()
+        index = {}
+        for rule in rules:
+            if rule.active:
+                index.setdefault((rule.product_id, rule.client_key), []).append(rule)
+        with self._lock:
+            self._by_code = {rule.code: rule for rule in rules}
+            self._index = index
+
+    def _reread(self, db, codes):
+        rules = db.fetch_price_rules(codes)
+        with self._lock:
+            for rule in rules:
+                self.put(rule)
+
+    def put(self, rule):
+        """Add or replace one rule (by code); the caller holds the lock."""
+        old = self._by_code.get(rule.code)
+        if old is not None and old.active:
+            bucket = self._index.get((old.product_id, old.client_key), [])
+            bucket[:] = [r for r in bucket if r.code != old.code]
+        self._by_code[rule.code] = rule
+        if rule.active:
+            self._index.setdefault((rule.product_id, rule.client_key), []).append(rule)
+
+    def best(self, db, product_id, client_name, qty, list_price, day=None, rate=1.0, sync=True):
+        """(rule, unit price) for the rule that prices `qty` units listed at `list_price` lowest on `day` (today),
+        or (None, list_price) when none applies or none lowers it."""
+        self.ensure_current(db, sync)
+        client = ClientMapper.normalise(client_name) if client_name else None
+        today = (day or date.today()).toordinal()
+        found, price = None, list_price
+        with self._lock:
+            for key in dict.fromkeys(((product_id, client), (product_id, None), (None, client), (None, None))):
+                for rule in self._index.get(key, ()):
+                    if rule.min_qty <= qty and rule.first_day <= today <= rule.last_day:
+                        unit = rule.unit_price(list_price, rate)
+                        if unit < price:
+                            found, price = rule, unit
+        return found, price
+
+    def forget(self):
+        """Drop the cached rules; the next lookup reloads them."""
+        with self._lock:
+            self._by_code, self._index = {}, {}
+            self.loaded_at = None
+
+
+PRICE_RULES = PriceRules()
+
+
+class DatabaseManager:
+    def __init__(self, backend=None):
+        self.backend = backend or make_backend()
         self.conn = None
         self.cursor = None
+        self._prepared = {}
+        self._summary_cache = {}
+        self.tenant_id = DEFAULT_TENANT_ID  # every document query and insert is scoped to this company/branch
+        self._tenants = {}
+        self.audit = AuditLog(self)
         self.check_connection()
 
     def check_connection(self):
         try:
-            conn = mysql.connector.connect(
-                host=DB_SETTINGS['host'],
-                user=DB_SETTINGS['user'],
-                password=DB_SETTINGS['password']
-            )
-            if conn.is_connected():
-                cursor = conn.cursor()
-                cursor.execute(f"CREATE DATABASE IF NOT EXISTS {DB_SETTINGS['database']}")
-                conn.close()
-                return True
-            return False
-        except Error as e:
+            return bool(self.backend.ensure_database())
+        except DB_ERRORS as e:
             # Do not terminate the entire application if DB is unavailable; run in offline mode.
-            print(f"Database Warning: Cannot reach MySQL. Running in offline mode. Details: {e}")
+            log_error("db.connect_probe", "Database Warning: Cannot reach the database. Running in offline mode.", e)
             return False
 
     def get_connection(self):
         try:
-            self.conn = mysql.connector.connect(
-                host=DB_SETTINGS['host'],
-                user=DB_SETTINGS['user'],
-                password=DB_SETTINGS['password'],
-                database=DB_SETTINGS['database']
-            )
-            self.cursor = self.conn.cursor(buffered=True)
+            self.conn = self.backend.connect()
+            self.cursor = self.backend.cursor(self.conn)
+            self._prepared = {}
             self.create_tables()
             return self.conn
-        except Error as e:
-            print(f"Database Error: Connection lost. Details: {e}")
+        except DB_ERRORS as e:
+            log_error("db.connect", "Database Error: Connection lost.", e)
             return None
 
+    def ensure_column(self, table, column, definition, after=None):
+        """SELF-HEALING: add `column` to `table` when an older schema lacks it. Returns True if added."""
+        try:
+            self.cursor.execute(f"SELECT {column} FROM {table} LIMIT 1")
+            self.cursor.fetchone()
+            return False
+        except DB_ERRORS:
+            self.cursor.execute(self.backend.add_column_sql(table, column, definition, after))
+            self.conn.commit()
+            return True
+
     def create_tables(self):
         # Ensure connection is established
         if not self.conn or not self.conn.is_connected():
             self.get_connection()
         if not self.conn or not self.conn.is_connected():  # Ensure connection is established
-            print("Database Error: Unable to establish a database connection.")
+            log_error("db.migrate", "Database Error: Unable to establish a database connection.")
             return False
 
         # Create table if it doesn't exist
         query_invoices = """
         CREATE TABLE IF NOT EXISTS invoices (
-            id INT AUTO_INCREMENT PRIMARY KEY,
+            id {pk},
             invoice_number VARCHAR(50) UNIQUE NOT NULL,
             client_name VARCHAR(100) NOT NULL,
             client_email VARCHAR(100),
             client_address VARCHAR(255),
             invoice_type VARCHAR(50),
-            date_issued DATETIME DEFAULT CURRENT_TIMESTAMP,
+            date_issued DATETIME {now},
             subtotal DECIMAL(15, 2),
             vat_amount DECIMAL(15, 2),
             shipping_cost DECIMAL(15, 2),
@@ -132,47 +1809,14 @@ class DatabaseManager:
             grand_total DECIMAL(15, 2)
         )
         """
-        self.cursor.execute(query_invoices)
-
-        # SELF-HEALING: Check if client_email exists
-        try:
-            self.cursor.execute("SELECT client_email FROM invoices LIMIT 1")
-            self.cursor.fetchone()
-        except Error:
-            self.cursor.execute("ALTER TABLE invoices ADD COLUMN client_email VARCHAR(100) AFTER client_name")
-            self.conn.commit()
-        
-        # SELF-HEALING: Check if client_address exists
-        try:
-            self.cursor.execute("SELECT client_address FROM invoices LIMIT 1")
-            self.cursor.fetchone()
-        except Error:
-            self.cursor.execute("ALTER TABLE invoices ADD COLUMN client_address VARCHAR(255) AFTER client_name")
-            self.conn.commit()
-
-        # SELF-HEALING: Check if invoice_type exists
-        try:
-            self.cursor.execute("SELECT invoice_type FROM invoices LIMIT 1")
-            self.cursor.fetchone()
-        except Error:
-            self.cursor.execute("ALTER TABLE invoices ADD COLUMN invoice_type VARCHAR(50) AFTER client_address")
-            self.conn.commit()
+        self.cursor.execute(self.backend.ddl(query_invoices))
 
-        # SELF-HEALING: Check if shipping_cost exists
-        try:
-            self.cursor.execute("SELECT shipping_cost FROM invoices LIMIT 1")
-            self.cursor.fetchone()
-        except Error:
-            self.cursor.execute("ALTER TABLE invoices ADD COLUMN shipping_cost DECIMAL(15, 2) AFTER vat_amount")
-            self.conn.commit()
-
-        # SELF-HEALING: Check if wht_rate exists
-        try:
-            self.cursor.execute("SELECT wht_rate FROM invoices LIMIT 1")
-            self.cursor.fetchone()
-        except Error:
-            self.cursor.execute("ALTER TABLE invoices ADD COLUMN wht_rate DECIMAL(5, 2) AFTER wht_amount")
-            self.conn.commit()
+        # SELF-HEALING: columns added after the first release
+        self.ensure_column("invoices", "client_email", "VARCHAR(100)", after="client_name")
+        self.ensure_column("invoices", "client_address", "VARCHAR(255)", after="client_name")
+        self.ensure_column("invoices", "invoice_type", "VARCHAR(50)", after="client_address")
+        self.ensure_column("invoices", "shipping_cost", "DECIMAL(15, 2)", after="vat_amount")
+        self.ensure_column("invoices", "wht_rate", "DECIMAL(5, 2)", after="wht_amount")
 
         # SELF-HEALING: Remove net_payable column if it exists
         try:
@@ -180,7 +1824,7 @@ class DatabaseManager:
             self.cursor.fetchone()
             self.cursor.execute("ALTER TABLE invoices DROP COLUMN net_payable")
             self.conn.commit()
-        except Error:
+        except DB_ERRORS:
             pass
 
         self.conn.commit()
@@ -188,12 +1832,12 @@ class DatabaseManager:
         # Create quotations table if it doesn't exist
         query_quotes = """
         CREATE TABLE IF NOT EXISTS quotations (
-            id INT AUTO_INCREMENT PRIMARY KEY,
+            id {pk},
             quote_number VARCHAR(50) UNIQUE NOT NULL,
             client_name VARCHAR(100) NOT NULL,
             client_email VARCHAR(100),
             client_address VARCHAR(255),
-            date_issued DATETIME DEFAULT CURRENT_TIMESTAMP,
+            date_issued DATETIME {now},
             subtotal DECIMAL(15, 2),
             vat_amount DECIMAL(15, 2),
             shipping_cost DECIMAL(15, 2),
@@ -201,331 +1845,2975 @@ class DatabaseManager:
         )
         """
         try:
-            self.cursor.execute(query_quotes)
+            self.cursor.execute(self.backend.ddl(query_quotes))
             self.conn.commit()
-        except Error as e:
-            print(f"Error creating quotations table: {e}")
+        except DB_ERRORS as e:
+            log_error("db.migrate", "Error creating quotations table.", e)
             # continue without stopping the app
 
-        # SELF-HEALING: Check if client_email exists in quotations
         try:
-            self.cursor.execute("SELECT client_email FROM quotations LIMIT 1")
-            self.cursor.fetchone()
-        except Error:
+            # SELF-HEALING: Check if client_email exists in quotations
+            self.ensure_column("quotations", "client_email", "VARCHAR(100)", after="client_name")
+            # SELF-HEALING: Link converted quotations to the invoice they produced
+            self.ensure_column("quotations", "converted_invoice", "VARCHAR(50)")
+            # SELF-HEALING: Link invoices back to their source quotation
+            self.ensure_column("invoices", "source_quote", "VARCHAR(50)", after="invoice_type")
+            # SELF-HEALING: Soft delete - tax records are flagged, never removed
+            self.ensure_column("invoices", "deleted_at", "DATETIME NULL")
+            self.ensure_column("quotations", "deleted_at", "DATETIME NULL")
+            # SELF-HEALING: Row versions for optimistic concurrency between clerks
+            self.ensure_column("invoices", "version", "INT NOT NULL DEFAULT 1")
+            self.ensure_column("quotations", "version", "INT NOT NULL DEFAULT 1")
+            # SELF-HEALING: Multi-company tenancy; documents from before it belong to the default company
+            self.ensure_column("invoices", "tenant_id", f"INT NOT NULL DEFAULT {DEFAULT_TENANT_ID}", after="id")
+            self.ensure_column("quotations", "tenant_id", f"INT NOT NULL DEFAULT {DEFAULT_TENANT_ID}", after="id")
+        except DB_ERRORS as e:
+            log_error("db.migrate", "Error upgrading quotation columns.", e)
+
+        # Line items for invoices and quotations (headers alone cannot be re-rendered or converted)
+        query_invoice_items = """
+        CREATE TABLE IF NOT EXISTS invoice_items (
+            id {pk},
+            invoice_number VARCHAR(50) NOT NULL,
+            sn INT,
+            description VARCHAR(255) NOT NULL,
+            item_type VARCHAR(50),
+            qty INT,
+            unit_price DECIMAL(15, 2),
+            total DECIMAL(15, 2)
+        )
+        """
+        query_quote_items = """
+        CREATE TABLE IF NOT EXISTS quotation_items (
+            id {pk},
+            quote_number VARCHAR(50) NOT NULL,
+            sn INT,
+            description VARCHAR(255) NOT NULL,
+            qty INT,
+            unit_price DECIMAL(15, 2),
+            total DECIMAL(15, 2)
+        )
+        """
+        # Delivery log written by save_email_log / read by the Email Log dialog
+        query_email_log = """
+        CREATE TABLE IF NOT EXISTS email_deliveries (
+            id {pk},
+            created_at DATETIME {now},
+            to_address VARCHAR(255),
+            subject VARCHAR(255),
+            attachment VARCHAR(255),
+            status VARCHAR(20),
+            error_message TEXT
+        )
+        """
+        # Append-only audit trail, written in batches by AuditLog
+        query_audit = """
+        CREATE TABLE IF NOT EXISTS audit_log (
+            id {pk},
+            event_time DATETIME NOT NULL,
+            actor VARCHAR(100) NOT NULL,
+            action VARCHAR(20) NOT NULL,
+            doc_kind VARCHAR(20),
+            doc_number VARCHAR(50),
+            details VARCHAR(255)
+        )
+        """
+        # Change feed: one row per committed document change, polled by open dashboards
+        query_change_feed = """
+        CREATE TABLE IF NOT EXISTS change_feed (
+            id {pk},
+            changed_at DATETIME {now},
+            doc_kind VARCHAR(20) NOT NULL,
+            doc_number VARCHAR(50) NOT NULL,
+            action VARCHAR(20) NOT NULL
+        )
+        """
+        # Companies and branches. Empty columns inherit from the parent company, then from COMPANY_CONFIG
+        query_tenants = """
+        CREATE TABLE IF NOT EXISTS tenants (
+            id {pk},
+            code VARCHAR(20) UNIQUE NOT NULL,
+            parent_id INT NULL,
+            company_name VARCHAR(100),
+            address VARCHAR(255),
+            tin VARCHAR(40),
+            bank_name VARCHAR(100),
+            account_name VARCHAR(100),
+            account_number VARCHAR(40),
+            logo_path VARCHAR(255),
+            number_prefix VARCHAR(20),
+            version INT NOT NULL DEFAULT 1,
+            created_at DATETIME {now}
+        )
+        """
+        # Per-tenant document number sequences (highest number issued per kind and year)
+        query_sequences = """
+        CREATE TABLE IF NOT EXISTS document_sequences (
+            tenant_id INT NOT NULL,
+            doc_kind VARCHAR(20) NOT NULL,
+            seq_year INT NOT NULL,
+            last_value INT NOT NULL,
+            PRIMARY KEY (tenant_id, doc_kind, seq_year)
+        )
+        """
+        # Bulk import idempotency: one row per imported document, so a rerun skips what is already in
+        query_import_keys = """
+        CREATE TABLE IF NOT EXISTS import_keys (
+            tenant_id INT NOT NULL,
+            idem_key VARCHAR(100) NOT NULL,
+            doc_number VARCHAR(50) NOT NULL,
+            content_hash CHAR(40) NOT NULL,
+            batch_id VARCHAR(40) NOT NULL,
+            imported_at DATETIME {now},
+            PRIMARY KEY (tenant_id, idem_key)
+        )
+        """
+        # Product/component catalog shared by every company and branch; cart lines reference it by id.
+        # Products are deactivated rather than deleted, so old line items keep their reference
+        query_products = """
+        CREATE TABLE IF NOT EXISTS products (
+            id {pk},
+            sku VARCHAR(40) UNIQUE NOT NULL,
+            description VARCHAR(255) NOT NULL,
+            unit_price DECIMAL(15, 2) NOT NULL,
+            vat_applicable INT NOT NULL DEFAULT 1,
+            active INT NOT NULL DEFAULT 1,
+            version INT NOT NULL DEFAULT 1,
+            updated_at DATETIME {now}
+        )
+        """
+        # Stock per tenant and product, split over STOCK_SETTINGS['shards'] counter rows: a sale updates one
+        # row that can cover it, so concurrent sales of a popular part rarely wait on the same row lock
+        query_stock_levels = """
+        CREATE TABLE IF NOT EXISTS stock_levels (
+            tenant_id INT NOT NULL,
+            product_id INT NOT NULL,
+            shard INT NOT NULL,
+            on_hand INT NOT NULL,
+            PRIMARY KEY (tenant_id, product_id, shard)
+        )
+        """
+        # Every stock movement (sale, receipt, stocktake, void), written in the transaction that made it
+        query_stock_ledger = """
+        CREATE TABLE IF NOT EXISTS stock_ledger (
+            id {pk},
+            tenant_id INT NOT NULL,
+            product_id INT NOT NULL,
+            qty_change INT NOT NULL,
+            reason VARCHAR(20) NOT NULL,
+            doc_number VARCHAR(50),
+            created_at DATETIME {now}
+        )
+        """
+        # Low-stock view: one row per stocked product, created with its counters, whose flag each stock movement
+        # updates only when the total crosses the reorder level (so sales do not all write one status row)
+        query_stock_status = """
+        CREATE TABLE IF NOT EXISTS stock_status (
+            tenant_id INT NOT NULL,
+            product_id INT NOT NULL,
+            low INT NOT NULL DEFAULT 0,
+            changed_at DATETIME {now},
+            PRIMARY KEY (tenant_id, product_id)
+        )
+        """
+        # Payments received against invoices; a mistaken one is voided (kept, with voided_at), never deleted
+        query_payments = """
+        CREATE TABLE IF NOT EXISTS payments (
+            id {pk},
+            tenant_id INT NOT NULL,
+            invoice_number VARCHAR(50) NOT NULL,
+            amount DECIMAL(15, 2) NOT NULL,
+            method VARCHAR(20) NOT NULL,
+            reference VARCHAR(100),
+            paid_at DATETIME NOT NULL,
+            voided_at DATETIME NULL,
+            created_at DATETIME {now}
+        )
+        """
+        # Open receivables pre-aggregated per issue day, and per client and issue day for the by-client report,
+        # kept in step by every invoice create, payment, delete and archive. Aging buckets are date ranges over
+        # them, so they move with the calendar without rewriting anything, and rows leave once all their
+        # invoices are paid. The daily table stays at one row per day however many invoices and clients there are
+        query_receivables = """
+        CREATE TABLE IF NOT EXISTS receivables_daily (
+            tenant_id INT NOT NULL,
+            issue_date DATE NOT NULL,
+            open_invoices INT NOT NULL DEFAULT 0,
+            balance_due DECIMAL(15, 2) NOT NULL DEFAULT 0,
+            PRIMARY KEY (tenant_id, issue_date)
+        )
+        """
+        query_receivables_clients = """
+        CREATE TABLE IF NOT EXISTS receivables_by_client (
+            tenant_id INT NOT NULL,
+            client_name VARCHAR(100) NOT NULL,
+            issue_date DATE NOT NULL,
+            open_invoices INT NOT NULL DEFAULT 0,
+            balance_due DECIMAL(15, 2) NOT NULL DEFAULT 0,
+            PRIMARY KEY (tenant_id, client_name, issue_date)
+        )
+        """
+        # Exchange rates shared by every company and branch: base-currency units per unit of `currency`, in force
+        # from rate_date until the next entry. A document keeps the rate it was saved at in its own exchange_rate
+        query_rates = """
+        CREATE TABLE IF NOT EXISTS exchange_rates (
+            currency VARCHAR(3) NOT NULL,
+            rate_date DATE NOT NULL,
+            rate DECIMAL(18, 6) NOT NULL,
+            updated_at DATETIME {now},
+            PRIMARY KEY (currency, rate_date)
+        )
+        """
+        # Price rules (see PriceRule), shared by every company and branch like the catalog they price
+        query_price_rules = """
+        CREATE TABLE IF NOT EXISTS price_rules (
+            id {pk},
+            code VARCHAR(40) UNIQUE NOT NULL,
+            description VARCHAR(100),
+            product_id INT NULL,
+            client_name VARCHAR(100) NULL,
+            kind VARCHAR(10) NOT NULL,
+            value DECIMAL(15, 4) NOT NULL,
+            min_qty INT NOT NULL DEFAULT 1,
+            starts_on DATE NULL,
+            ends_on DATE NULL,
+            active INT NOT NULL DEFAULT 1,
+            version INT NOT NULL DEFAULT 1,
+            updated_at DATETIME {now}
+        )
+        """
+        # A document's taxes by rate as they were worked out when it was saved (TaxRules.compute's 'taxes'),
+        # so the PDF shows the breakdown the client was charged even after the tax rules change
+        query_document_taxes = """
+        CREATE TABLE IF NOT EXISTS document_taxes (
+            id {pk},
+            doc_kind VARCHAR(20) NOT NULL,
+            doc_number VARCHAR(50) NOT NULL,
+            tax VARCHAR(10) NOT NULL,
+            rate DECIMAL(9, 4) NOT NULL,
+            taxable DECIMAL(15, 2) NOT NULL,
+            amount DECIMAL(15, 2) NOT NULL
+        )
+        """
+        # Credit notes and amendments against saved invoices (the invoice itself is never edited): numbered documents
+        # of their own in the invoice's currency and at its rate. `adjustment` is the signed change each made to what
+        # the client owes; the invoice keeps their running sum in adjusted_total
+        query_credit_notes = """
+        CREATE TABLE IF NOT EXISTS credit_notes (
+            id {pk},
+            tenant_id INT NOT NULL,
+            note_number VARCHAR(50) UNIQUE NOT NULL,
+            note_kind VARCHAR(20) NOT NULL,
+            invoice_number VARCHAR(50) NOT NULL,
+            client_name VARCHAR(100) NOT NULL,
+            reason VARCHAR(255) NOT NULL,
+            date_issued DATETIME {now},
+            subtotal DECIMAL(15, 2) NOT NULL,
+            vat_amount DECIMAL(15, 2) NOT NULL,
+            wht_amount DECIMAL(15, 2) NOT NULL,
+            grand_total DECIMAL(15, 2) NOT NULL,
+            adjustment DECIMAL(15, 2) NOT NULL,
+            currency VARCHAR(3) NOT NULL,
+            exchange_rate DECIMAL(18, 6) NOT NULL DEFAULT 1
+        )
+        """
+        query_credit_note_items = """
+        CREATE TABLE IF NOT EXISTS credit_note_items (
+            id {pk},
+            note_number VARCHAR(50) NOT NULL,
+            sn INT,
+            description VARCHAR(255) NOT NULL,
+            item_type VARCHAR(50),
+            qty INT,
+            unit_price DECIMAL(15, 2),
+            total DECIMAL(15, 2),
+            product_id INT NULL
+        )
+        """
+        # Settings saved from the app (SMTP, PDF profile, ...): the database layer of CONFIG
+        query_settings = """
+        CREATE TABLE IF NOT EXISTS app_settings (
+            section VARCHAR(40) NOT NULL,
+            setting VARCHAR(60) NOT NULL,
+            setting_value TEXT,
+            updated_at DATETIME {now},
+            PRIMARY KEY (section, setting)
+        )
+        """
+        # Archived documents: searchable header columns plus the full record (header + items)
+        # as zlib-compressed JSON; their PDFs live in the zip named by `bundle`
+        query_archive = """
+        CREATE TABLE IF NOT EXISTS document_archive (
+            id {pk},
+            doc_kind VARCHAR(20) NOT NULL,
+            doc_number VARCHAR(50) UNIQUE NOT NULL,
+            client_name VARCHAR(100),
+            client_email VARCHAR(100),
+            invoice_type VARCHAR(50),
+            date_issued DATETIME,
+            subtotal DECIMAL(15, 2),
+            vat_amount DECIMAL(15, 2),
+            shipping_cost DECIMAL(15, 2),
+            wht_amount DECIMAL(15, 2),
+            wht_rate DECIMAL(5, 2),
+            grand_total DECIMAL(15, 2),
+            bundle VARCHAR(255),
+            archived_at DATETIME {now},
+            payload {blob}
+        )
+        """
+        try:
+            self.cursor.execute(self.backend.ddl(query_invoice_items))
+            self.cursor.execute(self.backend.ddl(query_quote_items))
+            self.cursor.execute(self.backend.ddl(query_email_log))
+            self.cursor.execute(self.backend.ddl(query_archive))
+            self.cursor.execute(self.backend.ddl(query_audit))
+            self.cursor.execute(self.backend.ddl(query_change_feed))
+            self.cursor.execute(self.backend.ddl(query_settings))
+            # Older versions saved the SMTP password here from the email dialog
+            self.cursor.executemany("DELETE FROM app_settings WHERE section = %s AND setting = %s", sorted(DB_SECRET_KEYS))
+            self.cursor.execute(self.backend.ddl(query_tenants))
+            self.cursor.execute(self.backend.ddl(query_sequences))
+            self.cursor.execute(self.backend.ddl(query_import_keys))
+            self.cursor.execute(self.backend.ddl(query_products))
+            self.ensure_column("invoice_items", "product_id", "INT NULL")
+            self.ensure_column("quotation_items", "product_id", "INT NULL")
+            self.ensure_column("products", "reorder_level", "INT NOT NULL DEFAULT 0")
+            self.cursor.execute(self.backend.ddl(query_stock_levels))
+            self.cursor.execute(self.backend.ddl(query_stock_ledger))
+            self.cursor.execute(self.backend.ddl(query_stock_status))
+            self.cursor.execute(self.backend.ddl(query_payments))
+            self.cursor.execute(self.backend.ddl(query_receivables))
+            self.cursor.execute(self.backend.ddl(query_receivables_clients))
+            self.ensure_column("invoices", "amount_paid", "DECIMAL(15, 2) NOT NULL DEFAULT 0")
+            # Each document's currency and its rate to the base currency; everything before them was in the base currency
+            self.cursor.execute(self.backend.ddl(query_rates))
+            for table in ("invoices", "quotations", "document_archive"):
+                self.ensure_column(table, "currency", f"VARCHAR(3) NOT NULL DEFAULT '{CURRENCY_SETTINGS['base']}'")
+                self.ensure_column(table, "exchange_rate", "DECIMAL(18, 6) NOT NULL DEFAULT 1")
+            self.cursor.execute(self.backend.ddl(query_document_taxes))
+            # What each line listed at and the rule that discounted it, and each document's discounts in total
+            self.cursor.execute(self.backend.ddl(query_price_rules))
+            for table in ("invoice_items", "quotation_items"):
+                self.ensure_column(table, "list_price", "DECIMAL(15, 2) NULL")
+                self.ensure_column(table, "discount", "DECIMAL(15, 2) NOT NULL DEFAULT 0")
+                self.ensure_column(table, "price_rule", "VARCHAR(80) NULL")
+            for table in ("invoices", "quotations"):
+                self.ensure_column(table, "discount_total", "DECIMAL(15, 2) NOT NULL DEFAULT 0")
+            # The bank statement line a reconciled payment came from, so a statement can be run again safely
+            self.ensure_column("payments", "statement_key", "VARCHAR(40) NULL")
+            self.cursor.execute(self.backend.ddl(query_credit_notes))
+            self.cursor.execute(self.backend.ddl(query_credit_note_items))
+            self.ensure_column("invoices", "adjusted_total", "DECIMAL(15, 2) NOT NULL DEFAULT 0")
+            if self.ensure_column("invoices", "balance_due", "DECIMAL(15, 2) NULL"):
+                # Nothing was recorded as paid before payments were tracked, so every invoice starts out owed
+                self.cursor.execute("UPDATE invoices SET balance_due = grand_total - COALESCE(wht_amount, 0) - amount_paid + adjusted_total")
+                self.rebuild_receivables()
+            self.ensure_column("document_archive", "tenant_id", f"INT NOT NULL DEFAULT {DEFAULT_TENANT_ID}", after="id")
+            # 0 = not tenant-specific (settings, branch list)
+            self.ensure_column("change_feed", "tenant_id", f"INT NOT NULL DEFAULT {DEFAULT_TENANT_ID}", after="id")
+            self.cursor.execute("SELECT COUNT(*) FROM tenants WHERE id = %s", (DEFAULT_TENANT_ID,))
+            if not self.cursor.fetchone()[0]:
+                # The default company takes its letterhead from COMPANY_CONFIG and keeps the original NSE numbering
+                self.cursor.execute("INSERT INTO tenants (id, code, number_prefix) VALUES (%s, %s, %s)",
+                                    (DEFAULT_TENANT_ID, DEFAULT_TENANT_CODE, DEFAULT_TENANT_CODE))
+            self.backend.create_index(self.cursor, "idx_invoice_items_number", "invoice_items", "invoice_number")
+            self.backend.create_index(self.cursor, "idx_quotation_items_number", "quotation_items", "quote_number")
+            self.backend.create_index(self.cursor, "idx_document_taxes_doc", "document_taxes", "doc_kind, doc_number")
+            self.backend.create_index(self.cursor, "idx_price_rules_product", "price_rules", "product_id, client_name")
+            self.backend.create_index(self.cursor, "idx_credit_notes_invoice", "credit_notes", "tenant_id, invoice_number")
+            self.backend.create_index(self.cursor, "idx_credit_note_items_number", "credit_note_items", "note_number")
+            # Every dashboard, summary, statement and archive query is scoped to one tenant, so these all lead
+            # with tenant_id: a branch reads only its own slice, newest first, however large the other branches grow
+            for old_index, table in (("idx_invoices_date", "invoices"), ("idx_invoices_type_date", "invoices"),
+                                     ("idx_invoices_client_date", "invoices"), ("idx_quotations_date", "quotations"),
+                                     ("idx_archive_date", "document_archive"), ("idx_archive_client", "document_archive")):
+                self.backend.drop_index(self.cursor, old_index, table)
+            self.backend.create_index(self.cursor, "idx_invoices_tenant_date", "invoices", "tenant_id, date_issued")
+            self.backend.create_index(self.cursor, "idx_invoices_tenant_type_date", "invoices", "tenant_id, invoice_type, date_issued")
+            self.backend.create_index(self.cursor, "idx_invoices_tenant_client_date", "invoices", "tenant_id, client_name, date_issued")
+            self.backend.create_index(self.cursor, "idx_quotations_tenant_date", "quotations", "tenant_id, date_issued")
+            self.backend.create_index(self.cursor, "idx_quotations_tenant_client_date", "quotations", "tenant_id, client_name, date_issued")
+            self.backend.create_index(self.cursor, "idx_archive_tenant_date", "document_archive", "tenant_id, date_issued")
+            self.backend.create_index(self.cursor, "idx_archive_tenant_client", "document_archive", "tenant_id, client_name")
+            # A document's history and a user's activity are both read newest-first by these
+            self.backend.create_index(self.cursor, "idx_audit_doc_time", "audit_log", "doc_number, event_time")
+            self.backend.create_index(self.cursor, "idx_audit_actor_time", "audit_log", "actor, event_time")
+            self.backend.create_index(self.cursor, "idx_change_feed_time", "change_feed", "changed_at")
+            # A product's movements, and the sales to reverse when an invoice is deleted
+            self.backend.create_index(self.cursor, "idx_stock_ledger_product", "stock_ledger", "tenant_id, product_id, id")
+            self.backend.create_index(self.cursor, "idx_stock_ledger_doc", "stock_ledger", "doc_number")
+            self.backend.create_index(self.cursor, "idx_stock_status_low", "stock_status", "tenant_id, low")
+            self.backend.create_index(self.cursor, "idx_payments_invoice", "payments", "invoice_number, id")
+            self.backend.create_index(self.cursor, "idx_payments_statement", "payments", "tenant_id, statement_key, invoice_number",
+                                      unique=True)
+        except DB_ERRORS as e:
+            log_error("db.migrate", "Error creating line item tables.", e)
+        try:
+            self.backend.make_append_only(self.cursor, "audit_log")
+        except DB_ERRORS as e:
+            log_error("db.migrate", "Could not install append-only triggers on audit_log (the app still never updates it).", e)
+        self.conn.commit()
+
+    def save_invoice(self, data, items=None, renumber=False, idem_key=None):
+        """Insert an invoice and its items. With renumber=True (numbers generated for the form), a number
+        another user saved first is replaced by the next free one and data['invoice_no'] is updated.
+        idem_key (key, content_hash) is recorded in import_keys in the same transaction (API Idempotency-Key)."""
+        if not self.conn or not self.conn.is_connected():
+            self.get_connection()
+        attempts = CHANGE_FEED_SETTINGS['renumber_attempts'] if renumber else 1
+        for attempt in range(attempts):
             try:
-                self.cursor.execute("ALTER TABLE quotations ADD COLUMN client_email VARCHAR(100) AFTER client_name")
+                self._fix_exchange_rate(data)
+                self._insert_invoice(data, items)
+                self._claim_import_key(idem_key, data['invoice_no'])
+                self._record_change('invoices', data['invoice_no'], 'create')
                 self.conn.commit()
-            except Error:
-                pass
-        
-        # SELF-HEALING: ensure basic columns exist (no-op if table present)
+                self.invalidate_summaries()
+                self.audit.record('create', 'invoices', data['invoice_no'], f"{data['client_name']} {data['grand_total']:.2f} {data['currency']}")
+                return True
+            except MissingExchangeRate as e:
+                data['missing_rate'] = str(e)
+                logger.info(f"Invoice {data['invoice_no']} not saved. {e}")
+                return False
+            except StockShortage as e:
+                # Nothing is saved; the form (or API) tells the user which lines are short
+                self._rollback()
+                data['stock_shortages'] = e.shortages
+                logger.info(f"Invoice {data['invoice_no']} not saved. {e}")
+                return False
+            except DB_ERRORS as e:
+                self._rollback()
+                if attempt + 1 < attempts and self.backend.is_duplicate_key(e):
+                    data['invoice_no'] = self.generate_invoice_number()
+                    continue
+                log_error("db.save_invoice", "Save Error: Failed to save.", e)
+                return False
+
+    def _insert_invoice(self, data, items=None):
+        """Insert an invoice header and its line items without committing."""
+        sql = """
+        INSERT INTO invoices 
+        (tenant_id, invoice_number, client_name, client_email, client_address, invoice_type, source_quote, date_issued, subtotal, vat_amount, shipping_cost, wht_amount, wht_rate, grand_total, balance_due, currency, exchange_rate, discount_total) 
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """
+        # Issued on this clock, not the database's: the receivables accrue under the same day that a payment
+        # or delete later takes them off, even across midnight or with the server's clock set differently
+        issued = data['date_issued'] = data.get('date_issued') or datetime.now().replace(microsecond=0)
+        balance = round(data['grand_total'] - data['wht'], 2)
+        vals = (
+            self.tenant_id, data['invoice_no'], data['client_name'], data.get('client_email', ''), data['client_address'], data['invoice_type'],
+            data.get('source_quote'), issued, data['subtotal'], data['vat'], data['shipping'], data['wht'], data['wht_rate'], data['grand_total'], balance,
+            data['currency'], data['exchange_rate'], data.get('discount', 0)
+        )
+        self.cursor.execute(sql, vals)
+        self._claim_number('invoices', data['invoice_no'])
+        if balance > 0:
+            self._accrue_receivables([(issued, data['client_name'], _to_base(balance, data['exchange_rate']), 1)])
+        if items:
+            self.cursor.executemany(
+                "INSERT INTO invoice_items (invoice_number, sn, description, item_type, qty, unit_price, total, product_id, list_price, discount, price_rule) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                [(data['invoice_no'], int(item.get('sn') or idx + 1), item['desc'], item.get('service') or item.get('type', data['invoice_type']),
+                  item['qty'], item['price'], item['total'], item.get('product_id'), item.get('list_price'), item.get('discount', 0), item.get('price_rule'))
+                 for idx, item in enumerate(items)]
+            )
+            if data['invoice_type'] == 'Component':
+                self._deduct_stock(data['invoice_no'], items)
+        self._insert_taxes('invoices', data['invoice_no'], data.get('taxes'))
+
+    def _insert_taxes(self, kind, number, taxes):
+        """Store a document's tax breakdown (TaxRules.compute's 'taxes') without committing."""
+        if taxes:
+            self.cursor.executemany(
+                "INSERT INTO document_taxes (doc_kind, doc_number, tax, rate, taxable, amount) VALUES (%s, %s, %s, %s, %s, %s)",
+                [(kind, number, t['tax'], t['rate'], t['taxable'], t['amount']) for t in taxes])
+
+    def fetch_taxes(self, kind, number):
+        """A saved document's tax breakdown, VAT then WHT, highest rate first; [] for documents saved without one."""
+        rows = self._fetch_prepared("SELECT tax, rate, taxable, amount FROM document_taxes WHERE doc_kind = %s AND doc_number = %s "
+                                    "ORDER BY tax, rate DESC", [kind, number])
+        return [{'tax': tax, 'rate': float(rate), 'taxable': _money(taxable), 'amount': _money(amount)}
+                for tax, rate, taxable, amount in rows]
+
+    def exchange_rate(self, currency, day=None, sync=True):
+        """(rate, rate_day) in force for `currency` on `day` (today), from the shared EXCHANGE_RATES cache;
+        (None, None) when no usable rate has been entered."""
+        return EXCHANGE_RATES.rate(self, currency, day or date.today(), sync)
+
+    def _fix_exchange_rate(self, data, sync=True):
+        """Settle data['currency'] and data['exchange_rate'] (the rate in force on the issue day unless the caller
+        gave one) before a document is written. Raises MissingExchangeRate."""
+        data['currency'] = currency_code(data.get('currency'))
+        if data['currency'] == CURRENCY_SETTINGS['base']:
+            data['exchange_rate'] = 1.0
+        elif not data.get('exchange_rate'):
+            day = _issue_day(data.get('date_issued') or date.today())
+            rate, _ = self.exchange_rate(data['currency'], day, sync)
+            if rate is None:
+                raise MissingExchangeRate(data['currency'], day)
+            data['exchange_rate'] = rate
+
+    def _rollback(self):
         try:
-            self.cursor.execute("SELECT quote_number FROM quotations LIMIT 1")
-            self.cursor.fetchone()
-        except Error:
+            if self.conn:
+                self.conn.rollback()
+        except DB_ERRORS:
             pass
-        self.conn.commit()
 
-    def save_invoice(self, data):
+    def generate_invoice_number(self):
+        """Preview the next number in the current tenant's invoice sequence (PREFIX-INV-YEAR-NNNN).
+        Nothing is reserved; saving with renumber=True resolves a clash with another clerk."""
+        return self.next_document_number('invoices')
+
+    def fetch_invoices(self, filters=None, page=1, page_size=25):
+        """Return a list of invoices matching optional filters.
+        filters: dict with keys: invoice_no, client_name, invoice_type, date_from, date_to
+        Rows are DocumentRow objects: index them like the old dicts; values are decoded on access.
+        """
+        try:
+            # Ensure connection
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return []
+            sql, params = self._document_query('invoices', filters, self.PAGE_TAIL)
+            params.extend([page_size, (page - 1) * page_size])
+            return list(map(DocumentRow, self._fetch_prepared(sql, params)))
+        except Exception as e:
+            log_error("db.fetch_invoices", "Fetch Error", e)
+            return []
+
+    def iter_invoices(self, filters=None, batch_size=1000):
+        """Stream every matching invoice (newest first) as DocumentRow objects.
+        Uses a server-side cursor on MySQL, so large exports never hold the full result set;
+        the generator must be consumed before the connection runs another query.
+        """
+        if not self.conn or not self.conn.is_connected():
+            self.get_connection()
+        sql, params = self._document_query('invoices', filters, " ORDER BY date_issued DESC")
+        cursor = self.backend.stream_cursor(self.conn)
+        try:
+            cursor.execute(sql, tuple(params))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from map(DocumentRow, rows)
+        finally:
+            # Drain anything left unread (early exit) so the connection can run the next query
+            try:
+                cursor.fetchall()
+            except DB_ERRORS:
+                pass
+            cursor.close()
+
+    def delete_invoice(self, invoice_number, expected_version=None):
+        """Soft-delete an invoice. With expected_version (the version the user loaded), the delete only
+        happens if nobody changed the invoice since; False means nothing was deleted."""
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return False
+            # Soft delete: the invoice and its items stay on record for tax purposes. Stock and receivables
+            # move in the same transaction, so a failure part-way leaves nothing pending on the connection
+            self.backend.begin_write(self.conn)
+            if not self._soft_delete('invoices', invoice_number, expected_version):
+                self._rollback()
+                return False
+            self._return_stock(invoice_number)
+            self._release_receivables(self._fetch_prepared(
+                "SELECT date_issued, client_name, balance_due, exchange_rate FROM invoices WHERE invoice_number = %s AND tenant_id = %s",
+                [invoice_number, self.tenant_id]))
+            self.conn.commit()
+        except Exception as e:
+            self._rollback()
+            log_error("db.delete_invoice", "Delete Invoice Error", e)
+            return False
+        self.invalidate_summaries()
+        self.audit.record('delete', 'invoices', invoice_number)
+        return True
+
+    def delete_quotation(self, quote_number, expected_version=None):
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return False
+            deleted = self._soft_delete('quotations', quote_number, expected_version)
+            self.conn.commit()
+            if deleted:
+                self.invalidate_summaries()
+                self.audit.record('delete', 'quotations', quote_number)
+            return deleted
+        except Exception as e:
+            log_error("db.delete_quotation", "Delete Quote Error", e)
+            return False
+
+    def _soft_delete(self, kind, number, expected_version=None):
+        table, number_col, _, _ = self.ARCHIVE_KINDS[kind]
+        sql = f"UPDATE {table} SET deleted_at = %s, version = version + 1 WHERE {number_col} = %s AND tenant_id = %s AND deleted_at IS NULL"
+        params = [datetime.now(), number, self.tenant_id]
+        if expected_version is not None:
+            sql += " AND version = %s"
+            params.append(expected_version)
+        self.cursor.execute(sql, tuple(params))
+        if self.cursor.rowcount != 1:
+            return False
+        self._record_change(kind, number, 'delete')
+        return True
+
+    # ------------------- Change feed -------------------
+    SHARED_KINDS = ('settings', 'products', 'rates', 'prices')  # fed to every tenant (tenant_id 0)
+
+    def _record_change(self, kind, number, action):
+        """Append to change_feed inside the caller's transaction, so the feed row commits with the change."""
+        self.cursor.execute("INSERT INTO change_feed (tenant_id, doc_kind, doc_number, action) VALUES (%s, %s, %s, %s)",
+                            (0 if kind in self.SHARED_KINDS else self.tenant_id, kind, number, action))
+
+    def latest_change_id(self):
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return 0
+            self.conn.commit()
+            return int(self._fetch_prepared("SELECT MAX(id) FROM change_feed", [])[0][0] or 0)
+        except Exception as e:
+            log_error("db.change_feed", "Change Feed Error", e)
+            return 0
+
+    def fetch_changes(self, after_id, limit=500):
+        """Changes committed after `after_id` for this tenant (and global ones such as settings), oldest
+        first, as (id, doc_kind, doc_number, action) tuples. A primary-key range read, so polling stays
+        cheap however long the feed is."""
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return []  # offline: the next poll tries again
+            # End any open read snapshot (MySQL REPEATABLE READ) so other clients' commits are visible
+            self.conn.commit()
+            return [tuple(r) for r in self._fetch_prepared(
+                "SELECT id, doc_kind, doc_number, action FROM change_feed WHERE id > %s AND tenant_id IN (0, %s) ORDER BY id LIMIT %s",
+                [after_id, self.tenant_id, limit]
+            )]
+        except Exception as e:
+            log_error("db.change_feed", "Change Feed Error", e)
+            return []
+
+    def prune_change_feed(self, retention_hours=None):
+        hours = CHANGE_FEED_SETTINGS['retention_hours'] if retention_hours is None else retention_hours
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return
+            self.cursor.execute("DELETE FROM change_feed WHERE changed_at < %s", (datetime.now() - timedelta(hours=hours),))
+            self.conn.commit()
+        except Exception as e:
+            log_error("db.change_feed", "Change Feed Prune Error", e)
+
+    def fetch_dashboard_row(self, kind, number, filters=None):
+        """The dashboard row for one document if it still matches `filters` (None otherwise)."""
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            sql, params = self._document_query(kind, dict(filters or {}, number=number), " LIMIT 1")
+            rows = self._fetch_prepared(sql, params)
+            return DocumentRow(rows[0]) if rows else None
+        except Exception as e:
+            log_error("db.fetch_dashboard_row", "Fetch Row Error", e)
+            return None
+
+    def generate_quotation_number(self):
+        return self.next_document_number('quotations')
+
+    # ------------------- Tenants & number sequences -------------------
+    NUMBER_TAGS = {'invoices': 'INV', 'quotations': 'QTN', 'credit_notes': 'CRN', 'amendments': 'AMD'}
+    TENANT_FIELDS = ('company_name', 'address', 'tin', 'bank_name', 'account_name', 'account_number', 'logo_path')
+
+    def next_document_number(self, kind):
+        if not self.conn or not self.conn.is_connected():
+            self.get_connection()
+        if not (self.conn and self.conn.is_connected()):
+            raise Error("Database connection could not be established.")
+        prefix = self.tenant()['number_prefix']
+        year = datetime.now().year
+        rows = self._fetch_prepared(
+            "SELECT last_value FROM document_sequences WHERE tenant_id = %s AND doc_kind = %s AND seq_year = %s",
+            [self.tenant_id, kind, year])
+        last = rows[0][0] if rows else self._highest_number(kind, prefix, year)
+        return f"{prefix}-{self.NUMBER_TAGS[kind]}-{year}-{last + 1:04d}"
+
+    def _highest_number(self, kind, prefix, year):
+        """Seed for a tenant/kind/year sequence that has no row yet: the highest number already issued
+        in that series (documents saved before sequences existed, e.g. the id-based NSE numbers)."""
+        table, number_col = ('credit_notes', 'note_number') if kind in self.NOTE_KINDS else self.ARCHIVE_KINDS[kind][:2]
+        rows = self._fetch_prepared(
+            f"SELECT {number_col} FROM {table} WHERE tenant_id = %s AND {number_col} LIKE %s "
+            f"ORDER BY LENGTH({number_col}) DESC, {number_col} DESC LIMIT 1",
+            [self.tenant_id, f"{prefix}-{self.NUMBER_TAGS[kind]}-{year}-%"])
+        suffix = rows[0][0].rsplit('-', 1)[-1] if rows else ''
+        return int(suffix) if suffix.isdigit() else 0
+
+    def _claim_number(self, kind, number):
+        """Advance the tenant's sequence to `number` inside the caller's transaction, so the next preview
+        follows it. Numbers outside the tenant's PREFIX-TAG-YEAR-N series (typed by hand) are left alone."""
+        prefix = self.tenant()['number_prefix']
+        match = re.fullmatch(rf"{re.escape(prefix)}-{self.NUMBER_TAGS[kind]}-(\d{{4}})-(\d+)", number)
+        if not match:
+            return
+        year, value = int(match.group(1)), int(match.group(2))
+        key = (self.tenant_id, kind, year)
+        self.cursor.execute("UPDATE document_sequences SET last_value = %s "
+                            "WHERE tenant_id = %s AND doc_kind = %s AND seq_year = %s AND last_value < %s", (value, *key, value))
+        if self.cursor.rowcount:
+            return
+        self.cursor.execute("SELECT 1 FROM document_sequences WHERE tenant_id = %s AND doc_kind = %s AND seq_year = %s", key)
+        if not self.cursor.fetchall():
+            # A concurrent first claim raises a duplicate key here, which save_*(renumber=True) retries
+            self.cursor.execute("INSERT INTO document_sequences (tenant_id, doc_kind, seq_year, last_value) VALUES (%s, %s, %s, %s)",
+                                (*key, value))
+
+    def tenant(self, tenant_id=None):
+        """The current (or given) tenant with inherited values resolved: a dict with id, code, parent_id,
+        number_prefix, version and TENANT_FIELDS. Blank fields fall back to the parent company, then to
+        COMPANY_CONFIG (the default company stores none, so config edits show on its documents)."""
+        tenant_id = self.tenant_id if tenant_id is None else tenant_id
+        cached = self._tenants.get(tenant_id)
+        if cached is not None and cached['version'][2] == CONFIG.snapshot.version:
+            return cached
+        if not self.conn or not self.conn.is_connected():
+            self.get_connection()
+        cols = ", ".join(('id', 'code', 'parent_id', 'number_prefix', 'version') + self.TENANT_FIELDS)
+        rows = self._fetch_prepared(f"SELECT {cols} FROM tenants WHERE id = %s", [tenant_id]) if self.cursor else []
+        if not rows:
+            raise Error(f"Unknown company/branch id {tenant_id}.")
+        tenant = dict(zip(cols.split(", "), rows[0]))
+        parent = self.tenant(tenant['parent_id']) if tenant['parent_id'] else {}
+        fallback = {'company_name': COMPANY_CONFIG['company_name'], 'address': COMPANY_CONFIG['address'],
+                    'tin': COMPANY_CONFIG['tin'], 'bank_name': COMPANY_CONFIG['bank_name'],
+                    'account_name': COMPANY_CONFIG['account_name'], 'account_number': COMPANY_CONFIG['account_number'],
+                    'logo_path': LOGO_FILENAME}
+        for field in self.TENANT_FIELDS:
+            if not tenant[field]:
+                tenant[field] = parent.get(field) or fallback[field]
+        tenant['number_prefix'] = tenant['number_prefix'] or tenant['code']
+        # Parent versions count too: editing a company changes what its branches inherit
+        tenant['version'] = (tenant['version'], parent.get('version'), CONFIG.snapshot.version)
+        self._tenants[tenant_id] = tenant
+        return tenant
+
+    def forget_tenants(self):
+        """Drop resolved tenants (after a branch edit or a config reload)."""
+        self._tenants.clear()
+
+    def use_tenant(self, tenant):
+        """Scope this manager to a tenant, given its id or code. Returns True if it exists."""
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return False
+            column = 'id' if isinstance(tenant, int) else 'code'
+            rows = self._fetch_prepared(f"SELECT id FROM tenants WHERE {column} = %s", [tenant])
+            if not rows:
+                return False
+            self.tenant_id = int(rows[0][0])
+            self.invalidate_summaries()
+            return True
+        except Exception as e:
+            log_error("db.tenant", "Select Company Error", e)
+            return False
+
+    def fetch_tenants(self):
+        """All companies and branches as (id, code, parent_id, company_name) tuples, companies first."""
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return []
+            return [tuple(r) for r in self._fetch_prepared(
+                "SELECT id, code, parent_id, company_name FROM tenants ORDER BY COALESCE(parent_id, id), parent_id IS NOT NULL, code", [])]
+        except Exception as e:
+            log_error("db.tenant", "Fetch Companies Error", e)
+            return []
+
+    def save_tenant(self, data):
+        """Create or update a company/branch from a dict with 'code' and optional parent_id, number_prefix and
+        TENANT_FIELDS (blank = inherit). Updates when data has an 'id'. Returns (tenant_id, '') or (None, error)."""
+        code = (data.get('code') or '').strip().upper()
+        if not re.fullmatch(r"[A-Z0-9]{2,20}", code):
+            return None, "The code must be 2-20 letters or digits."
+        prefix = (data.get('number_prefix') or '').strip().upper() or None
+        if prefix and not re.fullmatch(r"[A-Z0-9]{2,20}", prefix):
+            return None, "The number prefix must be 2-20 letters or digits."
+        values = [(data.get(field) or '').strip() or None for field in self.TENANT_FIELDS]
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return None, "Database connection could not be established."
+            parent_id = data.get('parent_id') or None
+            if parent_id:
+                rows = self._fetch_prepared("SELECT parent_id FROM tenants WHERE id = %s", [parent_id])
+                if not rows or rows[0][0] is not None or parent_id == data.get('id'):
+                    return None, "A branch must belong to a company (branches cannot have branches)."
+            # Document numbers are unique across tenants, so no two may number from the same prefix
+            rows = self._fetch_prepared("SELECT code FROM tenants WHERE id <> %s AND COALESCE(number_prefix, code) = %s",
+                                        [data.get('id') or 0, prefix or code])
+            if rows:
+                return None, f"{rows[0][0]} already numbers its documents {prefix or code}-..."
+            cols = ", ".join(self.TENANT_FIELDS)
+            if data.get('id'):
+                tenant_id = int(data['id'])
+                self.cursor.execute(
+                    f"UPDATE tenants SET code = %s, parent_id = %s, number_prefix = %s, "
+                    + ", ".join(f"{f} = %s" for f in self.TENANT_FIELDS) + ", version = version + 1 WHERE id = %s",
+                    (code, parent_id, prefix, *values, tenant_id))
+            else:
+                self.cursor.execute(
+                    f"INSERT INTO tenants (code, parent_id, number_prefix, {cols}) VALUES (%s, %s, %s, {', '.join(['%s'] * len(values))})",
+                    (code, parent_id, prefix, *values))
+                tenant_id = self.cursor.lastrowid
+            self.cursor.execute("INSERT INTO change_feed (tenant_id, doc_kind, doc_number, action) VALUES (0, 'tenants', %s, 'update')", (code,))
+            self.conn.commit()
+        except Exception as e:
+            self._rollback()
+            if self.backend.is_duplicate_key(e):
+                return None, f"Code {code} is already in use."
+            log_error("db.tenant", "Save Company Error", e)
+            return None, str(e)
+        self.forget_tenants()
+        self.audit.record('settings', 'tenants', code, 'saved')
+        return tenant_id, ''
+
+    def fetch_tenant(self, tenant_id):
+        """One tenant's stored row (blank fields not resolved) for editing, or None."""
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return None
+            cols = ('id', 'code', 'parent_id', 'number_prefix') + self.TENANT_FIELDS
+            rows = self._fetch_prepared(f"SELECT {', '.join(cols)} FROM tenants WHERE id = %s", [tenant_id])
+            return dict(zip(cols, rows[0])) if rows else None
+        except Exception as e:
+            log_error("db.tenant", "Fetch Company Error", e)
+            return None
+
+    def letterhead(self, tenant_id=None):
+        """The cached Letterhead for the current (or given) tenant."""
+        tenant = self.tenant(tenant_id)
+        return LETTERHEADS.get(tenant, lambda: Letterhead.from_tenant(tenant))
+
+    def save_quotation(self, data, items=None, renumber=False, idem_key=None):
+        """Insert a quotation and its items; renumber and idem_key work as in save_invoice (updates data['quote_no'])."""
+        if not self.conn or not self.conn.is_connected():
+            self.get_connection()
+        attempts = CHANGE_FEED_SETTINGS['renumber_attempts'] if renumber else 1
+        for attempt in range(attempts):
+            try:
+                self._fix_exchange_rate(data)
+                self._insert_quotation(data, items)
+                self._claim_import_key(idem_key, data['quote_no'])
+                self._record_change('quotations', data['quote_no'], 'create')
+                self.conn.commit()
+                self.invalidate_summaries()
+                self.audit.record('create', 'quotations', data['quote_no'], f"{data['client_name']} {data['grand_total']:.2f} {data['currency']}")
+                return True
+            except MissingExchangeRate as e:
+                data['missing_rate'] = str(e)
+                logger.info(f"Quotation {data['quote_no']} not saved. {e}")
+                return False
+            except Exception as e:
+                self._rollback()
+                if attempt + 1 < attempts and self.backend.is_duplicate_key(e):
+                    data['quote_no'] = self.generate_quotation_number()
+                    continue
+                log_error("db.save_quotation", "Save Quote Error", e)
+                return False
+
+    def _insert_quotation(self, data, items=None):
+        """Insert the quotation header and items without committing."""
+        sql = """
+        INSERT INTO quotations (tenant_id, quote_number, client_name, client_email, client_address, subtotal, vat_amount, shipping_cost, grand_total, currency, exchange_rate,
+                                discount_total)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """
+        vals = (
+            self.tenant_id, data['quote_no'], data['client_name'], data.get('client_email', ''), data['client_address'], data['subtotal'], data['vat'], data['shipping'], data['grand_total'],
+            data['currency'], data['exchange_rate'], data.get('discount', 0)
+        )
+        self.cursor.execute(sql, vals)
+        self._claim_number('quotations', data['quote_no'])
+        if items:
+            self.cursor.executemany(
+                "INSERT INTO quotation_items (quote_number, sn, description, qty, unit_price, total, product_id, list_price, discount, price_rule) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                [(data['quote_no'], int(item.get('sn') or idx + 1), item['desc'], item['qty'], item['price'], item['total'], item.get('product_id'),
+                  item.get('list_price'), item.get('discount', 0), item.get('price_rule'))
+                 for idx, item in enumerate(items)]
+            )
+        self._insert_taxes('quotations', data['quote_no'], data.get('taxes'))
+
+    def convert_quotation_to_invoice(self, quote_number, invoice_type="Component", wht_rate=0.0):
+        """Copy a quotation header and its line items into a new Project or Component invoice in one transaction.
+        The quoted amounts stand; a Project invoice also withholds `wht_rate` % (WHT applies to project work only),
+        and only a Component invoice takes its catalog lines out of stock. A number another user saved first is
+        replaced by the next free one, as in save_invoice(renumber=True).
+        Returns (invoice_data, '') on success, (None, error_message) on failure.
+        invoice_data carries the copied line items under 'items' for PDF rendering.
+        """
+        if invoice_type not in ('Project', 'Component'):
+            return None, f"Invoice type must be Project or Component, not {invoice_type!r}."
+        if invoice_type == 'Component':
+            wht_rate = 0.0
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return None, "Database connection could not be established."
+            # The invoice is issued today, so it takes today's rate for the quoted currency; looked up before the
+            # transaction starts, since the rate cache may read the change feed
+            quoted = self._fetch_prepared("SELECT currency FROM quotations WHERE quote_number = %s AND tenant_id = %s",
+                                          [quote_number, self.tenant_id])
+            pricing = {'currency': quoted[0][0] if quoted else None}
+            self._fix_exchange_rate(pricing)
+        except MissingExchangeRate as e:
+            return None, str(e)
+        except Exception as e:
+            log_error("db.convert_quotation", "Convert Quote Error", e)
+            return None, str(e)
+        attempts = CHANGE_FEED_SETTINGS['renumber_attempts']
+        for attempt in range(attempts):
+            try:
+                # Close any implicit read transaction so the row lock below sees fresh data
+                self.backend.begin_write(self.conn)
+                self.cursor.execute(
+                    "SELECT quote_number, client_name, client_email, client_address, subtotal, vat_amount, shipping_cost, grand_total, converted_invoice, "
+                    "discount_total FROM quotations WHERE quote_number = %s AND tenant_id = %s AND deleted_at IS NULL" + self.backend.lock_clause,
+                    (quote_number, self.tenant_id)
+                )
+                row = self.cursor.fetchone()
+                if not row:
+                    self._rollback()
+                    return None, f"Quotation {quote_number} not found."
+                if row[8]:
+                    self._rollback()
+                    return None, f"Quotation {quote_number} was already converted to {row[8]}."
+
+                self.cursor.execute(
+                    "SELECT sn, description, qty, unit_price, total, product_id, list_price, discount, price_rule FROM quotation_items "
+                    "WHERE quote_number = %s ORDER BY sn, id", (quote_number,)
+                )
+                # The quoted prices stand, discounts included, whatever the price rules say today
+                items = [
+                    {"sn": str(r[0]), "desc": r[1], "type": invoice_type, "qty": r[2],
+                     "price": float(r[3] or 0), "total": float(r[4] or 0), "product_id": r[5],
+                     "list_price": None if r[6] is None else float(r[6]), "discount": float(r[7] or 0), "price_rule": r[8]}
+                    for r in self.cursor.fetchall()
+                ]
+                subtotal = float(row[4] or 0)
+                if not items:
+                    # Quotations saved before line items were stored only have totals
+                    items = [{"sn": "1", "desc": f"As per quotation {quote_number}", "type": invoice_type,
+                              "qty": 1, "price": subtotal, "total": subtotal}]
+                # The VAT breakdown the client was quoted carries over with the amounts; WHT is worked out as on the form
+                withheld = document_totals(items, float(row[6] or 0), wht_rate, pricing['currency'])
+
+                invoice_data = {
+                    "invoice_no": self.generate_invoice_number(),
+                    "client_name": row[1],
+                    "client_email": row[2] or '',
+                    "client_address": row[3] or '',
+                    "invoice_type": invoice_type,
+                    "source_quote": quote_number,
+                    "subtotal": subtotal,
+                    "vat": float(row[5] or 0),
+                    "shipping": float(row[6] or 0),
+                    "grand_total": float(row[7] or 0),
+                    "discount": float(row[9] or 0),
+                    "wht_rate": wht_rate,
+                    "wht": withheld['wht'],
+                    "taxes": [t for t in self.fetch_taxes('quotations', quote_number) if t['tax'] == 'VAT']
+                             + [t for t in withheld['taxes'] if t['tax'] == 'WHT'],
+                    **pricing
+                }
+                self._insert_invoice(invoice_data, items)
+                self.cursor.execute(
+                    "UPDATE quotations SET converted_invoice = %s, version = version + 1 WHERE quote_number = %s",
+                    (invoice_data['invoice_no'], quote_number)
+                )
+                self._record_change('quotations', quote_number, 'update')
+                self._record_change('invoices', invoice_data['invoice_no'], 'create')
+                self.conn.commit()
+                break
+            except StockShortage as e:
+                self._rollback()
+                return None, str(e)
+            except DB_ERRORS as e:
+                self._rollback()
+                if attempt + 1 < attempts and self.backend.is_duplicate_key(e):
+                    continue  # another user saved an invoice under the number first
+                log_error("db.convert_quotation", "Convert Quote Error", e)
+                return None, str(e)
+            except Exception as e:
+                log_error("db.convert_quotation", "Convert Quote Error", e)
+                self._rollback()
+                return None, str(e)
+        self.invalidate_summaries()
+        self.audit.record('convert', 'quotations', quote_number, f"to {invoice_data['invoice_no']}")
+        self.audit.record('create', 'invoices', invoice_data['invoice_no'], f"from {quote_number}")
+        invoice_data['items'] = items
+        return invoice_data, ''
+
+    def fetch_quotations(self, filters=None, page=1, page_size=25):
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return []
+            sql, params = self._document_query('quotations', filters, self.PAGE_TAIL)
+            params.extend([page_size, (page - 1) * page_size])
+            return list(map(DocumentRow, self._fetch_prepared(sql, params)))
+        except Exception as e:
+            log_error("db.fetch_quotations", "Fetch Quotes Error", e)
+            return []
+
+    SUMMARY_CACHE_TTL = 60  # seconds; bounds staleness from other clients writing to the same DB
+
+    def summarize_documents(self, kind, filters=None):
+        """Count and money totals for everything matching the dashboard filters, from one aggregate query.
+        kind: 'invoices' or 'quotations'. Results are cached per filter until a save/delete or the TTL expires.
+        Returns a dict with count, subtotal, vat, wht, grand_total, balance_due and adjusted (the invoices' credit
+        notes and amendments, net), in the base currency.
+        """
+        empty = {'count': 0, 'subtotal': 0.0, 'vat': 0.0, 'wht': 0.0, 'grand_total': 0.0, 'balance_due': 0.0, 'adjusted': 0.0}
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return empty
+            sql, params = self._document_query(kind, filters, "", select=self.DOCUMENT_SUMMARIES[kind])
+            key = (sql, tuple(params))
+            cached = self._summary_cache.get(key)
+            now = time.monotonic()
+            if cached and now - cached[0] < self.SUMMARY_CACHE_TTL:
+                return cached[1]
+            row = self._fetch_prepared(sql, params)[0]
+            summary = {'count': int(row[0] or 0), 'subtotal': round(_money(row[1]), 2), 'vat': round(_money(row[2]), 2),
+                       'wht': round(_money(row[3]), 2), 'grand_total': round(_money(row[4]), 2), 'balance_due': round(_money(row[5]), 2),
+                       'adjusted': round(_money(row[6]), 2)}
+            self._summary_cache[key] = (now, summary)
+            return summary
+        except Exception as e:
+            log_error("db.summarize", "Summary Error", e)
+            return empty
+
+    def invalidate_summaries(self):
+        self._summary_cache.clear()
+
+    def fetch_document(self, kind, number):
+        """One invoice or quotation with its line items, shaped for render_document_pdf
+        (key 'invoice_no' or 'quote_no', items under 'items'). Invoices also carry amount_paid, balance_due and
+        'adjusted' (the net of their credit notes and amendments). Returns None when it does not exist."""
+        table, number_col, items_table, _ = self.ARCHIVE_KINDS[kind]
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if kind == 'invoices':
+                extra, item_type, paid = "invoice_type, wht_amount, wht_rate", "item_type", "amount_paid, balance_due, adjusted_total"
+            else:
+                extra, item_type, paid = "'Quotation', 0, 0", "'Quotation'", "0, 0, 0"
+            rows = self._fetch_prepared(
+                f"SELECT date_issued, client_name, client_email, client_address, {extra}, subtotal, vat_amount, shipping_cost, grand_total, version, {paid}, "
+                "currency, exchange_rate, discount_total "
+                f"FROM {table} WHERE {number_col} = %s AND tenant_id = %s AND deleted_at IS NULL", [number, self.tenant_id]
+            )
+            if not rows:
+                return None
+            r = rows[0]
+            doc = {'invoice_no' if kind == 'invoices' else 'quote_no': number, 'date_issued': r[0], 'client_name': r[1],
+                   'client_email': r[2] or '', 'client_address': r[3] or '', 'invoice_type': r[4], 'wht': _money(r[5]),
+                   'wht_rate': _money(r[6]), 'subtotal': _money(r[7]), 'vat': _money(r[8]), 'shipping': _money(r[9]),
+                   'grand_total': _money(r[10]), 'version': r[11], 'currency': currency_code(r[15]), 'exchange_rate': float(r[16]),
+                   'discount': _money(r[17]), 'tenant_id': self.tenant_id}
+            if kind == 'invoices':
+                doc.update(amount_paid=_money(r[12]), balance_due=_money(r[13]), adjusted=_money(r[14]))
+            doc['items'] = [
+                {'sn': str(i[0] or ''), 'desc': i[1], 'type': i[2] or '', 'qty': i[3], 'price': _money(i[4]), 'total': _money(i[5]),
+                 'product_id': i[6], 'list_price': None if i[7] is None else _money(i[7]), 'discount': _money(i[8]), 'price_rule': i[9]}
+                for i in self._fetch_prepared(
+                    f"SELECT sn, description, {item_type}, qty, unit_price, total, product_id, list_price, discount, price_rule "
+                    f"FROM {items_table} WHERE {number_col} = %s ORDER BY sn, id",
+                    [number]
+                )
+            ]
+            doc['taxes'] = self.fetch_taxes(kind, number)
+            return doc
+        except Exception as e:
+            log_error("db.fetch_document", "Fetch Document Error", e)
+            return None
+
+    # ------------------- Statements of account -------------------
+    STATEMENT_WHERE = " WHERE tenant_id = %s AND client_name = %s AND date_issued >= %s AND date_issued <= %s AND deleted_at IS NULL"
+
+    @staticmethod
+    def _statement_range(date_from, date_to):
+        return (date_bound(date_from) if date_from else datetime(1970, 1, 1),
+                date_bound(date_to, end_of_day=True) if date_to else datetime(9999, 12, 31, 23, 59, 59))
+
+    def client_statement_summary(self, client_name, date_from=None, date_to=None):
+        """Totals for one client's invoices in a date range (in the base currency, each invoice at its own rate),
+        plus the contact details on their latest invoice. Returns a dict with count, subtotal, vat, wht, grand_total,
+        adjusted (net of credit notes and amendments), amount_paid, balance_due, client_email and client_address."""
+        summary = {'count': 0, 'subtotal': 0.0, 'vat': 0.0, 'wht': 0.0, 'grand_total': 0.0, 'adjusted': 0.0,
+                   'amount_paid': 0.0, 'balance_due': 0.0, 'client_email': '', 'client_address': ''}
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            params = [self.tenant_id, client_name, *self._statement_range(date_from, date_to)]
+            row = self._fetch_prepared(
+                "SELECT COUNT(*), SUM(subtotal * exchange_rate), SUM(vat_amount * exchange_rate), SUM(wht_amount * exchange_rate), "
+                "SUM(grand_total * exchange_rate), SUM(adjusted_total * exchange_rate), SUM(amount_paid * exchange_rate), "
+                "SUM(balance_due * exchange_rate) FROM invoices" + self.STATEMENT_WHERE, params
+            )[0]
+            summary.update(count=int(row[0] or 0), subtotal=round(_money(row[1]), 2), vat=round(_money(row[2]), 2),
+                           wht=round(_money(row[3]), 2), grand_total=round(_money(row[4]), 2), adjusted=round(_money(row[5]), 2),
+                           amount_paid=round(_money(row[6]), 2), balance_due=round(_money(row[7]), 2))
+            latest = self._fetch_prepared(
+                "SELECT client_email, client_address FROM invoices" + self.STATEMENT_WHERE + " ORDER BY date_issued DESC LIMIT 1", params
+            )
+            if latest:
+                summary['client_email'], summary['client_address'] = latest[0][0] or '', latest[0][1] or ''
+        except Exception as e:
+            log_error("db.statement_summary", "Statement Summary Error", e)
+        return summary
+
+    def iter_client_invoices(self, client_name, date_from=None, date_to=None, chunk_size=200, with_items=True):
+        """Yield one client's invoices oldest first, in lists of at most `chunk_size` dicts shaped for
+        render_document_pdf (with 'items' when with_items). Pages by (date_issued, id) keyset, so each
+        chunk is a short indexed query and memory stays flat however many invoices the client has."""
+        if not self.conn or not self.conn.is_connected():
+            self.get_connection()
+        start, end = self._statement_range(date_from, date_to)
+        last_date, last_id = start, 0
+        sql = ("SELECT id, invoice_number, date_issued, client_email, client_address, invoice_type, subtotal, vat_amount, "
+               "shipping_cost, wht_amount, wht_rate, grand_total, currency, adjusted_total, amount_paid, balance_due FROM invoices"
+               " WHERE tenant_id = %s AND client_name = %s AND date_issued <= %s AND (date_issued > %s OR (date_issued = %s AND id >= %s))"
+               " AND deleted_at IS NULL"
+               " ORDER BY date_issued, id LIMIT %s")
+        while True:
+            rows = self._fetch_prepared(sql, [self.tenant_id, client_name, end, last_date, last_date, last_id, chunk_size])
+            if not rows:
+                return
+            last_date, last_id = rows[-1][2], rows[-1][0] + 1
+            chunk = [{
+                'invoice_no': r[1], 'date_issued': r[2], 'client_name': client_name, 'client_email': r[3] or '',
+                'client_address': r[4] or '', 'invoice_type': r[5], 'subtotal': _money(r[6]), 'vat': _money(r[7]),
+                'shipping': _money(r[8]), 'wht': _money(r[9]), 'wht_rate': _money(r[10]), 'grand_total': _money(r[11]),
+                'currency': currency_code(r[12]), 'adjusted': _money(r[13]), 'amount_paid': _money(r[14]),
+                'balance_due': _money(r[15]),
+            } for r in rows]
+            if with_items:
+                by_number = {inv['invoice_no']: inv for inv in chunk}
+                for inv in chunk:
+                    inv['items'] = []
+                marks = ", ".join(["%s"] * len(by_number))
+                self.cursor.execute(
+                    f"SELECT invoice_number, sn, description, item_type, qty, unit_price, total FROM invoice_items "
+                    f"WHERE invoice_number IN ({marks}) ORDER BY id", tuple(by_number)
+                )
+                for r in self.cursor.fetchall():
+                    by_number[r[0]]['items'].append({'sn': str(r[1] or ''), 'desc': r[2], 'type': r[3] or '', 'qty': r[4],
+                                                     'price': _money(r[5]), 'total': _money(r[6])})
+            yield chunk
+            if len(rows) < chunk_size:
+                return
+
+    # ------------------- Archive & purge -------------------
+    # kind -> (live table, number column, items table, PDF filename prefix)
+    ARCHIVE_KINDS = {
+        'invoices': ('invoices', 'invoice_number', 'invoice_items', 'Invoice'),
+        'quotations': ('quotations', 'quote_number', 'quotation_items', 'Quotation'),
+    }
+
+    # Invoices still owed stay live, so the oldest debts keep showing in the aging report and can still be reconciled
+    ARCHIVE_SETTLED = {'invoices': " AND (deleted_at IS NOT NULL OR balance_due <= 0)", 'quotations': ""}
+
+    def archive_candidates(self, kind, cutoff, limit):
+        """The current tenant's oldest document numbers issued before `cutoff`, leaving out invoices with a
+        balance due (read-only; uses the tenant/date index)."""
+        table, number_col, _, _ = self.ARCHIVE_KINDS[kind]
+        if not self.conn or not self.conn.is_connected():
+            self.get_connection()
+        rows = self._fetch_prepared(
+            f"SELECT {number_col} FROM {table} WHERE tenant_id = %s AND date_issued < %s{self.ARCHIVE_SETTLED[kind]} "
+            "ORDER BY date_issued LIMIT %s",
+            [self.tenant_id, cutoff, limit]
+        )
+        return [r[0] for r in rows]
+
+    def archive_documents(self, kind, numbers, bundle=None):
+        """Move the given documents and their line items into document_archive in one short transaction.
+        An invoice that is owed again by the time its row is locked is left live.
+        Returns the numbers actually moved ([] on failure)."""
+        if not numbers:
+            return []
+        table, number_col, items_table, _ = self.ARCHIVE_KINDS[kind]
+        marks = ", ".join(["%s"] * len(numbers))
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            self.backend.begin_write(self.conn)
+            self.cursor.execute(f"SELECT * FROM {table} WHERE tenant_id = %s AND {number_col} IN ({marks}){self.ARCHIVE_SETTLED[kind]}"
+                                + self.backend.lock_clause, (self.tenant_id, *numbers))
+            cols = [d[0] for d in self.cursor.description]
+            headers = [dict(zip(cols, r)) for r in self.cursor.fetchall()]
+            self.cursor.execute(f"SELECT * FROM {items_table} WHERE {number_col} IN ({marks}) ORDER BY id", tuple(numbers))
+            item_cols = [d[0] for d in self.cursor.description]
+            items_by_doc = {}
+            for r in self.cursor.fetchall():
+                item = dict(zip(item_cols, r))
+                item.pop('id', None)
+                items_by_doc.setdefault(item[number_col], []).append(item)
+            self.cursor.execute(f"SELECT doc_number, tax, rate, taxable, amount FROM document_taxes WHERE doc_kind = %s AND doc_number IN ({marks}) "
+                                "ORDER BY id", (kind, *numbers))
+            taxes_by_doc = {}
+            for number, tax, rate, taxable, amount in self.cursor.fetchall():
+                taxes_by_doc.setdefault(number, []).append({'tax': tax, 'rate': float(rate), 'taxable': _money(taxable), 'amount': _money(amount)})
+
+            archive_rows = []
+            for h in headers:
+                h.pop('id', None)
+                number = h[number_col]
+                payload = zlib.compress(json.dumps({'header': h, 'items': items_by_doc.get(number, []), 'taxes': taxes_by_doc.get(number, [])},
+                                                   default=str).encode('utf-8'))
+                archive_rows.append((
+                    self.tenant_id, kind, number, h.get('client_name'), h.get('client_email'), h.get('invoice_type', 'Quotation'),
+                    h.get('date_issued'), h.get('subtotal'), h.get('vat_amount'), h.get('shipping_cost'),
+                    h.get('wht_amount', 0), h.get('wht_rate', 0), h.get('grand_total'), bundle, payload,
+                    currency_code(h.get('currency')), h.get('exchange_rate') or 1
+                ))
+            moved = [h[number_col] for h in headers]
+            if archive_rows:
+                self.cursor.executemany(
+                    "INSERT INTO document_archive (tenant_id, doc_kind, doc_number, client_name, client_email, invoice_type, date_issued, subtotal, vat_amount, "
+                    "shipping_cost, wht_amount, wht_rate, grand_total, bundle, payload, currency, exchange_rate) "
+                    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                    archive_rows
+                )
+                moved_marks = ", ".join(["%s"] * len(moved))
+                # Nothing owed is archived, so the receivables aggregates are untouched
+                self.cursor.execute(f"DELETE FROM {items_table} WHERE {number_col} IN ({moved_marks})", tuple(moved))
+                self.cursor.execute(f"DELETE FROM document_taxes WHERE doc_kind = %s AND doc_number IN ({moved_marks})", (kind, *moved))
+                self.cursor.execute(f"DELETE FROM {table} WHERE {number_col} IN ({moved_marks})", tuple(moved))
+                self.cursor.executemany("INSERT INTO change_feed (tenant_id, doc_kind, doc_number, action) VALUES (%s, %s, %s, %s)",
+                                        [(self.tenant_id, kind, number, 'archive') for number in moved])
+            self.conn.commit()
+            self.invalidate_summaries()
+            for number in moved:
+                self.audit.record('archive', kind, number, bundle and os.path.basename(bundle))
+            return moved
+        except Exception as e:
+            log_error("db.archive", "Archive Error", e)
+            self._rollback()
+            return []
+
+    def fetch_archived(self, filters=None, page=1, page_size=25):
+        """Search archived documents with the dashboard filters (rows shaped like fetch_invoices)."""
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return []
+            sql, params = self._document_query('archive', filters, self.PAGE_TAIL)
+            params.extend([page_size, (page - 1) * page_size])
+            return list(map(DocumentRow, self._fetch_prepared(sql, params)))
+        except Exception as e:
+            log_error("db.fetch_archived", "Fetch Archive Error", e)
+            return []
+
+    def restore_archived(self, doc_number):
+        """Move one archived document (header + items) back into the live tables.
+        Returns ({'doc_kind', 'doc_number', 'bundle'}, '') on success, (None, error_message) on failure."""
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            self.backend.begin_write(self.conn)
+            self.cursor.execute(
+                "SELECT doc_kind, bundle, payload FROM document_archive WHERE doc_number = %s AND tenant_id = %s" + self.backend.lock_clause,
+                (doc_number, self.tenant_id)
+            )
+            row = self.cursor.fetchone()
+            if not row:
+                self._rollback()
+                return None, f"{doc_number} is not in the archive."
+            kind, bundle, blob = row
+            table, number_col, items_table, _ = self.ARCHIVE_KINDS[kind]
+            record = json.loads(zlib.decompress(bytes(blob)).decode('utf-8'))
+            header = dict(record['header'], tenant_id=self.tenant_id)  # payloads from before tenancy have no tenant_id
+            cols = list(header)
+            self.cursor.execute(
+                f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join(['%s'] * len(cols))})",
+                tuple(header[c] for c in cols)
+            )
+            if record['items']:
+                item_cols = list(record['items'][0])
+                self.cursor.executemany(
+                    f"INSERT INTO {items_table} ({', '.join(item_cols)}) VALUES ({', '.join(['%s'] * len(item_cols))})",
+                    [tuple(item[c] for c in item_cols) for item in record['items']]
+                )
+            self._insert_taxes(kind, doc_number, record.get('taxes'))  # archived before breakdowns were kept: none
+            self.cursor.execute("DELETE FROM document_archive WHERE doc_number = %s AND tenant_id = %s", (doc_number, self.tenant_id))
+            if kind == 'invoices':
+                # Archived before payments were tracked: nothing recorded as paid, so it is owed in full
+                self.cursor.execute("UPDATE invoices SET balance_due = grand_total - COALESCE(wht_amount, 0) - amount_paid + adjusted_total "
+                                    "WHERE invoice_number = %s AND balance_due IS NULL", (doc_number,))
+                self.cursor.execute("SELECT date_issued, client_name, balance_due, exchange_rate FROM invoices "
+                                    "WHERE invoice_number = %s AND deleted_at IS NULL", (doc_number,))
+                self._accrue_receivables([(issued, client, _to_base(_money(balance), float(rate)), 1)
+                                          for issued, client, balance, rate in self.cursor.fetchall() if _money(balance) > 0])
+            self._record_change(kind, doc_number, 'restore')
+            self.conn.commit()
+            self.invalidate_summaries()
+            self.audit.record('restore', kind, doc_number)
+            return {'doc_kind': kind, 'doc_number': doc_number, 'bundle': bundle}, ''
+        except Exception as e:
+            log_error("db.restore_archived", "Restore Error", e)
+            self._rollback()
+            return None, str(e)
+
+    def save_email_log(self, to_address, subject, attachment, status, error_message=None):
+        """Persist an email delivery record to the database."""
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            sql = """
+            INSERT INTO email_deliveries (to_address, subject, attachment, status, error_message)
+            VALUES (%s, %s, %s, %s, %s)
+            """
+            vals = (to_address, subject, attachment or '', status, error_message or '')
+            self.cursor.execute(sql, vals)
+            self.conn.commit()
+            return True
+        except Exception as e:
+            log_error("db.save_email_log", "Email Log Save Error", e)
+            return False
+
+    def fetch_email_logs(self, limit=500):
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            rows = self._fetch_prepared(
+                "SELECT id, created_at, to_address, subject, attachment, status, error_message FROM email_deliveries ORDER BY created_at DESC LIMIT %s",
+                [limit]
+            )
+            return list(map(EmailLogRow, rows))
+        except Exception as e:
+            log_error("db.fetch_email_logs", "Fetch Email Logs Error", e)
+            return []
+
+    def fetch_audit_history(self, doc_number=None, actor=None, limit=200):
+        """Newest-first audit events for one document or one actor (or everything), flushing queued events first."""
+        self.audit.flush()
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            select = "SELECT id, event_time, actor, action, doc_kind, doc_number, details FROM audit_log"
+            if doc_number:
+                sql, params = select + " WHERE doc_number = %s ORDER BY event_time DESC, id DESC LIMIT %s", [doc_number, limit]
+            elif actor:
+                sql, params = select + " WHERE actor = %s ORDER BY event_time DESC, id DESC LIMIT %s", [actor, limit]
+            else:
+                sql, params = select + " ORDER BY id DESC LIMIT %s", [limit]
+            return list(map(AuditRow, self._fetch_prepared(sql, params)))
+        except Exception as e:
+            log_error("db.fetch_audit", "Fetch Audit Error", e)
+            return []
+
+    # ------------------- Bulk import -------------------
+    def fetch_import_keys(self, keys):
+        """{idem_key: (doc_number, content_hash)} for those of `keys` already imported into this tenant."""
+        if not keys:
+            return {}
+        if not self.conn or not self.conn.is_connected():
+            self.get_connection()
+        rows = self._fetch_prepared(
+            f"SELECT idem_key, doc_number, content_hash FROM import_keys WHERE tenant_id = %s AND idem_key IN ({', '.join(['%s'] * len(keys))})",
+            [self.tenant_id, *keys])
+        return {key: (number, digest) for key, number, digest in rows}
+
+    def _claim_import_key(self, idem_key, doc_number, batch_id='api'):
+        """Record idem_key (key, content_hash) for doc_number without committing; a second writer with the
+        same key fails on the primary key instead of saving the document twice. No-op for None."""
+        if idem_key:
+            self.cursor.execute("INSERT INTO import_keys (tenant_id, idem_key, doc_number, content_hash, batch_id) VALUES (%s, %s, %s, %s, %s)",
+                                (self.tenant_id, idem_key[0], doc_number, idem_key[1], batch_id))
+
+    def taken_invoice_numbers(self, numbers):
+        """Those of `numbers` already used by a live, deleted or archived invoice (numbers are unique across tenants)."""
+        if not numbers:
+            return set()
+        if not self.conn or not self.conn.is_connected():
+            self.get_connection()
+        marks = ', '.join(['%s'] * len(numbers))
+        rows = self._fetch_prepared(
+            f"SELECT invoice_number FROM invoices WHERE invoice_number IN ({marks}) "
+            f"UNION SELECT doc_number FROM document_archive WHERE doc_number IN ({marks})", [*numbers, *numbers])
+        return {row[0] for row in rows}
+
+    def fetch_client_names(self):
+        """Distinct client names this tenant has invoiced (for matching imported names)."""
+        if not self.conn or not self.conn.is_connected():
+            self.get_connection()
+        return [row[0] for row in self._fetch_prepared(
+            "SELECT DISTINCT client_name FROM invoices WHERE tenant_id = %s", [self.tenant_id])]
+
+    def import_invoices(self, docs, batch_id):
+        """Insert validated import documents in one transaction: headers, items and idempotency keys
+        with one executemany each. docs: (idem_key, content_hash, data, items) tuples with data shaped
+        like save_invoice's plus 'date_issued', 'currency' and 'exchange_rate'. Sequences advance past imported numbers in their series,
+        and the chunk is one change-feed entry and one audit event. Returns True, or False with nothing written."""
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            self.cursor.executemany(
+                "INSERT INTO invoices (tenant_id, invoice_number, client_name, client_email, client_address, invoice_type, "
+                "date_issued, subtotal, vat_amount, shipping_cost, wht_amount, wht_rate, grand_total, balance_due, currency, exchange_rate) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                [(self.tenant_id, d['invoice_no'], d['client_name'], d['client_email'], d['client_address'], d['invoice_type'],
+                  d['date_issued'], d['subtotal'], d['vat'], d['shipping'], d['wht'], d['wht_rate'], d['grand_total'],
+                  round(d['grand_total'] - d['wht'], 2), d['currency'], d['exchange_rate'])
+                 for _, _, d, _ in docs])
+            self._accrue_receivables([(d['date_issued'], d['client_name'], _to_base(round(d['grand_total'] - d['wht'], 2), d['exchange_rate']), 1)
+                                      for _, _, d, _ in docs if d['grand_total'] - d['wht'] > 0])
+            self.cursor.executemany(
+                "INSERT INTO invoice_items (invoice_number, sn, description, item_type, qty, unit_price, total) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                [(d['invoice_no'], idx + 1, item['desc'], item['type'], item['qty'], item['price'], item['total'])
+                 for _, _, d, items in docs for idx, item in enumerate(items)])
+            self.cursor.executemany(
+                "INSERT INTO import_keys (tenant_id, idem_key, doc_number, content_hash, batch_id) VALUES (%s, %s, %s, %s, %s)",
+                [(self.tenant_id, key, d['invoice_no'], digest, batch_id) for key, digest, d, _ in docs])
+            # Claim only the highest number per series; _claim_number ignores numbers outside the tenant's series
+            highest = {}
+            for _, _, d, _ in docs:
+                series, _, suffix = d['invoice_no'].rpartition('-')
+                if suffix.isdigit() and int(suffix) > highest.get(series, (0, ''))[0]:
+                    highest[series] = (int(suffix), d['invoice_no'])
+            for _, number in highest.values():
+                self._claim_number('invoices', number)
+            self._record_change('invoices', batch_id, 'import')
+            self.conn.commit()
+        except Exception as e:
+            self._rollback()
+            if len(docs) == 1 and self.backend.is_duplicate_key(e):
+                return False  # reported by the importer; not worth a traceback per row
+            log_error("db.import", f"Import of {len(docs)} invoices rolled back", e)
+            return False
+        self.invalidate_summaries()
+        self.audit.record('import', 'invoices', batch_id, f"{len(docs)} invoices")
+        return True
+
+    # ------------------- Product catalog -------------------
+    PRODUCT_COLUMNS = "id, sku, description, unit_price, vat_applicable, active, version, reorder_level"
+
+    def fetch_products(self, skus=None):
+        """Catalog entries as Product objects: all of them, or those with the given SKUs."""
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return []
+            self.conn.commit()  # see other workstations' saves (MySQL snapshot)
+            sql, params = f"SELECT {self.PRODUCT_COLUMNS} FROM products", []
+            if skus is not None:
+                if not skus:
+                    return []
+                sql += f" WHERE sku IN ({', '.join(['%s'] * len(skus))})"
+                params = list(skus)
+            sql += " ORDER BY id"
+            return [Product(*row) for row in self._fetch_prepared(sql, params)]
+        except Exception as e:
+            log_error("db.products", "Fetch Products Error", e)
+            return []
+
+    @staticmethod
+    def product_values(data):
+        """(sku, description, unit_price, vat, active, reorder_level) from a form/CSV dict (prices may be
+        formatted like the export); raises ValueError listing its problems."""
+        problems = []
+        sku = str(data.get('sku') or '').strip().upper()
+        if not re.fullmatch(r"[A-Z0-9][A-Z0-9._/-]{0,39}", sku):
+            problems.append("SKU must be 1-40 letters, digits or . _ / -")
+        description = " ".join(str(data.get('description') or '').split())
+        if not description or len(description) > 255:
+            problems.append("description must be 1-255 characters")
+        try:
+            price = round(parse_amount(data.get('unit_price', ''), "unit price"), 2)
+            if price < 0:
+                raise ValueError
+        except ValueError:
+            problems.append(f"unit price must be a number of at least 0, not {data.get('unit_price')!r}")
+            price = None
+        flags = []
+        for name in ('vat', 'active'):
+            value = data.get(name, True)
+            flags.append(value if isinstance(value, bool) else str(value).strip().lower() not in ('0', 'no', 'n', 'false', 'exempt'))
+        reorder_level = str(data.get('reorder_level') or 0).strip()
+        if not reorder_level.isdigit():
+            problems.append(f"reorder level must be a whole number of at least 0, not {data.get('reorder_level')!r}")
+        if problems:
+            raise ValueError("; ".join(problems))
+        return (sku, description, price, *flags, int(reorder_level))
+
+    def save_product(self, data):
+        """Create or update (when data has an 'id') one catalog entry. With data['version'] the update
+        only applies if nobody saved the product since it was read. Returns (product_id, '') or (None, error)."""
+        try:
+            sku, description, price, vat, active, reorder_level = self.product_values(data)
+        except ValueError as e:
+            return None, str(e)
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return None, "Database connection could not be established."
+            if data.get('id'):
+                product_id = int(data['id'])
+                sql = ("UPDATE products SET sku = %s, description = %s, unit_price = %s, vat_applicable = %s, active = %s, "
+                       "reorder_level = %s, version = version + 1, updated_at = %s WHERE id = %s")
+                params = [sku, description, price, int(vat), int(active), reorder_level, datetime.now(), product_id]
+                if data.get('version'):
+                    sql += " AND version = %s"
+                    params.append(data['version'])
+                self.cursor.execute(sql, params)
+                if self.cursor.rowcount == 0:
+                    self._rollback()
+                    return None, f"{sku} was changed or removed by another user; reopen it and try again."
+                self.rebuild_stock_status([product_id])  # a new reorder level can flag (or clear) it in every branch
+                action = 'update'
+            else:
+                self.cursor.execute("INSERT INTO products (sku, description, unit_price, vat_applicable, active, reorder_level) "
+                                    "VALUES (%s, %s, %s, %s, %s, %s)", (sku, description, price, int(vat), int(active), reorder_level))
+                product_id, action = self.cursor.lastrowid, 'create'
+            self._record_change('products', sku, action)
+            self.conn.commit()
+        except Exception as e:
+            self._rollback()
+            if self.backend.is_duplicate_key(e):
+                return None, f"SKU {sku} is already in the catalog."
+            log_error("db.products", "Save Product Error", e)
+            return None, str(e)
+        self.audit.record(action, 'products', sku, f"{price:.2f}{'' if active else ' (inactive)'}")
+        return product_id, ''
+
+    def import_products(self, rows, chunk_size=1000):
+        """Upsert catalog entries by SKU from dicts (sku, description, unit_price, vat, active, reorder_level), one
+        transaction per chunk with an executemany each for new and existing SKUs. Returns
+        (created, updated, rejected) where rejected lists (row_number, sku, error)."""
+        created = updated = 0
+        rejected = []
+        chunk = {}
+
+        def write(chunk):
+            existing = {sku: product_id for product_id, sku, *_ in self._fetch_prepared(
+                f"SELECT {self.PRODUCT_COLUMNS} FROM products WHERE sku IN ({', '.join(['%s'] * len(chunk))})", list(chunk))}
+            now = datetime.now()
+            self.cursor.executemany(
+                "INSERT INTO products (sku, description, unit_price, vat_applicable, active, reorder_level) VALUES (%s, %s, %s, %s, %s, %s)",
+                [(sku, desc, price, int(vat), int(active), reorder) for sku, desc, price, vat, active, reorder in chunk.values()
+                 if sku not in existing])
+            self.cursor.executemany(
+                "UPDATE products SET description = %s, unit_price = %s, vat_applicable = %s, active = %s, reorder_level = %s, "
+                "version = version + 1, updated_at = %s WHERE id = %s",
+                [(desc, price, int(vat), int(active), reorder, now, existing[sku]) for sku, desc, price, vat, active, reorder in chunk.values()
+                 if sku in existing])
+            if existing:
+                self.rebuild_stock_status(list(existing.values()))
+            self._record_change('products', f"{len(chunk)} products", 'import')
+            self.conn.commit()
+            return len(chunk) - len(existing), len(existing)
+
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return 0, 0, [(0, '', "Database connection could not be established.")]
+            for row_number, data in enumerate(rows, start=1):
+                try:
+                    values = self.product_values(data)
+                except ValueError as e:
+                    rejected.append((row_number, str(data.get('sku') or ''), str(e)))
+                    continue
+                chunk[values[0]] = values  # a SKU listed twice: the last row wins
+                if len(chunk) >= chunk_size:
+                    new, old = write(chunk)
+                    created, updated, chunk = created + new, updated + old, {}
+            if chunk:
+                new, old = write(chunk)
+                created, updated = created + new, updated + old
+        except Exception as e:
+            self._rollback()
+            log_error("db.products", "Product Import Error", e)
+            rejected.append((0, '', f"stopped after {created + updated} products: {e}"))
+        if created or updated:
+            self.audit.record('import', 'products', '', f"{created} created, {updated} updated")
+        return created, updated, rejected
+
+    # ------------------- Stock -------------------
+    @staticmethod
+    def _stock_lines(items):
+        """{product_id: [qty, description]} for the catalog lines of a cart."""
+        lines = {}
+        for item in items or ():
+            if item.get('product_id'):
+                line = lines.setdefault(int(item['product_id']), [0, item['desc']])
+                line[0] += int(item['qty'])
+        return lines
+
+    def _locked_shards(self, product_id):
+        self.cursor.execute("SELECT shard, on_hand FROM stock_levels WHERE tenant_id = %s AND product_id = %s ORDER BY shard"
+                            + self.backend.lock_clause, (self.tenant_id, product_id))
+        return [(int(shard), int(on_hand)) for shard, on_hand in self.cursor.fetchall()]
+
+    def _deduct_stock(self, doc_number, items):
+        """Take a Component invoice's catalog lines out of stock inside the caller's transaction.
+        Products with no counters in this tenant are not stock-tracked and pass through untouched.
+
+        A line normally updates one randomly chosen shard that can cover it, guarded by on_hand >= qty,
+        so concurrent sales of the same product mostly lock different rows. Only when no single shard
+        is enough are all of the product's shards locked and drawn down together. Products are
+        visited in id order, so two sales never wait on each other's locks in a cycle. Raises
+        StockShortage unless STOCK_SETTINGS['allow_oversell']."""
+        wanted = self._stock_lines(items)
+        if not wanted:
+            return
+        ids = sorted(wanted)
+        shards = {}
+        for product_id, shard, on_hand in self._fetch_prepared(
+                f"SELECT product_id, shard, on_hand FROM stock_levels WHERE tenant_id = %s AND product_id IN ({', '.join(['%s'] * len(ids))})",
+                [self.tenant_id, *ids]):
+            shards.setdefault(product_id, []).append((shard, on_hand))
+        shortages, moves = [], []
+        for product_id in ids:
+            if product_id not in shards:
+                continue
+            qty, desc = wanted[product_id]
+            candidates = [shard for shard, on_hand in shards[product_id] if on_hand >= qty]
+            taken = False
+            if candidates:
+                self.cursor.execute("UPDATE stock_levels SET on_hand = on_hand - %s "
+                                    "WHERE tenant_id = %s AND product_id = %s AND shard = %s AND on_hand >= %s",
+                                    (qty, self.tenant_id, product_id, random.choice(candidates), qty))
+                taken = self.cursor.rowcount == 1
+            if not taken:
+                rows = self._locked_shards(product_id)
+                available = sum(on_hand for _, on_hand in rows)
+                if available < qty and not STOCK_SETTINGS['allow_oversell']:
+                    shortages.append((desc, qty, max(available, 0)))
+                    continue
+                takes, remaining = {}, qty
+                for shard, on_hand in sorted(rows, key=lambda row: -row[1]):
+                    takes[shard] = min(max(on_hand, 0), remaining)
+                    remaining -= takes[shard]
+                takes[rows[0][0]] += remaining  # an allowed oversell leaves the deficit on the first counter
+                self.cursor.executemany("UPDATE stock_levels SET on_hand = on_hand - %s WHERE tenant_id = %s AND product_id = %s AND shard = %s",
+                                        [(take, self.tenant_id, product_id, shard) for shard, take in takes.items() if take])
+            moves.append((self.tenant_id, product_id, -qty, 'sale', doc_number))
+        if shortages:
+            raise StockShortage(shortages)
+        self.cursor.executemany("INSERT INTO stock_ledger (tenant_id, product_id, qty_change, reason, doc_number) VALUES (%s, %s, %s, %s, %s)",
+                                moves)
+        self._update_stock_status([move[1] for move in moves])
+
+    def _rebalance_stock(self, product_id, change=0, counted=None):
+        """Lock a product's counters and spread its new total (current + change, or `counted`) evenly over
+        them, creating the counters and status row on the first receipt. Returns (old_total, new_total)."""
+        rows = self._locked_shards(product_id)
+        old = sum(on_hand for _, on_hand in rows)
+        new = counted if counted is not None else old + change
+        count = len(rows) or STOCK_SETTINGS['shards']
+        parts = [(new // count) + (1 if idx < new % count else 0) for idx in range(count)]
+        if rows:
+            self.cursor.executemany("UPDATE stock_levels SET on_hand = %s WHERE tenant_id = %s AND product_id = %s AND shard = %s",
+                                    [(part, self.tenant_id, product_id, shard) for (shard, _), part in zip(rows, parts)])
+        else:
+            self.cursor.executemany("INSERT INTO stock_levels (tenant_id, product_id, shard, on_hand) VALUES (%s, %s, %s, %s)",
+                                    [(self.tenant_id, product_id, shard, part) for shard, part in enumerate(parts)])
+            self.cursor.execute("INSERT INTO stock_status (tenant_id, product_id, low) VALUES (%s, %s, 0)", (self.tenant_id, product_id))
+        return old, new
+
+    def _update_stock_status(self, product_ids):
+        """Flip the low-stock flag of those products whose total crossed their reorder level. Only a
+        crossing writes (and puts a 'stock' row on the change feed for open low-stock lists)."""
+        if not product_ids:
+            return
+        rows = self._fetch_prepared(
+            "SELECT s.product_id, SUM(s.on_hand), MAX(p.reorder_level), MAX(st.low) FROM stock_levels s "
+            "JOIN products p ON p.id = s.product_id "
+            "JOIN stock_status st ON st.tenant_id = s.tenant_id AND st.product_id = s.product_id "
+            f"WHERE s.tenant_id = %s AND s.product_id IN ({', '.join(['%s'] * len(product_ids))}) GROUP BY s.product_id",
+            [self.tenant_id, *product_ids])
+        for product_id, on_hand, reorder_level, low in rows:
+            is_low = int(on_hand) <= int(reorder_level)
+            if is_low != bool(low):
+                self.cursor.execute("UPDATE stock_status SET low = %s, changed_at = %s WHERE tenant_id = %s AND product_id = %s AND low = %s",
+                                    (int(is_low), datetime.now(), self.tenant_id, product_id, int(low)))
+                if self.cursor.rowcount:
+                    self._record_change('stock', str(product_id), 'low' if is_low else 'restocked')
+
+    def rebuild_stock_status(self, product_ids=None):
+        """Recompute low-stock flags from the counters for every tenant (or only `product_ids`), inside
+        the caller's transaction. Stock movements keep the flags current; this covers reorder-level
+        edits and any flag a concurrent sale left stale."""
+        total = "(SELECT SUM(s.on_hand) FROM stock_levels s WHERE s.tenant_id = stock_status.tenant_id AND s.product_id = stock_status.product_id)"
+        level = "(SELECT p.reorder_level FROM products p WHERE p.id = stock_status.product_id)"
+        flag = f"CASE WHEN {total} <= {level} THEN 1 ELSE 0 END"
+        sql, params = f"UPDATE stock_status SET low = {flag}, changed_at = %s WHERE low <> {flag}", [datetime.now()]
+        if product_ids is not None:
+            if not product_ids:
+                return
+            sql += f" AND product_id IN ({', '.join(['%s'] * len(product_ids))})"
+            params.extend(product_ids)
+        self.cursor.execute(sql, params)
+
+    def _return_stock(self, doc_number):
+        """Put back what a deleted invoice took out of stock (its ledger rows net to zero afterwards)."""
+        rows = self._fetch_prepared("SELECT product_id, SUM(qty_change) FROM stock_ledger WHERE tenant_id = %s AND doc_number = %s "
+                                    "GROUP BY product_id ORDER BY product_id", [self.tenant_id, doc_number])
+        moves = []
+        for product_id, taken in rows:
+            if int(taken) < 0:
+                self._rebalance_stock(product_id, change=-int(taken))
+                moves.append((self.tenant_id, product_id, -int(taken), 'void', doc_number))
+        if moves:
+            self.cursor.executemany("INSERT INTO stock_ledger (tenant_id, product_id, qty_change, reason, doc_number) VALUES (%s, %s, %s, %s, %s)",
+                                    moves)
+            self._update_stock_status([move[1] for move in moves])
+
+    def adjust_stock(self, product_id, qty=0, counted=None, reason='receipt', reference=None):
+        """Receive `qty` of a product into this tenant's stock (reason 'receipt'), or set it to the
+        `counted` quantity from a stocktake (reason 'stocktake'). The first receipt starts tracking the
+        product here. Returns (new_total, '') or (None, error)."""
+        if counted is None and (not isinstance(qty, int) or qty <= 0):
+            return None, "The quantity received must be a whole number above 0."
+        if counted is not None and (not isinstance(counted, int) or counted < 0):
+            return None, "The counted quantity must be a whole number of at least 0."
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return None, "Database connection could not be established."
+            self.backend.begin_write(self.conn)
+            self.cursor.execute("SELECT sku FROM products WHERE id = %s", (product_id,))
+            row = self.cursor.fetchone()
+            if not row:
+                self._rollback()
+                return None, f"Product {product_id} is not in the catalog."
+            old, new = self._rebalance_stock(product_id, qty, counted)
+            if new != old:
+                self.cursor.execute("INSERT INTO stock_ledger (tenant_id, product_id, qty_change, reason, doc_number) VALUES (%s, %s, %s, %s, %s)",
+                                    (self.tenant_id, product_id, new - old, reason, reference))
+            self._update_stock_status([product_id])
+            self.conn.commit()
+        except Exception as e:
+            self._rollback()
+            log_error("db.stock", "Stock Adjustment Error", e)
+            return None, str(e)
+        self.audit.record('stock', 'products', row[0], f"{reason} {new - old:+d} -> {new}")
+        return new, ''
+
+    def stock_on_hand(self, product_ids):
+        """{product_id: quantity in this tenant} for the stock-tracked ones of `product_ids`."""
+        if not product_ids:
+            return {}
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return {}
+            return {product_id: int(total) for product_id, total in self._fetch_prepared(
+                f"SELECT product_id, SUM(on_hand) FROM stock_levels WHERE tenant_id = %s AND product_id IN ({', '.join(['%s'] * len(product_ids))}) "
+                "GROUP BY product_id", [self.tenant_id, *product_ids])}
+        except Exception as e:
+            log_error("db.stock", "Stock Lookup Error", e)
+            return {}
+
+    def fetch_low_stock(self):
+        """This tenant's low-stock list as (product_id, sku, description, on_hand, reorder_level), lowest first."""
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return []
+            self.conn.commit()  # see other clients' sales (MySQL snapshot)
+            return [(product_id, sku, desc, int(on_hand), int(level)) for product_id, sku, desc, on_hand, level in self._fetch_prepared(
+                "SELECT p.id, p.sku, p.description, SUM(s.on_hand), p.reorder_level FROM stock_status st "
+                "JOIN products p ON p.id = st.product_id "
+                "JOIN stock_levels s ON s.tenant_id = st.tenant_id AND s.product_id = st.product_id "
+                "WHERE st.tenant_id = %s AND st.low = 1 GROUP BY p.id, p.sku, p.description, p.reorder_level "
+                "ORDER BY SUM(s.on_hand) - p.reorder_level, p.sku", [self.tenant_id])]
+        except Exception as e:
+            log_error("db.stock", "Low Stock Error", e)
+            return []
+
+    # ------------------- Payments & receivables -------------------
+    def _accrue_receivables(self, entries):
+        """Add (issued, client_name, balance_change, open_change) entries to the receivables aggregates inside
+        the caller's transaction (balance changes in the base currency), one upsert per issue day (and per client and day). Rows whose last open
+        invoice was settled are removed, so the tables only ever hold what is still owed."""
+        if not entries:
+            return
+        for table, keyed in RECEIVABLES_TABLES:
+            totals = {}
+            for issued, client_name, balance, opened in entries:
+                key = (self.tenant_id, client_name, _issue_day(issued)) if keyed else (self.tenant_id, _issue_day(issued))
+                total = totals.setdefault(key, [0, 0.0])
+                total[0] += opened
+                total[1] += balance
+            keys = ["tenant_id", "client_name", "issue_date"] if keyed else ["tenant_id", "issue_date"]
+            self.cursor.executemany(self.backend.accumulate_sql(table, keys, ["open_invoices", "balance_due"]),
+                                    [(*key, opened, round(balance, 2)) for key, (opened, balance) in totals.items()])
+            settled = [key for key, (opened, _) in totals.items() if opened < 0]
+            if settled:
+                self.cursor.executemany(f"DELETE FROM {table} WHERE {' AND '.join(k + ' = %s' for k in keys)} AND open_invoices <= 0",
+                                        settled)
+
+    def _release_receivables(self, rows):
+        """Take deleted invoices out of the receivables aggregates.
+        rows: (date_issued, client_name, balance_due, exchange_rate) of the invoices."""
+        self._accrue_receivables([(issued, client_name, -_to_base(_money(balance), float(rate)), -1)
+                                  for issued, client_name, balance, rate in rows if _money(balance) > 0])
+
+    def rebuild_receivables(self):
+        """Recompute the receivables aggregates for every tenant from the invoices' balances, inside the
+        caller's transaction. Invoice saves, payments, deletes and archiving keep them current; this seeds
+        them for invoices written before they existed and repairs them after manual edits. Balances are converted to
+        the base currency at each invoice's rate and rounded per invoice, as the incremental updates do."""
+        for table, keyed in RECEIVABLES_TABLES:
+            keys = "tenant_id, client_name, issue_date" if keyed else "tenant_id, issue_date"
+            groups = "tenant_id, client_name, DATE(date_issued)" if keyed else "tenant_id, DATE(date_issued)"
+            self.cursor.execute(f"DELETE FROM {table}")
+            self.cursor.execute(f"INSERT INTO {table} ({keys}, open_invoices, balance_due) SELECT {groups}, COUNT(*), "
+                                f"SUM(ROUND(balance_due * exchange_rate, 2)) "
+                                f"FROM invoices WHERE deleted_at IS NULL AND balance_due > 0 GROUP BY {groups}")
+
+    def _locked_invoice_balance(self, invoice_number):
+        self.cursor.execute("SELECT date_issued, client_name, grand_total, wht_amount, amount_paid, balance_due, currency, exchange_rate FROM invoices "
+                            "WHERE invoice_number = %s AND tenant_id = %s AND deleted_at IS NULL" + self.backend.lock_clause,
+                            (invoice_number, self.tenant_id))
+        return self.cursor.fetchone()
+
+    def record_payment(self, invoice_number, amount, method, reference='', paid_at=None, idem_key=None):
+        """Record a (possibly partial) payment against an invoice, in the invoice's currency, and bring its
+        amount_paid/balance_due and the receivables aging in line in the same transaction. A payment may not exceed the balance due.
+        idem_key works as in save_invoice. Returns (payment_id, '') or (None, error)."""
+        try:
+            amount = round(parse_amount(amount, "amount") if isinstance(amount, str) else float(amount), 2)
+        except (TypeError, ValueError):
+            return None, f"The amount must be a number, not {amount!r}."
+        method = " ".join(str(method or '').split())
+        if amount <= 0:
+            return None, "The amount must be above 0."
+        if not method or len(method) > 20:
+            return None, "Choose how it was paid (at most 20 characters)."
+        reference = " ".join(str(reference or '').split())[:100]
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return None, "Database connection could not be established."
+            self.backend.begin_write(self.conn)
+            row = self._locked_invoice_balance(invoice_number)
+            if not row:
+                self._rollback()
+                return None, f"{invoice_number} is not a live invoice of this company/branch."
+            issued, client_name, _, _, _, balance, currency, rate = row
+            balance, rate = _money(balance), float(rate)
+            if amount > balance + 0.005:
+                self._rollback()
+                return None, f"{invoice_number} has only {format_money(balance, currency)} left to pay."
+            self.cursor.execute("INSERT INTO payments (tenant_id, invoice_number, amount, method, reference, paid_at) VALUES (%s, %s, %s, %s, %s, %s)",
+                                (self.tenant_id, invoice_number, amount, method, reference, paid_at or datetime.now()))
+            payment_id = self.cursor.lastrowid
+            self._claim_import_key(idem_key, str(payment_id))
+            self.cursor.execute("UPDATE invoices SET amount_paid = amount_paid + %s, balance_due = balance_due - %s, version = version + 1 "
+                                "WHERE invoice_number = %s AND tenant_id = %s", (amount, amount, invoice_number, self.tenant_id))
+            self._accrue_receivables([(issued, client_name, _to_base(balance - amount, rate) - _to_base(balance, rate),
+                                       -1 if balance - amount < 0.005 else 0)])
+            self._record_change('invoices', invoice_number, 'payment')
+            self.conn.commit()
+        except Exception as e:
+            self._rollback()
+            log_error("db.payment", "Payment Error", e)
+            return None, str(e)
+        self.invalidate_summaries()
+        self.audit.record('payment', 'invoices', invoice_number, f"{amount:.2f} {method} {reference}".strip())
+        return payment_id, ''
+
+    def void_payment(self, payment_id):
+        """Void a payment recorded in error: it stays listed (with voided_at) and its amount is owed again.
+        Returns (True, '') or (False, error)."""
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return False, "Database connection could not be established."
+            self.backend.begin_write(self.conn)
+            self.cursor.execute("SELECT invoice_number, amount FROM payments WHERE id = %s AND tenant_id = %s AND voided_at IS NULL"
+                                + self.backend.lock_clause, (payment_id, self.tenant_id))
+            payment = self.cursor.fetchone()
+            row = payment and self._locked_invoice_balance(payment[0])
+            if not row:
+                self._rollback()
+                return False, "That payment is already voided, or its invoice was deleted or archived."
+            invoice_number, amount = payment[0], _money(payment[1])
+            issued, client_name, _, _, _, balance, _, rate = row
+            balance, rate = _money(balance), float(rate)
+            self.cursor.execute("UPDATE payments SET voided_at = %s WHERE id = %s", (datetime.now(), payment_id))
+            self.cursor.execute("UPDATE invoices SET amount_paid = amount_paid - %s, balance_due = balance_due + %s, version = version + 1 "
+                                "WHERE invoice_number = %s AND tenant_id = %s", (amount, amount, invoice_number, self.tenant_id))
+            self._accrue_receivables([(issued, client_name, _to_base(balance + amount, rate) - _to_base(balance, rate),
+                                       1 if balance < 0.005 else 0)])
+            self._record_change('invoices', invoice_number, 'payment')
+            self.conn.commit()
+        except Exception as e:
+            self._rollback()
+            log_error("db.payment", "Void Payment Error", e)
+            return False, str(e)
+        self.invalidate_summaries()
+        self.audit.record('void_payment', 'invoices', invoice_number, f"{amount:.2f} (payment {payment_id})")
+        return True, ''
+
+    def fetch_payments(self, invoice_number):
+        """An invoice's payments, oldest first, as dicts (voided ones included, with voided_at set)."""
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return []
+            return [{'id': pid, 'amount': _money(amount), 'method': method, 'reference': reference or '',
+                     'paid_at': _format_timestamp(paid_at), 'voided_at': _format_timestamp(voided_at) if voided_at else None}
+                    for pid, amount, method, reference, paid_at, voided_at in self._fetch_prepared(
+                        "SELECT id, amount, method, reference, paid_at, voided_at FROM payments "
+                        "WHERE invoice_number = %s AND tenant_id = %s ORDER BY id", [invoice_number, self.tenant_id])]
+        except Exception as e:
+            log_error("db.payment", "Fetch Payments Error", e)
+            return []
+
+    def iter_open_invoices(self, batch_size=5000):
+        """Stream (invoice_number, issue day, client_name, balance_due) for every base-currency invoice of this
+        tenant with something left to pay, for statement reconciliation (the bank account is kept in the base
+        currency; foreign-currency receipts are recorded by hand). Same cursor rules as iter_invoices."""
         if not self.conn or not self.conn.is_connected():
             self.get_connection()
-            
-        sql = """
-        INSERT INTO invoices 
-        (invoice_number, client_name, client_email, client_address, invoice_type, subtotal, vat_amount, shipping_cost, wht_amount, wht_rate, grand_total) 
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """
-        vals = (
-            data['invoice_no'], data['client_name'], data.get('client_email', ''), data['client_address'], data['invoice_type'],
-            data['subtotal'], data['vat'], data['shipping'], data['wht'], data['wht_rate'], data['grand_total']
-        )
+        self.conn.commit()  # see payments recorded by other clients (MySQL snapshot)
+        cursor = self.backend.stream_cursor(self.conn)
         try:
-            self.cursor.execute(sql, vals)
-            self.conn.commit()
-            return True
-        except Error as e:
-            print(f"Save Error: Failed to save. Details: {e}")
-            return False
+            cursor.execute("SELECT invoice_number, DATE(date_issued), client_name, balance_due FROM invoices "
+                           "WHERE tenant_id = %s AND deleted_at IS NULL AND balance_due > 0 AND currency = %s",
+                           (self.tenant_id, CURRENCY_SETTINGS['base']))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            try:
+                cursor.fetchall()
+            except DB_ERRORS:
+                pass
+            cursor.close()
 
-    def generate_invoice_number(self):
+    def reconciled_statement_keys(self, keys):
+        """Those of `keys` (statement line fingerprints) already recorded as payments in this tenant."""
+        if not keys:
+            return set()
         if not self.conn or not self.conn.is_connected():
             self.get_connection()
-        if self.conn and self.conn.is_connected():
-            self.cursor.execute("SELECT id FROM invoices ORDER BY id DESC LIMIT 1")
-            result = self.cursor.fetchone()
-            year = datetime.now().year
-            next_id = 1
-            if result:
-                next_id = result[0] + 1
-            return f"NSE-INV-{year}-{next_id:04d}"
-        else:
-            raise Error("Database connection could not be established.")
+        rows = self._fetch_prepared(
+            f"SELECT DISTINCT statement_key FROM payments WHERE tenant_id = %s AND statement_key IN ({', '.join(['%s'] * len(keys))})",
+            [self.tenant_id, *keys])
+        return {row[0] for row in rows}
+
+    def record_statement_payments(self, payments, batch_id):
+        """Record payments matched from a bank statement in one transaction: the invoices are locked and
+        re-checked, then payments, balances and the receivables aggregates are written with one executemany
+        each. payments: (invoice_number, amount, paid_at, reference, statement_key) tuples. A payment whose
+        invoice was deleted or paid meanwhile is refused, the rest still go in; the chunk is one change-feed
+        entry and one audit event. Returns ({index: reason} of the refused ones, '') or (None, error)."""
+        refused, rows = {}, []
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return None, "Database connection could not be established."
+            self.backend.begin_write(self.conn)
+            numbers, balances = sorted({p[0] for p in payments}), {}
+            for start in range(0, len(numbers), 500):
+                part = numbers[start:start + 500]
+                # By number alone (numbers are unique across tenants): with tenant_id in the WHERE clause SQLite
+                # walks the tenant's date index instead of probing the number index
+                self.cursor.execute(
+                    "SELECT invoice_number, tenant_id, date_issued, client_name, balance_due, exchange_rate FROM invoices "
+                    f"WHERE invoice_number IN ({', '.join(['%s'] * len(part))}) AND deleted_at IS NULL" + self.backend.lock_clause, part)
+                balances.update((number, [issued, client, _money(balance), float(rate)])
+                                for number, tenant_id, issued, client, balance, rate in self.cursor.fetchall() if tenant_id == self.tenant_id)
+            accruals = []
+            for idx, (number, amount, paid_at, reference, key) in enumerate(payments):
+                held = balances.get(number)
+                if held is None:
+                    refused[idx] = f"{number} is no longer a live invoice"
+                elif amount > held[2] + 0.005:
+                    refused[idx] = f"{number} has only {held[2]:,.2f} left to pay"
+                else:
+                    before, held[2] = held[2], round(held[2] - amount, 2)
+                    rows.append((number, amount, paid_at, reference, key))
+                    accruals.append((held[0], held[1], _to_base(held[2], held[3]) - _to_base(before, held[3]), -1 if held[2] < 0.005 else 0))
+            if rows:
+                self.cursor.executemany(
+                    "INSERT INTO payments (tenant_id, invoice_number, amount, method, reference, paid_at, statement_key) "
+                    "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                    [(self.tenant_id, number, amount, 'Transfer', reference, paid_at, key) for number, amount, paid_at, reference, key in rows])
+                self.cursor.executemany(
+                    "UPDATE invoices SET amount_paid = amount_paid + %s, balance_due = balance_due - %s, version = version + 1 "
+                    "WHERE invoice_number = %s AND tenant_id = %s", [(amount, amount, number, self.tenant_id) for number, amount, *_ in rows])
+                self._accrue_receivables(accruals)
+                self._record_change('invoices', batch_id, 'reconcile')
+            self.conn.commit()
+        except Exception as e:
+            self._rollback()
+            log_error("db.payment", f"Reconciliation of {len(payments)} payments rolled back", e)
+            return None, str(e)
+        if rows:
+            self.invalidate_summaries()
+            self.audit.record('reconcile', 'invoices', batch_id, f"{len(rows)} payments, {sum(r[1] for r in rows):.2f}")
+        return refused, ''
+
+    def _aging_query(self, group_by_client, as_of):
+        """(sql, params) summing receivables_daily (or receivables_by_client) into AGING_BUCKETS as of `as_of`."""
+        columns, params = [], []
+        for label in AGING_BUCKETS:
+            start, end = aging_range(label, as_of)
+            cond = " AND ".join(c for c in ("issue_date >= %s" if start else "", "issue_date <= %s") if c)
+            columns.append(f"SUM(CASE WHEN {cond} THEN open_invoices ELSE 0 END), SUM(CASE WHEN {cond} THEN balance_due ELSE 0 END)")
+            params.extend(([start] if start else []) + [end] + ([start] if start else []) + [end])
+        sql = (f"SELECT {'client_name, ' if group_by_client else ''}{', '.join(columns)} "
+               f"FROM {'receivables_by_client' if group_by_client else 'receivables_daily'} WHERE tenant_id = %s")
+        if group_by_client:
+            sql += " GROUP BY client_name ORDER BY SUM(balance_due) DESC, client_name"
+        return sql, params + [self.tenant_id]
+
+    def aging_summary(self, as_of=None):
+        """Open receivables of this tenant by age since issue: OrderedDict bucket -> {'count', 'balance'} over
+        AGING_BUCKETS, plus 'Total'. Reads the pre-aggregated receivables_daily (a row per issue day), not the invoices."""
+        summary = OrderedDict((label, {'count': 0, 'balance': 0.0}) for label in (*AGING_BUCKETS, 'Total'))
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return summary
+            self.conn.commit()  # see other clients' payments (MySQL snapshot)
+            row = self._fetch_prepared(*self._aging_query(False, as_of))[0]
+            for idx, label in enumerate(AGING_BUCKETS):
+                summary[label] = {'count': int(row[2 * idx] or 0), 'balance': _money(row[2 * idx + 1])}
+                summary['Total']['count'] += summary[label]['count']
+                summary['Total']['balance'] += summary[label]['balance']
+        except Exception as e:
+            log_error("db.aging", "Aging Summary Error", e)
+        return summary
 
-    def fetch_invoices(self, filters=None, page=1, page_size=25):
-        """Return a list of invoices matching optional filters.
-        filters: dict with keys: invoice_no, client_name, invoice_type, date_from, date_to
-        """
+    def aging_by_client(self, as_of=None):
+        """Aging report rows, largest balance first: (client_name, open invoices, [balance per AGING_BUCKETS], total)."""
         try:
-            # Ensure connection
             if not self.conn or not self.conn.is_connected():
                 self.get_connection()
             if not self.cursor:
                 return []
-
-            sql = "SELECT invoice_number, date_issued, client_name, client_email, invoice_type, subtotal, vat_amount, shipping_cost, wht_amount, wht_rate, grand_total FROM invoices"
-            where = []
-            params = []
-            if filters:
-                if filters.get('invoice_no'):
-                    where.append("invoice_number LIKE %s")
-                    params.append(f"%{filters['invoice_no']}%")
-                if filters.get('client_name'):
-                    where.append("client_name LIKE %s")
-                    params.append(f"%{filters['client_name']}%")
-                if filters.get('invoice_type') and filters.get('invoice_type') != 'All':
-                    where.append("invoice_type = %s")
-                    params.append(filters['invoice_type'])
-                if filters.get('date_from'):
-                    where.append("date_issued >= %s")
-                    params.append(filters['date_from'])
-                if filters.get('date_to'):
-                    where.append("date_issued <= %s")
-                    params.append(filters['date_to'])
-            if where:
-                sql += " WHERE " + " AND ".join(where)
-            sql += " ORDER BY date_issued DESC LIMIT %s OFFSET %s"
-            params.extend([page_size, (page - 1) * page_size])
-            self.cursor.execute(sql, tuple(params))
-            rows = self.cursor.fetchall()
-            results = []
-            for r in rows:
-                # Format date_issued as string
-                date_val = r[1]
-                try:
-                    date_str = date_val.strftime('%Y-%m-%d %H:%M:%S') if hasattr(date_val, 'strftime') else str(date_val)
-                except Exception:
-                    date_str = str(date_val)
-                results.append({
-                    'invoice_no': r[0],
-                    'date_issued': date_str,
-                    'client_name': r[2],
-                    'client_email': r[3],
-                    'invoice_type': r[4],
-                    'subtotal': float(r[5]) if r[5] is not None else 0.0,
-                    'vat': float(r[6]) if r[6] is not None else 0.0,
-                    'shipping': float(r[7]) if r[7] is not None else 0.0,
-                    'wht': float(r[8]) if r[8] is not None else 0.0,
-                    'wht_rate': float(r[9]) if r[9] is not None else 0.0,
-                    'grand_total': float(r[10]) if r[10] is not None else 0.0
-                })
-            return results
+            self.conn.commit()
+            report = []
+            for row in self._fetch_prepared(*self._aging_query(True, as_of)):
+                balances = [_money(row[2 + 2 * idx]) for idx in range(len(AGING_BUCKETS))]
+                report.append((row[0], sum(int(row[1 + 2 * idx] or 0) for idx in range(len(AGING_BUCKETS))), balances, round(sum(balances), 2)))
+            return report
         except Exception as e:
-            print(f"Fetch Error: {e}")
+            log_error("db.aging", "Aging Report Error", e)
             return []
 
-    def delete_invoice(self, invoice_number):
+    # ------------------- Credit notes & amendments -------------------
+    # kind -> (PDF doc_type, PDF filename prefix); each kind is numbered in its own sequence (NUMBER_TAGS)
+    NOTE_KINDS = {'credit_notes': ('CREDIT NOTE', 'CreditNote'), 'amendments': ('INVOICE AMENDMENT', 'Amendment')}
+
+    @staticmethod
+    def note_lines(kind, items, currency=None, default_type='Project'):
+        """Validate the lines of a credit note or amendment: (lines, '') with each total worked out, or (None, error).
+        A credit note lists what is taken off the invoice, so its quantities and prices are positive; an amendment's
+        lines are signed (a negative quantity or price takes off, a positive one adds a charge). Untyped lines take `default_type`."""
+        lines = []
+        for idx, item in enumerate(items or [], start=1):
+            desc = " ".join(str(item.get('desc') or '').split())
+            try:
+                qty, price = int(item.get('qty')), round_money(parse_amount(item.get('price'), "price"), currency)
+            except (TypeError, ValueError):
+                return None, f"Line {idx}: the quantity must be a whole number and the price a number."
+            if not desc:
+                return None, f"Line {idx}: enter a description."
+            if kind == 'credit_notes' and (qty <= 0 or price <= 0):
+                return None, f"Line {idx}: a credit note's quantities and prices are above 0 (it only takes off)."
+            total = round_money(qty * price, currency)
+            if not total:
+                return None, f"Line {idx}: the line comes to nothing."
+            lines.append({'sn': str(idx), 'desc': desc[:255], 'type': item.get('service') or item.get('type') or default_type,
+                          'qty': qty, 'price': price, 'total': total, 'product_id': item.get('product_id')})
+        if not lines:
+            return None, "Add at least one line."
+        return lines, ''
+
+    def issue_invoice_note(self, kind, invoice_number, items, reason, idem_key=None):
+        """Issue a credit note (kind 'credit_notes') or an amendment ('amendments') against a live invoice. The
+        note is numbered in its own sequence, priced in the invoice's currency at its rate, and taxed like the
+        invoice (VAT only if it charged VAT, WHT at its rate). Its net (grand total less WHT; negative for a credit)
+        is added to the invoice's adjusted_total and balance_due, and the receivables aging moves with it, in one
+        transaction. A note may not leave the invoice owing less than has been paid on it. idem_key works as in save_invoice.
+        Returns (note, '') shaped for render_document_pdf (with the invoice's new 'balance_due') or (None, error)."""
+        if kind not in self.NOTE_KINDS:
+            return None, f"Unknown kind of note {kind!r}."
+        reason = " ".join(str(reason or '').split())
+        if not reason or len(reason) > 255:
+            return None, "Give the reason for the note (at most 255 characters)."
         try:
             if not self.conn or not self.conn.is_connected():
                 self.get_connection()
             if not self.cursor:
-                return False
-            self.cursor.execute("DELETE FROM invoices WHERE invoice_number = %s", (invoice_number,))
-            self.conn.commit()
-            return True
+                return None, "Database connection could not be established."
+            rows = self._fetch_prepared(
+                "SELECT client_address, invoice_type, vat_amount, wht_rate, currency, exchange_rate FROM invoices "
+                "WHERE invoice_number = %s AND tenant_id = %s AND deleted_at IS NULL", [invoice_number, self.tenant_id])
+            if not rows:
+                return None, f"{invoice_number} is not a live invoice of this company/branch."
+            address, invoice_type, invoice_vat, wht_rate, currency, rate = rows[0]
+            currency, rate = currency_code(currency), float(rate)
+            lines, err = self.note_lines(kind, items, currency, invoice_type or 'Project')
+            if not lines:
+                return None, err
+            if not _money(invoice_vat):
+                for line in lines:
+                    line['vat'] = False  # the invoice charged no VAT, so none is given back or added
+            totals = document_totals(lines, 0.0, _money(wht_rate), currency)
+            adjustment = round_money((totals['grand_total'] - totals['wht']) * (-1 if kind == 'credit_notes' else 1), currency)
+            if not adjustment:
+                return None, "The note comes to nothing once taxes are worked out."
         except Exception as e:
-            print(f"Delete Invoice Error: {e}")
-            return False
-
-    def delete_quotation(self, quote_number):
+            log_error("db.invoice_note", "Invoice Note Error", e)
+            return None, str(e)
+        attempts = CHANGE_FEED_SETTINGS['renumber_attempts']
+        for attempt in range(attempts):
+            try:
+                number = self.next_document_number(kind)
+                self.backend.begin_write(self.conn)
+                row = self._locked_invoice_balance(invoice_number)
+                if not row:
+                    self._rollback()
+                    return None, f"{invoice_number} is not a live invoice of this company/branch."
+                issued, client_name, _, _, _, balance, _, _ = row
+                balance = _money(balance)
+                after = round(balance + adjustment, 2)
+                if after < -0.005:
+                    self._rollback()
+                    return None, (f"{invoice_number} has only {format_money(balance, currency)} left to pay; "
+                                  "void payments on it before taking off more.")
+                now = datetime.now().replace(microsecond=0)
+                self.cursor.execute(
+                    "INSERT INTO credit_notes (tenant_id, note_number, note_kind, invoice_number, client_name, reason, date_issued, subtotal, "
+                    "vat_amount, wht_amount, grand_total, adjustment, currency, exchange_rate) "
+                    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                    (self.tenant_id, number, kind, invoice_number, client_name, reason, now, totals['subtotal'], totals['vat'],
+                     totals['wht'], totals['grand_total'], adjustment, currency, rate))
+                self.cursor.executemany(
+                    "INSERT INTO credit_note_items (note_number, sn, description, item_type, qty, unit_price, total, product_id) "
+                    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+                    [(number, int(line['sn']), line['desc'], line['type'], line['qty'], line['price'], line['total'], line['product_id'])
+                     for line in lines])
+                self._insert_taxes(kind, number, totals['taxes'])
+                self._claim_number(kind, number)
+                self._claim_import_key(idem_key, number)
+                self.cursor.execute("UPDATE invoices SET adjusted_total = adjusted_total + %s, balance_due = balance_due + %s, version = version + 1 "
+                                    "WHERE invoice_number = %s AND tenant_id = %s", (adjustment, adjustment, invoice_number, self.tenant_id))
+                opened = (1 if after >= 0.005 else 0) - (1 if balance >= 0.005 else 0)
+                self._accrue_receivables([(issued, client_name, _to_base(max(after, 0.0), rate) - _to_base(max(balance, 0.0), rate), opened)])
+                self._record_change('invoices', invoice_number, 'adjust')
+                self.conn.commit()
+                break
+            except DB_ERRORS as e:
+                self._rollback()
+                if attempt + 1 < attempts and self.backend.is_duplicate_key(e):
+                    continue  # another clerk took the number first
+                log_error("db.invoice_note", "Invoice Note Error", e)
+                return None, str(e)
+            except Exception as e:
+                self._rollback()
+                log_error("db.invoice_note", "Invoice Note Error", e)
+                return None, str(e)
+        self.invalidate_summaries()
+        self.audit.record('create', kind, number, f"{invoice_number} {adjustment:+.2f} {currency}")
+        self.audit.record('adjust', 'invoices', invoice_number, f"{number} {adjustment:+.2f} {currency}")
+        return dict(totals, note_no=number, note_kind=kind, invoice_ref=invoice_number, reason=reason, date_issued=now,
+                    client_name=client_name, client_address=address or '', invoice_type=invoice_type, wht_rate=_money(wht_rate),
+                    currency=currency, exchange_rate=rate, adjustment=adjustment, balance_due=after, items=lines), ''
+
+    NOTE_COLUMNS = ("note_number, note_kind, invoice_number, client_name, reason, date_issued, subtotal, vat_amount, wht_amount, "
+                    "grand_total, adjustment, currency, exchange_rate")
+
+    def _note_dict(self, r):
+        return {'note_no': r[0], 'note_kind': r[1], 'invoice_ref': r[2], 'client_name': r[3], 'reason': r[4], 'date_issued': r[5],
+                'subtotal': _money(r[6]), 'vat': _money(r[7]), 'wht': _money(r[8]), 'shipping': 0.0, 'grand_total': _money(r[9]),
+                'adjustment': _money(r[10]), 'currency': currency_code(r[11]), 'exchange_rate': float(r[12])}
+
+    def fetch_invoice_notes(self, invoice_number):
+        """An invoice's credit notes and amendments, oldest first, as dicts (without their lines)."""
         try:
             if not self.conn or not self.conn.is_connected():
                 self.get_connection()
             if not self.cursor:
-                return False
-            self.cursor.execute("DELETE FROM quotations WHERE quote_number = %s", (quote_number,))
-            self.conn.commit()
-            return True
+                return []
+            return [self._note_dict(r) for r in self._fetch_prepared(
+                f"SELECT {self.NOTE_COLUMNS} FROM credit_notes WHERE invoice_number = %s AND tenant_id = %s ORDER BY id",
+                [invoice_number, self.tenant_id])]
         except Exception as e:
-            print(f"Delete Quote Error: {e}")
-            return False
+            log_error("db.invoice_note", "Fetch Notes Error", e)
+            return []
 
-    def generate_quotation_number(self):
-        if not self.conn or not self.conn.is_connected():
-            self.get_connection()
-        if self.conn and self.conn.is_connected():
-            self.cursor.execute("SELECT id FROM quotations ORDER BY id DESC LIMIT 1")
-            result = self.cursor.fetchone()
-            year = datetime.now().year
-            next_id = 1
-            if result:
-                next_id = result[0] + 1
-            return f"NSE-QTN-{year}-{next_id:04d}"
-        else:
-            raise Error("Database connection could not be established.")
+    def fetch_invoice_note(self, note_number):
+        """One credit note or amendment with its lines and tax breakdown, shaped for render_document_pdf
+        (the invoice's address and WHT rate included); None when it does not exist."""
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            rows = self._fetch_prepared(
+                f"SELECT {', '.join('n.' + c.strip() for c in self.NOTE_COLUMNS.split(','))}, i.client_address, i.invoice_type, i.wht_rate "
+                "FROM credit_notes n LEFT JOIN invoices i ON i.invoice_number = n.invoice_number "
+                "WHERE n.note_number = %s AND n.tenant_id = %s", [note_number, self.tenant_id])
+            if not rows:
+                return None
+            note = self._note_dict(rows[0])
+            note.update(client_address=rows[0][13] or '', invoice_type=rows[0][14] or '', wht_rate=_money(rows[0][15]))
+            note['items'] = [
+                {'sn': str(i[0] or ''), 'desc': i[1], 'type': i[2] or '', 'qty': i[3], 'price': _money(i[4]), 'total': _money(i[5]),
+                 'product_id': i[6]}
+                for i in self._fetch_prepared("SELECT sn, description, item_type, qty, unit_price, total, product_id FROM credit_note_items "
+                                              "WHERE note_number = %s ORDER BY sn, id", [note_number])]
+            note['taxes'] = self.fetch_taxes(note['note_kind'], note_number)
+            return note
+        except Exception as e:
+            log_error("db.invoice_note", "Fetch Note Error", e)
+            return None
 
-    def save_quotation(self, data):
-        if not self.conn or not self.conn.is_connected():
-            self.get_connection()
-        sql = """
-        INSERT INTO quotations (quote_number, client_name, client_email, client_address, subtotal, vat_amount, shipping_cost, grand_total)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """
-        vals = (
-            data['quote_no'], data['client_name'], data.get('client_email', ''), data['client_address'], data['subtotal'], data['vat'], data['shipping'], data['grand_total']
-        )
+    # ------------------- Exchange rates -------------------
+    def fetch_exchange_rates(self, currencies=None):
+        """(currency, rate_date, rate) rows in (currency, rate_date) order: all of them, or those of `currencies`."""
         try:
-            self.cursor.execute(sql, vals)
-            self.conn.commit()
-            return True
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return []
+            self.conn.commit()  # see other workstations' saves (MySQL snapshot)
+            sql, params = "SELECT currency, rate_date, rate FROM exchange_rates", []
+            if currencies is not None:
+                if not currencies:
+                    return []
+                sql += f" WHERE currency IN ({', '.join(['%s'] * len(currencies))})"
+                params = list(currencies)
+            sql += " ORDER BY currency, rate_date"
+            return [(currency, _issue_day(day), float(rate)) for currency, day, rate in self._fetch_prepared(sql, params)]
         except Exception as e:
-            print(f"Save Quote Error: {e}")
-            return False
+            log_error("db.rates", "Fetch Exchange Rates Error", e)
+            return []
 
-    def fetch_quotations(self, filters=None, page=1, page_size=25):
+    @staticmethod
+    def exchange_rate_values(data):
+        """(currency, rate_date, rate) from a form/CSV dict (rate_date defaults to today); raises ValueError listing its problems."""
+        problems = []
+        base = CURRENCY_SETTINGS['base']
+        currency = str(data.get('currency') or '').strip().upper()
+        if currency not in CURRENCIES or currency == base:
+            problems.append(f"currency must be one of {', '.join(code for code in CURRENCIES if code != base)}, not {currency!r}")
+        day = date.today()
+        if data.get('rate_date'):
+            try:
+                day = parse_import_date(data['rate_date']).date()
+            except ValueError as e:
+                problems.append(str(e))
+        try:
+            rate = round(parse_amount(data.get('rate', ''), "rate"), 6)
+            if rate <= 0:
+                raise ValueError
+        except ValueError:
+            problems.append(f"rate must be a number above 0 ({base} per unit), not {data.get('rate')!r}")
+        if problems:
+            raise ValueError("; ".join(problems))
+        return currency, day, rate
+
+    def save_exchange_rates(self, rows):
+        """Enter or correct rates from dicts (currency, rate_date, rate) in one transaction; a later row for the same
+        currency and day wins. Documents already saved keep the rate they were saved at.
+        Returns (saved, rejected) where rejected lists (row_number, error); row 0 is a database failure."""
+        values, rejected = {}, []
+        for row_number, data in enumerate(rows, start=1):
+            try:
+                currency, day, rate = self.exchange_rate_values(data)
+            except ValueError as e:
+                rejected.append((row_number, str(e)))
+                continue
+            values[(currency, day)] = rate
+        if not values:
+            return 0, rejected
+        currencies = sorted({currency for currency, _ in values})
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return 0, rejected + [(0, "Database connection could not be established.")]
+            self.cursor.executemany("DELETE FROM exchange_rates WHERE currency = %s AND rate_date = %s", list(values))
+            self.cursor.executemany("INSERT INTO exchange_rates (currency, rate_date, rate) VALUES (%s, %s, %s)",
+                                    [(currency, day, rate) for (currency, day), rate in values.items()])
+            for currency in currencies:
+                self._record_change('rates', currency, 'update')
+            self.conn.commit()
+        except Exception as e:
+            self._rollback()
+            log_error("db.rates", "Save Exchange Rates Error", e)
+            return 0, rejected + [(0, str(e))]
+        if EXCHANGE_RATES.loaded_at is not None:
+            EXCHANGE_RATES.refresh(self)  # this process sees its own entry straight away
+        self.audit.record('update', 'rates', ", ".join(currencies)[:50], f"{len(values)} rate(s)")
+        return len(values), rejected
+
+    # ------------------- Price rules -------------------
+    PRICE_RULE_COLUMNS = ("r.id, r.code, r.description, r.product_id, p.sku, r.client_name, r.kind, r.value, r.min_qty, r.starts_on, r.ends_on, "
+                          "r.active, r.version")
+
+    def fetch_price_rules(self, codes=None):
+        """Price rules as PriceRule objects (with their product's SKU): all of them, or those with the given codes."""
         try:
             if not self.conn or not self.conn.is_connected():
                 self.get_connection()
             if not self.cursor:
                 return []
-            sql = "SELECT quote_number, date_issued, client_name, client_email, subtotal, vat_amount, shipping_cost, grand_total FROM quotations"
-            where = []
-            params = []
-            if filters:
-                if filters.get('invoice_no'):
-                    where.append("quote_number LIKE %s")
-                    params.append(f"%{filters['invoice_no']}%")
-                if filters.get('client_name'):
-                    where.append("client_name LIKE %s")
-                    params.append(f"%{filters['client_name']}%")
-            if where:
-                sql += " WHERE " + " AND ".join(where)
-            sql += " ORDER BY date_issued DESC LIMIT %s OFFSET %s"
-            params.extend([page_size, (page - 1) * page_size])
-            self.cursor.execute(sql, tuple(params))
-            rows = self.cursor.fetchall()
-            results = []
-            for r in rows:
-                date_val = r[1]
-                try:
-                    date_str = date_val.strftime('%Y-%m-%d %H:%M:%S') if hasattr(date_val, 'strftime') else str(date_val)
-                except Exception:
-                    date_str = str(date_val)
-                results.append({
-                    'invoice_no': r[0],
-                    'date_issued': date_str,
-                    'client_name': r[2],
-                    'client_email': r[3],
-                    'invoice_type': 'Quotation',
-                    'subtotal': float(r[4]) if r[4] is not None else 0.0,
-                    'vat': float(r[5]) if r[5] is not None else 0.0,
-                    'shipping': float(r[6]) if r[6] is not None else 0.0,
-                    'wht': 0.0,
-                    'wht_rate': 0.0,
-                    'grand_total': float(r[7]) if r[7] is not None else 0.0
-                })
-            return results
+            self.conn.commit()  # see other workstations' saves (MySQL snapshot)
+            sql, params = f"SELECT {self.PRICE_RULE_COLUMNS} FROM price_rules r LEFT JOIN products p ON p.id = r.product_id", []
+            if codes is not None:
+                if not codes:
+                    return []
+                sql += f" WHERE r.code IN ({', '.join(['%s'] * len(codes))})"
+                params = list(codes)
+            sql += " ORDER BY r.id"
+            return [PriceRule(*row) for row in self._fetch_prepared(sql, params)]
         except Exception as e:
-            print(f"Fetch Quotes Error: {e}")
+            log_error("db.prices", "Fetch Price Rules Error", e)
             return []
 
-    def save_email_log(self, to_address, subject, attachment, status, error_message=None):
-        """Persist an email delivery record to the database."""
+    @staticmethod
+    def price_rule_values(data, product_ids):
+        """(code, description, product_id, client_name, kind, value, min_qty, starts_on, ends_on, active) from a form/CSV
+        dict; `product_ids` maps SKUs to catalog ids. Raises ValueError listing its problems."""
+        problems = []
+        code = str(data.get('code') or '').strip().upper()
+        if not re.fullmatch(r"[A-Z0-9][A-Z0-9._/-]{0,39}", code):
+            problems.append("code must be 1-40 letters, digits or . _ / -")
+        description = " ".join(str(data.get('description') or '').split())[:100]
+        sku = str(data.get('sku') or '').strip().upper()
+        product_id = product_ids.get(sku) if sku else None
+        if sku and product_id is None:
+            problems.append(f"SKU {sku} is not in the catalog")
+        client = " ".join(str(data.get('client_name') or '').split()) or None
+        kind = str(data.get('kind') or '').strip().lower()
+        if kind not in PRICE_RULE_KINDS:
+            problems.append(f"kind must be one of {', '.join(PRICE_RULE_KINDS)}, not {data.get('kind')!r}")
+        try:
+            value = round(parse_amount(data.get('value', ''), "value"), 4)
+            if value < 0 or (kind == 'percent' and value > 100):
+                raise ValueError
+        except ValueError:
+            problems.append(f"value must be a number of at least 0{' and at most 100' if kind == 'percent' else ''}, not {data.get('value')!r}")
+            value = None
+        min_qty = str(data.get('min_qty') or 1).strip()
+        if not min_qty.isdigit() or int(min_qty) < 1:
+            problems.append(f"minimum quantity must be a whole number of at least 1, not {data.get('min_qty')!r}")
+        days = []
+        for name in ('starts_on', 'ends_on'):
+            try:
+                days.append(parse_import_date(data[name]).date() if data.get(name) else None)
+            except ValueError as e:
+                problems.append(str(e))
+                days.append(None)
+        if days[0] and days[1] and days[1] < days[0]:
+            problems.append("the rule ends before it starts")
+        active = data.get('active', True)
+        active = active if isinstance(active, bool) else str(active).strip().lower() not in ('0', 'no', 'n', 'false')
+        if problems:
+            raise ValueError("; ".join(problems))
+        return (code, description, product_id, client, kind, value, int(min_qty), *days, active)
+
+    def save_price_rules(self, rows):
+        """Create or replace rules by code from dicts (code, description, sku, client_name, kind, value, min_qty, starts_on,
+        ends_on, active) in one transaction; a later row for the same code wins. A rule is retired by saving it inactive.
+        Returns (saved, rejected) where rejected lists (row_number, error); row 0 is a database failure."""
+        rows = list(rows)
+        values, rejected = {}, []
         try:
             if not self.conn or not self.conn.is_connected():
                 self.get_connection()
-            sql = """
-            INSERT INTO email_deliveries (to_address, subject, attachment, status, error_message)
-            VALUES (%s, %s, %s, %s, %s)
-            """
-            vals = (to_address, subject, attachment or '', status, error_message or '')
-            self.cursor.execute(sql, vals)
+            if not self.cursor:
+                return 0, [(0, "Database connection could not be established.")]
+            skus = sorted({str(data.get('sku') or '').strip().upper() for data in rows} - {''})
+            product_ids = {}
+            for start in range(0, len(skus), 1000):
+                chunk = skus[start:start + 1000]
+                product_ids.update((sku, product_id) for product_id, sku in self._fetch_prepared(
+                    f"SELECT id, sku FROM products WHERE sku IN ({', '.join(['%s'] * len(chunk))})", chunk))
+            for row_number, data in enumerate(rows, start=1):
+                try:
+                    rule = self.price_rule_values(data, product_ids)
+                except ValueError as e:
+                    rejected.append((row_number, str(e)))
+                    continue
+                values[rule[0]] = rule
+            if not values:
+                return 0, rejected
+            codes = list(values)
+            existing = set()
+            for start in range(0, len(codes), 1000):
+                chunk = codes[start:start + 1000]
+                existing.update(code for code, in self._fetch_prepared(
+                    f"SELECT code FROM price_rules WHERE code IN ({', '.join(['%s'] * len(chunk))})", chunk))
+            self.cursor.executemany(
+                "INSERT INTO price_rules (code, description, product_id, client_name, kind, value, min_qty, starts_on, ends_on, active) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                [(*rule[:9], int(rule[9])) for code, rule in values.items() if code not in existing])
+            self.cursor.executemany(
+                "UPDATE price_rules SET description = %s, product_id = %s, client_name = %s, kind = %s, value = %s, min_qty = %s, "
+                "starts_on = %s, ends_on = %s, active = %s, version = version + 1, updated_at = %s WHERE code = %s",
+                [(*rule[1:9], int(rule[9]), datetime.now(), code) for code, rule in values.items() if code in existing])
+            if len(values) == 1:
+                self._record_change('prices', codes[0], 'update' if existing else 'create')
+            else:
+                self._record_change('prices', f"{len(values)} rules", 'import')  # one entry; caches reload
             self.conn.commit()
-            return True
         except Exception as e:
-            print(f"Email Log Save Error: {e}")
-            return False
+            self._rollback()
+            log_error("db.prices", "Save Price Rules Error", e)
+            return 0, rejected + [(0, str(e))]
+        if PRICE_RULES.loaded_at is not None:
+            PRICE_RULES.refresh(self)  # this process sees its own change straight away
+        self.audit.record('update', 'prices', ", ".join(codes)[:50], f"{len(values)} rule(s)")
+        return len(values), rejected
+
+    def price_items(self, items, client_name, currency=None, day=None):
+        """Price cart lines under the price rules as they are added: each line's 'price' is taken as its list price
+        (kept in 'list_price') and replaced by the best rule's, with 'total', 'discount' (off the line) and
+        'price_rule' (the rule's label) to match. Lines no rule lowers are left as listed. Returns the number of
+        lines discounted; 0 when the currency has no exchange rate (the save reports that)."""
+        currency = currency_code(currency)
+        rate, _ = self.exchange_rate(currency, day)
+        if rate is None:
+            return 0
+        discounted = 0
+        for item in items:
+            list_price = item.get('list_price') or item['price']
+            rule, price = PRICE_RULES.best(self, item.get('product_id'), client_name, item['qty'], list_price, day, rate)
+            for key in ('list_price', 'discount', 'price_rule'):
+                item.pop(key, None)
+            if rule is None:
+                item['price'], item['total'] = list_price, list_price * item['qty']
+                continue
+            price = round_money(price, currency)
+            item.update(price=price, total=round_money(price * item['qty'], currency), list_price=list_price,
+                        discount=round_money((list_price - price) * item['qty'], currency), price_rule=rule.label)
+            discounted += 1
+        return discounted
+
+    # ------------------- Settings (database layer of CONFIG) -------------------
+    def load_settings(self):
+        """{section: {setting: value}} from app_settings, or None if the database is unreachable
+        (the caller then keeps the layer it already has). Values are stored as JSON."""
+        try:
+            if not self.conn or not self.conn.is_connected():
+                self.get_connection()
+            if not self.cursor:
+                return None
+            self.conn.commit()  # see other clients' saves (MySQL snapshot)
+            layer = {}
+            for section, setting, value in self._fetch_prepared("SELECT section, setting, setting_value FROM app_settings", []):
+                if (section, setting) not in DB_SECRET_KEYS:
+                    layer.setdefault(section, {})[setting] = json.loads(value)
+            return layer
+        except Exception as e:
+            log_error("db.load_settings", "Load Settings Error", e)
+            return None
 
-    def fetch_email_logs(self, limit=500):
+    def save_settings(self, section, values):
+        """Persist settings for one section and reload CONFIG. Returns (True, '') or (False, error).
+        The values are validated against the full configuration before anything is written."""
+        if section not in DB_CONFIG_SECTIONS:
+            return False, f"{section} settings cannot be stored in the database."
+        secrets = sorted(f"{section}.{key}" for key in values if (section, key) in DB_SECRET_KEYS)
+        if secrets:
+            return False, f"{', '.join(secrets)} cannot be stored in the database; set it in the config file or environment."
         try:
             if not self.conn or not self.conn.is_connected():
                 self.get_connection()
-            self.cursor.execute("SELECT id, created_at, to_address, subject, attachment, status, error_message FROM email_deliveries ORDER BY created_at DESC LIMIT %s", (limit,))
-            rows = self.cursor.fetchall()
-            results = []
-            for r in rows:
-                results.append({
-                    'id': r[0],
-                    'created_at': r[1].strftime('%Y-%m-%d %H:%M:%S') if hasattr(r[1], 'strftime') else str(r[1]),
-                    'to_address': r[2],
-                    'subject': r[3],
-                    'attachment': r[4],
-                    'status': r[5],
-                    'error_message': r[6]
-                })
-            return results
+            if not self.cursor:
+                return False, "Database connection could not be established."
+            current = self.load_settings() or {}
+            candidate = dict(current, **{section: dict(current.get(section, {}), **values)})
+            CONFIG.check_db_layer(candidate)
+            self.cursor.execute(
+                f"DELETE FROM app_settings WHERE section = %s AND setting IN ({', '.join(['%s'] * len(values))})",
+                (section, *values))
+            self.cursor.executemany("INSERT INTO app_settings (section, setting, setting_value) VALUES (%s, %s, %s)",
+                                    [(section, key, json.dumps(value)) for key, value in values.items()])
+            # Open dashboards reload their configuration when they see this in the change feed
+            self._record_change('settings', section, 'update')
+            self.conn.commit()
+        except ConfigError as e:
+            return False, "\n".join(e.problems)
         except Exception as e:
-            print(f"Fetch Email Logs Error: {e}")
-            return []
+            log_error("db.save_settings", "Save Settings Error", e)
+            self._rollback()
+            return False, str(e)
+        self.audit.record('settings', 'settings', section, ", ".join(sorted(values))[:255])
+        _, error = CONFIG.reload(self)
+        if error:
+            return False, str(error)
+        return True, ''
+
+    # ------------------- Query fast path -------------------
+    PAGE_TAIL = " ORDER BY date_issued DESC LIMIT %s OFFSET %s"
+
+    # kind -> (SELECT in DocumentRow.FIELDS order, document number column, filters the table supports)
+    DOCUMENT_QUERIES = {
+        'invoices': (
+            "SELECT invoice_number, date_issued, client_name, client_email, invoice_type, subtotal, vat_amount, shipping_cost, wht_amount, wht_rate, grand_total, version, balance_due, currency, adjusted_total FROM invoices",
+            "invoice_number",
+            ('invoice_no', 'client_name', 'invoice_type', 'date_from', 'date_to', 'balance', 'number'),
+        ),
+        'quotations': (
+            "SELECT quote_number, date_issued, client_name, client_email, 'Quotation', subtotal, vat_amount, shipping_cost, 0, 0, grand_total, version, NULL, currency, 0 FROM quotations",
+            "quote_number",
+            ('invoice_no', 'client_name', 'date_from', 'date_to', 'number'),
+        ),
+        'archive': (
+            "SELECT doc_number, date_issued, client_name, client_email, invoice_type, subtotal, vat_amount, shipping_cost, wht_amount, wht_rate, grand_total, 0, NULL, currency, 0 FROM document_archive",
+            "doc_number",
+            ('invoice_no', 'client_name', 'invoice_type', 'date_from', 'date_to'),
+        ),
+    }
+    # Totals in the base currency: each document converted at its own rate inside the one aggregate query
+    DOCUMENT_SUMMARIES = {
+        'invoices': "SELECT COUNT(*), SUM(subtotal * exchange_rate), SUM(vat_amount * exchange_rate), SUM(wht_amount * exchange_rate), "
+                    "SUM(grand_total * exchange_rate), SUM(balance_due * exchange_rate), SUM(adjusted_total * exchange_rate) FROM invoices",
+        'quotations': "SELECT COUNT(*), SUM(subtotal * exchange_rate), SUM(vat_amount * exchange_rate), 0, SUM(grand_total * exchange_rate), 0, 0 "
+                      "FROM quotations",
+        'archive': "SELECT COUNT(*), SUM(subtotal * exchange_rate), SUM(vat_amount * exchange_rate), SUM(wht_amount * exchange_rate), "
+                   "SUM(grand_total * exchange_rate), 0, 0 FROM document_archive",
+    }
+    SOFT_DELETE_KINDS = ('invoices', 'quotations')
+    _sql_cache = {}
+
+    def _document_query(self, kind, filters, tail, select=None):
+        """Return (sql, params) for a dashboard query. The SQL text depends only on which
+        filters are set, so it is built once per shape and reused (which is also what lets the
+        prepared-statement caches below hit). `select` replaces the row SELECT (e.g. aggregates)."""
+        base, number_col, supported = self.DOCUMENT_QUERIES[kind]
+        base = select or base
+        filters = filters or {}
+        active = []
+        params = []
+        for name in supported:
+            value = filters.get(name)
+            if not value or (name in ('invoice_type', 'balance') and value == 'All'):
+                continue
+            if name == 'balance':
+                # The condition's shape depends on the value (Paid, Unpaid or an aging bucket), so it stands in for the name
+                condition, values = balance_condition(value)
+                active.append(condition)
+                params.extend(values)
+                continue
+            active.append(name)
+            if name in ('invoice_no', 'client_name'):
+                value = f"%{value}%"
+            elif name in ('date_from', 'date_to'):
+                value = date_bound(value, end_of_day=(name == 'date_to'))
+            params.append(value)
+        params.insert(0, self.tenant_id)
+        key = (base, tuple(active), tail)
+        sql = self._sql_cache.get(key)
+        if sql is None:
+            clauses = {
+                'invoice_no': f"{number_col} LIKE %s",
+                'client_name': "client_name LIKE %s",
+                'invoice_type': "invoice_type = %s",
+                'date_from': "date_issued >= %s",
+                'date_to': "date_issued <= %s",
+                'number': f"{number_col} = %s",
+            }
+            where = ["tenant_id = %s"] + [clauses.get(name, name) for name in active]
+            if kind in self.SOFT_DELETE_KINDS:
+                where.insert(1, "deleted_at IS NULL")
+            sql = base + " WHERE " + " AND ".join(where) + tail
+            self._sql_cache[key] = sql
+        return sql, params
+
+    def _fetch_prepared(self, sql, params):
+        """Execute on a per-statement prepared cursor (kept until the connection is replaced)."""
+        cursor = self._prepared.get(sql)
+        if cursor is None:
+            cursor = self.backend.prepared_cursor(self.conn)
+            self._prepared[sql] = cursor
+        cursor.execute(sql, tuple(params))
+        return cursor.fetchall()
+
+# =============================================================================
+# 5. ARCHIVE & PURGE
+# =============================================================================
+
+class DocumentArchiver:
+    """Moves documents older than the retention window out of the live tables.
+    Each batch first zips the batch's PDFs, then moves the rows in one short transaction,
+    and only then deletes the loose PDFs, so an interrupted run never loses a file.
+    """
+
+    def __init__(self, db, settings=None):
+        self.db = db
+        self.settings = dict(ARCHIVE_SETTINGS, **(settings or {}))
+
+    def pdf_name(self, kind, number):
+        return f"{self.db.ARCHIVE_KINDS[kind][3]}_{number}.pdf"
+
+    def iter_batches(self, retention_days=None):
+        """Archive in bounded batches, yielding progress after each:
+        {'kind', 'moved', 'total', 'bundle'}. Step it from an event loop to stay responsive; the
+        generator never sleeps, so the caller waits settings['pause_seconds'] between steps (run() sleeps,
+        the GUI schedules the next step that much later).
+        Every company and branch is archived, each batch within one tenant; the manager's own
+        tenant is put back afterwards. The manager's tenant changes between yields, so it must not be
+        one that anything else uses while the generator is suspended (the GUI gives it its own)."""
+        days = self.settings['retention_days'] if retention_days is None else retention_days
+        cutoff = datetime.now() - timedelta(days=days)
+        total = 0
+        own_tenant = self.db.tenant_id
+        try:
+            for tenant_id, *_ in self.db.fetch_tenants() or [(own_tenant,)]:
+                self.db.tenant_id = tenant_id
+                for kind in self.db.ARCHIVE_KINDS:
+                    while True:
+                        numbers = self.db.archive_candidates(kind, cutoff, self.settings['batch_size'])
+                        if not numbers:
+                            break
+                        bundle = self._write_bundle(kind, numbers)
+                        moved = self.db.archive_documents(kind, numbers, bundle)
+                        if not moved:
+                            raise RuntimeError(f"Archiving {kind} stopped: the batch could not be moved (see log).")
+                        self._remove_pdfs(kind, moved)
+                        total += len(moved)
+                        yield {'kind': kind, 'moved': len(moved), 'total': total, 'bundle': bundle}
+        finally:
+            self.db.tenant_id = own_tenant
+
+    def run(self, retention_days=None):
+        """Archive everything past the retention window; returns the number of documents moved."""
+        total = 0
+        for progress in self.iter_batches(retention_days):
+            total = progress['total']
+            if self.settings['pause_seconds']:
+                time.sleep(self.settings['pause_seconds'])
+        return total
+
+    def _write_bundle(self, kind, numbers):
+        pdfs = [(n, os.path.join(self.settings['pdf_dir'], self.pdf_name(kind, n))) for n in numbers]
+        pdfs = [(n, path) for n, path in pdfs if os.path.exists(path)]
+        if not pdfs:
+            return None
+        os.makedirs(self.settings['archive_dir'], exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        bundle = os.path.join(self.settings['archive_dir'], f"{kind}_{stamp}.zip")
+        with zipfile.ZipFile(bundle, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+            for _, path in pdfs:
+                zf.write(path, arcname=os.path.basename(path))
+        return bundle
+
+    def _remove_pdfs(self, kind, numbers):
+        for n in numbers:
+            path = os.path.join(self.settings['pdf_dir'], self.pdf_name(kind, n))
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                log_error("archive.remove_pdf", f"Could not remove {path}", e)
+
+    def restore(self, doc_number):
+        """Bring an archived document back into the live tables and its PDF back into pdf_dir.
+        Returns (True, '') or (False, error_message)."""
+        record, err = self.db.restore_archived(doc_number)
+        if not record:
+            return False, err
+        bundle = record.get('bundle')
+        name = self.pdf_name(record['doc_kind'], doc_number)
+        if bundle and os.path.exists(bundle):
+            try:
+                with zipfile.ZipFile(bundle) as zf:
+                    if name in zf.namelist():
+                        zf.extract(name, self.settings['pdf_dir'])
+            except (OSError, zipfile.BadZipFile) as e:
+                return True, f"Restored, but the PDF could not be extracted from {bundle}: {e}"
+        return True, ''
 
 # =============================================================================
-# 3. PDF ENGINE
+# 6. PDF ENGINE
 # =============================================================================
 
+# Images are ASCII85-wrapped by default, which costs ~25% in size and, without ReportLab's C
+# accelerator, most of the render time. Binary streams are valid in every profile (PDF/A included).
+rl_config.useA85 = 0
+
+LOGO_SIZE_PT = 80  # printed logo width/height in points
+BUILTIN_FONTS = {'regular': 'Helvetica', 'bold': 'Helvetica-Bold', 'italic': 'Helvetica-Oblique'}
+_font_lock = threading.Lock()
+
+
+def resolve_pdf_profile(profile=None):
+    """Return the settings dict for `profile` (a name or a dict); unknown names fall back to 'standard'."""
+    if isinstance(profile, dict):
+        return dict(PDF_PROFILES['standard'], **profile)
+    name = profile or PDF_SETTINGS.get('profile') or 'standard'
+    if name not in PDF_PROFILES:
+        logger.warning(f"Unknown PDF profile '{name}', using 'standard'")
+        name = 'standard'
+    return PDF_PROFILES[name]
+
+
+def profile_fonts(profile):
+    """Register the profile's TrueType fonts once per process and return {'regular', 'bold', 'italic'} font names.
+    ReportLab embeds TrueType fonts as subsets containing only the glyphs a document uses."""
+    files = profile.get('fonts')
+    if not files:
+        return BUILTIN_FONTS
+    names = {}
+    with _font_lock:
+        for role, path in zip(('regular', 'bold', 'italic'), files):
+            name = os.path.splitext(os.path.basename(path))[0]
+            if name not in pdfmetrics.getRegisteredFontNames():
+                try:
+                    pdfmetrics.registerFont(TTFont(name, path))
+                except Exception as e:
+                    log_error("pdf.fonts", f"Could not load font {path}; falling back to built-in fonts", e)
+                    return BUILTIN_FONTS
+            names[role] = name
+    names.setdefault('bold', names['regular'])
+    names.setdefault('italic', names['regular'])
+    return names
+
+
+@functools.lru_cache(maxsize=PDF_SETTINGS['logo_cache_size'])
+def _downsampled_logo(path, mtime, dpi):
+    from PIL import Image  # ReportLab already depends on Pillow for PNG logos
+    target = max(1, int(round(LOGO_SIZE_PT / 72.0 * dpi)))
+    with Image.open(path) as img:
+        img.load()
+        if max(img.size) > target:
+            img.thumbnail((target, target), Image.LANCZOS)
+        buf = io.BytesIO()
+        img.save(buf, format='PNG', optimize=True)
+    return buf.getvalue()
+
+
+def logo_image(path, dpi=None):
+    """The logo as something canvas.drawImage accepts: the original path, or a cached in-memory
+    copy downsampled to `dpi` at its printed size (decoded and resized once per path/mtime/dpi)."""
+    if not dpi:
+        return path
+    try:
+        return ImageReader(io.BytesIO(_downsampled_logo(path, os.path.getmtime(path), dpi)))
+    except Exception as e:
+        log_error("pdf.logo", "Could not downsample logo; embedding original", e)
+        return path
+
+
+@functools.lru_cache(maxsize=1)
+def _srgb_icc_profile():
+    from PIL import ImageCms
+    return ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+
+
+PDFA_XMP = """<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about=""
+    xmlns:dc="http://purl.org/dc/elements/1.1/"
+    xmlns:xmp="http://ns.adobe.com/xap/1.0/"
+    xmlns:pdf="http://ns.adobe.com/pdf/1.3/"
+    xmlns:pdfaid="http://www.aiim.org/pdfa/ns/id/">
+   <dc:format>application/pdf</dc:format>
+   <dc:title><rdf:Alt><rdf:li xml:lang="x-default">{title}</rdf:li></rdf:Alt></dc:title>
+   <dc:creator><rdf:Seq><rdf:li>{author}</rdf:li></rdf:Seq></dc:creator>
+   <dc:description><rdf:Alt><rdf:li xml:lang="x-default">{subject}</rdf:li></rdf:Alt></dc:description>
+   <xmp:CreateDate>{date}</xmp:CreateDate>
+   <xmp:ModifyDate>{date}</xmp:ModifyDate>
+   <xmp:MetadataDate>{date}</xmp:MetadataDate>
+   <xmp:CreatorTool>{creator}</xmp:CreatorTool>
+   <pdf:Producer>{producer}</pdf:Producer>
+   <pdf:Keywords>{keywords}</pdf:Keywords>
+   <pdfaid:part>2</pdfaid:part>
+   <pdfaid:conformance>B</pdfaid:conformance>
+  </rdf:Description>
+ </rdf:RDF>
+</x:xmpmeta>
+<?xpacket end="w"?>"""
+
+
+class Letterhead:
+    """The company block printed on a tenant's documents (name, address, TIN, bank details, logo),
+    resolved and split once rather than on every page."""
+    __slots__ = ('tenant_id', 'company_name', 'address_lines', 'tin', 'bank_name', 'account_name',
+                 'account_number', 'logo_path')
+
+    def __init__(self, tenant_id, company_name, address, tin, bank_name, account_name, account_number, logo_path=None):
+        self.tenant_id = tenant_id
+        self.company_name = company_name
+        self.address_lines = tuple(address.split('\n'))
+        self.tin = tin
+        self.bank_name = bank_name
+        self.account_name = account_name
+        self.account_number = account_number
+        self.logo_path = logo_path if logo_path and os.path.exists(logo_path) else None
+
+    @classmethod
+    def from_tenant(cls, tenant):
+        """From a DatabaseManager.tenant() dict (inherited values already resolved)."""
+        return cls(tenant['id'], tenant['company_name'], tenant['address'], tenant['tin'], tenant['bank_name'],
+                   tenant['account_name'], tenant['account_number'], tenant['logo_path'])
+
+    @classmethod
+    def from_config(cls):
+        return cls(DEFAULT_TENANT_ID, COMPANY_CONFIG['company_name'], COMPANY_CONFIG['address'], COMPANY_CONFIG['tin'],
+                   COMPANY_CONFIG['bank_name'], COMPANY_CONFIG['account_name'], COMPANY_CONFIG['account_number'],
+                   LOGO_FILENAME)
+
+
+class LetterheadCache:
+    """Letterheads kept per tenant, so branches never share (or evict each other's) company blocks.
+    An entry is rebuilt when its tenant version changes (a branch edit, or a config reload for
+    values inherited from COMPANY_CONFIG)."""
+
+    def __init__(self, max_items=64):
+        self.max_items = max_items
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, tenant, build):
+        key, version = tenant['id'], tenant['version']
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == version:
+                self._entries.move_to_end(key)
+                return entry[1]
+        letterhead = build()
+        with self._lock:
+            self._entries[key] = (version, letterhead)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+        return letterhead
+
+    def default(self):
+        """The letterhead from COMPANY_CONFIG, for callers without a database (CLI renders, benchmarks)."""
+        return self.get({'id': None, 'version': CONFIG.snapshot.version}, Letterhead.from_config)
+
+    def discard(self, tenant_id):
+        with self._lock:
+            self._entries.pop(tenant_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+LETTERHEADS = LetterheadCache()
+
+
 class InvoicePDF:
-    def __init__(self, filename):
+    def __init__(self, filename, profile=None, letterhead=None):
         self.filename = filename
-        self.c = canvas.Canvas(filename, pagesize=A4)
+        self.letterhead = letterhead or LETTERHEADS.default()
+        self.profile = resolve_pdf_profile(profile)
+        self.fonts = profile_fonts(self.profile)
+        self.c = self._open_canvas(filename)
         self.width, self.height = A4
 
+    def _open_canvas(self, filename):
+        return canvas.Canvas(filename, pagesize=A4, pageCompression=1 if self.profile['compress'] else 0,
+                             initialFontName=self.fonts['regular'])
+
     def draw_header(self, invoice_no, date_str, doc_type="INVOICE"):
+        # Document info (mirrored into XMP metadata for PDF/A)
+        self.c.setTitle(f"{doc_type.title()} {invoice_no}")
+        self.c.setAuthor(self.letterhead.company_name)
+        self.c.setSubject(f"{doc_type.title()} {invoice_no} dated {date_str}")
+        self.c.setCreator("Nascomsoft Invoice Manager")
+
         # Logo
-        if LOGO_FILENAME and os.path.exists(LOGO_FILENAME):
+        if self.letterhead.logo_path:
             try:
-                self.c.drawImage(LOGO_FILENAME, 30, self.height - 110, width=80, height=80, mask='auto')
+                self.c.drawImage(logo_image(self.letterhead.logo_path, self.profile['logo_dpi']), 30, self.height - 110,
+                                 width=LOGO_SIZE_PT, height=LOGO_SIZE_PT, mask='auto')
             except Exception as e:
-                print(f"Error loading logo: {e}")
+                log_error("pdf.header", "Error loading logo", e)
 
         # Company Details
-        self.c.setFont("Helvetica-Bold", 18)
+        self.c.setFont(self.fonts['bold'], 18)
         self.c.setFillColor(colors.HexColor("#0f3057"))
-        self.c.drawRightString(self.width - 30, self.height - 50, COMPANY_CONFIG["company_name"])
+        self.c.drawRightString(self.width - 30, self.height - 50, self.letterhead.company_name)
         
-        self.c.setFont("Helvetica", 10)
+        self.c.setFont(self.fonts['regular'], 10)
         self.c.setFillColor(colors.black)
         
         # Multi-line company address
         y_text = self.height - 70
-        self.c.setFont("Helvetica", 10)
-        for line in COMPANY_CONFIG["address"].split('\n'):
+        self.c.setFont(self.fonts['regular'], 10)
+        for line in self.letterhead.address_lines:
             self.c.drawRightString(self.width - 30, y_text, line)
             y_text -= 12
         
         y_pos = y_text - 10
-        self.c.setFont("Helvetica-Bold", 10)
-        self.c.drawRightString(self.width - 30, y_pos, f"TIN: {COMPANY_CONFIG['tin']}")
+        self.c.setFont(self.fonts['bold'], 10)
+        self.c.drawRightString(self.width - 30, y_pos, f"TIN: {self.letterhead.tin}")
 
         # Document Banner
         self.c.setStrokeColor(colors.HexColor("#0f3057"))
         self.c.line(30, self.height - 130, self.width - 30, self.height - 130)
         
-        self.c.setFont("Helvetica-Bold", 22)
+        self.c.setFont(self.fonts['bold'], 22)
         self.c.setFillColor(colors.HexColor("#e94560"))
         self.c.drawString(30, self.height - 160, doc_type)
         
-        self.c.setFont("Helvetica-Bold", 12)
+        self.c.setFont(self.fonts['bold'], 12)
         self.c.setFillColor(colors.black)
         self.c.drawString(30, self.height - 180, f"{doc_type} #: {invoice_no}")
         self.c.drawString(30, self.height - 195, f"Date: {date_str}")
 
     def draw_client_info(self, name, address):
-        self.c.setFont("Helvetica-Bold", 12)
+        self.c.setFont(self.fonts['bold'], 12)
         self.c.drawString(self.width - 250, self.height - 160, "BILL TO:")
         
-        self.c.setFont("Helvetica-Bold", 12)
+        self.c.setFont(self.fonts['bold'], 12)
         self.c.drawString(self.width - 250, self.height - 180, name)
         
         # Render Client Address (Multi-line)
-        self.c.setFont("Helvetica", 10)
+        self.c.setFont(self.fonts['regular'], 10)
         text_obj = self.c.beginText()
         text_obj.setTextOrigin(self.width - 250, self.height - 195)
         
@@ -535,16 +4823,24 @@ class InvoicePDF:
             text_obj.textLine(line)
         self.c.drawText(text_obj)
 
-    def draw_items_table(self, items):
+    def draw_reference(self, invoice_no, reason):
+        """Under the banner of a credit note or amendment: the invoice it corrects and why."""
+        self.c.setFont(self.fonts['bold'], 10)
+        self.c.drawString(30, self.height - 212, f"Against Invoice #: {invoice_no}")
+        self.c.setFont(self.fonts['regular'], 9)
+        for idx, line in enumerate(textwrap.wrap(f"Reason: {reason}", width=60)[:2]):
+            self.c.drawString(30, self.height - 226 - idx * 11, line)
+
+    def draw_items_table(self, items, currency=None):
         data = [['S/N', 'Description', 'Type', 'Qty', 'Rate', 'Amount']]
         for item in items:
             data.append([
                 item.get('sn', ''),
-                item['desc'],
+                item['desc'] + discount_note(item, currency),
                 item['type'],
                 str(item['qty']),
-                f"{COMPANY_CONFIG['currency_symbol']}{item['price']:,.2f}",
-                f"{COMPANY_CONFIG['currency_symbol']}{item['total']:,.2f}"
+                format_money(item['price'], currency),
+                format_money(item['total'], currency)
             ])
             
         table = Table(data, colWidths=[50, 220, 70, 40, 90, 90])
@@ -554,7 +4850,8 @@ class InvoicePDF:
             ('ALIGN', (0,0), (-1,-1), 'LEFT'),
             ('ALIGN', (3,0), (-1,-1), 'CENTER'),
             ('ALIGN', (4,0), (-1,-1), 'RIGHT'),
-            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+            ('FONTNAME', (0,0), (-1,-1), self.fonts['regular']),
+            ('FONTNAME', (0,0), (-1,0), self.fonts['bold']),
             ('BOTTOMPADDING', (0,0), (-1,0), 12),
             ('GRID', (0,0), (-1,-1), 1, colors.lightgrey),
         ])
@@ -564,87 +4861,1420 @@ class InvoicePDF:
         self.y_position = self.height - 250 - h
         table.drawOn(self.c, 30, self.y_position)
 
-    def draw_footer(self, totals):
-        x_label = self.width - 200
-        x_val = self.width - 35
-        y = self.y_position - 30
-        
-        def print_line(label, val, is_bold=False, color=colors.black):
-            self.c.setFillColor(color)
-            font = "Helvetica-Bold" if is_bold else "Helvetica"
-            self.c.setFont(font, 10 if not is_bold else 12)
-            self.c.drawRightString(x_label, y, label)
-            self.c.drawRightString(x_val, y, f"{COMPANY_CONFIG['currency_symbol']}{val:,.2f}")
-        
-        print_line("Subtotal:", totals['subtotal'])
-        y -= 20
-        print_line("VAT (7.5%):", totals['vat'])
-        y -= 20
-        print_line("Shipping Cost:", totals['shipping'])
-        y -= 20
-        self.c.setStrokeColor(colors.grey)
-        self.c.line(x_label - 50, y + 15, x_val, y + 15)
-        print_line("Grand Total:", totals['grand_total'], is_bold=True)
-        y -= 20
-        
-        # Only show WHT if applicable
-        if totals.get('wht_rate', 0) > 0:
-            print_line(f"Less WHT ({totals['wht_rate']}%):", totals['wht'], color=colors.red)
-            y -= 25
+    def draw_footer(self, totals):
+        x_label = self.width - 200
+        x_val = self.width - 35
+        y = self.y_position - 30
+        currency = totals.get('currency')
+        
+        def print_line(label, val, is_bold=False, color=colors.black):
+            self.c.setFillColor(color)
+            font = self.fonts['bold'] if is_bold else self.fonts['regular']
+            self.c.setFont(font, 10 if not is_bold else 12)
+            self.c.drawRightString(x_label, y, label)
+            self.c.drawRightString(x_val, y, format_money(val, currency))
+        
+        for label, amount in discount_lines(totals):
+            print_line(label, amount)
+            y -= 20
+        print_line("Subtotal:", totals['subtotal'])
+        y -= 20
+        for label, amount in vat_lines(totals):
+            print_line(label, amount)
+            y -= 20
+        print_line("Shipping Cost:", totals['shipping'])
+        y -= 20
+        self.c.setStrokeColor(colors.grey)
+        self.c.line(x_label - 50, y + 15, x_val, y + 15)
+        print_line("Grand Total:", totals['grand_total'], is_bold=True)
+        y -= 20
+        
+        # Only show WHT if applicable
+        for label, amount in wht_lines(totals):
+            print_line(label, amount, color=colors.red)
+            y -= 25
+        for label, amount in adjustment_lines(totals):
+            print_line(label, amount, is_bold=True)
+            y -= 25
+
+        # Decide whether there is enough space below to print payment and warranty
+        required_space = 160  # approximate space needed for bank details + warranty
+        new_page = False
+        if y < required_space + 30:
+            # Start a new page for the payment & warranty to avoid overlap
+            self.c.showPage()
+            new_page = True
+
+        # Place Payment Details at bottom-left and Warranty at bottom-right
+        # Use bottom coordinates (y from bottom); keep a small margin above page bottom
+        y_bottom = 110
+        y_bank = y_bottom
+        y_warranty = y_bottom
+
+        # Bank Details (left)
+        self.c.setFillColor(colors.black)
+        self.c.setFont(self.fonts['bold'], 10)
+        self.c.drawString(30, y_bank, "PAYMENT DETAILS:")
+        self.c.setFont(self.fonts['regular'], 9)
+        self.c.drawString(30, y_bank - 15, f"Bank: {self.letterhead.bank_name}")
+        self.c.drawString(30, y_bank - 28, f"Account Name: {self.letterhead.account_name}")
+        self.c.drawString(30, y_bank - 41, f"Account Number: {self.letterhead.account_number}")
+
+        # Delivery & Warranty Section (right-aligned)
+        self.c.setFillColor(colors.HexColor("#0f3057"))
+        self.c.setFont(self.fonts['bold'], 9)
+        self.c.drawRightString(self.width - 30, y_warranty, "DELIVERY & WARRANTY:")
+        
+        self.c.setFont(self.fonts['regular'], 7.5)
+        self.c.setFillColor(colors.black)
+        warranty_text = [
+            "Delivery: Orders dispatched within 48 hours of payment. Shipping notification will be sent.",
+            "Replacements: Replacement guaranteed for defects reported within 48 hours.",
+            "Note: No monetary refunds for faulty goods - direct item exchanges only."
+        ]
+        
+        # Wrap warranty lines to a reasonable width and right-align them
+        wrapped_lines = []
+        for line in warranty_text:
+            wrapped_lines.extend(textwrap.wrap(line, width=60))
+
+        text_y = y_warranty - 12
+        for line in wrapped_lines:
+            self.c.drawRightString(self.width - 30, text_y, line)
+            text_y -= 10
+
+        # Footer note at bottom of page
+        self.c.setFont(self.fonts['italic'], 8)
+        self.c.drawCentredString(self.width/2, 8, "Nascomsoft Embeded - Technology for all. Thank you for your patronage.")
+        self.save()
+
+    def save(self):
+        if self.profile['pdfa']:
+            self._mark_pdfa()
+        self.c.save()
+
+    def _mark_pdfa(self):
+        """Add the PDF/A-2b identification: XMP metadata mirroring the document info and an sRGB output intent."""
+        if self.fonts is BUILTIN_FONTS:
+            logger.warning(f"{self.filename}: PDF/A needs embedded fonts; writing a plain PDF")
+            return
+        doc = self.c._doc
+        info = doc.info
+        ts = doc._timeStamp
+        yyyy, mm, dd, hh, mi, ss = ts.YMDhms
+        stamp = f"{yyyy:04d}-{mm:02d}-{dd:02d}T{hh:02d}:{mi:02d}:{ss:02d}{ts.dhh:+03d}:{ts.dmm:02d}"
+        xmp = PDFA_XMP.format(title=xml_escape(info.title), author=xml_escape(info.author), subject=xml_escape(info.subject),
+                              creator=xml_escape(info.creator), producer=xml_escape(info.producer),
+                              keywords=xml_escape(info.keywords), date=stamp)
+        # PDF/A wants the metadata stream readable without decoding, so it is written unfiltered
+        doc.Catalog.Metadata = PDFStream(PDFDictionary({'Type': PDFName('Metadata'), 'Subtype': PDFName('XML')}),
+                                         xmp.encode('utf-8'), filters=[])
+        try:
+            icc = PDFStream(PDFDictionary({'N': 3}), _srgb_icc_profile())
+        except Exception as e:
+            log_error("pdf.pdfa", "Could not build the sRGB output intent", e)
+            return
+        doc.Catalog.OutputIntents = PDFArray([PDFDictionary({
+            'Type': PDFName('OutputIntent'), 'S': PDFName('GTS_PDFA1'),
+            'OutputConditionIdentifier': PDFString('sRGB IEC61966-2.1'), 'Info': PDFString('sRGB IEC61966-2.1'),
+            'DestOutputProfile': doc.Reference(icc),
+        })])
+        # PDFCatalog only serialises the keys it knows about
+        doc.Catalog.__NoDefault__ = list(doc.Catalog.__NoDefault__) + ['OutputIntents']
+
+
+def concatenate_pdfs(parts, filename):
+    """Join PDFs written by ReportLab canvases (one classic xref table each, no object streams) into `filename`,
+    pages in order. Objects are renumbered and copied a part at a time, so only one part is read into memory;
+    the first part's catalog, document info and PDF/A identification describe the result."""
+    positions, kids = array('Q'), array('Q')
+    base, pages_root = 0, None
+
+    def place(number, offset):
+        while len(positions) <= number:
+            positions.append(0)
+        positions[number] = offset
+
+    with open(filename, 'wb') as out:
+        for index, part in enumerate(parts):
+            with open(part, 'rb') as f:
+                data = f.read()
+            xref_at = int(data[data.rindex(b'startxref') + 9:].split()[0])
+            trailer_at = data.index(b'trailer', xref_at)
+            trailer = data[trailer_at:]
+            table = re.findall(rb'(\d{10}) \d{5} ([nf])', data[xref_at:trailer_at])
+            objects = {number: int(offset) for number, (offset, kind) in enumerate(table) if kind == b'n'}
+            starts = sorted(objects.values())
+            ends = dict(zip(starts, starts[1:] + [xref_at]))
+
+            def body(number):
+                chunk = data[objects[number]:ends[objects[number]]]
+                chunk = chunk[chunk.index(b'obj') + 3:].strip()
+                return chunk[:-len(b'endobj')].rstrip() if chunk.endswith(b'endobj') else chunk
+
+            def ref(source, key):
+                return int(re.search(rb'/' + key + rb' (\d+) 0 R', source).group(1))
+
+            catalog, info = ref(trailer, b'Root'), ref(trailer, b'Info')
+            pages = ref(body(catalog), b'Pages')
+            if index == 0:
+                out.write(data[:starts[0]])
+                root, root_info, pages_root = catalog, info, pages
+                file_id = re.search(rb'/ID\s*(\[[^\]]*\])', trailer).group(1)
+
+            def shift(match):
+                number = int(match.group(1))
+                return b'%d 0 R' % (pages_root if number == pages else number + base)
+
+            for number in sorted(objects):
+                content = body(number)
+                if number == pages:
+                    kids.extend(int(n) + base for n in re.findall(rb'(\d+) 0 R', re.search(rb'/Kids\s*\[([^\]]*)\]', content).group(1)))
+                    if index == 0:
+                        continue  # written last, listing every part's pages
+                    content = b'null'
+                elif index and number in (catalog, info):
+                    content = b'null'
+                else:
+                    # References are renumbered in the object's dictionary only, never inside stream data
+                    split = re.search(rb'>>\s*stream\r?\n', content)
+                    head, tail = (content[:split.start() + 2], content[split.start() + 2:]) if split else (content, b'')
+                    content = re.sub(rb'(\d+) 0 R', shift, head) + tail
+                place(number + base, out.tell())
+                out.write(b'%d 0 obj\n%s\nendobj\n' % (number + base, content))
+            base += len(table) - 1
+        place(pages_root, out.tell())
+        out.write(b'%d 0 obj\n<<\n/Count %d /Kids [ ' % (pages_root, len(kids)))
+        for kid in kids:
+            out.write(b'%d 0 R ' % kid)
+        out.write(b'] /Type /Pages\n>>\nendobj\n')
+        xref_at = out.tell()
+        out.write(b'xref\n0 %d\n0000000000 65535 f \n' % (base + 1))
+        for number in range(1, base + 1):
+            offset = positions[number] if number < len(positions) else 0
+            out.write(b'%010d 00000 n \n' % offset if offset else b'0000000000 00000 f \n')
+        out.write(b'trailer\n<<\n/ID %s\n/Info %d 0 R\n/Root %d 0 R\n/Size %d\n>>\nstartxref\n%d\n%%%%EOF\n'
+                  % (file_id, root_info, root, base + 1, xref_at))
+    return len(kids)
+
+
+class StatementPDF(InvoicePDF):
+    """Statement of account: a summary of the client's invoices followed by every invoice, in one file.
+    Invoices are drawn as they stream in from the database a chunk at a time, so only one chunk of rows is held.
+    ReportLab keeps a record of every finished page until its canvas is saved, so every pdf.statement_part_pages
+    pages the canvas is written to a part file and a fresh one started; close() joins the parts into the statement."""
+
+    ROW_HEIGHT = 14
+    COLUMNS = ((30, 'Date', 'left'), (90, 'Invoice #', 'left'), (270, 'Amount', 'right'), (340, 'WHT', 'right'),
+               (415, 'Credit/Adj.', 'right'), (490, 'Paid', 'right'), (565, 'Balance', 'right'))
+
+    def __init__(self, filename, profile=None, letterhead=None, title='', part_pages=None):
+        self.target, self.title = filename, title
+        self.part_pages = part_pages or PDF_SETTINGS['statement_part_pages']
+        # Next to the statement, so a single part can simply be renamed into place
+        self.workdir = tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(filename)))
+        self.parts, self.pages = [], 0
+        super().__init__(self._part_name(), profile, letterhead)
+
+    def _part_name(self):
+        return os.path.join(self.workdir.name, f"part{len(self.parts):04d}.pdf")
+
+    def _write_part(self):
+        self.pages += self.c.getPageNumber() - 1
+        self.c.setTitle(self.title)
+        InvoicePDF.save(self)
+        self.parts.append(self.filename)
+
+    def new_page(self):
+        """End the page; a part that has reached part_pages is written out and the next page starts a new canvas."""
+        self.c.showPage()
+        if self.c.getPageNumber() > self.part_pages:
+            self._write_part()
+            self.filename = self._part_name()
+            self.c = self._open_canvas(self.filename)
+
+    def save(self):
+        # Each invoice ends its last page instead of closing the file
+        self.new_page()
+
+    def close(self):
+        """Write the last part and join the parts into the statement file; returns the page count."""
+        try:
+            if self.c.getPageNumber() > 1 or not self.parts:
+                self._write_part()
+            if len(self.parts) == 1:
+                os.replace(self.parts[0], self.target)
+            else:
+                concatenate_pdfs(self.parts, self.target)
+        finally:
+            self.discard()
+        return self.pages
+
+    def discard(self):
+        """Remove the part files (close() does this; call it when rendering fails part way)."""
+        self.workdir.cleanup()
+
+    def _draw_row(self, y, values, font):
+        self.c.setFont(font, 9)
+        for (x, _, align), value in zip(self.COLUMNS, values):
+            if align == 'right':
+                self.c.drawRightString(x, y, value)
+            else:
+                self.c.drawString(x, y, value)
+
+    def draw_summary(self, statement_no, client_name, period, summary, invoices):
+        """Summary page(s): one line per invoice from the `invoices` chunk stream, then the totals. Each line's
+        balance is what is still owed on it: net of WHT, credit notes, amendments and payments."""
+        self.draw_header(statement_no, datetime.now().strftime("%d-%b-%Y"), doc_type="STATEMENT")
+        self.draw_client_info(client_name, summary.get('client_address', ''))
+        self.c.setFont(self.fonts['regular'], 10)
+        self.c.drawString(30, self.height - 215, f"Period: {period}    Invoices: {summary['count']:,}")
+        y = self.height - 250
+        self._draw_row(y, [c[1] for c in self.COLUMNS], self.fonts['bold'])
+        for chunk in invoices:
+            for inv in chunk:
+                y -= self.ROW_HEIGHT
+                if y < 60:
+                    self.new_page()
+                    y = self.height - 50
+                    self._draw_row(y, [c[1] for c in self.COLUMNS], self.fonts['bold'])
+                    y -= self.ROW_HEIGHT
+                currency = inv['currency']
+                self._draw_row(y, [
+                    _format_timestamp(inv['date_issued'])[:10], inv['invoice_no'], format_money(inv['grand_total'], currency),
+                    format_money(inv['wht'], currency), format_money(inv['adjusted'], currency),
+                    format_money(inv['amount_paid'], currency), format_money(inv['balance_due'], currency)
+                ], self.fonts['regular'])
+        if y < 100:
+            self.new_page()
+            y = self.height - 50
+        self.c.setStrokeColor(colors.grey)
+        self.c.line(30, y - 8, self.width - 30, y - 8)
+        # Totals are in the base currency (client_statement_summary converts each invoice at its own rate)
+        self._draw_row(y - 24, ['', f"TOTAL ({CURRENCY_SETTINGS['base']})", format_money(summary['grand_total']),
+                                format_money(summary['wht']), format_money(summary['adjusted']),
+                                format_money(summary['amount_paid']), format_money(summary['balance_due'])],
+                       self.fonts['bold'])
+        self.new_page()
+
+
+def render_statement_pdf(filename, db, client_name, date_from=None, date_to=None, profile=None, progress=None, part_pages=None):
+    """Render a statement of account for `client_name` (exact name) to `filename`.
+    Reads the invoices twice in chunks (summary lines, then full invoices) and writes the pages in parts
+    of `part_pages` (default pdf.statement_part_pages; see StatementPDF), so memory stays flat for clients with
+    thousands of invoices. `progress(done, total)` is called after each chunk.
+    Returns {'filename', 'invoices', 'pages', 'seconds', 'pages_per_sec', 'client_email'}."""
+    started = time.perf_counter()
+    chunk = PDF_SETTINGS.get('statement_chunk', 200)
+    summary = db.client_statement_summary(client_name, date_from, date_to)
+    period = f"{date_bound(date_from):%d-%b-%Y}" if date_from else "All time"
+    if date_to:
+        period += f" to {date_bound(date_to):%d-%b-%Y}" if date_from else f" up to {date_bound(date_to):%d-%b-%Y}"
+    statement_no = f"SOA-{datetime.now():%Y%m%d}"
+
+    pdf = StatementPDF(filename, profile, db.letterhead(), f"Statement of Account - {client_name}", part_pages)
+    try:
+        pdf.draw_summary(statement_no, client_name, period, summary,
+                         db.iter_client_invoices(client_name, date_from, date_to, chunk, with_items=False))
+        done = 0
+        for invoices in db.iter_client_invoices(client_name, date_from, date_to, chunk):
+            for inv in invoices:
+                issued = _format_timestamp(inv['date_issued'])[:10]
+                pdf.draw_header(inv['invoice_no'], datetime.strptime(issued, "%Y-%m-%d").strftime("%d-%b-%Y"))
+                pdf.draw_client_info(inv['client_name'], inv['client_address'])
+                pdf.draw_items_table(inv['items'], inv['currency'])
+                pdf.draw_footer(inv)
+            done += len(invoices)
+            if progress:
+                progress(done, summary['count'])
+        pages = pdf.close()
+    finally:
+        pdf.discard()
+    seconds = time.perf_counter() - started
+    return {'filename': filename, 'invoices': done, 'pages': pages, 'seconds': seconds,
+            'pages_per_sec': pages / seconds if seconds > 0 else None, 'client_email': summary['client_email']}
+
+
+def vat_label(totals):
+    """'VAT (7.5%):' with the rate the document was issued at. The rate is recovered from its stored
+    amounts, so re-rendering an old document after the configured rate changes still labels it correctly."""
+    subtotal = float(totals.get('subtotal') or 0)
+    if subtotal and totals.get('vat') is not None:
+        rate = round(float(totals['vat']) / subtotal * 100, 2)
+    else:
+        rate = COMPANY_CONFIG['vat_rate'] * 100
+    return f"VAT ({rate:g}%):"
+
+
+def discount_note(item, currency=None):
+    """The second description line of a discounted item: its price rule and list price."""
+    if not item.get('discount'):
+        return ''
+    return f"\n{item.get('price_rule') or 'Discount'}: list {format_money(item['list_price'], currency)}, less {format_money(item['discount'], currency)}"
+
+
+def discount_lines(totals):
+    """(label, amount) footer lines above the subtotal when the price rules discounted any line."""
+    discount = totals.get('discount') or 0
+    if not discount:
+        return []
+    return [("Before Discounts:", totals['subtotal'] + discount), ("Less Discounts:", discount)]
+
+
+def adjustment_lines(totals):
+    """(label, amount) footer line for a credit note or amendment: what it takes off (or adds to) the invoice's balance."""
+    adjustment = totals.get('adjustment')
+    if not adjustment:
+        return []
+    return [(f"{'Taken off' if adjustment < 0 else 'Added to'} Invoice {totals['invoice_ref']}:", abs(adjustment))]
+
+
+def vat_lines(totals):
+    """(label, amount) footer lines for a document's VAT: one per rate, exempt lines included, when its saved
+    breakdown has more than one; otherwise the single vat_label line."""
+    entries = [t for t in totals.get('taxes') or () if t['tax'] == 'VAT']
+    if len(entries) < 2:
+        return [(vat_label(totals), totals['vat'])]
+    currency = totals.get('currency')
+    return [(f"VAT ({t['rate']:g}%) on {format_money(t['taxable'], currency)}:" if t['rate'] else
+             f"VAT exempt ({format_money(t['taxable'], currency)}):", t['amount']) for t in entries]
+
+
+def wht_lines(totals):
+    """(label, amount) footer lines for the WHT deducted: one per rate when lines were withheld at different
+    rates, a single line at the document's rate otherwise, and none when nothing is withheld."""
+    entries = [t for t in totals.get('taxes') or () if t['tax'] == 'WHT']
+    if len(entries) > 1:
+        currency = totals.get('currency')
+        return [(f"Less WHT ({t['rate']:g}%) on {format_money(t['taxable'], currency)}:", t['amount']) for t in entries]
+    if entries:
+        return [(f"Less WHT ({entries[0]['rate']:g}%):", entries[0]['amount'])]
+    if totals.get('wht_rate', 0) > 0:
+        return [(f"Less WHT ({totals['wht_rate']:g}%):", totals['wht'])]
+    return []
+
+
+def render_document_pdf(filename, doc_data, items, doc_type="INVOICE", date_str=None, profile=None, letterhead=None):
+    """Render a complete invoice, quotation, credit note or amendment to `filename` using an output profile
+    (a PDF_PROFILES name; defaults to PDF_SETTINGS['profile']) and the issuing tenant's letterhead
+    (DatabaseManager.letterhead(); defaults to COMPANY_CONFIG). A note (with 'invoice_ref') names the invoice it corrects.
+    Touches no Tk state or DB connection, so it is safe to run on a worker thread.
+    """
+    doc_no = doc_data.get('invoice_no') or doc_data.get('quote_no') or doc_data.get('note_no')
+    pdf = InvoicePDF(filename, profile, letterhead)
+    pdf.draw_header(doc_no, date_str or datetime.now().strftime("%d-%b-%Y"), doc_type=doc_type)
+    pdf.draw_client_info(doc_data['client_name'], doc_data['client_address'])
+    if doc_data.get('invoice_ref'):
+        pdf.draw_reference(doc_data['invoice_ref'], doc_data.get('reason', ''))
+    pdf.draw_items_table(items, doc_data.get('currency'))
+    pdf.draw_footer(doc_data)
+    return filename
+
+
+def note_pdf(note):
+    """(doc_type, PDF file name) for a credit note or amendment (an issue_invoice_note/fetch_invoice_note dict)."""
+    doc_type, prefix = DatabaseManager.NOTE_KINDS[note['note_kind']]
+    return doc_type, f"{prefix}_{note['note_no']}.pdf"
+
+@functools.lru_cache(maxsize=16)
+def _preview_font(size, bold=False):
+    from PIL import ImageFont
+    name = 'VeraBd.ttf' if bold else 'Vera.ttf'
+    for folder in rl_config.TTFSearchPath:
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            return ImageFont.truetype(path, size)
+    return ImageFont.load_default()
+
+
+def render_preview_image(doc, width=None, letterhead=None):
+    """Draw a page-1 preview of a document (a fetch_document dict) as a PIL image, following the
+    InvoicePDF layout. Pure Pillow work with no Tk or DB access, so it runs on a worker thread."""
+    from PIL import Image, ImageDraw
+    letterhead = letterhead or doc.get('letterhead') or LETTERHEADS.default()
+    width = width or PDF_SETTINGS['preview_width']
+    k = width / A4[0]  # points -> pixels
+    img = Image.new('RGB', (width, int(A4[1] * k)), 'white')
+    d = ImageDraw.Draw(img)
+    navy, red, grey = '#0f3057', '#e94560', '#d3d3d3'
+    currency = doc.get('currency')
+    doc_type = "QUOTATION" if 'quote_no' in doc else "INVOICE"
+    number = doc.get('invoice_no') or doc.get('quote_no')
+
+    def text(x, y, value, size, bold=False, fill='black', anchor='la'):
+        # y is measured from the top of the page, in points
+        d.text((x * k, y * k), str(value), font=_preview_font(max(6, int(size * k)), bold), fill=fill, anchor=anchor)
+
+    right = A4[0] - 30
+    text(right, 40, letterhead.company_name, 18, True, navy, 'ra')
+    y = 62
+    for line in letterhead.address_lines:
+        text(right, y, line, 10, anchor='ra')
+        y += 12
+    d.line((30 * k, 130 * k, right * k, 130 * k), fill=navy)
+    text(30, 142, doc_type, 22, True, red)
+    text(30, 170, f"{doc_type} #: {number}", 12, True)
+    text(30, 185, f"Date: {_format_timestamp(doc.get('date_issued'))[:10]}", 12, True)
+    text(A4[0] - 250, 150, "BILL TO:", 12, True)
+    text(A4[0] - 250, 170, doc['client_name'], 12, True)
+    y = 185
+    for line in textwrap.wrap(doc.get('client_address') or '', width=35)[:4]:
+        text(A4[0] - 250, y, line, 10)
+        y += 12
+
+    columns = ((30, 'S/N'), (80, 'Description'), (300, 'Type'), (370, 'Qty'), (410, 'Rate'), (500, 'Amount'))
+    y = 250
+    d.rectangle((30 * k, y * k, right * k, (y + 18) * k), fill=navy)
+    for x, title in columns:
+        text(x + 4, y + 4, title, 9, True, 'white')
+    y += 18
+    items = doc.get('items', [])
+    shown = items[:25]
+    for item in shown:
+        values = (item.get('sn', ''), str(item['desc'])[:34], item.get('type', ''), item['qty'],
+                  format_money(item['price'], currency), format_money(item['total'], currency))
+        for (x, _), value in zip(columns, values):
+            text(x + 4, y + 3, value, 8)
+        d.line((30 * k, (y + 16) * k, right * k, (y + 16) * k), fill=grey)
+        y += 16
+    if len(items) > len(shown):
+        text(34, y + 3, f"... {len(items) - len(shown)} more item(s)", 8, fill='grey')
+        y += 16
+
+    y += 20
+    lines = [*discount_lines(doc), ("Subtotal:", doc['subtotal']), *vat_lines(doc),
+             ("Shipping Cost:", doc['shipping']), ("Grand Total:", doc['grand_total']), *wht_lines(doc)]
+    for label, value in lines:
+        bold = label == "Grand Total:"
+        fill = 'red' if label.startswith("Less WHT") else 'black'
+        text(A4[0] - 200, y, label, 12 if bold else 10, bold, fill, 'ra')
+        text(A4[0] - 35, y, format_money(value, currency), 12 if bold else 10, bold, fill, 'ra')
+        y += 20
+    return img
+
+
+class PreviewCache:
+    """LRU cache of rendered previews keyed by (kind, number), capped at PDF_SETTINGS['preview_cache_size'].
+    Misses render on the executor; a key is rendered at most once however often it is requested."""
+
+    def __init__(self, executor, max_items=None):
+        self.executor = executor
+        self._max_items = max_items
+        self._images = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @property
+    def max_items(self):
+        return self._max_items or PDF_SETTINGS['preview_cache_size']
+
+    def request(self, key, load):
+        """Return a Future resolving to the preview for `key`, or None if there is nothing to preview.
+        On a miss `load()` is called on the caller's thread (it may touch the DB) and must return
+        a fetch_document dict or None; only the drawing runs in the background."""
+        with self._lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                done = Future()
+                done.set_result(self._images[key])
+                return done
+            if key in self._pending:
+                return self._pending[key]
+        doc = load()
+        if not doc:
+            return None
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self.executor.submit(self._render, key, doc)
+                self._pending[key] = future
+            return future
+
+    def _render(self, key, doc):
+        try:
+            img = render_preview_image(doc)
+            with self._lock:
+                self._images[key] = img
+                self._images.move_to_end(key)
+                while len(self._images) > self.max_items:
+                    self._images.popitem(last=False)
+            return img
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def discard(self, key):
+        with self._lock:
+            self._images.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+
+# =============================================================================
+# 7. EMAIL DELIVERY
+# =============================================================================
+
+def document_for_file(path):
+    """(kind, number) for a generated document file name such as Invoice_<no>.pdf; ('file', name) otherwise."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    for prefix, kind in (("Invoice_", "invoices"), ("Quotation_", "quotations"),
+                         *((f"{name}_", kind) for kind, (_, name) in DatabaseManager.NOTE_KINDS.items())):
+        if name.startswith(prefix):
+            return kind, name[len(prefix):]
+    return 'file', os.path.basename(path)
+
+
+def send_email(to_address, subject, body, attachment_path, db=None, action='send', smtp=None):
+    """Send an email with the given attachment. Returns (True, '') on success, (False, error_message) on failure.
+    The outcome is logged to `db` (a DatabaseManager) when one is given, and a delivered attachment is
+    recorded in its audit trail as `action` ('send' right after generating, 'resend' later).
+    `smtp` overrides SMTP_SETTINGS (the settings dialog tests unsaved values this way).
+    """
+    settings = smtp or SMTP_SETTINGS
+    if not settings.get('host'):
+        return False, "SMTP is not configured. Please configure email settings first."
+    try:
+        with METRICS.timer("smtp.build_message"):
+            msg = EmailMessage()
+            msg['Subject'] = subject
+            msg['From'] = settings.get('from_email') or settings.get('username')
+            msg['To'] = to_address
+            msg.set_content(body)
+
+            # attach file
+            if attachment_path and os.path.exists(attachment_path):
+                with open(attachment_path, 'rb') as f:
+                    data = f.read()
+                ctype, encoding = mimetypes.guess_type(attachment_path)
+                if ctype:
+                    maintype, subtype = ctype.split('/', 1)
+                else:
+                    maintype, subtype = 'application', 'octet-stream'
+                msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=os.path.basename(attachment_path))
+
+        context = ssl.create_default_context()
+        with METRICS.timer("smtp.connect"):
+            server = smtplib.SMTP(settings.get('host'), settings.get('port'))
+        with server:
+            with METRICS.timer("smtp.handshake"):
+                if settings.get('use_tls'):
+                    server.starttls(context=context)
+                if settings.get('username'):
+                    server.login(settings.get('username'), settings.get('password'))
+            with METRICS.timer("smtp.send_message"):
+                server.send_message(msg)
+        # Log success in DB if available
+        if db:
+            try:
+                db.save_email_log(to_address, subject, attachment_path, 'SENT', '')
+                if attachment_path:
+                    db.audit.record(action, *document_for_file(attachment_path), f"to {to_address}")
+            except Exception:
+                pass
+        return True, ''
+    except Exception as e:
+        log_error("email.send", f"Email to {to_address} failed", e)
+        # Log failure in DB if available
+        if db:
+            try:
+                db.save_email_log(to_address, subject, attachment_path, 'FAILED', str(e))
+            except Exception:
+                pass
+        return False, str(e)
+
+# =============================================================================
+# 8. DASHBOARD EXPORT & BULK IMPORT
+# =============================================================================
+
+DASHBOARD_HEADINGS = ["Invoice #", "Date", "Client", "Type", "Subtotal", "VAT", "Shipping", "WHT", "Grand Total", "Balance Due",
+                      "Currency"]
+BALANCE_FILTERS = ["All", "Unpaid", "Paid"] + [f"{bucket} days" for bucket in AGING_BUCKETS]
+PAYMENT_METHODS = ["Transfer", "Cash", "POS", "Cheque"]
+
+DASHBOARD_PERIODS = ["Any time", "Today", "This month", "Last month", "Last 30 days", "This year", "Last year", "Custom"]
+
+
+def period_range(period, today=None):
+    """(date_from, date_to) for a dashboard period preset; (None, None) for 'Any time'/'Custom'."""
+    today = today or date.today()
+    if period == "Today":
+        return today, today
+    if period == "This month":
+        return today.replace(day=1), today
+    if period == "Last month":
+        last_day = today.replace(day=1) - timedelta(days=1)
+        return last_day.replace(day=1), last_day
+    if period == "Last 30 days":
+        return today - timedelta(days=29), today
+    if period == "This year":
+        return today.replace(month=1, day=1), today
+    if period == "Last year":
+        return date(today.year - 1, 1, 1), date(today.year - 1, 12, 31)
+    return None, None
+
+
+def dashboard_row_values(inv):
+    """Format a fetch_invoices/fetch_quotations row as the dashboard displays (and exports) it, in its own currency."""
+    cur = inv['currency']
+    balance = inv['balance_due']
+    return (inv['invoice_no'], inv['date_issued'], inv['client_name'], inv['invoice_type'],
+            format_money(inv['subtotal'], cur), format_money(inv['vat'], cur), format_money(inv['shipping'], cur),
+            format_money(inv['wht'], cur), format_money(inv['grand_total'], cur),
+            "" if balance is None else format_money(balance, cur), cur)
+
+
+def dashboard_summary_text(summaries):
+    """One-line summary strip text from {'Invoices': summary, 'Quotations': summary} (base-currency totals)."""
+    parts = []
+    for label, s in summaries.items():
+        text = f"{label}: {s['count']:,}  |  Total {format_money(s['grand_total'])}  |  VAT {format_money(s['vat'])}"
+        if label != 'Quotations':
+            text += f"  |  WHT {format_money(s['wht'])}"
+        if label == 'Invoices':
+            adjusted = s.get('adjusted', 0.0)
+            if adjusted:
+                # Credit notes and amendments, net
+                text += f"  |  Adjusted {'-' if adjusted < 0 else '+'}{format_money(abs(adjusted))}"
+            text += f"  |  Due {format_money(s.get('balance_due', 0.0))}"
+        parts.append(text)
+    return "      ".join(parts)
+
+
+def write_dashboard_csv(path, rows):
+    """Write already-formatted dashboard rows to `path`. Returns the number of rows written."""
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(DASHBOARD_HEADINGS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def write_aging_csv(path, report):
+    """Write DatabaseManager.aging_by_client rows, with a totals line, to `path`. Returns the number of clients."""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Client", "Open Invoices"] + [f"{label} days" for label in AGING_BUCKETS] + ["Total"])
+        sums = [0.0] * (len(AGING_BUCKETS) + 1)
+        count = 0
+        for client, open_invoices, balances, total in report:
+            writer.writerow([client, open_invoices] + [f"{b:.2f}" for b in balances] + [f"{total:.2f}"])
+            sums = [a + b for a, b in zip(sums, balances + [total])]
+            count += open_invoices
+        writer.writerow(["TOTAL", count] + [f"{b:.2f}" for b in sums])
+    return len(report)
+
+
+# ------------------- Bulk import (the counterpart of the CSV export) -------------------
+
+# Accepted column names (compared lower-cased, spaces/dashes as underscores) -> import field.
+# The dashboard export's own headings are included, so an exported file imports back.
+IMPORT_COLUMNS = {
+    'invoice_no': 'invoice_no', 'invoice_#': 'invoice_no', 'invoice_number': 'invoice_no', 'number': 'invoice_no',
+    'date_issued': 'date_issued', 'date': 'date_issued', 'invoice_date': 'date_issued',
+    'client_name': 'client_name', 'client': 'client_name', 'customer': 'client_name',
+    'client_email': 'client_email', 'email': 'client_email',
+    'client_address': 'client_address', 'address': 'client_address',
+    'invoice_type': 'invoice_type', 'type': 'invoice_type',
+    'subtotal': 'subtotal', 'vat': 'vat', 'vat_amount': 'vat', 'shipping': 'shipping', 'shipping_cost': 'shipping',
+    'wht': 'wht', 'wht_amount': 'wht', 'wht_rate': 'wht_rate', 'grand_total': 'grand_total', 'total': 'grand_total',
+    'description': 'desc', 'desc': 'desc', 'item': 'desc', 'item_type': 'item_type',
+    'qty': 'qty', 'quantity': 'qty', 'unit_price': 'price', 'price': 'price', 'rate': 'price',
+    'idempotency_key': 'key', 'import_key': 'key', 'external_id': 'key', 'currency': 'currency',
+}
+IMPORT_HEADER_FIELDS = ('invoice_no', 'date_issued', 'client_name', 'client_email', 'client_address', 'invoice_type',
+                        'subtotal', 'vat', 'shipping', 'wht', 'wht_rate', 'grand_total', 'key', 'currency')
+# Currency symbols a formatted amount may start with, longest first ('CN\u00a5' before '\u00a5')
+CURRENCY_PREFIXES = sorted({symbol.strip() for symbol, _ in CURRENCIES.values()}, key=len, reverse=True)
+IMPORT_DATE_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d", "%d/%m/%Y", "%d-%b-%Y", "%d %b %Y")
+
+
+def parse_import_date(text):
+    text = str(text).strip()
+    for fmt in IMPORT_DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    raise ValueError(f"unrecognised date {text!r} (use YYYY-MM-DD)")
+
+
+def parse_amount(value, field):
+    """A number from a spreadsheet cell: plain, or formatted like the export (N1,234.50, \u20a61,234.50, $99.00)."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    text = str(value).strip().replace(',', '')
+    for symbol in (COMPANY_CONFIG['currency_symbol'], '\u20a6', *CURRENCY_PREFIXES):
+        if symbol and text.startswith(symbol):
+            text = text[len(symbol):].strip()
+            break
+    try:
+        return float(text)
+    except ValueError:
+        raise ValueError(f"{field} is not a number: {value!r}")
+
+
+def iter_import_documents(path):
+    """Stream raw documents from an import file as (line_no, {field: value, 'items': [...]}).
+
+    .csv: one row per line item (or per invoice, for totals-only history); consecutive rows with the
+          same invoice number form one invoice, so a file must keep each invoice's lines together.
+    .jsonl / .ndjson: one invoice object per line, with an "items" list.
+    .json: an array of such objects, decoded one object at a time.
+    Only the current document is held in memory."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.csv':
+        yield from _iter_csv_documents(path)
+    elif ext in ('.jsonl', '.ndjson'):
+        with open(path, encoding='utf-8') as f:
+            for line_no, line in enumerate(f, start=1):
+                if line.strip():
+                    yield line_no, _normalise_import_record(json.loads(line))
+    elif ext == '.json':
+        yield from _iter_json_array(path)
+    else:
+        raise ValueError(f"{os.path.basename(path)}: import files must be .csv, .json, .jsonl or .ndjson")
+
+
+def _normalise_import_record(record):
+    if not isinstance(record, dict):
+        raise ValueError("each document must be a JSON object")
+    doc = {}
+    for name, value in record.items():
+        field = IMPORT_COLUMNS.get(name.strip().lower().replace(' ', '_').replace('-', '_'))
+        if field:
+            doc[field] = value
+    doc['items'] = [{IMPORT_COLUMNS.get(k.strip().lower().replace(' ', '_'), k): v for k, v in item.items()}
+                    for item in record.get('items') or [] if isinstance(item, dict)]
+    return doc
+
+
+def _iter_csv_documents(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        try:
+            headings = next(reader)
+        except StopIteration:
+            return
+        fields = [IMPORT_COLUMNS.get(h.strip().lower().replace(' ', '_').replace('-', '_')) for h in headings]
+        if 'invoice_no' not in fields:
+            raise ValueError("the CSV needs an invoice number column (invoice_no)")
+        header_idx = [(i, f) for i, f in enumerate(fields) if f in IMPORT_HEADER_FIELDS]
+        item_idx = [(i, f) for i, f in enumerate(fields) if f in ('desc', 'item_type', 'qty', 'price')]
+        number_idx = fields.index('invoice_no')
+        doc, start = None, 0
+        for line_no, row in enumerate(reader, start=2):
+            if not any(cell.strip() for cell in row):
+                continue
+            row += [''] * (len(fields) - len(row))
+            number = row[number_idx].strip()
+            if doc is None or number != doc['invoice_no']:
+                if doc is not None:
+                    yield start, doc
+                doc = {f: row[i].strip() for i, f in header_idx if row[i].strip()}
+                doc['invoice_no'], doc['items'], start = number, [], line_no
+            item = {f: row[i].strip() for i, f in item_idx if row[i].strip()}
+            if item.get('desc'):
+                doc['items'].append(item)
+        if doc is not None:
+            yield start, doc
+
+
+def _iter_json_array(path, chunk_size=65536):
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as f:
+        buf, pos, started, count = "", 0, False, 0
+        while True:
+            chunk = f.read(chunk_size)
+            buf, pos = buf[pos:] + chunk, 0
+            while True:
+                while pos < len(buf) and buf[pos] in " \t\r\n,":
+                    pos += 1
+                if pos >= len(buf):
+                    break
+                if not started:
+                    if buf[pos] != '[':
+                        raise ValueError("a .json import file must hold an array of invoices")
+                    started, pos = True, pos + 1
+                    continue
+                if buf[pos] == ']':
+                    return
+                try:
+                    record, pos_end = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    if not chunk:
+                        raise
+                    break  # the object continues in the next chunk
+                count, pos = count + 1, pos_end
+                yield count, _normalise_import_record(record)
+            if not chunk:
+                if started:
+                    raise ValueError("the JSON array is not closed")
+                return
+
+
+class ClientMapper:
+    """Maps imported client names onto the spelling already on file, ignoring case and spacing
+    ('acme  ltd' -> 'Acme Ltd'), plus explicit {source name: client name} overrides. New names are
+    kept as first seen, so later rows for the same client agree."""
+
+    def __init__(self, known=(), overrides=None):
+        self.names = {}
+        for name in known:
+            self.names.setdefault(self.normalise(name), name)
+        self.overrides = {self.normalise(src): target for src, target in (overrides or {}).items()}
 
-        # Decide whether there is enough space below to print payment and warranty
-        required_space = 160  # approximate space needed for bank details + warranty
-        new_page = False
-        if y < required_space + 30:
-            # Start a new page for the payment & warranty to avoid overlap
-            self.c.showPage()
-            new_page = True
+    @staticmethod
+    def normalise(name):
+        return " ".join(str(name).split()).casefold()
 
-        # Place Payment Details at bottom-left and Warranty at bottom-right
-        # Use bottom coordinates (y from bottom); keep a small margin above page bottom
-        y_bottom = 110
-        y_bank = y_bottom
-        y_warranty = y_bottom
+    def map(self, name):
+        key = self.normalise(name)
+        if key in self.overrides:
+            return self.overrides[key]
+        return self.names.setdefault(key, " ".join(str(name).split()))
 
-        # Bank Details (left)
-        self.c.setFillColor(colors.black)
-        self.c.setFont("Helvetica-Bold", 10)
-        self.c.drawString(30, y_bank, "PAYMENT DETAILS:")
-        self.c.setFont("Helvetica", 9)
-        self.c.drawString(30, y_bank - 15, f"Bank: {COMPANY_CONFIG['bank_name']}")
-        self.c.drawString(30, y_bank - 28, f"Account Name: {COMPANY_CONFIG['account_name']}")
-        self.c.drawString(30, y_bank - 41, f"Account Number: {COMPANY_CONFIG['account_number']}")
 
-        # Delivery & Warranty Section (right-aligned)
-        self.c.setFillColor(colors.HexColor("#0f3057"))
-        self.c.setFont("Helvetica-Bold", 9)
-        self.c.drawRightString(self.width - 30, y_warranty, "DELIVERY & WARRANTY:")
-        
-        self.c.setFont("Helvetica", 7.5)
-        self.c.setFillColor(colors.black)
-        warranty_text = [
-            "Delivery: Orders dispatched within 48 hours of payment. Shipping notification will be sent.",
-            "Replacements: Replacement guaranteed for defects reported within 48 hours.",
-            "Note: No monetary refunds for faulty goods - direct item exchanges only."
-        ]
-        
-        # Wrap warranty lines to a reasonable width and right-align them
-        wrapped_lines = []
-        for line in warranty_text:
-            wrapped_lines.extend(textwrap.wrap(line, width=60))
+def read_client_map(path):
+    """{source name: client name} from a two-column CSV (source_name, client_name)."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return {row[0]: row[1] for row in csv.reader(f) if len(row) >= 2 and row[0].strip() and row[0].strip().lower() != 'source_name'}
 
-        text_y = y_warranty - 12
-        for line in wrapped_lines:
-            self.c.drawRightString(self.width - 30, text_y, line)
-            text_y -= 10
 
-        # Footer note at bottom of page
-        self.c.setFont("Helvetica-Oblique", 8)
-        self.c.drawCentredString(self.width/2, 8, "Nascomsoft Embeded - Technology for all. Thank you for your patronage.")
-        self.c.save()
+PRODUCT_IMPORT_COLUMNS = {
+    'sku': 'sku', 'code': 'sku', 'item_code': 'sku', 'part_number': 'sku',
+    'description': 'description', 'name': 'description', 'component_name': 'description',
+    'unit_price': 'unit_price', 'price': 'unit_price', 'rate': 'unit_price',
+    'vat': 'vat', 'vat_applicable': 'vat', 'taxable': 'vat', 'active': 'active',
+    'reorder_level': 'reorder_level', 'reorder_at': 'reorder_level', 'min_stock': 'reorder_level',
+}
+
+
+def iter_product_rows(path):
+    """Catalog rows from a CSV with sku, description and unit_price columns (vat and active optional,
+    yes/no or 1/0; reorder_level optional), for DatabaseManager.import_products."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        try:
+            headings = next(reader)
+        except StopIteration:
+            return
+        fields = [PRODUCT_IMPORT_COLUMNS.get(h.strip().lower().replace(' ', '_').replace('-', '_')) for h in headings]
+        missing = {'sku', 'description', 'unit_price'} - set(fields)
+        if missing:
+            raise ValueError(f"the CSV needs {', '.join(sorted(missing))} column(s)")
+        for row in reader:
+            if not any(cell.strip() for cell in row):
+                continue
+            yield {f: cell.strip() for f, cell in zip(fields, row) if f and cell.strip()}
+
+
+RATE_IMPORT_COLUMNS = {
+    'currency': 'currency', 'code': 'currency', 'currency_code': 'currency',
+    'rate_date': 'rate_date', 'date': 'rate_date', 'effective_date': 'rate_date',
+    'rate': 'rate', 'exchange_rate': 'rate',
+}
+
+
+def iter_rate_rows(path):
+    """Exchange-rate rows from a CSV with currency, date and rate columns (rate = base currency per unit),
+    for DatabaseManager.save_exchange_rates."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        try:
+            headings = next(reader)
+        except StopIteration:
+            return
+        fields = [RATE_IMPORT_COLUMNS.get(h.strip().lower().replace(' ', '_').replace('-', '_')) for h in headings]
+        missing = {'currency', 'rate_date', 'rate'} - set(fields)
+        if missing:
+            raise ValueError(f"the CSV needs {', '.join(sorted(missing))} column(s)")
+        for row in reader:
+            if not any(cell.strip() for cell in row):
+                continue
+            yield {f: cell.strip() for f, cell in zip(fields, row) if f and cell.strip()}
+
+
+PRICE_RULE_IMPORT_COLUMNS = {
+    'code': 'code', 'rule': 'code', 'rule_code': 'code', 'promo_code': 'code',
+    'description': 'description', 'name': 'description',
+    'sku': 'sku', 'item_code': 'sku', 'product': 'sku',
+    'client_name': 'client_name', 'client': 'client_name', 'customer': 'client_name',
+    'kind': 'kind', 'type': 'kind', 'discount_type': 'kind',
+    'value': 'value', 'amount': 'value', 'discount': 'value',
+    'min_qty': 'min_qty', 'min_quantity': 'min_qty', 'from_qty': 'min_qty',
+    'starts_on': 'starts_on', 'start_date': 'starts_on', 'valid_from': 'starts_on',
+    'ends_on': 'ends_on', 'end_date': 'ends_on', 'valid_to': 'ends_on',
+    'active': 'active',
+}
+
+
+def iter_price_rule_rows(path):
+    """Price-rule rows from a CSV with at least code, kind and value columns (sku and client blank for any),
+    for DatabaseManager.save_price_rules."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        try:
+            headings = next(reader)
+        except StopIteration:
+            return
+        fields = [PRICE_RULE_IMPORT_COLUMNS.get(h.strip().lower().replace(' ', '_').replace('-', '_')) for h in headings]
+        missing = {'code', 'kind', 'value'} - set(fields)
+        if missing:
+            raise ValueError(f"the CSV needs {', '.join(sorted(missing))} column(s)")
+        for row in reader:
+            if not any(cell.strip() for cell in row):
+                continue
+            yield {f: cell.strip() for f, cell in zip(fields, row) if f and cell.strip()}
+
+
+class InvoiceImporter:
+    """Streams invoices from a CSV/JSON file into the current tenant of `db`, a chunk of documents per
+    transaction (validate -> one idempotency-key lookup -> one number lookup -> executemany inserts).
+
+    Every document has an idempotency key (an idempotency_key/external_id column, else its number)
+    stored with a hash of its content, so a rerun skips what is already in and reports, rather than
+    duplicates, a document whose content changed. Rejected rows go to `errors_path` as CSV; memory
+    stays flat whatever the file size. Totals missing from the file are computed like the entry forms.
+    """
+
+    def __init__(self, db, chunk_size=None, client_map=None, errors_path=None, dry_run=False):
+        self.db = db
+        self.chunk_size = chunk_size or IMPORT_SETTINGS['chunk_size']
+        self.client_map = client_map
+        self.errors_path = errors_path
+        self.dry_run = dry_run
+        self.stats = {'documents': 0, 'items': 0, 'imported': 0, 'skipped': 0, 'rejected': 0, 'seconds': 0.0}
+        self._errors = None
+
+    def build(self, raw):
+        """(key, content_hash, data, items) for one raw document; raises ValueError listing its problems."""
+        problems = []
+        number = str(raw.get('invoice_no') or '').strip()
+        if not number:
+            problems.append("invoice number is missing")
+        client = str(raw.get('client_name') or '').strip()
+        if not client:
+            problems.append("client name is missing")
+        invoice_type = str(raw.get('invoice_type') or 'Component').strip().title()
+        if invoice_type not in ('Project', 'Component'):
+            problems.append(f"type must be Project or Component, not {invoice_type!r}")
+        issued = None
+        try:
+            issued = parse_import_date(raw['date_issued']) if raw.get('date_issued') else None
+            if issued is None:
+                problems.append("date is missing")
+        except ValueError as e:
+            problems.append(str(e))
+        currency = currency_code(raw.get('currency'))
+        if currency not in CURRENCIES:
+            problems.append(f"currency must be one of {', '.join(CURRENCIES)}, not {currency!r}")
+        items = []
+        for n, item in enumerate(raw.get('items') or [], start=1):
+            try:
+                qty = parse_amount(item.get('qty', 1), f"item {n} qty")
+                price = parse_amount(item.get('price', 0), f"item {n} price")
+                if qty <= 0 or qty != int(qty) or price < 0:
+                    raise ValueError(f"item {n} needs a whole quantity >= 1 and a price >= 0")
+                items.append({'desc': str(item['desc']).strip(), 'type': str(item.get('item_type') or invoice_type).strip(),
+                              'qty': int(qty), 'price': price, 'total': round(int(qty) * price, 2)})
+            except (KeyError, ValueError) as e:
+                problems.append(str(e) if not isinstance(e, KeyError) else f"item {n} has no description")
+        given = {}
+        for field in ('subtotal', 'vat', 'shipping', 'wht', 'wht_rate', 'grand_total'):
+            if raw.get(field) not in (None, ''):
+                try:
+                    given[field] = parse_amount(raw[field], field)
+                except ValueError as e:
+                    problems.append(str(e))
+        if not items and 'grand_total' not in given:
+            problems.append("no line items and no grand total")
+        if problems:
+            raise ValueError("; ".join(problems))
+        rate, _ = self.db.exchange_rate(currency, issued)
+        if rate is None:
+            raise ValueError(str(MissingExchangeRate(currency, issued.date())))
+        # Base-currency documents hash exactly as they did before currencies, so reruns of old files still skip
+        foreign = currency if currency != CURRENCY_SETTINGS['base'] else None
+        # Amounts given in the file win (historical VAT rates); the rest are derived as the forms do
+        totals = document_totals(items, given.get('shipping', 0.0), given.get('wht_rate', 0.0), foreign)
+        totals.pop('taxes')  # amounts given in the file may not follow today's rules, so no breakdown is kept
+        totals.pop('discount')  # imported lines are at the prices invoiced
+        if 'subtotal' in given:
+            totals['subtotal'] = given['subtotal']
+            totals['vat'] = totals['subtotal'] * COMPANY_CONFIG['vat_rate']
+        totals['vat'] = given.get('vat', totals['vat'])
+        totals['grand_total'] = given.get('grand_total', totals['subtotal'] + totals['vat'] + totals['shipping'])
+        totals['wht'] = given.get('wht', round(totals['grand_total'] * totals['wht_rate'] / 100, 2))
+        data = dict(totals, invoice_no=number, client_name=self.client_map.map(client) if self.client_map else client,
+                    client_email=str(raw.get('client_email') or '').strip(), client_address=str(raw.get('client_address') or '').strip(),
+                    invoice_type=invoice_type, date_issued=issued)
+        content = json.dumps([data, items] + ([foreign] if foreign else []), sort_keys=True, default=str)
+        data.update(currency=currency, exchange_rate=rate)
+        key = str(raw.get('key') or number).strip()
+        return key, hashlib.sha1(content.encode('utf-8')).hexdigest(), data, items
+
+    def reject(self, line_no, number, message):
+        self.stats['rejected'] += 1
+        if self.errors_path:
+            if self._errors is None:
+                self._errors = open(self.errors_path, 'w', newline='', encoding='utf-8')
+                self._writer = csv.writer(self._errors)
+                self._writer.writerow(["line", "invoice_no", "error"])
+            self._writer.writerow([line_no, number, message])
+
+    def iter_chunks(self, path):
+        """Import `path`, yielding the running stats after each chunk. Step it from an event loop or thread."""
+        started = time.perf_counter()
+        batch_id = f"import-{datetime.now():%Y%m%d%H%M%S}-{os.getpid()}"
+        if self.client_map is None and IMPORT_SETTINGS['match_clients']:
+            self.client_map = ClientMapper(self.db.fetch_client_names())
+        chunk = []
+        try:
+            for line_no, raw in iter_import_documents(path):
+                self.stats['documents'] += 1
+                try:
+                    chunk.append((line_no, self.build(raw)))
+                except ValueError as e:
+                    self.reject(line_no, raw.get('invoice_no', ''), str(e))
+                if len(chunk) >= self.chunk_size:
+                    self._import_chunk(chunk, f"{batch_id}-{self.stats['documents']}")
+                    chunk = []
+                    self.stats['seconds'] = time.perf_counter() - started
+                    yield dict(self.stats)
+            if chunk:
+                self._import_chunk(chunk, f"{batch_id}-{self.stats['documents']}")
+            self.stats['seconds'] = time.perf_counter() - started
+            yield dict(self.stats)
+        finally:
+            if self._errors is not None:
+                self._errors.close()
+                self._errors = None
+            self.db.audit.flush()
+
+    def run(self, path, progress=None):
+        """Import the whole file; `progress(stats)` after each chunk. Returns the final stats."""
+        stats = dict(self.stats)
+        for stats in self.iter_chunks(path):
+            if progress:
+                progress(stats)
+        return stats
+
+    def _import_chunk(self, chunk, batch_id):
+        pending, seen = [], {}
+        for line_no, (key, digest, data, items) in chunk:
+            if key in seen:
+                self.reject(line_no, data['invoice_no'], f"repeats the idempotency key of line {seen[key]}")
+                continue
+            seen[key] = line_no
+            pending.append((line_no, (key, digest, data, items)))
+        done = self.db.fetch_import_keys(list(seen))
+        fresh = []
+        for line_no, doc in pending:
+            key, digest, data, _ = doc
+            if key in done:
+                if done[key][1] == digest:
+                    self.stats['skipped'] += 1  # imported by an earlier run
+                else:
+                    self.reject(line_no, data['invoice_no'], f"already imported as {done[key][0]} with different content")
+            else:
+                fresh.append((line_no, doc))
+        taken = self.db.taken_invoice_numbers([doc[2]['invoice_no'] for _, doc in fresh])
+        rows = []
+        for line_no, doc in fresh:
+            if doc[2]['invoice_no'] in taken:
+                self.reject(line_no, doc[2]['invoice_no'], "invoice number is already in use")
+            else:
+                rows.append((line_no, doc))
+        if not rows:
+            return
+        if self.dry_run:
+            self.stats['imported'] += len(rows)  # would have been imported
+            return
+        if self.db.import_invoices([doc for _, doc in rows], batch_id):
+            self.stats['imported'] += len(rows)
+            self.stats['items'] += sum(len(doc[3]) for _, doc in rows)
+            return
+        # Something in the chunk failed (e.g. a number saved by a clerk since the check): isolate it
+        for line_no, doc in rows:
+            if self.db.import_invoices([doc], batch_id):
+                self.stats['imported'] += 1
+                self.stats['items'] += len(doc[3])
+            else:
+                self.reject(line_no, doc[2]['invoice_no'], "could not be saved (number taken or database error)")
+
+
+# ------------------- Bank statement reconciliation -------------------
+
+# Accepted statement column names (compared like IMPORT_COLUMNS) -> field. Bank exports name them differently.
+STATEMENT_COLUMNS = {
+    'date': 'date', 'trans_date': 'date', 'transaction_date': 'date', 'txn_date': 'date', 'posting_date': 'date',
+    'post_date': 'date', 'value_date': 'value_date',
+    'narration': 'narration', 'description': 'narration', 'remarks': 'narration', 'details': 'narration',
+    'transaction_details': 'narration', 'narrative': 'narration', 'particulars': 'narration',
+    'credit': 'credit', 'credits': 'credit', 'credit_amount': 'credit', 'deposit': 'credit', 'deposits': 'credit',
+    'lodgement': 'credit', 'lodgements': 'credit', 'money_in': 'credit',
+    'debit': 'debit', 'debits': 'debit', 'debit_amount': 'debit', 'withdrawal': 'debit', 'withdrawals': 'debit',
+    'amount': 'amount',
+    'reference': 'reference', 'ref': 'reference', 'ref_no': 'reference', 'reference_no': 'reference',
+    'reference_number': 'reference', 'transaction_id': 'reference', 'tran_id': 'reference',
+}
+STATEMENT_HEADER_SEARCH = 30  # bank exports open with account details; the heading row must come within this many lines
+_NOT_ALNUM = re.compile(r"[^A-Z0-9]")
+
+
+def _compact(text):
+    """Upper-case letters and digits only: how invoice numbers and names are compared against narrations."""
+    return _NOT_ALNUM.sub('', str(text).upper())
+
+
+def _cents(amount):
+    cents = float(amount) * 100
+    return int(cents + 0.5) if cents >= 0 else -int(0.5 - cents)
+
+
+@functools.lru_cache(maxsize=4096)
+def _statement_date(text):
+    # A statement repeats each date on many lines; parse_import_date tries several formats per call
+    return parse_import_date(text).date()
+
+
+def iter_statement_lines(path):
+    """Stream the money-in lines of a bank statement CSV as dicts (line, date, amount, narration, reference,
+    error). The heading row is looked for among the first lines, amounts come from a credit column or a
+    signed amount column (positive = in), and debit, balance and blank rows are passed over. A line whose
+    date or amount cannot be read is yielded with `error` set rather than stopping the run."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        fields = None
+        for line_no, row in enumerate(csv.reader(f), start=1):
+            if fields is None:
+                found = [STATEMENT_COLUMNS.get(h.strip().lower().replace(' ', '_').replace('-', '_').replace('.', '')) for h in row]
+                if {'date', 'value_date'} & set(found) and {'credit', 'amount'} & set(found):
+                    fields = found
+                elif line_no >= STATEMENT_HEADER_SEARCH:
+                    raise ValueError(f"no heading row with a date and a credit (or amount) column in the first {line_no} lines")
+                continue
+            record = {f: cell.strip() for f, cell in zip(fields, row) if f and cell.strip()}
+            text = record.get('credit' if 'credit' in fields else 'amount')
+            if not text:
+                continue
+            line = {'line': line_no, 'date': None, 'amount': 0.0, 'narration': record.get('narration', ''),
+                    'reference': record.get('reference', ''), 'error': ''}
+            try:
+                line['amount'] = parse_amount(text, "credit")
+                if line['amount'] <= 0:
+                    continue
+                line['date'] = _statement_date(record.get('date') or record['value_date'])
+            except KeyError:
+                line['error'] = "no date"
+            except ValueError as e:
+                line['error'] = str(e)
+            yield line
+
+
+class StatementReconciler:
+    """Matches the credit lines of a bank statement CSV to the open invoices of `db`'s tenant and records
+    them as payments, a chunk of lines per transaction.
+
+    The open invoices are read once into hash and sorted indexes: compacted invoice number -> invoice, and
+    balance -> invoices sorted by issue day. A line that names invoice numbers in its narration or reference
+    (in any spacing, e.g. NSEINV20250012) pays those: one, up to its balance, or several paid in full by
+    the exact total. Otherwise a line pays the one invoice owing exactly its amount issued within
+    `date_window` days before it; several such invoices are told apart by the client's name in the
+    narration. Each line costs a few dictionary lookups and a bisect, whatever the number of invoices.
+
+    Every recorded payment carries a fingerprint of its line, so a statement (or an overlapping one) can be
+    run again and only the new or still unmatched lines are considered. Lines that match nothing, or more
+    than one invoice, go to `review_path` as CSV for a clerk to settle by hand.
+    """
+
+    REFERENCE = re.compile(r"([A-Z]+)[\s\-/_.]*INV[\s\-/_.]*(\d+(?:[\s\-/_.]+\d+)*)")
+    MAX_CANDIDATES = 50  # same-amount invoices compared by client name before a line is left for review
+
+    def __init__(self, db, date_window=None, chunk_size=None, review_path=None, dry_run=False):
+        self.db = db
+        self.date_window = RECONCILE_SETTINGS['date_window_days'] if date_window is None else date_window
+        self.chunk_size = chunk_size or RECONCILE_SETTINGS['chunk_size']
+        self.review_path = review_path
+        self.dry_run = dry_run
+        self.stats = {'lines': 0, 'open_invoices': 0, 'matched': 0, 'by_reference': 0, 'by_amount': 0, 'payments': 0,
+                      'amount': 0.0, 'skipped': 0, 'review': 0, 'seconds': 0.0}
+        self.open = {}       # invoice number -> (issue day ordinal, balance in cents, client name)
+        self.by_key = {}     # compacted invoice number -> invoice number
+        self.by_amount = {}  # balance in cents -> sorted [(issue day ordinal, invoice number)]
+        self.prefix = ''     # the tenant's own number prefix, for narrations that leave it out ("INV-2025-0012")
+        self._review = None
+
+    def load(self):
+        """Index the tenant's open invoices (one streamed query)."""
+        self.open, self.by_key, self.by_amount = {}, {}, {}
+        self.prefix = _compact(self.db.tenant()['number_prefix'])
+        days = {}  # a few thousand distinct issue days, parsed once each
+        # A million small tuples would set off the cyclic collector hundreds of times over (doubling the
+        # build time) and none of them can be part of a cycle
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            for number, issued, client_name, balance in self.db.iter_open_invoices():
+                day = days.get(issued)
+                if day is None:
+                    day = days[issued] = _issue_day(issued).toordinal()
+                cents = _cents(balance)
+                self.open[number] = (day, cents, client_name)
+                key = number.upper().replace('-', '')
+                self.by_key[key if key.isalnum() else _compact(key)] = number
+                self.by_amount.setdefault(cents, []).append((day, number))
+        finally:
+            if collecting:
+                gc.enable()
+        for entries in self.by_amount.values():
+            entries.sort()
+        self.stats['open_invoices'] = len(self.open)
+
+    def referenced(self, text):
+        """Open invoices whose numbers appear in `text`, in order of appearance."""
+        found = []
+        for match in self.REFERENCE.finditer(text.upper()):
+            letters, groups = match.group(1), re.split(r"[\s\-/_.]+", match.group(2))
+            # The prefix may be glued to preceding narration ("TRFNSEINV..."), and digit groups separated
+            # by spaces may run into other numbers: try the longest prefix first, keep the longest number
+            for prefix in [letters[cut:] for cut in range(max(0, len(letters) - 10), len(letters) - 1)] + [self.prefix]:
+                key, number = prefix + "INV", None
+                for group in groups:
+                    key += group
+                    number = self.by_key.get(key, number)
+                if number:
+                    if number not in found:
+                        found.append(number)
+                    break
+        return found
+
+    def match(self, day, cents, text):
+        """([(invoice_number, cents paid)], how) for a credit line, or (None, reason to review it)."""
+        numbers = self.referenced(text)
+        if len(numbers) == 1:
+            balance = self.open[numbers[0]][1]
+            if cents <= balance:
+                return [(numbers[0], cents)], 'by_reference'
+            return None, f"more than the {balance / 100:,.2f} left on {numbers[0]}"
+        if numbers:
+            if cents == sum(self.open[n][1] for n in numbers):
+                return [(n, self.open[n][1]) for n in numbers], 'by_reference'
+            return None, f"names {', '.join(numbers)} but does not settle them exactly"
+        entries = self.by_amount.get(cents, ())
+        candidates = entries[bisect.bisect_left(entries, (day - self.date_window,)):bisect.bisect_left(entries, (day + 1,))]
+        if len(candidates) == 1:
+            return [(candidates[0][1], cents)], 'by_amount'
+        if not candidates:
+            return None, "no open invoice names or matches it"
+        words = _compact(text)
+        named = [number for _, number in candidates[:self.MAX_CANDIDATES] if _compact(self.open[number][2]) in words]
+        if len(named) == 1:
+            return [(named[0], cents)], 'by_amount'
+        return None, f"{len(candidates)} open invoices of {cents / 100:,.2f} in the date window"
+
+    def settle(self, number, cents):
+        """Take a matched payment off the indexes, so later lines see the invoice's new balance."""
+        day, balance, client_name = self.open[number]
+        entries = self.by_amount[balance]
+        del entries[bisect.bisect_left(entries, (day, number))]
+        if not entries:
+            del self.by_amount[balance]
+        if balance - cents > 0:
+            self.open[number] = (day, balance - cents, client_name)
+            bisect.insort(self.by_amount.setdefault(balance - cents, []), (day, number))
+        else:
+            del self.open[number]
+            del self.by_key[_compact(number)]
+
+    def review(self, line, reason):
+        self.stats['review'] += 1
+        if self.review_path:
+            if self._review is None:
+                self._review = open(self.review_path, 'w', newline='', encoding='utf-8')
+                self._writer = csv.writer(self._review)
+                self._writer.writerow(["line", "date", "amount", "narration", "reference", "reason"])
+            self._writer.writerow([line['line'], line['date'] or '', f"{line['amount']:.2f}", line['narration'], line['reference'], reason])
+
+    def iter_chunks(self, path):
+        """Reconcile `path`, yielding the running stats after each chunk. Step it from an event loop or thread."""
+        started = time.perf_counter()
+        batch_id = f"reconcile-{datetime.now():%Y%m%d%H%M%S}-{os.getpid()}"
+        self.load()
+        seen, chunk = {}, []  # identical lines (two equal transfers on a day) stay distinct payments
+        try:
+            for line in iter_statement_lines(path):
+                self.stats['lines'] += 1
+                key = None
+                if not line['error']:
+                    content = f"{line['date']}|{_cents(line['amount'])}|{line['narration']}|{line['reference']}"
+                    seen[content] = seen.get(content, 0) + 1
+                    key = hashlib.sha1(f"{content}|{seen[content]}".encode('utf-8')).hexdigest()
+                chunk.append((line, key))
+                if len(chunk) >= self.chunk_size:
+                    self._reconcile_chunk(chunk, f"{batch_id}-{self.stats['lines']}")
+                    chunk = []
+                    self.stats['seconds'] = time.perf_counter() - started
+                    yield dict(self.stats)
+            if chunk:
+                self._reconcile_chunk(chunk, f"{batch_id}-{self.stats['lines']}")
+            self.stats['seconds'] = time.perf_counter() - started
+            yield dict(self.stats)
+        finally:
+            if self._review is not None:
+                self._review.close()
+                self._review = None
+            self.db.audit.flush()
+
+    def run(self, path, progress=None):
+        """Reconcile the whole file; `progress(stats)` after each chunk. Returns the final stats."""
+        stats = dict(self.stats)
+        for stats in self.iter_chunks(path):
+            if progress:
+                progress(stats)
+        return stats
+
+    def _reconcile_chunk(self, chunk, batch_id):
+        done = self.db.reconciled_statement_keys([key for _, key in chunk if key])
+        payments, matched = [], []
+        for line, key in chunk:
+            if line['error']:
+                self.review(line, line['error'])
+                continue
+            if key in done:
+                self.stats['skipped'] += 1  # recorded by an earlier run
+                continue
+            paid, how = self.match(line['date'].toordinal(), _cents(line['amount']), f"{line['narration']} {line['reference']}")
+            if paid is None:
+                self.review(line, how)
+                continue
+            first = len(payments)
+            for number, cents in paid:
+                self.settle(number, cents)
+                payments.append((number, cents / 100, line['date'], (line['reference'] or line['narration'])[:100], key))
+            matched.append((line, how, range(first, len(payments))))
+        if not payments:
+            return
+        refused = {}
+        if not self.dry_run:
+            refused, err = self.db.record_statement_payments(payments, batch_id)
+            if refused is None:
+                refused = {idx: f"could not be saved: {err}" for idx in range(len(payments))}
+        for line, how, indexes in matched:
+            reasons = [refused[idx] for idx in indexes if idx in refused]
+            if reasons:
+                self.review(line, "; ".join(reasons))
+                continue
+            self.stats['matched'] += 1
+            self.stats[how] += 1
+            self.stats['payments'] += len(indexes)
+            self.stats['amount'] += sum(payments[idx][1] for idx in indexes)
 
 # =============================================================================
-# 4. GUI APP WITH TABS
+# 9. GUI APP WITH TABS
 # =============================================================================
 
 class InvoiceApp(tb.Window):
@@ -655,14 +6285,42 @@ class InvoiceApp(tb.Window):
         self.resizable(True, True)
         
         self.db = DatabaseManager()
+        # Settings saved from any workstation live in the database; fold them in before building the UI
+        _, error = CONFIG.reload(self.db)
+        if error:
+            log_error("config.reload", "Stored settings were rejected; using file/default settings", error)
+        CONFIG.subscribe(self.on_config_changed)
+        if APP_SETTINGS['tenant'] and not self.db.use_tenant(APP_SETTINGS['tenant']):
+            logger.warning(f"Company/branch {APP_SETTINGS['tenant']!r} not found; using the default company")
         self.current_tab = "component"  # Track current tab
         self.cart = []
         self.quote_cart = []
+        # Both invoice tabs share one currency; the quotation tab has its own
+        self.var_currency = tk.StringVar(value=CURRENCY_SETTINGS['base'])
+        self.var_quote_currency = tk.StringVar(value=CURRENCY_SETTINGS['base'])
+        self.currency_hints = []
         # Dashboard pagination state
         self.dashboard_page = 1
-        self.dashboard_page_size = 25
+        self.dashboard_page_size = APP_SETTINGS['page_size']
+        self.dashboard_last_page = 1
+        # Worker pool for slow jobs (PDF rendering) that must not block the UI thread
+        self.executor = ThreadPoolExecutor(max_workers=APP_SETTINGS['workers'])
+        # One thread, so the change-feed poll's own connection is never shared between threads
+        self.feed_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="change-feed")
+        self.feed_db = None
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.after(AUDIT_SETTINGS['flush_seconds'] * 1000, self.flush_audit_log)
+        # Other users' changes arrive through the change feed; only rows they touch are refreshed
+        self.db.prune_change_feed()
+        self.change_feed_cursor = self.db.latest_change_id()
+        self.after(CHANGE_FEED_SETTINGS['poll_seconds'] * 1000, self.poll_change_feed)
+        # Product catalog for component lookup: read once in the background, then kept current by the change feed
+        self.products = ProductCatalog()
+        self.load_products()
+        self.after(APP_SETTINGS['reload_seconds'] * 1000, self.watch_config_file)
         
         self.setup_ui()
+        self.show_currency_rates()
         self.refresh_invoice_number()
         # Initialize quotation number
         try:
@@ -674,7 +6332,16 @@ class InvoiceApp(tb.Window):
         # Header
         header = tb.Frame(self, bootstyle="secondary")
         header.pack(fill=X, padx=10, pady=10)
+        branch_bar = tb.Frame(header, bootstyle="secondary")
+        branch_bar.pack(side=RIGHT, padx=10)
+        tb.Label(branch_bar, text="Company/Branch:", bootstyle="inverse-secondary").pack(side=LEFT, padx=4)
+        self.var_tenant = tk.StringVar()
+        self.cmb_tenant = ttk.Combobox(branch_bar, textvariable=self.var_tenant, state="readonly", width=32)
+        self.cmb_tenant.pack(side=LEFT)
+        self.cmb_tenant.bind("<<ComboboxSelected>>", lambda e: self.on_tenant_selected())
+        tb.Button(branch_bar, text="Branches...", bootstyle="light-outline", command=self.manage_tenants).pack(side=LEFT, padx=6)
         tb.Label(header, text="NASCOMSOFT INVOICE SYSTEM", font=("Segoe UI", 20, "bold"), bootstyle="inverse-secondary").pack(pady=10)
+        self.refresh_tenant_choices()
 
         # Create Notebook (Tabs)
         self.notebook = ttk.Notebook(self)
@@ -712,6 +6379,7 @@ class InvoiceApp(tb.Window):
         tb.Button(footer, text="Configure Email", bootstyle="secondary", command=self.configure_email_settings).pack(side=LEFT, padx=6)
         tb.Button(footer, text="SEND LAST FILE", bootstyle="info", command=self.send_last_file).pack(side=LEFT, padx=6)
         tb.Button(footer, text="Email Log", bootstyle="outline-info", command=self.show_email_log).pack(side=LEFT, padx=6)
+        tb.Button(footer, text="Diagnostics", bootstyle="outline-secondary", command=self.show_diagnostics).pack(side=LEFT, padx=6)
         tb.Button(footer, text="Delete Selected", bootstyle="danger-outline", command=self.delete_selected_item).pack(side=LEFT, padx=10)
         tb.Button(footer, text="Clear List", bootstyle="secondary-link", command=self.clear_list).pack(side=LEFT)   
 
@@ -756,6 +6424,7 @@ class InvoiceApp(tb.Window):
         tb.Label(details_frame, text="Shipping Cost (N):", font=("Arial", 10)).grid(row=3, column=0, sticky=E, padx=10, pady=8)
         self.var_shipping = tk.DoubleVar(value=0.0)
         tb.Entry(details_frame, textvariable=self.var_shipping, width=18).grid(row=3, column=1, sticky=W, padx=10, pady=8)
+        self.add_currency_field(details_frame, 4, self.var_currency, self.calculate_totals)
 
         # Add Items Section
         item_frame = tb.Labelframe(self.project_frame, text="  Add Project Item  ", bootstyle="warning", padding=20)
@@ -779,7 +6448,14 @@ class InvoiceApp(tb.Window):
         self.var_project_price = tk.DoubleVar(value=0.0)
         tb.Entry(item_frame, textvariable=self.var_project_price, width=15).grid(row=1, column=2, sticky=W+E, padx=10, pady=8)
         
-        tb.Button(item_frame, text="+ ADD ITEM", bootstyle="success", command=self.add_project_item).grid(row=1, column=3, sticky=W+E, padx=10, pady=8)  
+        # What the work is, for the tax rules (WHT rate by service, VAT-exempt services)
+        tb.Label(item_frame, text="Service Type:", font=("Arial", 10)).grid(row=0, column=3, sticky=W, padx=10, pady=8)
+        self.var_project_service = tk.StringVar(value="Project")
+        self.cmb_project_service = ttk.Combobox(item_frame, textvariable=self.var_project_service, values=service_types(),
+                                                state="readonly", width=18)
+        self.cmb_project_service.grid(row=1, column=3, sticky=W+E, padx=10, pady=8)
+        
+        tb.Button(item_frame, text="+ ADD ITEM", bootstyle="success", command=self.add_project_item).grid(row=1, column=4, sticky=W+E, padx=10, pady=8)  
 
         # Items List
         tree_frame = tb.Frame(self.project_frame)
@@ -835,6 +6511,7 @@ class InvoiceApp(tb.Window):
         tb.Label(details_frame, text="Shipping Cost (N):", font=("Arial", 10)).grid(row=2, column=0, sticky=E, padx=10, pady=8)
         self.var_shipping_comp = tk.DoubleVar(value=0.0)
         tb.Entry(details_frame, textvariable=self.var_shipping_comp, width=18).grid(row=2, column=1, sticky=W, padx=10, pady=8)
+        self.add_currency_field(details_frame, 3, self.var_currency, self.calculate_totals)
 
         # Add Items Section (Components)
         item_frame = tb.Labelframe(self.component_frame, text="  Add Component Item  ", bootstyle="warning", padding=20)
@@ -845,9 +6522,21 @@ class InvoiceApp(tb.Window):
         item_frame.columnconfigure(2, minsize=120)
         item_frame.columnconfigure(3, minsize=150)
         
-        tb.Label(item_frame, text="Component Name:", font=("Arial", 10)).grid(row=0, column=0, sticky=W, padx=10, pady=8)
+        tb.Label(item_frame, text="Component Name or SKU:", font=("Arial", 10)).grid(row=0, column=0, sticky=W, padx=10, pady=8)
         self.var_comp_desc = tk.StringVar()
-        tb.Entry(item_frame, textvariable=self.var_comp_desc, width=30).grid(row=1, column=0, sticky=W+E, padx=10, pady=8)
+        self.ent_comp_desc = tb.Entry(item_frame, textvariable=self.var_comp_desc, width=30)
+        self.ent_comp_desc.grid(row=1, column=0, sticky=W+E, padx=10, pady=8)
+        # Catalog matches drop down under the name as it is typed; picking one fills the price and links the line to it
+        self.comp_product = None
+        self.comp_matches = []
+        self.lst_comp_products = tk.Listbox(item_frame, height=8, exportselection=False)
+        self.ent_comp_desc.bind("<KeyRelease>", self.on_comp_desc_typed)
+        self.ent_comp_desc.bind("<Down>", lambda e: self.focus_product_matches())
+        self.ent_comp_desc.bind("<Return>", lambda e: self.pick_product(0))
+        self.ent_comp_desc.bind("<Escape>", lambda e: self.lst_comp_products.grid_remove())
+        self.lst_comp_products.bind("<Return>", lambda e: self.pick_product(self.lst_comp_products.index(tk.ACTIVE)))
+        self.lst_comp_products.bind("<Double-Button-1>", lambda e: self.pick_product(self.lst_comp_products.nearest(e.y)))
+        self.lst_comp_products.bind("<Escape>", lambda e: (self.lst_comp_products.grid_remove(), self.ent_comp_desc.focus_set()))
         
         tb.Label(item_frame, text="Qty/Unit:", font=("Arial", 10)).grid(row=0, column=1, sticky=W, padx=10, pady=8)
         self.var_comp_qty = tk.IntVar(value=1)
@@ -858,6 +6547,7 @@ class InvoiceApp(tb.Window):
         tb.Entry(item_frame, textvariable=self.var_comp_price, width=15).grid(row=1, column=2, sticky=W+E, padx=10, pady=8)
         
         tb.Button(item_frame, text="+ ADD ITEM", bootstyle="success", command=self.add_component_item).grid(row=1, column=3, sticky=W+E, padx=10, pady=8)
+        tb.Button(item_frame, text="Products...", bootstyle="info-outline", command=self.manage_products).grid(row=1, column=4, sticky=W, padx=10, pady=8)
 
         # Items List
         tree_frame = tb.Frame(self.component_frame)
@@ -878,6 +6568,28 @@ class InvoiceApp(tb.Window):
         self.tree_comp.column("total", width=140, anchor=E)
         self.tree_comp.pack(fill=BOTH, expand=True)
 
+    def add_currency_field(self, frame, row, variable, on_change):
+        """Currency picker on a details grid row, with the rate the document would be saved at beside it.
+        Prices are entered in the chosen currency."""
+        tb.Label(frame, text="Currency:", font=("Arial", 10)).grid(row=row, column=0, sticky=E, padx=10, pady=8)
+        combo = ttk.Combobox(frame, textvariable=variable, values=list(CURRENCIES), state="readonly", width=16)
+        combo.grid(row=row, column=1, sticky=W, padx=10, pady=8)
+        hint = tb.Label(frame, text="", font=("Arial", 8), bootstyle="info")
+        hint.grid(row=row, column=2, columnspan=2, sticky=W, padx=10, pady=8)
+        combo.bind("<<ComboboxSelected>>", lambda e: (self.show_currency_rates(), on_change()))
+        self.currency_hints.append((variable, hint))
+
+    def show_currency_rates(self):
+        """Refresh the rate shown beside each currency picker (today's, from the shared rate cache)."""
+        for variable, hint in self.currency_hints:
+            currency = variable.get()
+            if currency == CURRENCY_SETTINGS['base']:
+                hint.config(text="")
+                continue
+            rate, day = self.db.exchange_rate(currency)
+            hint.config(text=f"1 {currency} = {format_money(rate)} (rate of {day:%d-%b-%Y})" if rate is not None
+                        else f"No {currency} rate entered; see Rates... on the Dashboard")
+
     def setup_quotation(self):
         # Quote Client Section
         details_frame = tb.Labelframe(self.quotation_frame, text="  Quotation Information  ", bootstyle="info", padding=20)
@@ -894,13 +6606,22 @@ class InvoiceApp(tb.Window):
         self.var_quote_client = tk.StringVar()
         tb.Entry(details_frame, textvariable=self.var_quote_client, width=35).grid(row=0, column=3, sticky=W, padx=10, pady=8)
 
+        tb.Label(details_frame, text="Client Email:", font=("Arial", 10)).grid(row=0, column=4, sticky=E, padx=10, pady=8)
+        self.var_quote_email = tk.StringVar()
+        tb.Entry(details_frame, textvariable=self.var_quote_email, width=30).grid(row=0, column=5, sticky=W, padx=10, pady=8)
+
         tb.Label(details_frame, text="Client Address:", font=("Arial", 10)).grid(row=1, column=0, sticky=NE, padx=10, pady=8)
         self.var_quote_address = tk.Text(details_frame, height=2, width=35, wrap="word")
         self.var_quote_address.grid(row=1, column=1, columnspan=3, sticky=W+N, padx=10, pady=8)
 
+        # Auto-send toggle
+        self.var_auto_send_quote = tk.BooleanVar(value=False)
+        tb.Checkbutton(details_frame, text="Send to client after generating", variable=self.var_auto_send_quote).grid(row=2, column=2, columnspan=3, sticky=W, padx=10, pady=2)
+
         tb.Label(details_frame, text="Shipping Cost (N):", font=("Arial", 10)).grid(row=2, column=0, sticky=E, padx=10, pady=8)
         self.var_quote_shipping = tk.DoubleVar(value=0.0)
         tb.Entry(details_frame, textvariable=self.var_quote_shipping, width=18).grid(row=2, column=1, sticky=W, padx=10, pady=8)
+        self.add_currency_field(details_frame, 3, self.var_quote_currency, self.calculate_quote_totals)
 
         # Add Items Section
         item_frame = tb.Labelframe(self.quotation_frame, text="  Add Quotation Item  ", bootstyle="warning", padding=20)
@@ -965,21 +6686,27 @@ class InvoiceApp(tb.Window):
 
         sn = str(len(self.quote_cart) + 1)
         total = price * qty
-        self.quote_cart.append({"sn": sn, "desc": desc, "type": "Quotation", "qty": qty, "price": price, "total": total})
-        self.tree_quote.insert("", "end", values=(sn, desc, qty, f"{price:,.2f}", f"{total:,.2f}"))
+        item = {"sn": sn, "desc": desc, "type": "Quotation", "qty": qty, "price": price, "total": total}
+        shown = self.price_line(item, self.var_quote_client.get(), self.var_quote_currency.get())
+        self.quote_cart.append(item)
+        self.tree_quote.insert("", "end", values=(sn, shown, qty, f"{item['price']:,.2f}", f"{item['total']:,.2f}"))
         self.calculate_quote_totals()
 
         self.var_quote_desc.set("")
         self.var_quote_price.set(0.0)
         self.var_quote_qty.set(1)
 
+    def price_line(self, item, client_name, currency=None):
+        """Apply the price rules to a line as it is added to a cart (the price typed or picked is its list
+        price); returns the description to show for it, naming the rule that discounted it."""
+        self.db.price_items([item], client_name.strip(), currency or self.var_currency.get())
+        return f"{item['desc']}  [{item['price_rule']}]" if item.get('price_rule') else item['desc']
+
     def calculate_quote_totals(self):
-        subtotal = sum(item['total'] for item in self.quote_cart)
-        vat = subtotal * COMPANY_CONFIG['vat_rate']
-        shipping = self.var_quote_shipping.get()
-        grand_total = subtotal + vat + shipping
-        self.lbl_quote_total.config(text=f"Quote Total: N{grand_total:,.2f}")
-        return subtotal, vat, shipping, grand_total
+        currency = self.var_quote_currency.get()
+        totals = document_totals(self.quote_cart, self.var_quote_shipping.get(), 0.0, currency)
+        self.lbl_quote_total.config(text=f"Quote Total: {format_money(totals['grand_total'], currency)}")
+        return totals
 
     def clear_quote(self):
         self.quote_cart = []
@@ -1005,7 +6732,7 @@ class InvoiceApp(tb.Window):
             messagebox.showerror("Error", "Client Name is required.")
             return
 
-        subtotal, vat, shipping, grand_total = self.calculate_quote_totals()
+        totals = self.calculate_quote_totals()
         quote_no = self.var_quote_no.get()
 
         quote_data = {
@@ -1013,20 +6740,21 @@ class InvoiceApp(tb.Window):
             "client_name": client_name,
             "client_email": self.var_quote_email.get().strip(),
             "client_address": client_addr,
-            "subtotal": subtotal,
-            "vat": vat,
-            "shipping": shipping,
-            "grand_total": grand_total
+            "subtotal": totals['subtotal'],
+            "vat": totals['vat'],
+            "shipping": totals['shipping'],
+            "grand_total": totals['grand_total'],
+            "taxes": totals['taxes'],
+            "discount": totals['discount'],
+            "currency": self.var_quote_currency.get()
         }
 
-        if self.db.save_quotation(quote_data):
+        if self.db.save_quotation(quote_data, self.quote_cart, renumber=True):
+            # Another user may have taken the previewed number; show the one actually saved
+            self.var_quote_no.set(quote_data['quote_no'])
             try:
                 filename = f"Quotation_{quote_data['quote_no']}.pdf"
-                pdf = InvoicePDF(filename)
-                pdf.draw_header(quote_data['quote_no'], datetime.now().strftime("%d-%b-%Y"), doc_type="QUOTATION")
-                pdf.draw_client_info(quote_data['client_name'], quote_data['client_address'])
-                pdf.draw_items_table(self.quote_cart)
-                pdf.draw_footer(quote_data)
+                render_document_pdf(filename, quote_data, self.quote_cart, doc_type="QUOTATION", letterhead=self.db.letterhead())
 
                 # remember last file for optional sending
                 self.last_generated_file = filename
@@ -1061,6 +6789,8 @@ class InvoiceApp(tb.Window):
                 self.refresh_quote_number()
             except Exception as e:
                 messagebox.showerror("PDF Error", f"An error occurred while generating the PDF: {e}")
+        elif quote_data.get('missing_rate'):
+            messagebox.showerror("No Exchange Rate", f"The quotation was not saved.\n{quote_data['missing_rate']}")
 
 
 
@@ -1079,26 +6809,78 @@ class InvoiceApp(tb.Window):
 
         tb.Label(top, text="Type:", font=("Arial", 10)).grid(row=0, column=4, sticky=E, padx=8)
         self.var_dash_type = tk.StringVar(value="All")
-        tb.Combobox(top, values=["All", "Project", "Component", "Quotation"], textvariable=self.var_dash_type, width=14, state="readonly").grid(row=0, column=5, sticky=W, padx=8)
+        tb.Combobox(top, values=["All", "Project", "Component", "Quotation", "Archived"], textvariable=self.var_dash_type, width=14, state="readonly").grid(row=0, column=5, sticky=W, padx=8)
 
         tb.Button(top, text="Search", bootstyle="primary", command=self.on_dashboard_search).grid(row=0, column=6, sticky=W, padx=6)
         tb.Button(top, text="Refresh", bootstyle="secondary", command=lambda: self.load_dashboard_data(1)).grid(row=0, column=7, sticky=W, padx=6)
 
+        # Row 1: Date range (presets fill the From/To boxes; edit them directly for a custom range)
+        tb.Label(top, text="Period:", font=("Arial", 10)).grid(row=1, column=0, sticky=E, padx=8, pady=(6, 0))
+        self.var_dash_period = tk.StringVar(value="Any time")
+        period_box = tb.Combobox(top, values=DASHBOARD_PERIODS, textvariable=self.var_dash_period, width=16, state="readonly")
+        period_box.grid(row=1, column=1, sticky=W, padx=8, pady=(6, 0))
+        period_box.bind("<<ComboboxSelected>>", lambda e: self.on_dashboard_period())
+
+        tb.Label(top, text="From (YYYY-MM-DD):", font=("Arial", 10)).grid(row=1, column=2, sticky=E, padx=8, pady=(6, 0))
+        self.var_dash_from = tk.StringVar()
+        tb.Entry(top, textvariable=self.var_dash_from, width=14).grid(row=1, column=3, sticky=W, padx=8, pady=(6, 0))
+        tb.Label(top, text="To:", font=("Arial", 10)).grid(row=1, column=4, sticky=E, padx=8, pady=(6, 0))
+        self.var_dash_to = tk.StringVar()
+        tb.Entry(top, textvariable=self.var_dash_to, width=14).grid(row=1, column=5, sticky=W, padx=8, pady=(6, 0))
+        tb.Label(top, text="Balance:", font=("Arial", 10)).grid(row=1, column=6, sticky=E, padx=8, pady=(6, 0))
+        self.var_dash_balance = tk.StringVar(value="All")
+        balance_box = tb.Combobox(top, values=BALANCE_FILTERS, textvariable=self.var_dash_balance, width=12, state="readonly")
+        balance_box.grid(row=1, column=7, sticky=W, padx=8, pady=(6, 0))
+        balance_box.bind("<<ComboboxSelected>>", lambda e: self.load_dashboard_data(1))
+
+        # Summary strip: totals for everything matching the current filter, not just this page
+        summary = tb.Frame(self.dashboard_frame, padding=(10, 0))
+        summary.pack(fill=X, padx=10)
+        self.lbl_dash_summary = tb.Label(summary, text="", font=("Segoe UI", 10, "bold"), bootstyle="info")
+        self.lbl_dash_summary.pack(side=LEFT, padx=8)
+        self.lbl_low_stock = tb.Label(summary, text="", font=("Segoe UI", 10, "bold"), bootstyle="danger", cursor="hand2")
+        self.lbl_low_stock.pack(side=RIGHT, padx=8)
+        self.lbl_low_stock.bind("<Button-1>", lambda e: self.manage_stock())
+
         # Actions
         actions = tb.Frame(self.dashboard_frame, padding=8)
         actions.pack(fill=X, padx=10)
         tb.Button(actions, text="Open PDF", bootstyle="info-outline", command=self.open_selected_invoice_pdf).pack(side=LEFT, padx=6)
         tb.Button(actions, text="Export CSV", bootstyle="success-outline", command=self.export_dashboard_csv).pack(side=LEFT, padx=6)
         tb.Button(actions, text="Delete Invoice", bootstyle="danger-outline", command=self.delete_selected_invoice).pack(side=LEFT, padx=6)
-
-        # Treeview
-        tree_frame = tb.Frame(self.dashboard_frame)
-        tree_frame.pack(fill=BOTH, expand=True, padx=10, pady=6)
-
-        cols = ("invoice_no", "date", "client", "type", "subtotal", "vat", "shipping", "wht", "grand_total")
+        tb.Button(actions, text="Convert to Invoice", bootstyle="warning-outline", command=self.convert_selected_quotations).pack(side=LEFT, padx=6)
+        tb.Button(actions, text="History", bootstyle="info-outline", command=self.show_document_history).pack(side=LEFT, padx=6)
+        tb.Button(actions, text="Statement...", bootstyle="info-outline", command=self.generate_statement).pack(side=LEFT, padx=6)
+        tb.Button(actions, text="Payments...", bootstyle="success-outline", command=self.manage_payments).pack(side=LEFT, padx=6)
+        tb.Button(actions, text="Credit / Amend...", bootstyle="warning-outline", command=self.manage_invoice_notes).pack(side=LEFT, padx=6)
+        tb.Button(actions, text="Aging...", bootstyle="info-outline", command=self.show_aging_report).pack(side=LEFT, padx=6)
+        tb.Button(actions, text="Import...", bootstyle="success-outline", command=self.import_invoices).pack(side=LEFT, padx=6)
+        tb.Button(actions, text="Reconcile...", bootstyle="success-outline", command=self.reconcile_statement).pack(side=LEFT, padx=6)
+        tb.Button(actions, text="Stock...", bootstyle="info-outline", command=self.manage_stock).pack(side=LEFT, padx=6)
+        tb.Button(actions, text="Rates...", bootstyle="info-outline", command=self.manage_rates).pack(side=LEFT, padx=6)
+        tb.Button(actions, text="Prices...", bootstyle="info-outline", command=self.manage_price_rules).pack(side=LEFT, padx=6)
+        tb.Button(actions, text="Archive Old...", bootstyle="secondary-outline", command=self.run_archive_job).pack(side=LEFT, padx=6)
+        tb.Button(actions, text="Restore Archived", bootstyle="secondary-outline", command=self.restore_selected_archived).pack(side=LEFT, padx=6)
+
+        # Treeview with the preview pane on its right
+        body = tb.Frame(self.dashboard_frame)
+        body.pack(fill=BOTH, expand=True, padx=10, pady=6)
+        preview_frame = tb.Labelframe(body, text="Preview", padding=6)
+        preview_frame.pack(side=RIGHT, fill=Y, padx=(6, 0))
+        self.preview_label = tb.Label(preview_frame, text="Select a document to preview", anchor=CENTER,
+                                      width=PDF_SETTINGS['preview_width'] // 8)
+        self.preview_label.pack(fill=BOTH, expand=True)
+        self.preview_photo = None
+        self.preview_key = None
+        self.preview_cache = PreviewCache(self.executor)
+        tree_frame = tb.Frame(body)
+        tree_frame.pack(side=LEFT, fill=BOTH, expand=True)
+
+        cols = ("invoice_no", "date", "client", "type", "subtotal", "vat", "shipping", "wht", "grand_total", "balance_due",
+                "currency")
         self.dashboard_tree = ttk.Treeview(tree_frame, columns=cols, show="headings", height=18)
-        headings = ["Invoice #", "Date", "Client", "Type", "Subtotal", "VAT", "Shipping", "WHT", "Grand Total"]
-        widths = [120, 140, 260, 80, 90, 90, 90, 80, 110]
+        headings = DASHBOARD_HEADINGS
+        widths = [120, 140, 240, 80, 90, 90, 90, 80, 110, 110, 70]
         for col, h, w in zip(cols, headings, widths):
             self.dashboard_tree.heading(col, text=h)
             self.dashboard_tree.column(col, width=w, anchor=W)
@@ -1108,13 +6890,15 @@ class InvoiceApp(tb.Window):
         self.dashboard_tree.column("shipping", anchor=E)
         self.dashboard_tree.column("wht", anchor=E)
         self.dashboard_tree.column("grand_total", anchor=E)
+        self.dashboard_tree.column("balance_due", anchor=E)
 
         # Add striped rows tags
         self.dashboard_tree.tag_configure('oddrow', background='#f6f8fa')
         self.dashboard_tree.tag_configure('evenrow', background='white')
 
         self.dashboard_tree.pack(fill=BOTH, expand=True)
-        # Double-click to open
+        # Selecting a row previews it in-app; double-click opens the PDF (re-rendered if missing)
+        self.dashboard_tree.bind("<<TreeviewSelect>>", lambda e: self.on_dashboard_select())
         self.dashboard_tree.bind("<Double-1>", lambda e: self.open_selected_invoice_pdf())
 
         # Pagination controls
@@ -1127,115 +6911,996 @@ class InvoiceApp(tb.Window):
 
         # Load initial data
         self.load_dashboard_data(self.dashboard_page)
+        self.refresh_low_stock()
 
-    def load_dashboard_data(self, page=1):
-        self.dashboard_page = page
+    def dashboard_filters(self):
+        """Current dashboard filter values with dates parsed; raises ValueError on a malformed date."""
         filters = {
             'invoice_no': self.var_dash_inv.get().strip() if hasattr(self, 'var_dash_inv') else '',
             'client_name': self.var_dash_client.get().strip() if hasattr(self, 'var_dash_client') else '',
-            'invoice_type': self.var_dash_type.get().strip() if hasattr(self, 'var_dash_type') else 'All'
+            'invoice_type': self.var_dash_type.get().strip() if hasattr(self, 'var_dash_type') else 'All',
+            'date_from': self.var_dash_from.get().strip() if hasattr(self, 'var_dash_from') else '',
+            'date_to': self.var_dash_to.get().strip() if hasattr(self, 'var_dash_to') else '',
+            'balance': self.var_dash_balance.get() if hasattr(self, 'var_dash_balance') else 'All'
         }
-        # Note: date_from/date_to not implemented yet
-        # Decide whether to load invoices, quotations or both
+        for key in ('date_from', 'date_to'):
+            if filters[key]:
+                filters[key] = datetime.strptime(filters[key], "%Y-%m-%d").date()
+        return filters
+
+    def dashboard_kinds(self, filters):
+        """The document kinds the dashboard lists for the type filter, in display order."""
         doc_type = filters.get('invoice_type', 'All')
-        rows = []
+        kinds = []
+        if doc_type == 'Archived':
+            kinds.append('archive')
         if doc_type in (None, 'All', 'Project', 'Component'):
-            invoices = self.db.fetch_invoices(filters=filters, page=page, page_size=self.dashboard_page_size)
-            rows.extend(invoices)
-        if doc_type in (None, 'All', 'Quotation'):
-            quotes = self.db.fetch_quotations(filters=filters, page=page, page_size=self.dashboard_page_size)
-            rows.extend(quotes)
+            kinds.append('invoices')
+        if doc_type in (None, 'All', 'Quotation') and filters.get('balance', 'All') == 'All':
+            kinds.append('quotations')  # quotations are never owed, so a balance filter leaves them out
+        return kinds
+
+    def refresh_dashboard_summary(self, filters):
+        labels = {'archive': 'Archived', 'invoices': 'Invoices', 'quotations': 'Quotations'}
+        summaries = {}
+        for kind in self.dashboard_kinds(filters):
+            kind_filters = dict(filters, invoice_type='All') if kind == 'archive' else filters
+            summaries[labels[kind]] = self.db.summarize_documents(kind, kind_filters)
+        # Both kinds are paged side by side, so the longer list decides the last page
+        largest = max((s['count'] for s in summaries.values()), default=0)
+        self.dashboard_last_page = max(1, -(-largest // self.dashboard_page_size))
+        self.lbl_dash_page.config(text=f"Page {self.dashboard_page} of {self.dashboard_last_page}")
+        self.lbl_dash_summary.config(text=dashboard_summary_text(summaries))
+
+    def load_dashboard_data(self, page=1):
+        try:
+            filters = self.dashboard_filters()
+        except ValueError:
+            messagebox.showwarning("Invalid date", "Dates must be in YYYY-MM-DD format.")
+            return
+        self.dashboard_page = page
+        # Decide whether to load invoices, quotations or both
+        rows = []
+        for kind in self.dashboard_kinds(filters):
+            if kind == 'archive':
+                rows.extend(self.db.fetch_archived(filters=dict(filters, invoice_type='All'), page=page, page_size=self.dashboard_page_size))
+            elif kind == 'invoices':
+                rows.extend(self.db.fetch_invoices(filters=filters, page=page, page_size=self.dashboard_page_size))
+            else:
+                rows.extend(self.db.fetch_quotations(filters=filters, page=page, page_size=self.dashboard_page_size))
 
         # Clear tree
         for r in self.dashboard_tree.get_children():
             self.dashboard_tree.delete(r)
-        # Insert rows
+        # Insert rows; item ids are "kind:number" so change-feed updates can find them
+        self.dashboard_versions = {}
+        archived = self.var_dash_type.get() == 'Archived'
         for idx, inv in enumerate(rows):
             tag = 'evenrow' if idx % 2 == 0 else 'oddrow'
-            self.dashboard_tree.insert('', 'end', values=(inv['invoice_no'], inv['date_issued'], inv['client_name'], inv['invoice_type'], f"{COMPANY_CONFIG['currency_symbol']}{inv['subtotal']:,.2f}", f"{COMPANY_CONFIG['currency_symbol']}{inv['vat']:,.2f}", f"{COMPANY_CONFIG['currency_symbol']}{inv['shipping']:,.2f}", f"{COMPANY_CONFIG['currency_symbol']}{inv['wht']:,.2f}", f"{COMPANY_CONFIG['currency_symbol']}{inv['grand_total']:,.2f}"), tags=(tag,))
-        self.lbl_dash_page.config(text=f"Page {self.dashboard_page}")
+            kind = 'archive' if archived else ('quotations' if inv['invoice_type'] == 'Quotation' else 'invoices')
+            iid = self.dashboard_iid(kind, inv['invoice_no'])
+            if self.dashboard_tree.exists(iid):
+                continue
+            self.dashboard_tree.insert('', 'end', iid=iid, values=dashboard_row_values(inv), tags=(tag,))
+            self.dashboard_versions[iid] = inv['version']
+        self.refresh_dashboard_summary(filters)
+
+    @staticmethod
+    def dashboard_iid(kind, number):
+        return f"{kind}:{number}"
+
+    def poll_change_feed(self):
+        """Apply other users' committed changes to the visible page, then re-arm.
+
+        The feed, the caches it names and the changed documents' rows are read on the change-feed
+        worker with its own connection (see read_change_feed); only the tree update runs here. The page
+        is not reloaded unless a change could shift rows between pages (a create or restore while not on
+        page 1 leaves it alone)."""
+        try:
+            filters = self.dashboard_filters()
+        except ValueError:
+            filters = None  # half-typed date filter; the next search reloads everything anyway
+        tenant_id = self.db.tenant_id
+        future = self.feed_executor.submit(self.read_change_feed, tenant_id, self.change_feed_cursor,
+                                           filters, self.dashboard_kinds(filters) if filters is not None else ())
+
+        def finished():
+            try:
+                changes, rows, low_stock = future.result()
+                if changes:
+                    self.change_feed_cursor = changes[-1][0]
+                    if tenant_id == self.db.tenant_id:  # a branch switched meanwhile has reloaded everything itself
+                        if any(kind == 'rates' for _, kind, _, _ in changes):
+                            self.show_currency_rates()
+                        if low_stock is not None:
+                            self.show_low_stock(low_stock)
+                        if filters is not None:
+                            self.apply_dashboard_changes(changes, filters, rows)
+            except Exception as e:
+                log_error("gui.change_feed", "Dashboard update failed", e)
+            self.after(CHANGE_FEED_SETTINGS['poll_seconds'] * 1000, self.poll_change_feed)
+
+        self.run_when_done([future], finished)
+
+    def read_change_feed(self, tenant_id, after_id, filters, kinds):
+        """Runs on the change-feed worker: (changes, {(kind, number): dashboard row or None}, low-stock list
+        or None) for everything committed after `after_id`. The worker is a single thread, so its
+        DatabaseManager (and connection) is opened once and only ever used from that thread."""
+        if self.feed_db is None:
+            self.feed_db = DatabaseManager()
+        db = self.feed_db
+        db.tenant_id = tenant_id
+        changes = db.fetch_changes(after_id)
+        if not changes:
+            return changes, {}, None
+        if self.products.loaded_at is not None:
+            self.products.apply_changes(db, changes)
+        if PRICE_RULES.loaded_at is not None:
+            PRICE_RULES.apply_changes(db, changes)
+        if EXCHANGE_RATES.loaded_at is not None and any(kind == 'rates' for _, kind, _, _ in changes):
+            EXCHANGE_RATES.apply_changes(db, changes)
+        low_stock = db.fetch_low_stock() if any(kind in ('stock', 'products') for _, kind, _, _ in changes) else None
+        latest = OrderedDict()
+        for _, kind, number, action in changes:
+            latest[(kind, number)] = action
+        rows = {}
+        if not any(kind == 'invoices' and action in ('import', 'reconcile') for _, kind, _, action in changes):
+            for (kind, number), action in latest.items():
+                if kind in kinds and action not in ('delete', 'archive'):
+                    rows[(kind, number)] = db.fetch_dashboard_row(kind, number, filters)
+        return changes, rows, low_stock
+
+    def apply_dashboard_changes(self, changes, filters=None, rows=None):
+        """Patch the visible page for `changes`. `rows` holds dashboard rows already read for them (by the
+        change-feed worker); without it the rows are read here, which is only done for this user's own saves."""
+        if filters is None:
+            try:
+                filters = self.dashboard_filters()
+            except ValueError:
+                return  # half-typed date filter; the next search reloads everything anyway
+        kinds = self.dashboard_kinds(filters)
+        # Latest action per document: a create followed by a delete needs only the delete
+        touched = OrderedDict()
+        if any(kind == 'settings' for _, kind, _, _ in changes):
+            # Another workstation saved settings; take them (on_config_changed refreshes what depends on them)
+            self.reload_config(self.db)
+        if any(kind == 'tenants' for _, kind, _, _ in changes):
+            self.on_tenants_changed()
+        if any(kind == 'invoices' and action in ('import', 'reconcile') for _, kind, _, action in changes):
+            # A bulk import or reconciliation touches far too many rows to patch in one at a time
+            self.db.invalidate_summaries()
+            self.load_dashboard_data(self.dashboard_page)
+            return
+        for _, kind, number, action in changes:
+            touched.pop((kind, number), None)
+            touched[(kind, number)] = action
+        tree = self.dashboard_tree
+        changed = False
+        for (kind, number), action in touched.items():
+            if action in ('delete', 'archive'):
+                self.preview_cache.discard((kind, number))
+            if kind not in kinds:
+                continue
+            changed = True
+            iid = self.dashboard_iid(kind, number)
+            if action in ('delete', 'archive'):
+                row = None
+            elif rows is not None:
+                row = rows.get((kind, number))
+            else:
+                row = self.db.fetch_dashboard_row(kind, number, filters)
+            if tree.exists(iid):
+                if row is None:
+                    tree.delete(iid)
+                    self.dashboard_versions.pop(iid, None)
+                elif row['version'] != self.dashboard_versions.get(iid):
+                    tree.item(iid, values=dashboard_row_values(row))
+                    self.dashboard_versions[iid] = row['version']
+                    self.preview_cache.discard((kind, number))
+            elif row is not None and self.dashboard_page == 1:
+                # Newest first, so new documents belong at the top of page 1
+                tree.insert('', 0, iid=iid, values=dashboard_row_values(row))
+                self.dashboard_versions[iid] = row['version']
+        if not changed:
+            return
+        children = tree.get_children()
+        for iid in children[self.dashboard_page_size * len(kinds):]:
+            tree.delete(iid)
+            self.dashboard_versions.pop(iid, None)
+        for idx, iid in enumerate(tree.get_children()):
+            tree.item(iid, tags=('evenrow' if idx % 2 == 0 else 'oddrow',))
+        self.db.invalidate_summaries()
+        self.refresh_dashboard_summary(filters)
+
+    def on_dashboard_search(self):
+        self.load_dashboard_data(1)
+
+    def on_dashboard_period(self):
+        date_from, date_to = period_range(self.var_dash_period.get())
+        if self.var_dash_period.get() != "Custom":
+            self.var_dash_from.set(date_from.isoformat() if date_from else "")
+            self.var_dash_to.set(date_to.isoformat() if date_to else "")
+            self.load_dashboard_data(1)
+
+    def dashboard_row_key(self, item):
+        """(kind, number) for a dashboard tree item, or None for archived rows (not in the live tables)."""
+        if self.var_dash_type.get() == 'Archived':
+            return None
+        row = self.dashboard_tree.item(item, 'values')
+        if not row:
+            return None
+        return ('quotations' if len(row) > 3 and row[3] == 'Quotation' else 'invoices', row[0])
+
+    def on_dashboard_select(self):
+        sel = self.dashboard_tree.selection()
+        if not sel:
+            return
+        item = sel[0]
+        key = self.dashboard_row_key(item)
+        self.preview_key = key
+        if key is None:
+            self.preview_label.config(image='', text="Restore archived documents to preview them")
+            return
+        self.request_preview(item, show=True)
+        # Prefetch the neighbours so stepping through rows shows them instantly
+        for neighbour in (self.dashboard_tree.prev(item), self.dashboard_tree.next(item)):
+            if neighbour:
+                self.request_preview(neighbour)
+
+    def preview_document(self, kind, number):
+        doc = self.db.fetch_document(kind, number)
+        if doc:
+            doc['letterhead'] = self.db.letterhead()
+        return doc
+
+    def request_preview(self, item, show=False):
+        key = self.dashboard_row_key(item)
+        if key is None:
+            return
+        future = self.preview_cache.request(key, lambda: self.preview_document(*key))
+        if not show:
+            return
+        if future is None:
+            self.preview_label.config(image='', text=f"{key[1]} was not found in the database")
+            return
+        if not future.done():
+            self.preview_label.config(image='', text="Rendering preview...")
+
+        def display():
+            if self.preview_key != key:
+                return  # selection moved on while this rendered
+            try:
+                img = future.result()
+            except Exception as e:
+                log_error("pdf.preview", f"Preview of {key[1]} failed", e)
+                self.preview_label.config(image='', text="Preview unavailable")
+                return
+            from PIL import ImageTk
+            self.preview_photo = ImageTk.PhotoImage(img)
+            self.preview_label.config(image=self.preview_photo, text='')
+        self.run_when_done([future], display, interval=30)
+
+    def open_selected_invoice_pdf(self):
+        sel = self.dashboard_tree.selection()
+        if not sel:
+            messagebox.showwarning("No selection", "Select an invoice or quotation to open its PDF.")
+            return
+        row = self.dashboard_tree.item(sel[0], 'values')
+        inv_no = row[0]
+        inv_type = row[3] if len(row) > 3 else 'Project'
+        if inv_type == 'Quotation':
+            filename = f"Quotation_{inv_no}.pdf"
+        else:
+            filename = f"Invoice_{inv_no}.pdf"
+        key = self.dashboard_row_key(sel[0])
+        if not os.path.exists(filename) and key:
+            # Missing on disk (moved, deleted, other machine): rebuild it from the stored record
+            doc = self.db.fetch_document(*key)
+            if doc:
+                try:
+                    render_document_pdf(filename, doc, doc['items'], doc_type="QUOTATION" if key[0] == 'quotations' else "INVOICE",
+                                        date_str=datetime.strptime(_format_timestamp(doc['date_issued'])[:10], "%Y-%m-%d").strftime("%d-%b-%Y"),
+                                        letterhead=self.db.letterhead())
+                except Exception as e:
+                    log_error("pdf.render", f"Could not re-render {filename}", e)
+        self.open_pdf_file(filename)
+
+    def open_pdf_file(self, filename, parent=None):
+        """Open a PDF in the system viewer."""
+        if os.path.exists(filename):
+            try:
+                if os.name == 'nt':
+                    os.startfile(filename)
+                else:
+                    subprocess.run(['open' if sys.platform == 'darwin' else 'xdg-open', filename], check=False)
+            except Exception as e:
+                messagebox.showerror("Open Error", f"Could not open PDF: {e}", parent=parent)
+        else:
+            messagebox.showwarning("Not found", f"PDF {filename} not found on disk.", parent=parent)
+
+    def export_dashboard_csv(self):
+        rows = [self.dashboard_tree.item(i, 'values') for i in self.dashboard_tree.get_children()]
+        if not rows:
+            messagebox.showinfo("No Data", "No rows to export.")
+            return
+        path = filedialog.asksaveasfilename(defaultextension='.csv', filetypes=[('CSV files','*.csv')], initialfile='invoices_export.csv')
+        if not path:
+            return
+        try:
+            write_dashboard_csv(path, rows)
+            messagebox.showinfo("Exported", f"Exported {len(rows)} rows to {path}")
+        except Exception as e:
+            messagebox.showerror("Export Error", f"Could not export CSV: {e}")
+
+    def delete_selected_invoice(self):
+        sel = self.dashboard_tree.selection()
+        if not sel:
+            messagebox.showwarning("No selection", "Select an invoice to delete.")
+            return
+        row = self.dashboard_tree.item(sel[0], 'values')
+        inv_no = row[0]
+        inv_type = row[3] if len(row) > 3 else 'Project'
+        if not messagebox.askyesno("Confirm Delete", f"Delete {inv_type} {inv_no}?\nIt is hidden from the dashboard but kept on record with an audit entry."):
+            return
+        kind = 'quotations' if inv_type == 'Quotation' else 'invoices'
+        # Only delete the version this user is looking at; a concurrent edit or delete wins
+        expected = getattr(self, 'dashboard_versions', {}).get(sel[0])
+        if kind == 'quotations':
+            success = self.db.delete_quotation(inv_no, expected_version=expected)
+        else:
+            success = self.db.delete_invoice(inv_no, expected_version=expected)
+
+        if success:
+            # The PDF stays on disk: soft-deleted tax records keep their rendered copy
+            self.preview_cache.discard((kind, inv_no))
+            messagebox.showinfo("Deleted", f"{inv_type} {inv_no} deleted.")
+            self.load_dashboard_data(self.dashboard_page)
+        elif self.db.fetch_document(kind, inv_no) is None:
+            messagebox.showwarning("Already Deleted", f"{inv_type} {inv_no} was already deleted or archived by another user.")
+            self.load_dashboard_data(self.dashboard_page)
+        elif expected is not None:
+            messagebox.showwarning("Changed", f"{inv_type} {inv_no} was changed by another user. Review it and try again.")
+            self.load_dashboard_data(self.dashboard_page)
+        else:
+            messagebox.showerror("Delete Error", f"Could not delete {inv_type} from DB.")
+
+    def convert_selected_quotations(self):
+        """Ask whether the selected quotations become Project (with WHT) or Component invoices, then convert them all."""
+        quote_nos = []
+        for sel in self.dashboard_tree.selection():
+            row = self.dashboard_tree.item(sel, 'values')
+            if len(row) > 3 and row[3] == 'Quotation':
+                quote_nos.append(row[0])
+        if not quote_nos:
+            messagebox.showwarning("No selection", "Select one or more quotations to convert.")
+            return
+        dlg = tk.Toplevel(self)
+        dlg.title("Convert to Invoice")
+        dlg.transient(self)
+        dlg.grab_set()
+        type_var, wht_var = tk.StringVar(value="Component"), tk.DoubleVar(value=self.var_wht.get())
+        tk.Label(dlg, text=f"Convert {len(quote_nos)} quotation(s) into invoices.").grid(row=0, column=0, columnspan=2, sticky=W, padx=6, pady=6)
+        tk.Label(dlg, text="Invoice type:").grid(row=1, column=0, sticky=E, padx=6, pady=4)
+        ttk.Combobox(dlg, values=("Component", "Project"), textvariable=type_var, state="readonly", width=14).grid(row=1, column=1, sticky=W, padx=6, pady=4)
+        tk.Label(dlg, text="WHT (%):").grid(row=2, column=0, sticky=E, padx=6, pady=4)
+        wht_box = tb.Spinbox(dlg, from_=0, to=10, increment=2.5, textvariable=wht_var, width=14, state=DISABLED)
+        wht_box.grid(row=2, column=1, sticky=W, padx=6, pady=4)
+        # WHT applies to project work only
+        type_var.trace_add('write', lambda *_: wht_box.config(state=NORMAL if type_var.get() == "Project" else DISABLED))
+
+        def convert():
+            try:
+                wht_rate = wht_var.get() if type_var.get() == "Project" else 0.0
+            except tk.TclError:
+                messagebox.showerror("Convert", "Enter the WHT rate as a number.", parent=dlg)
+                return
+            dlg.destroy()
+            self.convert_quotations(quote_nos, type_var.get(), wht_rate)
+
+        buttons = tk.Frame(dlg)
+        buttons.grid(row=3, column=0, columnspan=2, pady=8)
+        tk.Button(buttons, text="Convert", command=convert).pack(side=LEFT, padx=4)
+        tk.Button(buttons, text="Cancel", command=dlg.destroy).pack(side=LEFT, padx=4)
+
+    def convert_quotations(self, quote_nos, invoice_type, wht_rate):
+        """Convert each quotation into an invoice of `invoice_type`; PDFs render in the background."""
+        converted = []
+        errors = []
+        for quote_no in quote_nos:
+            invoice_data, err = self.db.convert_quotation_to_invoice(quote_no, invoice_type, wht_rate)
+            if invoice_data:
+                converted.append(invoice_data)
+            else:
+                errors.append(f"{quote_no}: {err}")
+
+        if converted:
+            letterhead = self.db.letterhead()
+            futures = [
+                self.executor.submit(render_document_pdf, f"Invoice_{inv['invoice_no']}.pdf", inv, inv['items'],
+                                     letterhead=letterhead)
+                for inv in converted
+            ]
+            self.run_when_done(futures, lambda: self.on_conversion_rendered(converted, futures))
+            self.load_dashboard_data(self.dashboard_page)
+            self.refresh_invoice_number()
+        if errors:
+            messagebox.showerror("Convert Error", "Some quotations were not converted:\n" + "\n".join(errors))
+
+    def on_conversion_rendered(self, converted, futures):
+        failed = []
+        for inv, fut in zip(converted, futures):
+            if fut.exception():
+                failed.append(f"{inv['invoice_no']}: {fut.exception()}")
+            else:
+                self.last_generated_file = fut.result()
+        if failed:
+            messagebox.showerror("PDF Error", "Invoices were saved but some PDFs failed to render:\n" + "\n".join(failed))
+        else:
+            created = ", ".join(f"{inv['source_quote']} -> {inv['invoice_no']}" for inv in converted)
+            messagebox.showinfo("Converted", f"Created {len(converted)} invoice(s):\n{created}")
+
+    def reload_config(self, db=None):
+        _, error = CONFIG.reload(db)
+        if error:
+            # Keep running on the last good snapshot; the problem is in the log for whoever edited it
+            log_error("config.reload", "Configuration change rejected", error)
+
+    def watch_config_file(self):
+        """Hot-reload the config file when it is edited, then re-arm."""
+        if CONFIG.file_changed():
+            self.reload_config()
+        self.after(APP_SETTINGS['reload_seconds'] * 1000, self.watch_config_file)
+
+    def on_config_changed(self, snapshot, changed):
+        """Apply a reloaded configuration to the running window."""
+        pending = restart_required(changed)
+        if pending:
+            logger.info(f"Configuration reloaded; restart to apply {', '.join(pending)}")
+        if ('app', 'page_size') in changed:
+            self.dashboard_page_size = snapshot['app']['page_size']
+        if any(section in ('company', 'app') for section, _ in changed):
+            # Currency symbol, VAT rate and page size all show on the dashboard and the entry forms
+            self.load_dashboard_data(1 if ('app', 'page_size') in changed else self.dashboard_page)
+            try:
+                self.calculate_totals()
+                self.calculate_quote_totals()
+            except tk.TclError:
+                pass  # a half-typed shipping amount; totals refresh on the next edit
+        if any(section in ('pdf', 'company') for section, _ in changed):
+            # Letterheads inherit company settings
+            self.preview_cache.clear()
+        if any(section == 'currency' for section, _ in changed):
+            # A new base currency or rate age limit changes which rates apply; re-read them on the next lookup
+            EXCHANGE_RATES.forget()
+            self.show_currency_rates()
+            self.load_dashboard_data(self.dashboard_page)
+        if any(section == 'tax' for section, _ in changed):
+            # tax_rules() recompiles for the new snapshot; carts already entered are re-taxed under it
+            self.cmb_project_service.config(values=service_types())
+            try:
+                self.calculate_totals()
+                self.calculate_quote_totals()
+            except tk.TclError:
+                pass
+
+    def flush_audit_log(self):
+        """Write queued audit events, then re-arm; DB work stays on the UI thread."""
+        self.db.audit.flush()
+        self.after(AUDIT_SETTINGS['flush_seconds'] * 1000, self.flush_audit_log)
+
+    def on_close(self):
+        self.db.audit.flush()
+        self.executor.shutdown(wait=False)
+        self.feed_executor.shutdown(wait=False)
+        self.destroy()
+
+    def run_when_done(self, futures, callback, interval=100):
+        """Poll background futures from the Tk event loop and run `callback` on the UI thread."""
+        if all(f.done() for f in futures):
+            callback()
+        else:
+            self.after(interval, lambda: self.run_when_done(futures, callback, interval))
+
+    def manage_payments(self):
+        """Payments received against the selected invoice: record a (part) payment or void a mistaken one."""
+        sel = self.dashboard_tree.selection()
+        kind, number = (sel and self.dashboard_row_key(sel[0])) or (None, None)
+        if kind != 'invoices':
+            messagebox.showwarning("Payments", "Select an invoice (not a quotation or archived document).")
+            return
+        dlg = tk.Toplevel(self)
+        dlg.title(f"Payments - {number}")
+        dlg.transient(self)
+        dlg.grab_set()
+
+        header = tk.Label(dlg, text="", font=("Segoe UI", 10, "bold"), justify=LEFT)
+        header.grid(row=0, column=0, columnspan=3, sticky=W, padx=6, pady=6)
+        tree = ttk.Treeview(dlg, columns=("paid_at", "amount", "method", "reference", "status"), show="headings", height=8)
+        for col, heading, width in (("paid_at", "Date", 140), ("amount", "Amount", 100), ("method", "Method", 90),
+                                    ("reference", "Reference", 180), ("status", "Status", 140)):
+            tree.heading(col, text=heading)
+            tree.column(col, width=width, anchor=E if col == "amount" else W)
+        tree.grid(row=1, column=0, columnspan=3, padx=6, pady=4)
+
+        amount_var, method_var, ref_var = tk.StringVar(), tk.StringVar(value=PAYMENT_METHODS[0]), tk.StringVar()
+        amount_label = tk.Label(dlg, text="Amount:")
+        amount_label.grid(row=2, column=0, sticky=E, padx=6, pady=4)
+        tk.Entry(dlg, textvariable=amount_var, width=16).grid(row=2, column=1, sticky=W, padx=6, pady=4)
+        tk.Label(dlg, text="Method:").grid(row=3, column=0, sticky=E, padx=6, pady=4)
+        ttk.Combobox(dlg, values=PAYMENT_METHODS, textvariable=method_var, width=14).grid(row=3, column=1, sticky=W, padx=6, pady=4)
+        tk.Label(dlg, text="Reference:").grid(row=4, column=0, sticky=E, padx=6, pady=4)
+        tk.Entry(dlg, textvariable=ref_var, width=30).grid(row=4, column=1, sticky=W, padx=6, pady=4)
+
+        def show():
+            row = self.db.fetch_dashboard_row('invoices', number)
+            if row is None:
+                header.config(text=f"{number} was deleted or archived.")
+                return
+            # Payments are taken in the invoice's own currency
+            cur = row['currency']
+            due, net, adjusted = row['balance_due'] or 0.0, row['grand_total'] - row['wht'], row['adjusted']
+            notes = f"Adjusted {'-' if adjusted < 0 else '+'}{format_money(abs(adjusted), cur)}   " if adjusted else ""
+            header.config(text=f"{number}  {row['client_name']}\nTotal {format_money(row['grand_total'], cur)}   "
+                               f"WHT {format_money(row['wht'], cur)}   {notes}Paid {format_money(net + adjusted - due, cur)}   "
+                               f"Balance due {format_money(due, cur)}")
+            amount_label.config(text=f"Amount ({cur}):")
+            amount_var.set(f"{due:.{currency_places(cur)}f}" if due > 0 else "")
+            tree.delete(*tree.get_children())
+            for payment in self.db.fetch_payments(number):
+                status = f"Voided {payment['voided_at']}" if payment['voided_at'] else "Received"
+                tree.insert('', tk.END, iid=str(payment['id']), values=(payment['paid_at'], format_money(payment['amount'], cur),
+                                                                      payment['method'], payment['reference'], status))
+            self.apply_dashboard_changes([(None, 'invoices', number, 'payment')])
+
+        def record():
+            payment_id, err = self.db.record_payment(number, amount_var.get(), method_var.get(), ref_var.get())
+            if not payment_id:
+                messagebox.showerror("Payments", f"Not recorded:\n{err}", parent=dlg)
+                return
+            ref_var.set("")
+            show()
+
+        def void():
+            selected = tree.selection()
+            if not selected or not messagebox.askyesno("Payments", "Void the selected payment? Its amount becomes owed again.", parent=dlg):
+                return
+            done, err = self.db.void_payment(int(selected[0]))
+            if not done:
+                messagebox.showerror("Payments", err, parent=dlg)
+            show()
+
+        buttons = tk.Frame(dlg)
+        buttons.grid(row=5, column=0, columnspan=3, pady=8)
+        tk.Button(buttons, text="Record Payment", command=record).pack(side=LEFT, padx=4)
+        tk.Button(buttons, text="Void Selected", command=void).pack(side=LEFT, padx=4)
+        show()
+
+    def manage_invoice_notes(self):
+        """Credit notes and amendments for the selected invoice: list them (double-click opens a PDF) and issue a new
+        one from lines copied off the invoice or typed in. The invoice is never edited; its balance moves with the notes."""
+        sel = self.dashboard_tree.selection()
+        kind, number = (sel and self.dashboard_row_key(sel[0])) or (None, None)
+        if kind != 'invoices':
+            messagebox.showwarning("Credit / Amend", "Select an invoice (not a quotation or archived document).")
+            return
+        invoice = self.db.fetch_document('invoices', number)
+        if invoice is None:
+            messagebox.showwarning("Credit / Amend", f"{number} was deleted or archived by another user.")
+            return
+        cur = invoice['currency']
+        labels = {doc_type.title(): note_kind for note_kind, (doc_type, _) in self.db.NOTE_KINDS.items()}
+        dlg = tk.Toplevel(self)
+        dlg.title(f"Credit Notes & Amendments - {number}")
+        dlg.transient(self)
+        dlg.grab_set()
+
+        header = tk.Label(dlg, text="", font=("Segoe UI", 10, "bold"), justify=LEFT)
+        header.grid(row=0, column=0, columnspan=4, sticky=W, padx=6, pady=6)
+        notes = ttk.Treeview(dlg, columns=("note_no", "kind", "date", "change", "reason"), show="headings", height=5)
+        for col, heading, width in (("note_no", "Number", 150), ("kind", "Type", 130), ("date", "Date", 130),
+                                    ("change", "Change to Balance", 120), ("reason", "Reason", 220)):
+            notes.heading(col, text=heading)
+            notes.column(col, width=width, anchor=E if col == "change" else W)
+        notes.grid(row=1, column=0, columnspan=4, padx=6, pady=4)
+
+        tk.Label(dlg, text="Lines (an amendment's may be negative, to take off):").grid(row=2, column=0, columnspan=4, sticky=W, padx=6)
+        lines_tree = ttk.Treeview(dlg, columns=("desc", "qty", "price", "total"), show="headings", height=6)
+        for col, heading, width in (("desc", "Description", 330), ("qty", "Qty", 60), ("price", "Rate", 110), ("total", "Amount", 110)):
+            lines_tree.heading(col, text=heading)
+            lines_tree.column(col, width=width, anchor=W if col == "desc" else E)
+        lines_tree.grid(row=3, column=0, columnspan=4, padx=6, pady=4)
+        lines = []
+
+        desc_var, qty_var, price_var = tk.StringVar(), tk.StringVar(value="1"), tk.StringVar()
+        kind_var, reason_var = tk.StringVar(value=next(iter(labels))), tk.StringVar()
+        entry = tk.Frame(dlg)
+        entry.grid(row=4, column=0, columnspan=4, sticky=W, padx=6, pady=4)
+        tk.Label(entry, text="Description:").pack(side=LEFT)
+        tk.Entry(entry, textvariable=desc_var, width=32).pack(side=LEFT, padx=4)
+        tk.Label(entry, text="Qty:").pack(side=LEFT)
+        tk.Entry(entry, textvariable=qty_var, width=6).pack(side=LEFT, padx=4)
+        tk.Label(entry, text=f"Rate ({cur}):").pack(side=LEFT)
+        tk.Entry(entry, textvariable=price_var, width=12).pack(side=LEFT, padx=4)
+        tk.Label(dlg, text="Type:").grid(row=6, column=0, sticky=E, padx=6, pady=4)
+        ttk.Combobox(dlg, values=list(labels), textvariable=kind_var, width=20, state="readonly").grid(row=6, column=1, sticky=W, padx=6, pady=4)
+        tk.Label(dlg, text="Reason:").grid(row=7, column=0, sticky=E, padx=6, pady=4)
+        tk.Entry(dlg, textvariable=reason_var, width=60).grid(row=7, column=1, columnspan=3, sticky=W, padx=6, pady=4)
+
+        def show():
+            row = self.db.fetch_dashboard_row('invoices', number)
+            if row is None:
+                header.config(text=f"{number} was deleted or archived.")
+                return
+            adjusted = row['adjusted']
+            header.config(text=f"{number}  {row['client_name']}\nTotal {format_money(row['grand_total'], cur)}   "
+                               f"Adjusted {'-' if adjusted < 0 else '+'}{format_money(abs(adjusted), cur)}   "
+                               f"Balance due {format_money(row['balance_due'] or 0.0, cur)}")
+            notes.delete(*notes.get_children())
+            for note in self.db.fetch_invoice_notes(number):
+                change = note['adjustment']
+                notes.insert('', tk.END, iid=note['note_no'], values=(
+                    note['note_no'], self.db.NOTE_KINDS[note['note_kind']][0].title(), _format_timestamp(note['date_issued']),
+                    f"{'-' if change < 0 else '+'}{format_money(abs(change), cur)}", note['reason']))
+            self.apply_dashboard_changes([(None, 'invoices', number, 'adjust')])
+
+        def show_lines():
+            lines_tree.delete(*lines_tree.get_children())
+            for idx, line in enumerate(lines):
+                lines_tree.insert('', tk.END, iid=str(idx), values=(line['desc'], line['qty'], format_money(line['price'], cur),
+                                                                    format_money(line['qty'] * line['price'], cur)))
+
+        def add_line():
+            try:
+                qty, price = int(qty_var.get()), parse_amount(price_var.get(), "rate")
+            except ValueError:
+                messagebox.showwarning("Credit / Amend", "The quantity must be a whole number and the rate a number.", parent=dlg)
+                return
+            lines.append({'desc': desc_var.get().strip(), 'qty': qty, 'price': price, 'type': invoice['invoice_type']})
+            desc_var.set("")
+            price_var.set("")
+            show_lines()
+
+        def copy_lines():
+            lines.extend({'desc': item['desc'], 'qty': item['qty'], 'price': item['price'], 'type': item['type'],
+                          'product_id': item.get('product_id')} for item in invoice['items'])
+            show_lines()
+
+        def remove_line():
+            for iid in sorted(lines_tree.selection(), key=int, reverse=True):
+                del lines[int(iid)]
+            show_lines()
+
+        def render(note, filename, doc_type):
+            render_document_pdf(filename, note, note['items'], doc_type=doc_type,
+                                date_str=datetime.strptime(_format_timestamp(note['date_issued'])[:10], "%Y-%m-%d").strftime("%d-%b-%Y"),
+                                letterhead=self.db.letterhead())
+
+        def issue():
+            label = kind_var.get()
+            if not messagebox.askyesno("Credit / Amend", f"Issue a {label.lower()} against {number}? It cannot be withdrawn.", parent=dlg):
+                return
+            note, err = self.db.issue_invoice_note(labels[label], number, lines, reason_var.get())
+            if not note:
+                messagebox.showerror("Credit / Amend", f"Not issued:\n{err}", parent=dlg)
+                return
+            doc_type, filename = note_pdf(note)
+            try:
+                render(note, filename, doc_type)
+            except Exception as e:
+                log_error("pdf.render", f"Could not render {filename}", e)
+            lines.clear()
+            reason_var.set("")
+            show_lines()
+            show()
+            messagebox.showinfo("Credit / Amend", f"{label} {note['note_no']} issued ({filename}).\n"
+                                f"{number} now has {format_money(note['balance_due'], cur)} left to pay.", parent=dlg)
+
+        def open_note(_event=None):
+            selected = notes.selection()
+            if not selected:
+                return
+            note = self.db.fetch_invoice_note(selected[0])
+            if note is None:
+                return
+            doc_type, filename = note_pdf(note)
+            if not os.path.exists(filename):
+                try:
+                    render(note, filename, doc_type)
+                except Exception as e:
+                    log_error("pdf.render", f"Could not re-render {filename}", e)
+            self.open_pdf_file(filename, parent=dlg)
+
+        notes.bind("<Double-1>", open_note)
+        line_buttons = tk.Frame(dlg)
+        line_buttons.grid(row=5, column=0, columnspan=4, sticky=W, padx=6)
+        tk.Button(line_buttons, text="Add Line", command=add_line).pack(side=LEFT, padx=4)
+        tk.Button(line_buttons, text="Copy Invoice Lines", command=copy_lines).pack(side=LEFT, padx=4)
+        tk.Button(line_buttons, text="Remove Selected", command=remove_line).pack(side=LEFT, padx=4)
+        buttons = tk.Frame(dlg)
+        buttons.grid(row=8, column=0, columnspan=4, pady=8)
+        tk.Button(buttons, text="Issue", command=issue).pack(side=LEFT, padx=4)
+        tk.Button(buttons, text="Open PDF", command=open_note).pack(side=LEFT, padx=4)
+        show()
+
+    def show_aging_report(self):
+        """Receivables aging for the current company/branch: totals per bucket and per client, from the
+        pre-aggregated receivables tables (in the base currency). Double-click a client to list their unpaid invoices."""
+        dlg = tk.Toplevel(self)
+        dlg.title(f"Receivables Aging - {date.today():%Y-%m-%d}")
+        dlg.transient(self)
+
+        summary = self.db.aging_summary()
+        totals = tk.Label(dlg, font=("Segoe UI", 10, "bold"), justify=LEFT, text="   ".join(
+            f"{label} days: {format_money(s['balance'])} ({s['count']:,})" if label != 'Total'
+            else f"Total: {format_money(s['balance'])} ({s['count']:,})"
+            for label, s in summary.items()))
+        totals.pack(fill=X, padx=6, pady=6)
+        cols = ("client", "open") + tuple(AGING_BUCKETS) + ("total",)
+        tree = ttk.Treeview(dlg, columns=cols, show="headings", height=18)
+        for col, heading in zip(cols, ["Client", "Open"] + [f"{label} days" for label in AGING_BUCKETS] + ["Total"]):
+            tree.heading(col, text=heading)
+            tree.column(col, width=240 if col == "client" else 100, anchor=W if col == "client" else E)
+        tree.pack(fill=BOTH, expand=True, padx=6, pady=4)
+        report = self.db.aging_by_client()
+        for client, count, balances, total in report:
+            tree.insert('', tk.END, values=(client, f"{count:,}", *(format_money(b) for b in balances), format_money(total)))
+
+        def show_client(_event=None):
+            selected = tree.selection()
+            if not selected:
+                return
+            self.var_dash_client.set(tree.item(selected[0], 'values')[0])
+            self.var_dash_type.set("All")
+            self.var_dash_balance.set("Unpaid")
+            self.load_dashboard_data(1)
+
+        def export():
+            path = filedialog.asksaveasfilename(parent=dlg, defaultextension='.csv', filetypes=[('CSV files', '*.csv')],
+                                                initialfile=f"aging_{date.today():%Y%m%d}.csv")
+            if path:
+                try:
+                    write_aging_csv(path, report)
+                    messagebox.showinfo("Exported", f"Exported {len(report):,} clients to {path}", parent=dlg)
+                except Exception as e:
+                    messagebox.showerror("Export Error", f"Could not export CSV: {e}", parent=dlg)
 
-    def on_dashboard_search(self):
-        self.load_dashboard_data(1)
+        tree.bind("<Double-1>", show_client)
+        tk.Button(dlg, text="Export CSV", command=export).pack(pady=6)
 
-    def open_selected_invoice_pdf(self):
+    def generate_statement(self):
+        """Statement of account for the selected row's client (or the exact name in the Client filter),
+        limited to the dashboard date range. Rendered on a worker thread with its own DB connection."""
         sel = self.dashboard_tree.selection()
-        if not sel:
-            messagebox.showwarning("No selection", "Select an invoice or quotation to open its PDF.")
+        client = self.dashboard_tree.item(sel[0], 'values')[2] if sel else self.var_dash_client.get().strip()
+        if not client:
+            messagebox.showwarning("Statement", "Select a row or type the client's name in the Client filter.")
             return
-        row = self.dashboard_tree.item(sel[0], 'values')
-        inv_no = row[0]
-        inv_type = row[3] if len(row) > 3 else 'Project'
-        if inv_type == 'Quotation':
-            filename = f"Quotation_{inv_no}.pdf"
-        else:
-            filename = f"Invoice_{inv_no}.pdf"
-        if os.path.exists(filename):
+        try:
+            date_from = self.var_dash_from.get().strip() or None
+            date_to = self.var_dash_to.get().strip() or None
+            for value in (date_from, date_to):
+                if value:
+                    datetime.strptime(value, "%Y-%m-%d")
+        except ValueError:
+            messagebox.showwarning("Invalid date", "Dates must be in YYYY-MM-DD format.")
+            return
+        safe_name = "".join(ch if ch.isalnum() else "_" for ch in client).strip("_")
+        path = filedialog.asksaveasfilename(defaultextension='.pdf', filetypes=[('PDF files', '*.pdf')],
+                                            initialfile=f"Statement_{safe_name}_{datetime.now():%Y%m%d}.pdf")
+        if not path:
+            return
+        progress = {'done': 0, 'total': 0}
+
+        tenant_id = self.db.tenant_id
+
+        def work():
+            db = DatabaseManager()
+            db.tenant_id = tenant_id
             try:
-                if os.name == 'nt':
-                    os.startfile(filename)
-                else:
-                    subprocess.run(['open' if sys.platform == 'darwin' else 'xdg-open', filename], check=False)
+                return render_statement_pdf(path, db, client, date_from, date_to,
+                                            progress=lambda done, total: progress.update(done=done, total=total))
+            finally:
+                if db.conn:
+                    db.conn.close()
+
+        future = self.executor.submit(work)
+
+        def show_progress():
+            if not future.done():
+                self.lbl_dash_summary.config(text=f"Statement for {client}: {progress['done']:,} / {progress['total']:,} invoices")
+                self.after(250, show_progress)
+
+        def finished():
+            self.load_dashboard_data(self.dashboard_page)
+            try:
+                result = future.result()
             except Exception as e:
-                messagebox.showerror("Open Error", f"Could not open PDF: {e}")
-        else:
-            messagebox.showwarning("Not found", f"PDF {filename} not found on disk.")
+                log_error("pdf.statement", "Statement Error", e)
+                messagebox.showerror("Statement Error", f"Could not create the statement: {e}")
+                return
+            if not result['invoices']:
+                messagebox.showinfo("Statement", f"No invoices found for '{client}' in that period.")
+                return
+            rate = f"{result['pages_per_sec']:,.0f} pages/sec" if result['pages_per_sec'] else ""
+            self.last_generated_file = path
+            msg = f"Statement saved: {path}\n{result['invoices']:,} invoices, {result['pages']:,} pages in {result['seconds']:.1f}s ({rate})"
+            email = result['client_email']
+            if email and self.is_valid_email(email) and messagebox.askyesno("Statement", msg + f"\n\nEmail it to {email}?"):
+                success, err = self.send_email(email, f"Statement of Account - {client}",
+                                               f"Please find attached your statement of account from {self.db.tenant()['company_name']}.", path)
+                if success:
+                    messagebox.showinfo("Email Sent", f"Statement sent to {email}")
+                else:
+                    messagebox.showerror("Email Error", f"Failed to send email: {err}")
+            else:
+                messagebox.showinfo("Statement", msg)
 
-    def export_dashboard_csv(self):
-        rows = [self.dashboard_tree.item(i, 'values') for i in self.dashboard_tree.get_children()]
-        if not rows:
-            messagebox.showinfo("No Data", "No rows to export.")
+        show_progress()
+        self.run_when_done([future], finished)
+
+    def import_invoices(self):
+        """Bulk-import invoices from a CSV/JSON file into the selected company/branch on a worker
+        thread with its own connection; rerunning a file only adds what is not in yet."""
+        path = filedialog.askopenfilename(filetypes=[('Invoice files', '*.csv *.json *.jsonl *.ndjson'), ('All files', '*.*')])
+        if not path:
             return
-        path = filedialog.asksaveasfilename(defaultextension='.csv', filetypes=[('CSV files','*.csv')], initialfile='invoices_export.csv')
+        errors_path = os.path.splitext(path)[0] + "_import_errors.csv"
+        progress = {}
+        tenant_id = self.db.tenant_id
+
+        def work():
+            db = DatabaseManager()
+            db.tenant_id = tenant_id
+            try:
+                return InvoiceImporter(db, errors_path=errors_path).run(path, progress=progress.update)
+            finally:
+                if db.conn:
+                    db.conn.close()
+
+        future = self.executor.submit(work)
+
+        def show_progress():
+            if not future.done():
+                if progress:
+                    self.lbl_dash_summary.config(text=f"Importing {os.path.basename(path)}: {progress['documents']:,} read, "
+                                                      f"{progress['imported']:,} imported, {progress['rejected']:,} rejected")
+                self.after(250, show_progress)
+
+        def finished():
+            self.db.invalidate_summaries()
+            self.load_dashboard_data(1)
+            try:
+                stats = future.result()
+            except Exception as e:
+                log_error("import", "Import Error", e)
+                messagebox.showerror("Import Error", f"The import stopped: {e}")
+                return
+            msg = (f"{stats['imported']:,} invoices imported, {stats['skipped']:,} already imported, "
+                   f"{stats['rejected']:,} rejected ({stats['seconds']:.1f}s).")
+            if stats['rejected']:
+                messagebox.showwarning("Import", msg + f"\n\nRejected rows are listed in {errors_path}")
+            else:
+                messagebox.showinfo("Import", msg)
+
+        show_progress()
+        self.run_when_done([future], finished)
+
+    def reconcile_statement(self):
+        """Match a bank statement CSV to the open invoices of the selected company/branch and record the
+        matches as payments, on a worker thread with its own connection. Lines it cannot place are written
+        next to the statement for review; running the same statement again skips what is already recorded."""
+        path = filedialog.askopenfilename(filetypes=[('Bank statements', '*.csv'), ('All files', '*.*')])
         if not path:
             return
-        try:
-            with open(path, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow([h for h in ["Invoice #","Date","Client","Type","Subtotal","VAT","Shipping","WHT","Grand Total"]])
-                for row in rows:
-                    writer.writerow(row)
-            messagebox.showinfo("Exported", f"Exported {len(rows)} rows to {path}")
-        except Exception as e:
-            messagebox.showerror("Export Error", f"Could not export CSV: {e}")
+        review_path = os.path.splitext(path)[0] + "_review.csv"
+        progress = {}
+        tenant_id = self.db.tenant_id
 
-    def delete_selected_invoice(self):
-        sel = self.dashboard_tree.selection()
-        if not sel:
-            messagebox.showwarning("No selection", "Select an invoice to delete.")
+        def work():
+            db = DatabaseManager()
+            db.tenant_id = tenant_id
+            try:
+                return StatementReconciler(db, review_path=review_path).run(path, progress=progress.update)
+            finally:
+                if db.conn:
+                    db.conn.close()
+
+        future = self.executor.submit(work)
+
+        def show_progress():
+            if not future.done():
+                if progress:
+                    self.lbl_dash_summary.config(text=f"Reconciling {os.path.basename(path)}: {progress['lines']:,} credits read, "
+                                                      f"{progress['matched']:,} matched, {progress['review']:,} to review")
+                self.after(250, show_progress)
+
+        def finished():
+            self.db.invalidate_summaries()
+            self.load_dashboard_data(1)
+            try:
+                stats = future.result()
+            except Exception as e:
+                log_error("reconcile", "Reconciliation Error", e)
+                messagebox.showerror("Reconciliation Error", f"The reconciliation stopped: {e}")
+                return
+            msg = (f"{stats['matched']:,} of {stats['lines']:,} credits matched ({stats['by_reference']:,} by invoice number, "
+                   f"{stats['by_amount']:,} by amount): {stats['payments']:,} payments totalling "
+                   f"{format_money(stats['amount'])}. {stats['skipped']:,} were already recorded "
+                   f"({stats['seconds']:.1f}s).")
+            if stats['review']:
+                messagebox.showwarning("Reconcile", msg + f"\n\n{stats['review']:,} lines need review; they are listed in {review_path}")
+            else:
+                messagebox.showinfo("Reconcile", msg)
+
+        show_progress()
+        self.run_when_done([future], finished)
+
+    def run_archive_job(self):
+        days = simpledialog.askinteger("Archive Old Documents", "Archive invoices and quotations older than how many days?",
+                                       parent=self, initialvalue=ARCHIVE_SETTINGS['retention_days'], minvalue=1)
+        if days is None:
             return
-        row = self.dashboard_tree.item(sel[0], 'values')
-        inv_no = row[0]
-        inv_type = row[3] if len(row) > 3 else 'Project'
-        if not messagebox.askyesno("Confirm Delete", f"Delete {inv_type} {inv_no} from database?"):
+        if not messagebox.askyesno("Confirm Archive", f"Move documents older than {days} days (and their PDFs) into the archive?"):
             return
-        success = False
-        if inv_type == 'Quotation':
-            success = self.db.delete_quotation(inv_no)
-            filename = f"Quotation_{inv_no}.pdf"
-        else:
-            success = self.db.delete_invoice(inv_no)
-            filename = f"Invoice_{inv_no}.pdf"
-
-        if success:
-            # Attempt to delete the PDF file if present
+        # The archiver walks every company and branch, so it gets its own manager: self.db keeps this
+        # window's tenant (and number sequences) for whatever the user does between batches
+        archive_db = DatabaseManager()
+        archiver = DocumentArchiver(archive_db)
+        batches = archiver.iter_batches(days)
+        pause_ms = max(1, int(archiver.settings['pause_seconds'] * 1000))
+        self.lbl_dash_summary.config(text="Archiving...")
+
+        def finish():
+            archive_db.audit.flush()
+            if archive_db.conn:
+                archive_db.conn.close()
+            self.db.invalidate_summaries()
+            self.load_dashboard_data(1)
+
+        # One batch per event-loop tick keeps the window responsive and live-table locks short; the pause
+        # between batches is spent in the event loop, not asleep on this thread
+        def step():
             try:
-                if os.path.exists(filename):
-                    os.remove(filename)
-            except Exception:
-                pass
-            messagebox.showinfo("Deleted", f"{inv_type} {inv_no} deleted.")
-            self.load_dashboard_data(self.dashboard_page)
+                progress = next(batches)
+            except StopIteration:
+                finish()
+                messagebox.showinfo("Archive", "Archiving finished.")
+                return
+            except Exception as e:
+                finish()
+                messagebox.showerror("Archive Error", str(e))
+                return
+            self.lbl_dash_summary.config(text=f"Archiving... {progress['total']:,} documents moved ({progress['kind']})")
+            self.after(pause_ms, step)
+        self.after(1, step)
+
+    def restore_selected_archived(self):
+        if self.var_dash_type.get() != 'Archived':
+            messagebox.showwarning("Restore", "Choose Type 'Archived' and select the documents to restore.")
+            return
+        numbers = [self.dashboard_tree.item(sel, 'values')[0] for sel in self.dashboard_tree.selection()]
+        if not numbers:
+            messagebox.showwarning("No selection", "Select one or more archived documents to restore.")
+            return
+        archiver = DocumentArchiver(self.db)
+        problems = []
+        for number in numbers:
+            ok, err = archiver.restore(number)
+            if err:
+                problems.append(f"{number}: {err}")
+        self.load_dashboard_data(self.dashboard_page)
+        if problems:
+            messagebox.showwarning("Restore", "\n".join(problems))
         else:
-            messagebox.showerror("Delete Error", f"Could not delete {inv_type} from DB.")
+            messagebox.showinfo("Restore", f"Restored {len(numbers)} document(s).")
 
     def prev_dashboard_page(self):
         if self.dashboard_page > 1:
             self.load_dashboard_data(self.dashboard_page - 1)
 
     def next_dashboard_page(self):
-        # Simple next page - user can click to paginate
-        self.load_dashboard_data(self.dashboard_page + 1)
+        if self.dashboard_page < self.dashboard_last_page:
+            self.load_dashboard_data(self.dashboard_page + 1)
 
     def on_tab_changed(self, event):
         selected = self.notebook.select()
@@ -1255,6 +7920,103 @@ class InvoiceApp(tb.Window):
         else:
             self.current_tab = "component"  # fallback
 
+    # ------------------- Companies & branches -------------------
+    def refresh_tenant_choices(self):
+        """Fill the Company/Branch selector (branches indented under their company)."""
+        self.tenant_choices = OrderedDict()
+        for tenant_id, code, parent_id, name in self.db.fetch_tenants():
+            label = f"{'    ' if parent_id else ''}{code}" + (f" - {name}" if name else "")
+            self.tenant_choices[label] = tenant_id
+        self.cmb_tenant.config(values=list(self.tenant_choices))
+        current = [label for label, tenant_id in self.tenant_choices.items() if tenant_id == self.db.tenant_id]
+        self.var_tenant.set(current[0] if current else "")
+
+    def on_tenant_selected(self):
+        tenant_id = self.tenant_choices.get(self.var_tenant.get())
+        if tenant_id is None or tenant_id == self.db.tenant_id:
+            return
+        if not self.db.use_tenant(tenant_id):
+            messagebox.showerror("Company/Branch", "That company or branch could not be selected (see log).")
+            self.refresh_tenant_choices()
+            return
+        # Numbers, dashboard rows and previews all belong to the selected tenant
+        self.preview_cache.clear()
+        self.preview_key = None
+        self.preview_label.config(image='', text="Select a document to preview")
+        self.refresh_invoice_number()
+        self.refresh_quote_number()
+        self.load_dashboard_data(1)
+        self.refresh_low_stock()
+
+    def on_tenants_changed(self):
+        """A company or branch was edited (here or on another workstation)."""
+        self.db.forget_tenants()
+        self.preview_cache.clear()
+        self.refresh_tenant_choices()
+        self.refresh_invoice_number()
+        self.refresh_quote_number()
+
+    def manage_tenants(self):
+        """Add or edit a company/branch. Blank fields inherit from the parent company (then from the
+        company settings), so a branch usually only needs its code, address and bank details."""
+        dlg = tk.Toplevel(self)
+        dlg.title("Companies & Branches")
+        dlg.transient(self)
+        dlg.grab_set()
+
+        tenants = self.db.fetch_tenants()
+        new_label = "(new)"
+        choices = OrderedDict([(new_label, None)] + [(f"{code} - {name}" if name else code, tenant_id)
+                                                     for tenant_id, code, _, name in tenants])
+        companies = OrderedDict([("(none - a company)", None)] + [(code, tenant_id) for tenant_id, code, parent_id, _ in tenants
+                                                                   if parent_id is None])
+        pick_var = tk.StringVar(value=new_label)
+        tk.Label(dlg, text="Edit:").grid(row=0, column=0, sticky=E, padx=6, pady=6)
+        pick = ttk.Combobox(dlg, textvariable=pick_var, values=list(choices), state="readonly", width=30)
+        pick.grid(row=0, column=1, padx=6, pady=6, sticky=W)
+
+        field_vars = OrderedDict((name, tk.StringVar()) for name in ('code', 'number_prefix') + DatabaseManager.TENANT_FIELDS)
+        parent_var = tk.StringVar(value="(none - a company)")
+        labels = {'code': "Code:", 'number_prefix': "Number Prefix:", 'company_name': "Company Name:", 'address': "Address:",
+                  'tin': "TIN:", 'bank_name': "Bank:", 'account_name': "Account Name:", 'account_number': "Account Number:",
+                  'logo_path': "Logo File:"}
+        tk.Label(dlg, text="Parent Company:").grid(row=1, column=0, sticky=E, padx=6, pady=4)
+        ttk.Combobox(dlg, textvariable=parent_var, values=list(companies), state="readonly", width=30).grid(row=1, column=1, padx=6, pady=4, sticky=W)
+        address_box = tk.Text(dlg, width=36, height=3)
+        for row, (name, var) in enumerate(field_vars.items(), start=2):
+            tk.Label(dlg, text=labels[name]).grid(row=row, column=0, sticky=NE if name == 'address' else E, padx=6, pady=4)
+            if name == 'address':
+                address_box.grid(row=row, column=1, padx=6, pady=4, sticky=W)
+            else:
+                tk.Entry(dlg, textvariable=var, width=38).grid(row=row, column=1, padx=6, pady=4, sticky=W)
+        tk.Label(dlg, text="Leave a field blank to inherit it from the parent company.", fg="grey").grid(
+            row=len(field_vars) + 2, column=0, columnspan=2, padx=6)
+
+        def load_selected(_event=None):
+            record = self.db.fetch_tenant(choices[pick_var.get()]) if choices.get(pick_var.get()) else {}
+            for name, var in field_vars.items():
+                var.set((record or {}).get(name) or '')
+            address_box.delete("1.0", tk.END)
+            address_box.insert("1.0", (record or {}).get('address') or '')
+            parent = [code for code, tenant_id in companies.items() if tenant_id and tenant_id == (record or {}).get('parent_id')]
+            parent_var.set(parent[0] if parent else "(none - a company)")
+
+        pick.bind("<<ComboboxSelected>>", load_selected)
+
+        def save():
+            data = {name: var.get() for name, var in field_vars.items()}
+            data['address'] = address_box.get("1.0", tk.END).strip()
+            data['parent_id'] = companies.get(parent_var.get())
+            data['id'] = choices.get(pick_var.get())
+            tenant_id, err = self.db.save_tenant(data)
+            if not tenant_id:
+                messagebox.showerror("Companies & Branches", f"Not saved:\n{err}", parent=dlg)
+                return
+            dlg.destroy()
+            self.on_tenants_changed()
+
+        tk.Button(dlg, text="Save", command=save).grid(row=len(field_vars) + 3, column=0, columnspan=2, pady=8)
+
     def refresh_invoice_number(self):
         try:
             new_no = self.db.generate_invoice_number()
@@ -1277,8 +8039,12 @@ class InvoiceApp(tb.Window):
         sn = str(len([i for i in self.cart if i['type'] == 'Project']) + 1)
 
         total = price * qty
-        self.cart.append({"sn": sn, "desc": desc, "type": "Project", "qty": qty, "price": price, "total": total})
-        self.tree_project.insert("", "end", values=(sn, desc, qty, f"{price:,.2f}", f"{total:,.2f}"))
+        item = {"sn": sn, "desc": desc, "type": "Project", "qty": qty, "price": price, "total": total}
+        if self.var_project_service.get() != "Project":
+            item["service"] = self.var_project_service.get()
+        shown = self.price_line(item, self.var_client.get())
+        self.cart.append(item)
+        self.tree_project.insert("", "end", values=(sn, shown, qty, f"{item['price']:,.2f}", f"{item['total']:,.2f}"))
         self.calculate_totals()
         
         self.var_project_desc.set("")
@@ -1296,29 +8062,413 @@ class InvoiceApp(tb.Window):
 
         # S/N is auto-generated per component item
         sn = str(len([i for i in self.cart if i['type'] == 'Component']) + 1)
+        # A line picked from the catalog keeps its product id (and VAT flag) unless the name was edited afterwards
+        product = self.comp_product if self.comp_product and self.comp_product.description == desc else None
 
         total = price * qty
-        self.cart.append({"sn": sn, "desc": desc, "type": "Component", "qty": qty, "price": price, "total": total})
-        self.tree_comp.insert("", "end", values=(sn, desc, qty, f"{price:,.2f}", f"{total:,.2f}"))
+        item = {"sn": sn, "desc": desc, "type": "Component", "qty": qty, "price": price, "total": total,
+                "product_id": product.id if product else None, "vat": product.vat if product else True}
+        shown = self.price_line(item, self.var_client_comp.get())
+        self.cart.append(item)
+        self.tree_comp.insert("", "end", values=(sn, shown, qty, f"{item['price']:,.2f}", f"{item['total']:,.2f}"))
         self.calculate_totals()
         
         self.var_comp_desc.set("")
         self.var_comp_price.set(0.0)
         self.var_comp_qty.set(1)
+        self.comp_product = None
+        self.lst_comp_products.grid_remove()
+
+    # ------------------- Product catalog -------------------
+    def load_products(self):
+        """Read the catalog on a worker thread with its own connection, then catch up with the change
+        feed on this thread for anything saved while it loaded."""
+        def work():
+            db = DatabaseManager()
+            try:
+                return self.products.load(db)
+            finally:
+                if db.conn:
+                    db.conn.close()
+
+        future = self.executor.submit(work)
+        self.run_when_done([future], lambda: self.products.refresh(self.db))
+
+    def on_comp_desc_typed(self, event):
+        if event.keysym in ('Up', 'Down', 'Return', 'Escape', 'Tab'):
+            return
+        text = self.var_comp_desc.get()
+        if self.comp_product and text != self.comp_product.description:
+            self.comp_product = None
+        self.comp_matches = self.products.search(text, limit=12)
+        self.lst_comp_products.delete(0, tk.END)
+        if not self.comp_matches:
+            self.lst_comp_products.grid_remove()
+            return
+        for product in self.comp_matches:
+            self.lst_comp_products.insert(tk.END, product.label)
+        self.lst_comp_products.grid(row=2, column=0, columnspan=4, sticky=W+E, padx=10)
+
+    def focus_product_matches(self):
+        if self.comp_matches:
+            self.lst_comp_products.focus_set()
+            self.lst_comp_products.selection_clear(0, tk.END)
+            self.lst_comp_products.selection_set(0)
+            self.lst_comp_products.activate(0)
+
+    def pick_product(self, index):
+        if not 0 <= index < len(self.comp_matches):
+            return
+        product = self.comp_matches[index]
+        self.comp_product = product
+        self.var_comp_desc.set(product.description)
+        # Catalog prices are in the base currency; offer today's equivalent on a foreign-currency invoice
+        rate, _ = self.db.exchange_rate(self.var_currency.get())
+        self.var_comp_price.set(round_money(product.unit_price / rate, self.var_currency.get()) if rate else product.unit_price)
+        self.comp_matches = []
+        self.lst_comp_products.grid_remove()
+        self.ent_comp_desc.focus_set()
+        self.ent_comp_desc.icursor(tk.END)
+        return "break"
+
+    def manage_products(self):
+        """Find, add or edit catalog entries, or load many from a CSV. Products are deactivated rather
+        than deleted, because saved invoices refer to them."""
+        dlg = tk.Toplevel(self)
+        dlg.title("Product Catalog")
+        dlg.transient(self)
+        dlg.grab_set()
+
+        find_var = tk.StringVar()
+        tk.Label(dlg, text="Find (name or SKU):").grid(row=0, column=0, sticky=E, padx=6, pady=6)
+        find_entry = tk.Entry(dlg, textvariable=find_var, width=40)
+        find_entry.grid(row=0, column=1, padx=6, pady=6, sticky=W)
+        matches_box = tk.Listbox(dlg, height=10, width=70, exportselection=False)
+        matches_box.grid(row=1, column=0, columnspan=2, padx=6, pady=4)
+        matches = []
+
+        field_vars = OrderedDict((name, tk.StringVar()) for name in ('sku', 'description', 'unit_price', 'reorder_level'))
+        labels = {'sku': "SKU:", 'description': "Description:", 'unit_price': f"Unit Price ({COMPANY_CONFIG['currency_symbol']}):",
+                  'reorder_level': "Reorder at (qty):"}
+        for row, (name, var) in enumerate(field_vars.items(), start=2):
+            tk.Label(dlg, text=labels[name]).grid(row=row, column=0, sticky=E, padx=6, pady=4)
+            tk.Entry(dlg, textvariable=var, width=50 if name == 'description' else 20).grid(row=row, column=1, padx=6, pady=4, sticky=W)
+        vat_var, active_var = tk.BooleanVar(value=True), tk.BooleanVar(value=True)
+        tk.Checkbutton(dlg, text="VAT applies", variable=vat_var).grid(row=6, column=1, sticky=W, padx=6)
+        tk.Checkbutton(dlg, text="Active (offered when invoicing)", variable=active_var).grid(row=7, column=1, sticky=W, padx=6)
+        status = tk.Label(dlg, text=f"{len(self.products):,} products in the catalog", fg="grey")
+        status.grid(row=9, column=0, columnspan=2, padx=6, pady=4)
+        editing = {}
+
+        def show(product=None):
+            editing.clear()
+            if product:
+                editing.update(id=product.id, version=product.version)
+            for name, var in field_vars.items():
+                var.set(getattr(product, name) if product else '')
+            vat_var.set(product.vat if product else True)
+            active_var.set(product.active if product else True)
+
+        def find(_event=None):
+            text = find_var.get()
+            inactive = self.products.by_sku(text, inactive=True)
+            matches[:] = self.products.search(text, limit=50)
+            if inactive and not inactive.active:
+                matches.insert(0, inactive)
+            matches_box.delete(0, tk.END)
+            for product in matches:
+                matches_box.insert(tk.END, product.label + ("" if product.active else "  [inactive]"))
+
+        def pick(_event=None):
+            selected = matches_box.curselection()
+            if selected:
+                show(matches[selected[0]])
+
+        def save():
+            data = {name: var.get() for name, var in field_vars.items()}
+            data.update(editing, vat=vat_var.get(), active=active_var.get())
+            product_id, err = self.db.save_product(data)
+            if not product_id:
+                messagebox.showerror("Product Catalog", f"Not saved:\n{err}", parent=dlg)
+                return
+            self.products.refresh(self.db)
+            show(self.products.get(product_id))
+            find()
+            status.config(text=f"Saved {data['sku'].strip().upper()}; {len(self.products):,} products in the catalog")
+
+        def import_csv():
+            path = filedialog.askopenfilename(parent=dlg, filetypes=[('CSV files', '*.csv'), ('All files', '*.*')])
+            if not path:
+                return
+            status.config(text=f"Importing {os.path.basename(path)}...")
+
+            def work():
+                db = DatabaseManager()
+                try:
+                    return db.import_products(iter_product_rows(path))
+                finally:
+                    db.audit.flush()
+                    if db.conn:
+                        db.conn.close()
+
+            future = self.executor.submit(work)
+
+            def finished():
+                try:
+                    created, updated, rejected = future.result()
+                except Exception as e:
+                    log_error("products.import", "Product Import Error", e)
+                    messagebox.showerror("Product Catalog", f"The import stopped: {e}", parent=dlg)
+                    return
+                self.products.refresh(self.db)
+                msg = f"{created:,} products created, {updated:,} updated, {len(rejected):,} rejected."
+                if rejected:
+                    msg += "\n\n" + "\n".join(f"Row {n} {sku}: {err}" for n, sku, err in rejected[:10])
+                messagebox.showinfo("Product Catalog", msg, parent=dlg)
+                if dlg.winfo_exists():
+                    status.config(text=f"{len(self.products):,} products in the catalog")
+
+            self.run_when_done([future], finished)
+
+        find_entry.bind("<KeyRelease>", find)
+        matches_box.bind("<<ListboxSelect>>", pick)
+        buttons = tk.Frame(dlg)
+        buttons.grid(row=8, column=0, columnspan=2, pady=8)
+        tk.Button(buttons, text="New", command=show).pack(side=LEFT, padx=4)
+        tk.Button(buttons, text="Save", command=save).pack(side=LEFT, padx=4)
+        tk.Button(buttons, text="Import CSV...", command=import_csv).pack(side=LEFT, padx=4)
+        find_entry.focus_set()
+
+    def refresh_low_stock(self):
+        self.show_low_stock(self.db.fetch_low_stock())
+
+    def show_low_stock(self, low):
+        self.lbl_low_stock.config(text=f"{len(low):,} product(s) low on stock" if low else "")
+
+    def manage_stock(self):
+        """Low-stock list for the current company/branch, plus receiving deliveries and entering stocktake
+        counts. A product's stock is only tracked here from its first receipt."""
+        dlg = tk.Toplevel(self)
+        dlg.title("Stock")
+        dlg.transient(self)
+        dlg.grab_set()
+
+        tk.Label(dlg, text="At or below reorder level:").grid(row=0, column=0, columnspan=3, sticky=W, padx=6, pady=(6, 0))
+        low_tree = ttk.Treeview(dlg, columns=("sku", "description", "on_hand", "reorder"), show="headings", height=10)
+        for col, heading, width in (("sku", "SKU", 100), ("description", "Description", 280), ("on_hand", "In Stock", 80), ("reorder", "Reorder At", 80)):
+            low_tree.heading(col, text=heading)
+            low_tree.column(col, width=width, anchor=E if col in ("on_hand", "reorder") else W)
+        low_tree.grid(row=1, column=0, columnspan=3, padx=6, pady=4)
+
+        product_var, qty_var, ref_var = tk.StringVar(), tk.StringVar(), tk.StringVar()
+        tk.Label(dlg, text="SKU:").grid(row=2, column=0, sticky=E, padx=6, pady=4)
+        tk.Entry(dlg, textvariable=product_var, width=20).grid(row=2, column=1, sticky=W, padx=6, pady=4)
+        tk.Label(dlg, text="Quantity:").grid(row=3, column=0, sticky=E, padx=6, pady=4)
+        tk.Entry(dlg, textvariable=qty_var, width=10).grid(row=3, column=1, sticky=W, padx=6, pady=4)
+        tk.Label(dlg, text="Reference (delivery note):").grid(row=4, column=0, sticky=E, padx=6, pady=4)
+        tk.Entry(dlg, textvariable=ref_var, width=20).grid(row=4, column=1, sticky=W, padx=6, pady=4)
+        status = tk.Label(dlg, text="", fg="grey")
+        status.grid(row=6, column=0, columnspan=3, padx=6, pady=4)
+
+        def show_low():
+            low_tree.delete(*low_tree.get_children())
+            for product_id, sku, desc, on_hand, level in self.db.fetch_low_stock():
+                low_tree.insert('', tk.END, values=(sku, desc, on_hand, level))
+            self.refresh_low_stock()
+
+        def pick(_event=None):
+            selected = low_tree.selection()
+            if selected:
+                product_var.set(low_tree.item(selected[0], 'values')[0])
+
+        def apply(counted):
+            product = self.products.by_sku(product_var.get(), inactive=True)
+            if not product:
+                messagebox.showerror("Stock", f"No product with SKU {product_var.get().strip().upper()!r}.", parent=dlg)
+                return
+            try:
+                qty = int(qty_var.get().strip())
+            except ValueError:
+                messagebox.showerror("Stock", "Enter the quantity as a whole number.", parent=dlg)
+                return
+            if counted:
+                total, err = self.db.adjust_stock(product.id, counted=qty, reason='stocktake', reference=ref_var.get().strip() or None)
+            else:
+                total, err = self.db.adjust_stock(product.id, qty, reference=ref_var.get().strip() or None)
+            if total is None:
+                messagebox.showerror("Stock", f"Not recorded:\n{err}", parent=dlg)
+                return
+            status.config(text=f"{product.sku}: {total:,} in stock")
+            qty_var.set("")
+            show_low()
+
+        low_tree.bind("<<TreeviewSelect>>", pick)
+        buttons = tk.Frame(dlg)
+        buttons.grid(row=5, column=0, columnspan=3, pady=8)
+        tk.Button(buttons, text="Receive", command=lambda: apply(False)).pack(side=LEFT, padx=4)
+        tk.Button(buttons, text="Set Counted (stocktake)", command=lambda: apply(True)).pack(side=LEFT, padx=4)
+        show_low()
+
+    def manage_rates(self):
+        """Exchange rates (base currency per unit) entered so far, newest first, and entering or correcting a
+        currency's rate for a day, one at a time or from a CSV. Saved documents keep the rate they were saved at."""
+        base = CURRENCY_SETTINGS['base']
+        dlg = tk.Toplevel(self)
+        dlg.title(f"Exchange Rates ({base} per unit)")
+        dlg.transient(self)
+        dlg.grab_set()
+
+        tree = ttk.Treeview(dlg, columns=("currency", "rate_date", "rate"), show="headings", height=14)
+        for col, heading, width in (("currency", "Currency", 90), ("rate_date", "Date", 110), ("rate", "Rate", 140)):
+            tree.heading(col, text=heading)
+            tree.column(col, width=width, anchor=E if col == "rate" else W)
+        tree.grid(row=0, column=0, columnspan=3, padx=6, pady=6)
+
+        foreign = [code for code in CURRENCIES if code != base]
+        currency_var, date_var, rate_var = tk.StringVar(value=foreign[0]), tk.StringVar(value=f"{date.today():%Y-%m-%d}"), tk.StringVar()
+        tk.Label(dlg, text="Currency:").grid(row=1, column=0, sticky=E, padx=6, pady=4)
+        ttk.Combobox(dlg, values=foreign, textvariable=currency_var, state="readonly", width=8).grid(row=1, column=1, sticky=W, padx=6, pady=4)
+        tk.Label(dlg, text="Date (YYYY-MM-DD):").grid(row=2, column=0, sticky=E, padx=6, pady=4)
+        tk.Entry(dlg, textvariable=date_var, width=12).grid(row=2, column=1, sticky=W, padx=6, pady=4)
+        tk.Label(dlg, text=f"Rate ({base}):").grid(row=3, column=0, sticky=E, padx=6, pady=4)
+        tk.Entry(dlg, textvariable=rate_var, width=14).grid(row=3, column=1, sticky=W, padx=6, pady=4)
+
+        def show():
+            tree.delete(*tree.get_children())
+            rows = self.db.fetch_exchange_rates()
+            for currency, day, rate in sorted(rows, key=lambda r: (r[1], r[0]), reverse=True):
+                tree.insert('', tk.END, values=(currency, f"{day:%Y-%m-%d}", f"{rate:,.6g}"))
+            self.show_currency_rates()
+
+        def save(rows):
+            saved, rejected = self.db.save_exchange_rates(rows)
+            if rejected:
+                messagebox.showerror("Exchange Rates", f"{saved:,} saved; not saved:\n" + "\n".join(
+                    f"row {row_number}: {error}" if row_number else error for row_number, error in rejected[:15]), parent=dlg)
+            show()
+            return saved
+
+        def add():
+            if save([{'currency': currency_var.get(), 'rate_date': date_var.get(), 'rate': rate_var.get()}]):
+                rate_var.set("")
+
+        def load_file():
+            path = filedialog.askopenfilename(parent=dlg, title="Exchange rates CSV (currency, date, rate)",
+                                              filetypes=[("CSV files", "*.csv")])
+            if not path:
+                return
+            try:
+                saved = save(list(iter_rate_rows(path)))
+            except (OSError, ValueError) as e:
+                messagebox.showerror("Exchange Rates", f"Could not read {path}: {e}", parent=dlg)
+                return
+            messagebox.showinfo("Exchange Rates", f"{saved:,} rates saved from {path}", parent=dlg)
+
+        buttons = tk.Frame(dlg)
+        buttons.grid(row=4, column=0, columnspan=3, pady=8)
+        tk.Button(buttons, text="Save Rate", command=add).pack(side=LEFT, padx=4)
+        tk.Button(buttons, text="Load CSV...", command=load_file).pack(side=LEFT, padx=4)
+        show()
+
+    def manage_price_rules(self):
+        """Price rules, newest first, and adding or changing one by code, or many from a CSV. A rule is retired by
+        saving it inactive. Rules price lines as they are added to a cart; saved documents keep their prices."""
+        dlg = tk.Toplevel(self)
+        dlg.title("Price Rules")
+        dlg.transient(self)
+        dlg.grab_set()
+
+        cols = (("code", "Code", 90), ("sku", "SKU", 90), ("client", "Client", 150), ("kind", "Kind", 60), ("value", "Value", 80),
+                ("min_qty", "From Qty", 60), ("dates", "Valid", 170), ("active", "Active", 50))
+        tree = ttk.Treeview(dlg, columns=[c[0] for c in cols], show="headings", height=14)
+        for col, heading, width in cols:
+            tree.heading(col, text=heading)
+            tree.column(col, width=width, anchor=E if col in ("value", "min_qty") else W)
+        tree.grid(row=0, column=0, columnspan=4, padx=6, pady=6)
+
+        fields = {}
+        for n, (name, label) in enumerate((("code", "Code:"), ("description", "Description:"), ("sku", "SKU (blank = any):"),
+                                           ("client_name", "Client (blank = any):"), ("value", "Value:"), ("min_qty", "From quantity:"),
+                                           ("starts_on", "From (YYYY-MM-DD):"), ("ends_on", "To (YYYY-MM-DD):"))):
+            fields[name] = tk.StringVar(value="1" if name == "min_qty" else "")
+            tk.Label(dlg, text=label).grid(row=1 + n // 2, column=(n % 2) * 2, sticky=E, padx=6, pady=3)
+            tk.Entry(dlg, textvariable=fields[name], width=24).grid(row=1 + n // 2, column=(n % 2) * 2 + 1, sticky=W, padx=6, pady=3)
+        kind_var, active_var = tk.StringVar(value=PRICE_RULE_KINDS[0]), tk.BooleanVar(value=True)
+        tk.Label(dlg, text="Kind:").grid(row=5, column=0, sticky=E, padx=6, pady=3)
+        ttk.Combobox(dlg, values=PRICE_RULE_KINDS, textvariable=kind_var, state="readonly", width=10).grid(row=5, column=1, sticky=W, padx=6, pady=3)
+        tk.Checkbutton(dlg, text="Active", variable=active_var).grid(row=5, column=3, sticky=W, padx=6, pady=3)
+        rules = {}
+
+        def show():
+            tree.delete(*tree.get_children())
+            rules.clear()
+            for rule in reversed(self.db.fetch_price_rules()):
+                rules[rule.code] = rule
+                value = f"{rule.value:g}%" if rule.kind == 'percent' else format_money(rule.value)
+                dates = f"{rule.starts_on or ''} - {rule.ends_on or ''}" if rule.starts_on or rule.ends_on else "always"
+                tree.insert('', tk.END, iid=rule.code, values=(rule.code, rule.sku or "any", rule.client_name or "any", rule.kind, value,
+                                                                rule.min_qty, dates, "yes" if rule.active else "no"))
+
+        def edit(event=None):
+            rule = rules.get(tree.focus())
+            if rule is None:
+                return
+            for name, value in (("code", rule.code), ("description", rule.description), ("sku", rule.sku or ""),
+                                ("client_name", rule.client_name or ""), ("value", f"{rule.value:g}"), ("min_qty", rule.min_qty),
+                                ("starts_on", rule.starts_on or ""), ("ends_on", rule.ends_on or "")):
+                fields[name].set(str(value))
+            kind_var.set(rule.kind)
+            active_var.set(rule.active)
+
+        def save(rows):
+            saved, rejected = self.db.save_price_rules(rows)
+            if rejected:
+                messagebox.showerror("Price Rules", f"{saved:,} saved; not saved:\n" + "\n".join(
+                    f"row {row_number}: {error}" if row_number else error for row_number, error in rejected[:15]), parent=dlg)
+            show()
+            return saved
+
+        def add():
+            if save([dict({name: var.get() for name, var in fields.items()}, kind=kind_var.get(), active=active_var.get())]):
+                for name, var in fields.items():
+                    var.set("1" if name == "min_qty" else "")
+
+        def load_file():
+            path = filedialog.askopenfilename(parent=dlg, title="Price rules CSV (code, sku, client, kind, value, min_qty, ...)",
+                                              filetypes=[("CSV files", "*.csv")])
+            if not path:
+                return
+            try:
+                saved = save(list(iter_price_rule_rows(path)))
+            except (OSError, ValueError) as e:
+                messagebox.showerror("Price Rules", f"Could not read {path}: {e}", parent=dlg)
+                return
+            messagebox.showinfo("Price Rules", f"{saved:,} rules saved from {path}", parent=dlg)
+
+        tree.bind("<<TreeviewSelect>>", edit)
+        buttons = tk.Frame(dlg)
+        buttons.grid(row=6, column=0, columnspan=4, pady=8)
+        tk.Button(buttons, text="Save Rule", command=add).pack(side=LEFT, padx=4)
+        tk.Button(buttons, text="Load CSV...", command=load_file).pack(side=LEFT, padx=4)
+        show()
 
     def calculate_totals(self):
-        subtotal = sum(item['total'] for item in self.cart)
-        vat = subtotal * COMPANY_CONFIG['vat_rate']
+        currency = self.var_currency.get()
         
-        # Get shipping based on current tab
+        # Get shipping and WHT based on current tab
         if self.current_tab == "project":
             shipping = self.var_shipping.get()
+            try:
+                wht_rate = self.var_wht.get()
+            except (tk.TclError, ValueError):
+                wht_rate = 0.0  # still being typed; generate_invoice reads it again
         else:
             shipping = self.var_shipping_comp.get()
+            wht_rate = 0  # No WHT for components
         
-        grand_total = subtotal + vat + shipping
-        self.lbl_total.config(text=f"Total: N{grand_total:,.2f}")
-        return subtotal, vat, shipping, grand_total
+        totals = document_totals(self.cart, shipping, wht_rate, currency)
+        self.lbl_total.config(text=f"Total: {format_money(totals['grand_total'], currency)}")
+        return totals
 
     def clear_list(self):
         self.cart = []
@@ -1373,56 +8523,9 @@ class InvoiceApp(tb.Window):
     def is_valid_email(self, email):
         return bool(email and "@" in email and "." in email)
 
-    def send_email(self, to_address, subject, body, attachment_path):
+    def send_email(self, to_address, subject, body, attachment_path, action='send', smtp=None):
         """Send an email with the given attachment. Returns (True, '') on success, (False, error_message) on failure."""
-        if not SMTP_SETTINGS.get('host'):
-            return False, "SMTP is not configured. Please configure email settings first."
-        try:
-            msg = EmailMessage()
-            msg['Subject'] = subject
-            msg['From'] = SMTP_SETTINGS.get('from_email') or SMTP_SETTINGS.get('username')
-            msg['To'] = to_address
-            msg.set_content(body)
-
-            # attach file
-            if attachment_path and os.path.exists(attachment_path):
-                with open(attachment_path, 'rb') as f:
-                    data = f.read()
-                ctype, encoding = mimetypes.guess_type(attachment_path)
-                if ctype:
-                    maintype, subtype = ctype.split('/', 1)
-                else:
-                    maintype, subtype = 'application', 'octet-stream'
-                msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=os.path.basename(attachment_path))
-
-            context = ssl.create_default_context()
-            with smtplib.SMTP(SMTP_SETTINGS.get('host'), SMTP_SETTINGS.get('port')) as server:
-                if SMTP_SETTINGS.get('use_tls'):
-                    server.starttls(context=context)
-                if SMTP_SETTINGS.get('username'):
-                    server.login(SMTP_SETTINGS.get('username'), SMTP_SETTINGS.get('password'))
-                server.send_message(msg)
-            # Log success in DB if available
-            try:
-                if hasattr(self, 'db') and self.db:
-                    try:
-                        self.db.save_email_log(to_address, subject, attachment_path, 'SENT', '')
-                    except Exception:
-                        pass
-            except Exception:
-                pass
-            return True, ''
-        except Exception as e:
-            # Log failure in DB if available
-            try:
-                if hasattr(self, 'db') and self.db:
-                    try:
-                        self.db.save_email_log(to_address, subject, attachment_path, 'FAILED', str(e))
-                    except Exception:
-                        pass
-            except Exception:
-                pass
-            return False, str(e) 
+        return send_email(to_address, subject, body, attachment_path, db=getattr(self, 'db', None), action=action, smtp=smtp)
 
     def configure_email_settings(self):
         # Simple dialog to configure SMTP settings
@@ -1454,35 +8557,53 @@ class InvoiceApp(tb.Window):
         from_var = tk.StringVar(value=SMTP_SETTINGS.get('from_email', ''))
         tk.Entry(dlg, textvariable=from_var, width=30).grid(row=5, column=1, padx=6, pady=6)
 
+        tk.Label(dlg, text="PDF Profile:").grid(row=6, column=0, sticky=E, padx=6, pady=6)
+        profile_var = tk.StringVar(value=PDF_SETTINGS.get('profile', 'standard'))
+        ttk.Combobox(dlg, textvariable=profile_var, values=list(PDF_PROFILES), state="readonly", width=18).grid(row=6, column=1, padx=6, pady=6, sticky=W)
+
+        def dialog_smtp():
+            return {'host': host_var.get().strip(), 'port': int(port_var.get()), 'username': user_var.get().strip(),
+                    'password': pass_var.get(), 'use_tls': use_tls_var.get(), 'from_email': from_var.get().strip()}
+
         def save_settings():
-            SMTP_SETTINGS['host'] = host_var.get().strip()
-            SMTP_SETTINGS['port'] = int(port_var.get())
-            SMTP_SETTINGS['username'] = user_var.get().strip()
-            SMTP_SETTINGS['password'] = pass_var.get()
-            SMTP_SETTINGS['use_tls'] = use_tls_var.get()
-            SMTP_SETTINGS['from_email'] = from_var.get().strip()
+            try:
+                smtp = dialog_smtp()
+            except (tk.TclError, ValueError):
+                messagebox.showerror("Invalid Port", "The SMTP port must be a number.", parent=dlg)
+                return
+            # The password stays on this workstation (config file); the rest is shared through the database
+            password = smtp.pop('password')
+            ok, err = self.db.save_settings('smtp', smtp)
+            if ok:
+                ok, err = self.db.save_settings('pdf', {'profile': profile_var.get()})
+            if ok and password != SMTP_SETTINGS.get('password', ''):
+                ok, err = CONFIG.save_file_values('smtp', {'password': password})
+            if not ok:
+                messagebox.showerror("Settings Error", f"Settings were not saved:\n{err}", parent=dlg)
+                return
             dlg.destroy()
-            messagebox.showinfo("Saved", "SMTP settings saved (in memory).")
+            messagebox.showinfo("Saved", "Email settings saved. Other workstations pick them up automatically; "
+                                         f"the password is kept in this workstation's {CONFIG.path} only.")
 
         def send_test():
             tmp_to = user_var.get().strip() or from_var.get().strip()
             if not tmp_to:
                 messagebox.showwarning("Test Email", "Provide a recipient or username to test.")
                 return
-            SMTP_SETTINGS['host'] = host_var.get().strip()
-            SMTP_SETTINGS['port'] = int(port_var.get())
-            SMTP_SETTINGS['username'] = user_var.get().strip()
-            SMTP_SETTINGS['password'] = pass_var.get()
-            SMTP_SETTINGS['use_tls'] = use_tls_var.get()
-            SMTP_SETTINGS['from_email'] = from_var.get().strip()
-            success, err = self.send_email(tmp_to, "Test Email from Nascomsoft", "This is a test email.", None)
+            try:
+                smtp = dialog_smtp()
+            except (tk.TclError, ValueError):
+                messagebox.showerror("Invalid Port", "The SMTP port must be a number.", parent=dlg)
+                return
+            # Test the values as typed, without saving them
+            success, err = self.send_email(tmp_to, "Test Email from Nascomsoft", "This is a test email.", None, smtp=smtp)
             if success:
                 messagebox.showinfo("Success", "Test email sent successfully.")
             else:
                 messagebox.showerror("Error", f"Test email failed: {err}")
 
-        tk.Button(dlg, text="Save", command=save_settings).grid(row=6, column=0, padx=6, pady=8)
-        tk.Button(dlg, text="Send Test", command=send_test).grid(row=6, column=1, padx=6, pady=8, sticky=W)
+        tk.Button(dlg, text="Save", command=save_settings).grid(row=7, column=0, padx=6, pady=8)
+        tk.Button(dlg, text="Send Test", command=send_test).grid(row=7, column=1, padx=6, pady=8, sticky=W)
 
     def send_last_file(self):
         if not getattr(self, 'last_generated_file', None):
@@ -1503,7 +8624,7 @@ class InvoiceApp(tb.Window):
             return
         subj = f"Document {os.path.basename(self.last_generated_file)}"
         body = "Please find attached the requested document."
-        success, err = self.send_email(to_email, subj, body, self.last_generated_file)
+        success, err = self.send_email(to_email, subj, body, self.last_generated_file, action='resend')
         if success:
             messagebox.showinfo("Email Sent", f"File sent to {to_email}")
         else:
@@ -1519,7 +8640,7 @@ class InvoiceApp(tb.Window):
             return
         subj = f"Quotation {self.var_quote_no.get()}"
         body = f"Please find attached quotation {self.var_quote_no.get()}"
-        success, err = self.send_email(to_email, subj, body, self.last_generated_file)
+        success, err = self.send_email(to_email, subj, body, self.last_generated_file, action='resend')
         if success:
             messagebox.showinfo("Email Sent", f"Quotation sent to {to_email}")
         else:
@@ -1584,6 +8705,87 @@ class InvoiceApp(tb.Window):
         tb.Button(btn_frame, text="Close", command=dlg.destroy, bootstyle='danger-outline').pack(side=RIGHT, padx=6)
 
 
+    def show_document_history(self):
+        """Audit trail for the selected document, or the current user's recent activity when nothing is selected."""
+        sel = self.dashboard_tree.selection()
+        doc_number = self.dashboard_tree.item(sel[0], 'values')[0] if sel else None
+        actor = None if doc_number else AUDIT_SETTINGS['actor']
+        dlg = tk.Toplevel(self)
+        dlg.title(f"History - {doc_number}" if doc_number else f"Activity - {actor}")
+        dlg.geometry("820x360")
+        dlg.transient(self)
+
+        frame = tb.Frame(dlg, padding=10)
+        frame.pack(fill=BOTH, expand=True)
+        cols = ("time", "actor", "action", "kind", "number", "details")
+        tree = ttk.Treeview(frame, columns=cols, show='headings')
+        for c, title, w in zip(cols, ["Time", "User", "Action", "Kind", "Document", "Details"], [150, 100, 80, 90, 140, 220]):
+            tree.heading(c, text=title)
+            tree.column(c, width=w, anchor=W)
+        tree.pack(fill=BOTH, expand=True, padx=6, pady=6)
+        for e in self.db.fetch_audit_history(doc_number=doc_number, actor=actor, limit=500):
+            tree.insert('', 'end', values=(e['event_time'], e['actor'], e['action'], e['doc_kind'], e['doc_number'], e['details']))
+        tb.Button(dlg, text="Close", command=dlg.destroy, bootstyle='danger-outline').pack(side=RIGHT, padx=12, pady=6)
+
+    def show_diagnostics(self):
+        dlg = tk.Toplevel(self)
+        dlg.title("Diagnostics - Stage Timings")
+        dlg.geometry("900x420")
+        dlg.transient(self)
+
+        top = tb.Frame(dlg, padding=6)
+        top.pack(fill=X)
+        enabled_var = tk.BooleanVar(value=METRICS.enabled)
+
+        def toggle():
+            if enabled_var.get():
+                METRICS.enable()
+            else:
+                METRICS.disable()
+        tb.Checkbutton(top, text="Instrumentation enabled", variable=enabled_var, command=toggle).pack(side=LEFT, padx=6)
+
+        frame = tb.Frame(dlg, padding=10)
+        frame.pack(fill=BOTH, expand=True)
+        cols = ("stage", "calls", "errors", "avg", "p50", "p95", "max")
+        tree = ttk.Treeview(frame, columns=cols, show='headings')
+        for c, title in zip(cols, ["Stage", "Calls", "Errors", "Avg (ms)", "p50 (ms)", "p95 (ms)", "Max (ms)"]):
+            tree.heading(c, text=title)
+            tree.column(c, width=220 if c == "stage" else 90, anchor=W if c == "stage" else E)
+        tree.pack(fill=BOTH, expand=True, padx=6, pady=6)
+
+        def refresh():
+            for it in tree.get_children():
+                tree.delete(it)
+            for st in METRICS.snapshot()['stages']:
+                tree.insert('', 'end', values=(st['stage'], st['calls'], st['errors'], f"{st['avg_ms']:.2f}",
+                                               f"{st['p50_ms']:.2f}", f"{st['p95_ms']:.2f}", f"{st['max_ms']:.2f}"))
+
+        def reset():
+            METRICS.reset()
+            refresh()
+
+        def export(fmt):
+            ext, ftype, content = ('.prom', ('Prometheus text', '*.prom'), METRICS.to_prometheus) if fmt == 'prom' \
+                else ('.json', ('JSON files', '*.json'), METRICS.to_json)
+            path = filedialog.asksaveasfilename(defaultextension=ext, filetypes=[ftype], title='Export Metrics')
+            if not path:
+                return
+            try:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(content())
+                messagebox.showinfo("Exported", f"Metrics exported to {path}")
+            except Exception as e:
+                messagebox.showerror("Export Error", f"Failed to export: {e}")
+
+        refresh()
+        btn_frame = tb.Frame(dlg, padding=6)
+        btn_frame.pack(fill=X)
+        tb.Button(btn_frame, text="Refresh", command=refresh, bootstyle='secondary').pack(side=LEFT, padx=6)
+        tb.Button(btn_frame, text="Reset", command=reset, bootstyle='warning-outline').pack(side=LEFT, padx=6)
+        tb.Button(btn_frame, text="Export Prometheus", command=lambda: export('prom'), bootstyle='success').pack(side=LEFT, padx=6)
+        tb.Button(btn_frame, text="Export JSON", command=lambda: export('json'), bootstyle='success-outline').pack(side=LEFT, padx=6)
+        tb.Button(btn_frame, text="Close", command=dlg.destroy, bootstyle='danger-outline').pack(side=RIGHT, padx=6)
+
     def generate_invoice(self):
         if not self.cart:
             messagebox.showerror("Error", "Invoice is empty.")
@@ -1606,8 +8808,7 @@ class InvoiceApp(tb.Window):
             messagebox.showerror("Error", "Client Name is required.")
             return
 
-        subtotal, vat, shipping, grand_total = self.calculate_totals()
-        wht_amount = grand_total * (wht_rate / 100)
+        totals = self.calculate_totals()
         
         # Use the invoice number field for the active tab
         invoice_no = self.var_inv_no.get() if self.current_tab == "project" else self.var_inv_no_comp.get()
@@ -1621,22 +8822,26 @@ class InvoiceApp(tb.Window):
             "client_email": client_email,
             "client_address": client_addr,
             "invoice_type": invoice_type,
-            "subtotal": subtotal,
-            "vat": vat,
-            "shipping": shipping,
-            "grand_total": grand_total,
+            "subtotal": totals['subtotal'],
+            "vat": totals['vat'],
+            "shipping": totals['shipping'],
+            "grand_total": totals['grand_total'],
             "wht_rate": wht_rate,
-            "wht": wht_amount
+            "wht": totals['wht'],
+            "taxes": totals['taxes'],
+            "discount": totals['discount'],
+            "currency": self.var_currency.get()
         }
 
-        if self.db.save_invoice(invoice_data):
+        if self.db.save_invoice(invoice_data, self.cart, renumber=True):
+            # Another user may have taken the previewed number; show the one actually saved
+            if self.current_tab == "project":
+                self.var_inv_no.set(invoice_data['invoice_no'])
+            else:
+                self.var_inv_no_comp.set(invoice_data['invoice_no'])
             try:
                 filename = f"Invoice_{invoice_data['invoice_no']}.pdf"
-                pdf = InvoicePDF(filename)
-                pdf.draw_header(invoice_data['invoice_no'], datetime.now().strftime("%d-%b-%Y"))
-                pdf.draw_client_info(invoice_data['client_name'], invoice_data['client_address'])
-                pdf.draw_items_table(self.cart)
-                pdf.draw_footer(invoice_data)
+                render_document_pdf(filename, invoice_data, self.cart, letterhead=self.db.letterhead())
                 
                 # remember last generated file
                 self.last_generated_file = filename
@@ -1676,7 +8881,799 @@ class InvoiceApp(tb.Window):
                 self.refresh_invoice_number()
             except Exception as e:
                 messagebox.showerror("PDF Error", f"An error occurred while generating the PDF: {e}")
+        elif invoice_data.get('stock_shortages'):
+            messagebox.showerror("Not Enough Stock", "The invoice was not saved. Short of:\n" + "\n".join(
+                f"{desc}: wanted {wanted}, {available} in stock" for desc, wanted, available in invoice_data['stock_shortages']))
+        elif invoice_data.get('missing_rate'):
+            messagebox.showerror("No Exchange Rate", f"The invoice was not saved.\n{invoice_data['missing_rate']}")
+        else:
+            messagebox.showerror("Save Error", "The invoice was not saved (see the error log).")
+
+# =============================================================================
+# 10. HTTP API
+# =============================================================================
+
+class ApiError(Exception):
+    """A request the API refuses; `status` is the HTTP status sent back with `message`."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+HTTP_REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+                405: "Method Not Allowed", 409: "Conflict", 411: "Length Required", 413: "Payload Too Large", 422: "Unprocessable Entity",
+                431: "Request Header Fields Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+                504: "Gateway Timeout"}
+
+
+def document_totals(items, shipping=0.0, wht_rate=0.0, currency=None):
+    """Totals for a cart, computed the way the entry forms do (see TaxRules.compute): VAT on the taxable
+    lines, WHT (a percentage) on the grand total or at each line type's own rate. With a `currency`,
+    amounts are rounded to its minor unit. 'taxes' holds the breakdown by rate and 'discount' what the
+    price rules took off the lines (already out of their totals)."""
+    totals = tax_rules().compute(items, shipping, wht_rate, currency)
+    totals['discount'] = round(sum(item.get('discount') or 0 for item in items), 2)
+    return totals
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat(sep=' ') if isinstance(value, datetime) else value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def api_document_request(kind, payload):
+    """Validate a create-invoice/quotation request body. Returns (data, items) shaped like the entry
+    forms' save_invoice/save_quotation arguments; raises ApiError(400) listing every problem."""
+    if not isinstance(payload, dict):
+        raise ApiError(400, "The request body must be a JSON object.")
+    problems = []
+    client_name = payload.get('client_name')
+    if not isinstance(client_name, str) or not client_name.strip():
+        problems.append("client_name is required")
+    invoice_type = payload.get('invoice_type', 'Component') if kind == 'invoices' else 'Quotation'
+    if invoice_type not in ('Project', 'Component', 'Quotation'):
+        problems.append("invoice_type must be 'Project' or 'Component'")
+
+    def number(key, default=0.0, low=0.0, high=None):
+        value = payload.get(key, default)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < low or (high is not None and value > high):
+            problems.append(f"{key} must be a number" + (f" between {low:g} and {high:g}" if high is not None else f" >= {low:g}"))
+            return default
+        return float(value)
+
+    shipping = number('shipping')
+    wht_rate = number('wht_rate', high=100.0) if invoice_type == 'Project' else 0.0  # WHT applies to project work only
+    items = []
+    raw_items = payload.get('items')
+    if not isinstance(raw_items, list) or not raw_items:
+        problems.append("items must be a non-empty list")
+        raw_items = []
+    for idx, item in enumerate(raw_items, start=1):
+        if not isinstance(item, dict) or not isinstance(item.get('desc'), str) or not item['desc'].strip():
+            problems.append(f"items[{idx}].desc is required")
+            continue
+        qty, price = item.get('qty'), item.get('price')
+        if isinstance(qty, bool) or not isinstance(qty, int) or qty < 1:
+            problems.append(f"items[{idx}].qty must be a whole number >= 1")
+            continue
+        if isinstance(price, bool) or not isinstance(price, (int, float)) or price < 0:
+            problems.append(f"items[{idx}].price must be a number >= 0")
+            continue
+        product_id = item.get('product_id')
+        if product_id is not None and (isinstance(product_id, bool) or not isinstance(product_id, int) or product_id < 1):
+            problems.append(f"items[{idx}].product_id must be a catalog id when given")
+            continue
+        items.append({'sn': str(idx), 'desc': item['desc'].strip(), 'type': item.get('type') or invoice_type,
+                      'qty': qty, 'price': float(price), 'total': qty * float(price), 'product_id': product_id})
+    doc_no = payload.get('number')
+    if doc_no is not None and (not isinstance(doc_no, str) or not doc_no.strip()):
+        problems.append("number must be a non-empty string when given")
+    currency = payload.get('currency')
+    if currency is not None and (not isinstance(currency, str) or currency_code(currency) not in CURRENCIES):
+        problems.append(f"currency must be one of {', '.join(CURRENCIES)} when given")
+    if problems:
+        raise ApiError(400, "; ".join(problems))
+    currency = currency_code(currency)
+    data = {'client_name': client_name.strip(), 'client_email': (payload.get('client_email') or '').strip(),
+            'client_address': (payload.get('client_address') or '').strip(), 'invoice_type': invoice_type,
+            'number': doc_no.strip() if doc_no else None, 'currency': currency}
+    data.update(document_totals(items, shipping, wht_rate, currency))
+    return data, items
+
+
+class DatabasePool:
+    """A fixed pool of DatabaseManager connections for the API. Each connection belongs to one
+    worker thread (SQLite connections may not cross threads), so run() hands a job to whichever
+    thread is free and the job gets that thread's connection, scoped to the request's tenant."""
+
+    def __init__(self, size, settings=None):
+        self.size = size
+        self.settings = settings
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="api-db")
+        self._local = threading.local()
+
+    def _manager(self):
+        local = self._local
+        if getattr(local, 'db', None) is None:
+            local.db = DatabaseManager(make_backend(self.settings) if self.settings else None)
+            local.db.audit.settings['actor'] = 'api'
+            local.flushed = time.monotonic()
+        return local.db
+
+    def _call(self, func, tenant_id):
+        db = self._manager()
+        db.tenant_id = tenant_id
+        try:
+            return func(db)
+        finally:
+            # Audit events are still batched, but never held longer than the GUI would hold them
+            now = time.monotonic()
+            if db.audit.pending() and now - self._local.flushed >= AUDIT_SETTINGS['flush_seconds']:
+                db.audit.flush()
+                self._local.flushed = now
+
+    async def run(self, func, tenant_id=DEFAULT_TENANT_ID):
+        """Run func(db) on a pooled connection without blocking the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._call, func, tenant_id)
+
+    def _close_local(self, barrier):
+        barrier.wait()  # holds this thread so every worker gets exactly one close job
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.audit.flush()
+            if db.conn:
+                db.conn.close()
+            self._local.db = None
+
+    def close(self):
+        barrier = threading.Barrier(self.size)
+        for future in [self.executor.submit(self._close_local, barrier) for _ in range(self.size)]:
+            future.result()
+        self.executor.shutdown(wait=True)
+
+
+class HttpRequest:
+    __slots__ = ('method', 'path', 'query', 'headers', 'body', 'keep_alive')
+
+    def __init__(self, method, path, query, headers, body, keep_alive):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+        self.keep_alive = keep_alive
+
+    def param(self, name, default=''):
+        values = self.query.get(name)
+        return values[0].strip() if values else default
+
+
+class ApiServer:
+    """Embedded asyncio HTTP/1.1 JSON API over DatabaseManager and the PDF renderer.
+
+        GET  /api/health
+        GET  /api/metrics                      Prometheus text (when metrics are enabled)
+        GET  /api/{invoices|quotations}        dashboard filters as query parameters, plus page/page_size/summary
+        POST /api/{invoices|quotations}        create; the number is allocated unless the body gives one
+        GET  /api/{invoices|quotations}/NUMBER
+        GET  /api/{invoices|quotations}/NUMBER.pdf[?profile=email-small]
+        GET  /api/invoices/NUMBER/payments
+        POST /api/invoices/NUMBER/payments     {amount, method, reference?}
+        GET  /api/invoices/NUMBER/notes        its credit notes and amendments
+        POST /api/invoices/NUMBER/{credit_notes|amendments}   {items: [{desc, qty, price, type?}], reason}
+        GET  /api/notes/NUMBER.pdf[?profile=email-small]
+        GET  /api/aging[?by=client]            open receivables per aging bucket (or per client)
+
+    The company/branch is chosen with an X-Tenant header (its code). Database work runs on a
+    DatabasePool and rendering on its own thread pool, so the event loop only parses and routes.
+    At most max_pending requests are in progress; further ones are refused at once with 503 and
+    Retry-After rather than queued without bound. Every response carries a Server-Timing header
+    (db, render and total milliseconds), and with metrics enabled each route's latency is recorded
+    under api.<route>.
+
+    Only reads are cut off with 504 after request_timeout: a write already handed to the pool commits
+    whether or not anyone is waiting, so it is always answered. A POST may carry an Idempotency-Key
+    header; a retry with the same key and body gets the original result back (201, with
+    Idempotent-Replayed: true) instead of writing again, and reusing the key for another request is refused with 422.
+    """
+
+    ROUTES = (
+        ('GET', re.compile(r'/api/health'), 'health'),
+        ('GET', re.compile(r'/api/metrics'), 'metrics'),
+        ('GET', re.compile(r'/api/(invoices|quotations)'), 'list_documents'),
+        ('POST', re.compile(r'/api/(invoices|quotations)'), 'create_document'),
+        ('GET', re.compile(r'/api/(invoices|quotations)/([^/]+)\.pdf'), 'document_pdf'),
+        ('GET', re.compile(r'/api/(invoices|quotations)/([^/]+)'), 'get_document'),
+        ('GET', re.compile(r'/api/invoices/([^/]+)/payments'), 'list_payments'),
+        ('POST', re.compile(r'/api/invoices/([^/]+)/payments'), 'create_payment'),
+        ('GET', re.compile(r'/api/invoices/([^/]+)/notes'), 'list_notes'),
+        ('POST', re.compile(r'/api/invoices/([^/]+)/(credit_notes|amendments)'), 'create_note'),
+        ('GET', re.compile(r'/api/notes/([^/]+)\.pdf'), 'note_pdf'),
+        ('GET', re.compile(r'/api/aging'), 'aging'),
+    )
+    LIST_FILTERS = ('invoice_no', 'client_name', 'invoice_type', 'date_from', 'date_to', 'balance')
+    IDEMPOTENCY_KEY_LENGTH = 96  # import_keys.idem_key holds 100, less the 'api:' prefix
+
+    def __init__(self, settings=None, db_settings=None):
+        self.settings = dict(API_SETTINGS, **(settings or {}))
+        self.db_settings = db_settings
+        self.pool = None
+        self.render_executor = None
+        self.server = None
+        self.port = None
+        self.in_flight = 0
+        self.rejected = 0
+        self._tenant_ids = {}
+        self._connections = set()
+
+    async def start(self):
+        self.pool = DatabasePool(self.settings['db_connections'], self.db_settings)
+        self.render_executor = ThreadPoolExecutor(max_workers=self.settings['render_workers'], thread_name_prefix="api-render")
+        if await self.pool.run(lambda db: db.create_tables()) is False:
+            raise RuntimeError("The database could not be reached or migrated (see log).")
+        self.server = await asyncio.start_server(self.handle_connection, self.settings['host'], self.settings['port'])
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"API listening on http://{self.settings['host']}:{self.port}/api")
+        return self
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+            for writer in list(self._connections):
+                writer.close()  # idle keep-alive readers see EOF and finish
+            await self.server.wait_closed()
+        loop = asyncio.get_running_loop()
+        if self.render_executor:
+            self.render_executor.shutdown(wait=False)
+        if self.pool:
+            await loop.run_in_executor(None, self.pool.close)
+
+    # ------------------- HTTP plumbing -------------------
+    async def handle_connection(self, reader, writer):
+        self._connections.add(writer)
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except ApiError as e:
+                    await self.write_response(writer, e.status, {'error': e.message}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                status, body, headers = await self.dispatch(request)
+                await self.write_response(writer, status, body, headers, request.keep_alive)
+                if not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def read_request(self, reader):
+        """Parse one request from a keep-alive connection; None when the client has closed it."""
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if e.partial.strip():
+                raise ApiError(400, "Incomplete request.")
+            return None
+        except asyncio.LimitOverrunError:
+            raise ApiError(431, "Request headers are too large.")
+        lines = head.decode('latin-1').split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            raise ApiError(400, "Malformed request line.")
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise ApiError(411, "Send a Content-Length instead of a chunked body.")
+        try:
+            length = int(headers.get('content-length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            raise ApiError(400, "Invalid Content-Length.")
+        if length > self.settings['max_body_kb'] * 1024:
+            raise ApiError(413, f"Request bodies are limited to {self.settings['max_body_kb']} KB.")
+        body = await reader.readexactly(length) if length else b""
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+        url = urlsplit(target)
+        return HttpRequest(method.upper(), unquote(url.path).rstrip('/') or '/', parse_qs(url.query), headers, body, keep_alive)
+
+    async def write_response(self, writer, status, body, headers=None, keep_alive=True):
+        headers = dict(headers or {})
+        if isinstance(body, (bytes, bytearray)):
+            payload = bytes(body)
+        else:
+            payload = json.dumps(body, default=_json_default).encode('utf-8')
+            headers.setdefault('Content-Type', 'application/json')
+        headers['Content-Length'] = str(len(payload))
+        headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+        head = f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+        writer.write(head.encode('latin-1') + b"\r\n" + payload)
+        await writer.drain()  # a slow reader holds up its own connection, not the server
+
+    async def dispatch(self, request):
+        """Route one request. Returns (status, body, headers)."""
+        started = time.perf_counter()
+        if self.in_flight >= self.settings['max_pending']:
+            self.rejected += 1
+            METRICS.inc("api_rejected_total", "api")
+            return 503, {'error': "Server busy, retry shortly."}, {'Retry-After': '1'}
+        self.in_flight += 1
+        timings = {}
+        route = 'unmatched'
+        headers = {}
+        try:
+            token = self.settings['token']
+            if token and request.headers.get('authorization') != f"Bearer {token}":
+                raise ApiError(401, "Missing or wrong API token.")
+            handler, match, allowed = None, None, False
+            for method, pattern, name in self.ROUTES:
+                found = pattern.fullmatch(request.path)
+                if found:
+                    allowed = True
+                    if method == request.method:
+                        handler, match, route = getattr(self, name), found, name
+                        break
+            if handler is None:
+                raise ApiError(405 if allowed else 404, "Method not allowed." if allowed else "No such endpoint.")
+            call = handler(request, *match.groups(), timings=timings)
+            if request.method == 'GET':
+                call = asyncio.wait_for(call, self.settings['request_timeout'])
+            status, body, extra = await call
+            headers.update(extra)
+        except ApiError as e:
+            status, body = e.status, {'error': e.message}
+        except asyncio.TimeoutError:
+            status, body = 504, {'error': "The request took too long."}
+        except Exception as e:
+            log_error(f"api.{route}", f"{request.method} {request.path} failed", e)
+            status, body = 500, {'error': "Internal error (see server log)."}
+        finally:
+            self.in_flight -= 1
+        elapsed = time.perf_counter() - started
+        timings['total'] = elapsed
+        headers['Server-Timing'] = ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items())
+        if METRICS.enabled:
+            METRICS.observe(f"api.{route}", elapsed)
+            if status >= 500:
+                METRICS.inc("errors_total", f"api.{route}")
+        return status, body, headers
+
+    async def timed(self, timings, stage, awaitable):
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
+
+    async def tenant_for(self, request, timings):
+        """The tenant id named by the X-Tenant header (a company/branch code), cached per code."""
+        code = request.headers.get('x-tenant') or APP_SETTINGS['tenant']
+        if not code:
+            return DEFAULT_TENANT_ID
+        tenant_id = self._tenant_ids.get(code)
+        if tenant_id is None:
+            tenant_id = await self.timed(timings, 'db', self.pool.run(lambda db: db.tenant_id if db.use_tenant(code) else None))
+            if tenant_id is None:
+                raise ApiError(404, f"Unknown company/branch {code!r}.")
+            self._tenant_ids[code] = tenant_id
+        return tenant_id
+
+    def idempotency_key(self, request):
+        """(key, content_hash) for the request's Idempotency-Key header, or None. Keys share import_keys with
+        bulk imports under an 'api:' prefix; the hash covers the path and body."""
+        key = (request.headers.get('idempotency-key') or '').strip()
+        if not key:
+            return None
+        if len(key) > self.IDEMPOTENCY_KEY_LENGTH:
+            raise ApiError(400, f"Idempotency-Key must be at most {self.IDEMPOTENCY_KEY_LENGTH} characters.")
+        return f"api:{key}", hashlib.sha1(request.path.encode('utf-8') + b"\n" + (request.body or b"")).hexdigest()
+
+    @staticmethod
+    def replayed(db, idem_key):
+        """What an earlier request with this idempotency key created (its doc_number), or None. Raises ApiError
+        (422) when the key was used for a different request."""
+        if not idem_key:
+            return None
+        done = db.fetch_import_keys([idem_key[0]]).get(idem_key[0])
+        if done and done[1] != idem_key[1]:
+            raise ApiError(422, "This Idempotency-Key was already used for a different request.")
+        return done[0] if done else None
+
+    # ------------------- Endpoints -------------------
+    async def health(self, request, timings):
+        return 200, {'status': 'ok', 'in_flight': self.in_flight, 'rejected': self.rejected}, {}
+
+    async def metrics(self, request, timings):
+        return 200, METRICS.to_prometheus().encode('utf-8'), {'Content-Type': 'text/plain; version=0.0.4'}
+
+    async def list_documents(self, request, kind, timings):
+        filters = {name: request.param(name) for name in self.LIST_FILTERS}
+        try:
+            for name in ('date_from', 'date_to'):
+                if filters[name]:
+                    filters[name] = datetime.strptime(filters[name], "%Y-%m-%d").date()
+            page = int(request.param('page', '1'))
+            page_size = int(request.param('page_size', str(APP_SETTINGS['page_size'])))
+        except ValueError:
+            raise ApiError(400, "Dates must be YYYY-MM-DD and page/page_size whole numbers.")
+        if filters['balance']:
+            try:
+                balance_condition(filters['balance'])
+            except ValueError:
+                raise ApiError(400, f"balance must be unpaid, paid or one of {', '.join(AGING_BUCKETS)}.")
+        if page < 1 or not 1 <= page_size <= self.settings['max_page_size']:
+            raise ApiError(400, f"page must be >= 1 and page_size between 1 and {self.settings['max_page_size']}.")
+        with_summary = request.param('summary') in ('1', 'true', 'yes')
+        fetch = DatabaseManager.fetch_invoices if kind == 'invoices' else DatabaseManager.fetch_quotations
+        tenant_id = await self.tenant_for(request, timings)
+
+        def work(db):
+            rows = fetch(db, filters, page, page_size)
+            return rows, (db.summarize_documents(kind, filters) if with_summary else None)
+        rows, summary = await self.timed(timings, 'db', self.pool.run(work, tenant_id))
+        body = {'kind': kind, 'page': page, 'page_size': page_size, 'rows': [row.to_dict() for row in rows]}
+        if kind == 'quotations':
+            for row in body['rows']:
+                row['quote_no'] = row.pop('invoice_no')  # named as in fetch_document and the create response
+                del row['balance_due']
+        if summary is not None:
+            body['summary'] = summary
+        return 200, body, {}
+
+    async def create_document(self, request, kind, timings):
+        try:
+            payload = json.loads(request.body or b"null")
+        except ValueError:
+            raise ApiError(400, "The request body is not valid JSON.")
+        data, items = api_document_request(kind, payload)
+        number_key = 'invoice_no' if kind == 'invoices' else 'quote_no'
+        idem_key = self.idempotency_key(request)
+        tenant_id = await self.tenant_for(request, timings)
+
+        def work(db):
+            done = self.replayed(db, idem_key)
+            if done:
+                return done, 'replay'
+            if db.price_items(items, data['client_name'], data['currency']):
+                data.update(document_totals(items, data['shipping'], data['wht_rate'], data['currency']))
+            given = data.pop('number')
+            if given:
+                data[number_key] = given
+            else:
+                data[number_key] = db.generate_invoice_number() if kind == 'invoices' else db.generate_quotation_number()
+            save = db.save_invoice if kind == 'invoices' else db.save_quotation
+            if save(data, items, renumber=not given, idem_key=idem_key):
+                return data[number_key], ''
+            done = self.replayed(db, idem_key)  # a retry with the same key saved it first
+            if done:
+                return done, 'replay'
+            if data.get('stock_shortages'):
+                return None, 'short'
+            if data.get('missing_rate'):
+                return None, 'rate'
+            if given and db.fetch_document(kind, given):
+                return None, 'taken'
+            return None, 'failed'
+        number, err = await self.timed(timings, 'db', self.pool.run(work, tenant_id))
+        if err == 'replay':
+            doc = await self.fetch(request, kind, number, timings)
+            # Lines no price rule lowered were answered without list_price/discount/price_rule
+            items = [{k: v for k, v in item.items() if item['price_rule'] or k not in ('list_price', 'discount', 'price_rule')}
+                     for item in doc['items']]
+            return 201, self.document_body(kind, doc, items), {'Location': f"/api/{kind}/{number}", 'Idempotent-Replayed': 'true'}
+        if err == 'taken':
+            raise ApiError(409, f"{data[number_key]} already exists.")
+        if err == 'short':
+            raise ApiError(409, str(StockShortage(data['stock_shortages'])))
+        if err == 'rate':
+            raise ApiError(409, data['missing_rate'])
+        if not number:
+            raise ApiError(500, "The document could not be saved (see server log).")
+        return 201, self.document_body(kind, data, items), {'Location': f"/api/{kind}/{number}"}
+
+    @staticmethod
+    def document_body(kind, data, items):
+        """The create response for a saved document (the saved data, or fetch_document's on a replay)."""
+        number_key = 'invoice_no' if kind == 'invoices' else 'quote_no'
+        location = f"/api/{kind}/{data[number_key]}"
+        return {'kind': kind, number_key: data[number_key], 'currency': data['currency'], 'exchange_rate': data['exchange_rate'],
+                'totals': {k: data[k] for k in ('subtotal', 'discount', 'vat', 'shipping', 'wht_rate', 'wht', 'grand_total')}, 'taxes': data['taxes'],
+                'items': [{k: item[k] for k in ('sn', 'price', 'total', 'list_price', 'discount', 'price_rule') if k in item} for item in items],
+                'links': {'self': location, 'pdf': location + ".pdf"}}
+
+    async def fetch(self, request, kind, number, timings, with_letterhead=False):
+        tenant_id = await self.tenant_for(request, timings)
+
+        def work(db):
+            doc = db.fetch_document(kind, number)
+            if doc and with_letterhead:
+                doc['letterhead'] = db.letterhead()
+            return doc
+        doc = await self.timed(timings, 'db', self.pool.run(work, tenant_id))
+        if doc is None:
+            raise ApiError(404, f"{number} was not found.")
+        return doc
+
+    async def get_document(self, request, kind, number, timings):
+        return 200, await self.fetch(request, kind, number, timings), {}
+
+    async def list_payments(self, request, number, timings):
+        doc = await self.fetch(request, 'invoices', number, timings)
+        tenant_id = await self.tenant_for(request, timings)
+        payments = await self.timed(timings, 'db', self.pool.run(lambda db: db.fetch_payments(number), tenant_id))
+        return 200, {'invoice_no': number, 'amount_paid': doc['amount_paid'], 'balance_due': doc['balance_due'], 'payments': payments}, {}
+
+    async def create_payment(self, request, number, timings):
+        try:
+            payload = json.loads(request.body or b"null")
+        except ValueError:
+            raise ApiError(400, "The request body is not valid JSON.")
+        if not isinstance(payload, dict):
+            raise ApiError(400, "The request body must be a JSON object.")
+        amount = payload.get('amount')
+        if isinstance(amount, bool) or not isinstance(amount, (int, float)):
+            raise ApiError(400, "amount must be a number.")
+        idem_key = self.idempotency_key(request)
+        tenant_id = await self.tenant_for(request, timings)
+
+        def work(db):
+            done = self.replayed(db, idem_key)
+            payment_id, err = (int(done), '') if done else \
+                db.record_payment(number, amount, payload.get('method'), payload.get('reference') or '', idem_key=idem_key)
+            if not payment_id:
+                done = self.replayed(db, idem_key)  # a retry with the same key recorded it first
+                payment_id = int(done) if done else None
+            return payment_id, err, bool(done), db.fetch_document('invoices', number) if payment_id else None
+        payment_id, err, replay, doc = await self.timed(timings, 'db', self.pool.run(work, tenant_id))
+        if not payment_id:
+            raise ApiError(404 if "not a live invoice" in err else 422, err)
+        location = f"/api/invoices/{number}/payments"
+        headers = {'Location': location, **({'Idempotent-Replayed': 'true'} if replay else {})}
+        return 201, {'id': payment_id, 'invoice_no': number, 'amount_paid': doc['amount_paid'], 'balance_due': doc['balance_due'],
+                     'links': {'payments': location, 'invoice': f"/api/invoices/{number}"}}, headers
+
+    async def list_notes(self, request, number, timings):
+        doc = await self.fetch(request, 'invoices', number, timings)
+        tenant_id = await self.tenant_for(request, timings)
+        notes = await self.timed(timings, 'db', self.pool.run(lambda db: db.fetch_invoice_notes(number), tenant_id))
+        return 200, {'invoice_no': number, 'adjusted': doc['adjusted'], 'balance_due': doc['balance_due'], 'notes': notes}, {}
+
+    async def create_note(self, request, number, kind, timings):
+        try:
+            payload = json.loads(request.body or b"null")
+        except ValueError:
+            raise ApiError(400, "The request body is not valid JSON.")
+        if not isinstance(payload, dict) or not isinstance(payload.get('items'), list):
+            raise ApiError(400, "The request body must be a JSON object with an items list.")
+        if not all(isinstance(item, dict) for item in payload['items']):
+            raise ApiError(400, "Each item must be a JSON object.")
+        idem_key = self.idempotency_key(request)
+        tenant_id = await self.tenant_for(request, timings)
+
+        def work(db):
+            done = self.replayed(db, idem_key)
+            if not done:
+                note, err = db.issue_invoice_note(kind, number, payload['items'], payload.get('reason'), idem_key=idem_key)
+                if note:
+                    return note, err, False
+                done = self.replayed(db, idem_key)  # a retry with the same key issued it first
+                if not done:
+                    return note, err, False
+            note = db.fetch_invoice_note(done)
+            note['balance_due'] = db.fetch_document('invoices', number)['balance_due']
+            return note, '', True
+        note, err, replay = await self.timed(timings, 'db', self.pool.run(work, tenant_id))
+        if not note:
+            raise ApiError(404 if "not a live invoice" in err else 422, err)
+        location = f"/api/notes/{note['note_no']}.pdf"
+        headers = {'Location': location, **({'Idempotent-Replayed': 'true'} if replay else {})}
+        return 201, dict(note, links={'pdf': location, 'invoice': f"/api/invoices/{number}", 'notes': f"/api/invoices/{number}/notes"}), headers
+
+    async def note_pdf(self, request, number, timings):
+        profile = request.param('profile') or None
+        if profile and profile not in PDF_PROFILES:
+            raise ApiError(400, f"Unknown PDF profile {profile!r}; choose from {', '.join(PDF_PROFILES)}.")
+        tenant_id = await self.tenant_for(request, timings)
+
+        def work(db):
+            note = db.fetch_invoice_note(number)
+            if note:
+                note['letterhead'] = db.letterhead()
+            return note
+        note = await self.timed(timings, 'db', self.pool.run(work, tenant_id))
+        if note is None:
+            raise ApiError(404, f"{number} was not found.")
+        doc_type, name = note_pdf(note)
+        date_str = datetime.strptime(_format_timestamp(note['date_issued'])[:10], "%Y-%m-%d").strftime("%d-%b-%Y")
+
+        def render():
+            buf = io.BytesIO()
+            render_document_pdf(buf, note, note['items'], doc_type, date_str, profile, note['letterhead'])
+            return buf.getvalue()
+        pdf = await self.timed(timings, 'render', asyncio.get_running_loop().run_in_executor(self.render_executor, render))
+        return 200, pdf, {'Content-Type': 'application/pdf', 'Content-Disposition': f'inline; filename="{name}"'}
+
+    async def aging(self, request, timings):
+        by_client = request.param('by') == 'client'
+        tenant_id = await self.tenant_for(request, timings)
+        if by_client:
+            rows = await self.timed(timings, 'db', self.pool.run(lambda db: db.aging_by_client(), tenant_id))
+            return 200, {'as_of': date.today().isoformat(), 'buckets': list(AGING_BUCKETS), 'clients': [
+                {'client_name': client, 'open_invoices': count, 'balances': dict(zip(AGING_BUCKETS, balances)), 'total': total}
+                for client, count, balances, total in rows]}, {}
+        summary = await self.timed(timings, 'db', self.pool.run(lambda db: db.aging_summary(), tenant_id))
+        return 200, {'as_of': date.today().isoformat(), 'buckets': summary}, {}
+
+    async def document_pdf(self, request, kind, number, timings):
+        profile = request.param('profile') or None
+        if profile and profile not in PDF_PROFILES:
+            raise ApiError(400, f"Unknown PDF profile {profile!r}; choose from {', '.join(PDF_PROFILES)}.")
+        doc = await self.fetch(request, kind, number, timings, with_letterhead=True)
+        doc_type = "QUOTATION" if kind == 'quotations' else "INVOICE"
+        date_str = datetime.strptime(_format_timestamp(doc['date_issued'])[:10], "%Y-%m-%d").strftime("%d-%b-%Y")
+
+        def render():
+            buf = io.BytesIO()
+            render_document_pdf(buf, doc, doc['items'], doc_type, date_str, profile, doc['letterhead'])
+            return buf.getvalue()
+        pdf = await self.timed(timings, 'render', asyncio.get_running_loop().run_in_executor(self.render_executor, render))
+        name = f"{'Quotation' if kind == 'quotations' else 'Invoice'}_{number}.pdf"
+        return 200, pdf, {'Content-Type': 'application/pdf', 'Content-Disposition': f'inline; filename="{name}"'}
+
+
+async def serve_api(settings=None, db_settings=None):
+    """Run the API until cancelled (Ctrl+C)."""
+    server = await ApiServer(settings, db_settings).start()
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
 
 if __name__ == "__main__":
+    configure_logging()
+    if os.environ.get("NASCOMSOFT_METRICS") == "1":
+        METRICS.enable()
+    if "--check-config" in sys.argv:
+        # Validate file + environment (+ database, when reachable) without starting anything
+        db = DatabaseManager()
+        _, error = CONFIG.reload(db)
+        print(error or f"Configuration OK (layers: {', '.join(CONFIG.snapshot.sources) or 'defaults only'})")
+        sys.exit(1 if error else 0)
+    if "--import" in sys.argv:
+        # Headless bulk import: INVOICE_GENERATOR.py --import FILE [--tenant CODE] [--errors FILE]
+        #                                            [--client-map FILE] [--dry-run]
+        def option(name):
+            return sys.argv[sys.argv.index(name) + 1] if name in sys.argv and sys.argv.index(name) + 1 < len(sys.argv) else None
+        db = DatabaseManager()
+        CONFIG.reload(db)
+        if not db.get_connection():
+            sys.exit("The database could not be reached.")
+        db.create_tables()
+        if option("--tenant") and not db.use_tenant(option("--tenant")):
+            sys.exit(f"Unknown company/branch {option('--tenant')!r}")
+        client_map = ClientMapper(db.fetch_client_names(), read_client_map(option("--client-map"))) if option("--client-map") else None
+        importer = InvoiceImporter(db, client_map=client_map, errors_path=option("--errors") or "import_errors.csv",
+                                   dry_run="--dry-run" in sys.argv)
+        stats = importer.run(option("--import"), progress=lambda st: print(
+            f"\r{st['documents']:,} read, {st['imported']:,} imported, {st['skipped']:,} skipped, {st['rejected']:,} rejected "
+            f"({st['documents'] / max(st['seconds'], 1e-9):,.0f} docs/s)", end="", flush=True))
+        print()
+        if stats['rejected']:
+            print(f"Rejected rows are listed in {importer.errors_path}")
+        sys.exit(1 if stats['rejected'] else 0)
+    if "--reconcile" in sys.argv:
+        # Match a bank statement to open invoices: INVOICE_GENERATOR.py --reconcile FILE [--tenant CODE]
+        #                                          [--review FILE] [--window DAYS] [--dry-run]
+        def option(name):
+            return sys.argv[sys.argv.index(name) + 1] if name in sys.argv and sys.argv.index(name) + 1 < len(sys.argv) else None
+        db = DatabaseManager()
+        CONFIG.reload(db)
+        if not db.get_connection():
+            sys.exit("The database could not be reached.")
+        db.create_tables()
+        if option("--tenant") and not db.use_tenant(option("--tenant")):
+            sys.exit(f"Unknown company/branch {option('--tenant')!r}")
+        reconciler = StatementReconciler(db, date_window=int(option("--window")) if option("--window") else None,
+                                         review_path=option("--review") or "reconcile_review.csv", dry_run="--dry-run" in sys.argv)
+        stats = reconciler.run(option("--reconcile"), progress=lambda st: print(
+            f"\r{st['lines']:,} credits read, {st['matched']:,} matched, {st['skipped']:,} skipped, {st['review']:,} to review "
+            f"({st['lines'] / max(st['seconds'], 1e-9):,.0f} lines/s)", end="", flush=True))
+        print()
+        print(f"{stats['payments']:,} payments totalling {format_money(stats['amount'])} "
+              f"({stats['by_reference']:,} lines by invoice number, {stats['by_amount']:,} by amount) "
+              f"against {stats['open_invoices']:,} open invoices")
+        if stats['review']:
+            print(f"Lines to review are listed in {reconciler.review_path}")
+        sys.exit(0)
+    if "--import-products" in sys.argv:
+        # Load or update the product catalog: INVOICE_GENERATOR.py --import-products FILE
+        db = DatabaseManager()
+        CONFIG.reload(db)
+        if not db.get_connection():
+            sys.exit("The database could not be reached.")
+        db.create_tables()
+        created, updated, rejected = db.import_products(iter_product_rows(sys.argv[sys.argv.index("--import-products") + 1]))
+        db.audit.flush()
+        print(f"{created:,} products created, {updated:,} updated, {len(rejected):,} rejected")
+        for row_number, sku, error in rejected:
+            print(f"  row {row_number} {sku}: {error}")
+        sys.exit(1 if rejected else 0)
+    if "--import-rates" in sys.argv:
+        # Enter exchange rates from a CSV (currency, date, rate): INVOICE_GENERATOR.py --import-rates FILE
+        db = DatabaseManager()
+        CONFIG.reload(db)
+        if not db.get_connection():
+            sys.exit("The database could not be reached.")
+        db.create_tables()
+        saved, rejected = db.save_exchange_rates(iter_rate_rows(sys.argv[sys.argv.index("--import-rates") + 1]))
+        db.audit.flush()
+        print(f"{saved:,} rates saved, {len(rejected):,} rejected")
+        for row_number, error in rejected:
+            print(f"  row {row_number}: {error}")
+        sys.exit(1 if rejected else 0)
+    if "--import-price-rules" in sys.argv:
+        # Create or change price rules from a CSV (code, sku, client, kind, value, min_qty, starts_on, ends_on, active):
+        # INVOICE_GENERATOR.py --import-price-rules FILE
+        db = DatabaseManager()
+        CONFIG.reload(db)
+        if not db.get_connection():
+            sys.exit("The database could not be reached.")
+        db.create_tables()
+        saved, rejected = db.save_price_rules(iter_price_rule_rows(sys.argv[sys.argv.index("--import-price-rules") + 1]))
+        db.audit.flush()
+        print(f"{saved:,} price rules saved, {len(rejected):,} rejected")
+        for row_number, error in rejected:
+            print(f"  row {row_number}: {error}")
+        sys.exit(1 if rejected else 0)
+    if "--aging-report" in sys.argv:
+        # Receivables aging per client as CSV: INVOICE_GENERATOR.py --aging-report FILE [--tenant CODE]
+        idx = sys.argv.index("--aging-report")
+        db = DatabaseManager()
+        CONFIG.reload(db)
+        if not db.get_connection():
+            sys.exit("The database could not be reached.")
+        db.create_tables()
+        if "--tenant" in sys.argv and not db.use_tenant(sys.argv[sys.argv.index("--tenant") + 1]):
+            sys.exit(f"Unknown company/branch {sys.argv[sys.argv.index('--tenant') + 1]!r}")
+        clients = write_aging_csv(sys.argv[idx + 1], db.aging_by_client())
+        total = db.aging_summary()['Total']
+        print(f"{clients:,} clients owe {format_money(total['balance'])} on {total['count']:,} invoices")
+        sys.exit(0)
+    if "--serve-api" in sys.argv:
+        # Headless HTTP/JSON API: INVOICE_GENERATOR.py --serve-api [port]
+        idx = sys.argv.index("--serve-api")
+        CONFIG.reload(DatabaseManager())
+        port = int(sys.argv[idx + 1]) if len(sys.argv) > idx + 1 else None
+        try:
+            asyncio.run(serve_api({'port': port} if port is not None else None))
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+    if "--archive" in sys.argv:
+        # Headless archive run for schedulers: INVOICE_GENERATOR.py --archive [retention_days]
+        idx = sys.argv.index("--archive")
+        days = int(sys.argv[idx + 1]) if len(sys.argv) > idx + 1 else None
+        db = DatabaseManager()
+        CONFIG.reload(db)
+        moved = DocumentArchiver(db).run(days)
+        db.audit.flush()
+        logger.info(f"Archived {moved} documents")
+        sys.exit(0)
     app = InvoiceApp()
     app.mainloop()
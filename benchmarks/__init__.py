@@ -0,0 +1,7 @@
+"""Headless performance benchmarks for the Nascomsoft billing pipeline.
+
+Run from the repository root:
+
+    python -m benchmarks.run --scale 10000 --output bench_results.json
+    python -m benchmarks.compare old.json new.json
+"""
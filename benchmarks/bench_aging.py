@@ -0,0 +1,86 @@
+"""Receivables aging: the pre-aggregated report against the same totals computed from the invoices, the
+dashboard balance filters, and record_payment latency (which keeps the aggregate current)."""
+
+from benchmarks import bench_db
+from benchmarks.harness import measure
+
+SUITE = "aging"
+PAID_SHARE = 5  # every 5th seeded invoice stays open, the rest are settled
+
+
+def naive_aging(app, db, by_client):
+    """The aging totals straight from the invoices table (what the report would cost without the receivables aggregates)."""
+    columns, params = [], []
+    for label in app.AGING_BUCKETS:
+        start, end = (app.date_bound(d, end_of_day=i == 1) if d else None for i, d in enumerate(app.aging_range(label)))
+        cond = "date_issued <= %s" if start is None else "date_issued >= %s AND date_issued <= %s"
+        columns.append(f"SUM(CASE WHEN {cond} THEN balance_due ELSE 0 END)")
+        params.extend([end] if start is None else [start, end])
+    sql = (f"SELECT {'client_name, ' if by_client else ''}COUNT(*), {', '.join(columns)} FROM invoices "
+           "WHERE tenant_id = %s AND deleted_at IS NULL AND balance_due > 0")
+    if by_client:
+        sql += " GROUP BY client_name ORDER BY SUM(balance_due) DESC"
+    db.cursor.execute(sql, (*params, db.tenant_id))
+    return db.cursor.fetchall()
+
+
+def settle_most(db):
+    """Mark all but every PAID_SHARE-th synthetic invoice as paid in full, then rebuild the aggregate."""
+    db.cursor.execute("UPDATE invoices SET amount_paid = 0, balance_due = grand_total - COALESCE(wht_amount, 0) "
+                      "WHERE invoice_number LIKE %s", ("BENCH-INV-%",))
+    db.cursor.execute(f"UPDATE invoices SET amount_paid = balance_due, balance_due = 0 WHERE invoice_number LIKE %s AND id % {PAID_SHARE} <> 0",
+                      ("BENCH-INV-%",))
+    db.rebuild_receivables()
+    db.conn.commit()
+
+
+def run(app, recorder, config):
+    db = config.get("db")
+    if db is None:
+        recorder.skip(SUITE, "aging_summary", config.get("db_unavailable", "no database"))
+        return
+    scale, repeat = config["scale"], config["repeat"]
+    db.create_tables()
+    bench_db.ensure_seeded(db, scale, config["seed"], config.get("reseed", False))
+    settle_most(db)
+    aggregate_rows = {}
+    for table, _ in app.RECEIVABLES_TABLES:
+        db.cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE tenant_id = %s", (db.tenant_id,))
+        aggregate_rows[table] = db.cursor.fetchone()[0]
+    open_invoices = db.aging_summary()["Total"]["count"]
+    params = {"invoices": scale, "open_invoices": open_invoices, "daily_rows": aggregate_rows["receivables_daily"],
+              "client_day_rows": aggregate_rows["receivables_by_client"]}
+
+    stats = measure(lambda: db.aging_summary(), repeat=repeat * 4)
+    recorder.add(SUITE, "aging_summary [receivables_daily]", stats, **params)
+    stats = measure(lambda: naive_aging(app, db, False), repeat=repeat)
+    recorder.add(SUITE, "aging totals [scan invoices, baseline]", stats, **params)
+    stats = measure(lambda: db.aging_by_client(), repeat=repeat * 4)
+    recorder.add(SUITE, "aging_by_client [receivables_by_client]", stats, **params)
+    stats = measure(lambda: naive_aging(app, db, True), repeat=repeat)
+    recorder.add(SUITE, "aging by client [scan invoices, baseline]", stats, **params)
+
+    for label in ("Unpaid", "90+ days"):
+        filters = {"balance": label}
+        stats = measure(lambda: db.fetch_invoices(filters, page=1, page_size=25), repeat=repeat * 4)
+        recorder.add(SUITE, f"fetch_invoices [balance={label}]", stats, **params)
+
+        def summary():
+            db.invalidate_summaries()
+            return db.summarize_documents("invoices", filters)
+        stats = measure(summary, repeat=repeat)
+        recorder.add(SUITE, f"summarize_documents [balance={label}]", stats, **params)
+
+    numbers = [row["invoice_no"] for row in db.fetch_invoices({"balance": "Unpaid"}, page=1, page_size=repeat * 4 + 1)]
+    pending = iter(numbers)
+
+    def pay():
+        payment_id, err = db.record_payment(next(pending), 1, "Transfer", "bench")
+        assert payment_id, err
+    stats = measure(pay, repeat=len(numbers) - 1)
+    recorder.add(SUITE, "record_payment (partial)", stats, **params)
+    db.audit.flush()
+    incremental = db.aging_summary()
+    db.rebuild_receivables()
+    db.conn.commit()
+    assert db.aging_summary() == incremental, "payments kept the aggregate equal to a rebuild"
@@ -0,0 +1,45 @@
+"""Product catalog: full load into ProductCatalog, autocomplete lookups and an incremental refresh after one save."""
+
+from benchmarks import datagen
+from benchmarks.harness import measure
+
+SUITE = "catalog"
+PRODUCT_PREFIX = "BENCH-SKU"
+QUERIES = [("exact SKU", f"{PRODUCT_PREFIX}-000123"), ("one letter", "a"), ("one word", "sensor"),
+           ("two words", "relay 4"), ("no match", "zzzz")]
+
+
+def run(app, recorder, config):
+    db = config.get("db")
+    if db is None:
+        recorder.skip(SUITE, "ProductCatalog", config.get("db_unavailable", "no database"))
+        return
+    scale, repeat = config["scale"], config["repeat"]
+    db.cursor.execute("DELETE FROM products WHERE sku LIKE %s", (PRODUCT_PREFIX + "-%",))
+    db.conn.commit()
+    try:
+        created, _, _ = db.import_products(datagen.iter_products(scale, config["seed"], prefix=PRODUCT_PREFIX))
+        catalog = app.ProductCatalog()
+        stats = measure(lambda: catalog.load(db), repeat=max(1, repeat // 2), units=created)
+        recorder.add(SUITE, "ProductCatalog.load", stats, products=created)
+
+        for label, text in QUERIES:
+            stats = measure(lambda: catalog.search(text, limit=12), repeat=repeat * 20)
+            recorder.add(SUITE, f"ProductCatalog.search [{label}]", stats, products=created,
+                         matches=len(catalog.search(text, limit=12)))
+
+        product = catalog.by_sku(f"{PRODUCT_PREFIX}-000001")
+        state = {"price": product.unit_price}
+
+        def save_and_refresh():
+            state["price"] += 1
+            db.save_product({"id": product.id, "sku": product.sku, "description": product.description,
+                             "unit_price": state["price"], "vat": product.vat})
+            catalog.refresh(db)
+        stats = measure(save_and_refresh, repeat=repeat)
+        recorder.add(SUITE, "save_product + ProductCatalog.refresh", stats, products=created)
+        assert catalog.by_sku(product.sku).unit_price == round(state["price"], 2)
+    finally:
+        db.cursor.execute("DELETE FROM products WHERE sku LIKE %s", (PRODUCT_PREFIX + "-%",))
+        db.conn.commit()
+        db.audit.flush()
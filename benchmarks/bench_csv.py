@@ -0,0 +1,27 @@
+"""Dashboard CSV export: row formatting plus write_dashboard_csv."""
+
+import os
+import tempfile
+from itertools import islice
+
+from benchmarks import datagen
+from benchmarks.harness import measure
+
+SUITE = "csv"
+
+
+def run(app, recorder, config):
+    n_rows = min(config["scale"], 200000)
+    rows = []
+    for data, _ in islice(datagen.iter_invoices(n_rows, config["seed"]), n_rows):
+        rows.append({"invoice_no": data["invoice_no"], "date_issued": data["date_issued"].strftime('%Y-%m-%d %H:%M:%S'),
+                     "client_name": data["client_name"], "client_email": data["client_email"],
+                     "invoice_type": data["invoice_type"], "subtotal": data["subtotal"], "vat": data["vat"],
+                     "shipping": data["shipping"], "wht": data["wht"], "wht_rate": data["wht_rate"],
+                     "grand_total": data["grand_total"], "balance_due": data["grand_total"] - data["wht"], "currency": "NGN"})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "export.csv")
+        stats = measure(lambda: app.write_dashboard_csv(path, (app.dashboard_row_values(r) for r in rows)),
+                        repeat=config["repeat"], units=n_rows)
+        recorder.add(SUITE, "format + write_dashboard_csv", stats, rows=n_rows, file_bytes=os.path.getsize(path))
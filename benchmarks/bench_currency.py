@@ -0,0 +1,102 @@
+"""Multi-currency: rate lookups from the ExchangeRates cache against a query per lookup, and base-currency
+totals converted in SQL (summarize_documents' SUM(x * exchange_rate)) against converting fetched rows in Python."""
+
+import random
+from datetime import date, timedelta
+
+from benchmarks import bench_db
+from benchmarks.harness import measure
+
+SUITE = "currency"
+FOREIGN = {"USD": 1500.0, "EUR": 1650.0, "GBP": 1900.0}
+FOREIGN_SHARE = 4  # one seeded invoice in FOREIGN_SHARE is re-priced in a foreign currency
+LOOKUPS = 20000
+
+
+def seed_rates(db, seed):
+    """A weekly fixing per foreign currency over the last ~400 days."""
+    rng = random.Random(seed)
+    today = date.today()
+    rows = [{"currency": currency, "rate_date": f"{today - timedelta(days=days):%Y-%m-%d}", "rate": f"{base * rng.uniform(0.95, 1.05):.4f}"}
+            for currency, base in FOREIGN.items() for days in range(0, 400, 7)]
+    saved, rejected = db.save_exchange_rates(rows)
+    assert not rejected, rejected
+    return saved
+
+
+def set_currencies(app, db, foreign):
+    """Put one synthetic invoice in FOREIGN_SHARE into each foreign currency, or all back into the base one."""
+    db.cursor.execute("UPDATE invoices SET currency = %s, exchange_rate = 1 WHERE invoice_number LIKE %s",
+                      (app.CURRENCY_SETTINGS["base"], "BENCH-INV-%"))
+    if foreign:
+        cycle = FOREIGN_SHARE * len(FOREIGN)
+        for n, (currency, rate) in enumerate(FOREIGN.items()):
+            db.cursor.execute(f"UPDATE invoices SET currency = %s, exchange_rate = %s WHERE invoice_number LIKE %s AND id % {cycle} = {n}",
+                              (currency, rate, "BENCH-INV-%"))
+    db.rebuild_receivables()
+    db.conn.commit()
+
+
+def query_rate(db, currency, day):
+    """The rate in force on `day` straight from the table (what every lookup would cost without the cache)."""
+    db.cursor.execute("SELECT rate, rate_date FROM exchange_rates WHERE currency = %s AND rate_date <= %s "
+                      "ORDER BY rate_date DESC LIMIT 1", (currency, day))
+    return db.cursor.fetchone()
+
+
+def python_totals(db):
+    """Base-currency totals from every invoice fetched and converted in Python (baseline)."""
+    db.cursor.execute("SELECT subtotal, vat_amount, grand_total, exchange_rate FROM invoices WHERE tenant_id = %s AND deleted_at IS NULL",
+                      (db.tenant_id,))
+    count, subtotal, vat, grand_total = 0, 0.0, 0.0, 0.0
+    for row_subtotal, row_vat, row_total, rate in db.cursor.fetchall():
+        rate = float(rate)
+        subtotal += float(row_subtotal) * rate
+        vat += float(row_vat) * rate
+        grand_total += float(row_total) * rate
+        count += 1
+    return count, subtotal, vat, grand_total
+
+
+def run(app, recorder, config):
+    db = config.get("db")
+    if db is None:
+        recorder.skip(SUITE, "ExchangeRates", config.get("db_unavailable", "no database"))
+        return
+    scale, repeat = config["scale"], config["repeat"]
+    db.create_tables()
+    bench_db.ensure_seeded(db, scale, config["seed"], config.get("reseed", False))
+    rates = seed_rates(db, config["seed"])
+    rng = random.Random(config["seed"])
+    today = date.today()
+    # An import or a day of invoicing asks for few distinct (currency, day) pairs, many times over
+    lookups = [(rng.choice(list(FOREIGN)), today - timedelta(days=rng.randint(0, 365))) for _ in range(LOOKUPS)]
+    params = {"invoices": scale, "rates": rates, "lookups": LOOKUPS}
+
+    app.EXCHANGE_RATES.forget()
+    stats = measure(lambda: app.EXCHANGE_RATES.load(db), repeat=repeat)
+    recorder.add(SUITE, "ExchangeRates.load", stats, **params)
+    stats = measure(lambda: [db.exchange_rate(currency, day) for currency, day in lookups], repeat=repeat, units=LOOKUPS)
+    recorder.add(SUITE, "exchange_rate [cached]", stats, hits=app.EXCHANGE_RATES.hits, misses=app.EXCHANGE_RATES.misses, **params)
+    sample = lookups[:LOOKUPS // 10]
+    stats = measure(lambda: [query_rate(db, currency, day) for currency, day in sample], repeat=repeat, units=len(sample))
+    recorder.add(SUITE, f"rate query per lookup [{len(sample)}, baseline]", stats, **params)
+    for currency, day in sample[:50]:
+        found, stored = db.exchange_rate(currency, day), query_rate(db, currency, day)
+        assert found[0] == float(stored[0]), (currency, day, found, stored)
+
+    try:
+        set_currencies(app, db, True)
+
+        def sql_totals():
+            db.invalidate_summaries()
+            return db.summarize_documents("invoices")
+        stats = measure(sql_totals, repeat=repeat, units=scale)
+        recorder.add(SUITE, "summarize_documents [SUM(x * exchange_rate)]", stats, **params)
+        stats = measure(lambda: python_totals(db), repeat=repeat, units=scale)
+        recorder.add(SUITE, "fetch + convert in Python [baseline]", stats, **params)
+        summary = sql_totals()
+        count, _, _, grand_total = python_totals(db)
+        assert summary["count"] == count and abs(summary["grand_total"] - grand_total) < 0.01 * count, "SQL and Python totals agree"
+    finally:
+        set_currencies(app, db, False)
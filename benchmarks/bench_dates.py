@@ -0,0 +1,55 @@
+"""Date-range filtering on a multi-year dataset: one month versus the whole history.
+
+Records the engine's query plan for each case so it is visible whether the
+date_issued index range is used instead of a full scan.
+"""
+
+from datetime import date, timedelta
+
+from benchmarks.bench_db import ensure_seeded
+from benchmarks.harness import measure
+
+SUITE = "dates"
+
+
+def explain(db, sql, params):
+    prefix = "EXPLAIN QUERY PLAN " if db.backend.name == "sqlite" else "EXPLAIN "
+    db.cursor.execute(prefix + sql, tuple(params))
+    return [" ".join(str(col) for col in row) for row in db.cursor.fetchall()]
+
+
+def date_cases():
+    # datagen spreads dates over the years up to 2026-01-01
+    return [
+        ("this month (Dec 2025)", date(2025, 12, 1), date(2025, 12, 31)),
+        ("last 30 days", date(2025, 12, 31) - timedelta(days=29), date(2025, 12, 31)),
+        ("one month, two years back", date(2023, 12, 1), date(2023, 12, 31)),
+        ("one year (2024)", date(2024, 1, 1), date(2024, 12, 31)),
+        ("all history", None, None),
+    ]
+
+
+def run(app, recorder, config):
+    db = config.get("db")
+    if db is None:
+        recorder.skip(SUITE, "date ranges", config.get("db_unavailable", "no database"))
+        return
+    scale, repeat = config["scale"], config["repeat"]
+    ensure_seeded(db, scale, config["seed"], config.get("reseed", False))
+
+    for label, date_from, date_to in date_cases():
+        filters = {"date_from": date_from, "date_to": date_to}
+        sql, params = db._document_query("invoices", filters, db.PAGE_TAIL)
+        plan = explain(db, sql, params + [25, 0])
+        stats = measure(lambda: db.fetch_invoices(filters, page=1, page_size=25), repeat=repeat)
+        recorder.add(SUITE, f"fetch_invoices [{label}]", stats, scale=scale, plan=plan)
+
+        def cold_summary():
+            db.invalidate_summaries()
+            return db.summarize_documents("invoices", filters)
+        stats = measure(cold_summary, repeat=repeat)
+        recorder.add(SUITE, f"summarize_documents [{label}]", stats, scale=scale,
+                     matched=cold_summary()["count"])
+
+        stats = measure(lambda: db.fetch_quotations(filters, page=1, page_size=25), repeat=repeat)
+        recorder.add(SUITE, f"fetch_quotations [{label}]", stats, scale=scale // 4)
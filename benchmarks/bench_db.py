@@ -0,0 +1,130 @@
+"""fetch_invoices / fetch_quotations under filter combinations, and save_invoice throughput."""
+
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import datagen
+from benchmarks.harness import measure
+
+SUITE = "db"
+BENCH_BRANCH = "BENCHBR"
+
+
+def filter_cases(scale, page_size):
+    month_end = datetime(2025, 12, 31, 23, 59, 59)
+    month_start = month_end - timedelta(days=30)
+    deep_page = max(1, scale // page_size // 2)
+    return [
+        ("no filter, page 1", {}, 1),
+        (f"no filter, page {deep_page}", {}, deep_page),
+        ("invoice_no substring", {"invoice_no": "0042"}, 1),
+        ("client_name substring", {"client_name": "Musa"}, 1),
+        ("invoice_type=Project", {"invoice_type": "Project"}, 1),
+        ("date range 30 days", {"date_from": month_start, "date_to": month_end}, 1),
+        ("client+type+date range", {"client_name": "Tech", "invoice_type": "Component",
+                                    "date_from": month_start - timedelta(days=335), "date_to": month_end}, 1),
+    ]
+
+
+def ensure_seeded(db, scale, seed, reseed=False):
+    """Make sure exactly `scale` synthetic invoices (and scale // 4 quotations) are present."""
+    db.cursor.execute("SELECT COUNT(*) FROM invoices WHERE invoice_number LIKE %s", ("BENCH-INV-%",))
+    present = db.cursor.fetchone()[0]
+    if present == scale and not reseed:
+        return False
+    db.cursor.execute("DELETE FROM invoice_items WHERE invoice_number LIKE %s", ("BENCH-%",))
+    db.cursor.execute("DELETE FROM invoices WHERE invoice_number LIKE %s", ("BENCH-%",))
+    db.cursor.execute("DELETE FROM quotations WHERE quote_number LIKE %s", ("BENCH-%",))
+    db.conn.commit()
+    start = time.perf_counter()
+    datagen.seed_database(db, scale, scale // 4, seed=seed)
+    print(f"  seeded {scale:,} invoices + {scale // 4:,} quotations in {time.perf_counter() - start:.1f}s")
+    return True
+
+
+def ensure_branch(app, db, rows, seed):
+    """A benchmark branch of the default company holding `rows` synthetic invoices."""
+    if not db.use_tenant(BENCH_BRANCH):
+        tenant_id, err = db.save_tenant({"code": BENCH_BRANCH, "parent_id": app.DEFAULT_TENANT_ID})
+        if not tenant_id:
+            raise RuntimeError(f"Could not create the benchmark branch: {err}")
+        db.use_tenant(tenant_id)
+    own = db.fetch_invoices(page=1, page_size=1)
+    if not own:
+        datagen.seed_database(db, rows, seed=seed, prefix=BENCH_BRANCH)
+    db.use_tenant(app.DEFAULT_TENANT_ID)
+
+
+def run(app, recorder, config):
+    db = config.get("db")
+    if db is None:
+        for name in ("fetch_invoices", "fetch_quotations", "save_invoice"):
+            recorder.skip(SUITE, name, config.get("db_unavailable", "no database"))
+        return
+
+    scale, repeat, page_size = config["scale"], config["repeat"], 25
+    ensure_seeded(db, scale, config["seed"], config.get("reseed", False))
+
+    for label, filters, page in filter_cases(scale, page_size):
+        stats = measure(lambda: db.fetch_invoices(filters=filters, page=page, page_size=page_size), repeat=repeat)
+        recorder.add(SUITE, f"fetch_invoices [{label}]", stats, scale=scale, page=page)
+
+    # Dashboard summary strip: one aggregate per filter, cold (after invalidation) and cached
+    for label, filters, _ in filter_cases(scale, page_size):
+        if _ != 1:
+            continue
+
+        def cold():
+            db.invalidate_summaries()
+            db.summarize_documents("invoices", filters)
+        recorder.add(SUITE, f"summarize_documents cold [{label}]", measure(cold, repeat=repeat), scale=scale)
+    stats = measure(lambda: db.summarize_documents("invoices", {}), repeat=repeat, units=1)
+    recorder.add(SUITE, "summarize_documents cached [no filter]", stats, scale=scale)
+
+    # A small branch sharing the tables with the seeded company: its pages come off the
+    # tenant-leading indexes, so they should cost the same whatever the other tenants hold
+    ensure_branch(app, db, max(100, scale // 100), config["seed"])
+    own_tenant = db.tenant_id
+    db.use_tenant(BENCH_BRANCH)
+    try:
+        for label, filters, page in filter_cases(scale, page_size)[:1] + filter_cases(scale, page_size)[5:6]:
+            stats = measure(lambda: db.fetch_invoices(filters=filters, page=page, page_size=page_size), repeat=repeat)
+            recorder.add(SUITE, f"fetch_invoices branch [{label}]", stats, scale=scale, branch_rows=max(100, scale // 100))
+    finally:
+        db.use_tenant(own_tenant)
+
+    for label, filters in [("no filter", {}), ("quote_no substring", {"invoice_no": "0042"}),
+                           ("client_name substring", {"client_name": "Musa"})]:
+        stats = measure(lambda: db.fetch_quotations(filters=filters, page=1, page_size=page_size), repeat=repeat)
+        recorder.add(SUITE, f"fetch_quotations [{label}]", stats, scale=scale // 4)
+
+    # save_invoice throughput: one header + its items per call, committed individually as the UI does
+    count = config["save_count"]
+    rng = random.Random(config["seed"])
+    clients = datagen.make_clients(50, config["seed"])
+    run_tag = datetime.now().strftime("%H%M%S")
+    batches = iter(range(2 * (repeat + 1)))
+
+    def save_batch():
+        batch = next(batches)
+        for i in range(count):
+            data, items = datagen.make_invoice(rng, f"BENCH-SAVE-{run_tag}-{batch}-{i:06d}", clients)
+            db.save_invoice(data, items)
+
+    try:
+        stats = measure(save_batch, repeat=repeat, warmup=1, units=count)
+        recorder.add(SUITE, "save_invoice (with items)", stats, invoices_per_batch=count,
+                     audit_batch_size=db.audit.settings["batch_size"])
+        # Same work with every audit event written on its own, to show what batching saves
+        db.audit.flush()
+        batch_size, db.audit.settings["batch_size"] = db.audit.settings["batch_size"], 1
+        try:
+            stats = measure(save_batch, repeat=repeat, warmup=1, units=count)
+        finally:
+            db.audit.settings["batch_size"] = batch_size
+        recorder.add(SUITE, "save_invoice (audit unbatched)", stats, invoices_per_batch=count, audit_batch_size=1)
+    finally:
+        db.cursor.execute("DELETE FROM invoice_items WHERE invoice_number LIKE %s", ("BENCH-SAVE-%",))
+        db.cursor.execute("DELETE FROM invoices WHERE invoice_number LIKE %s", ("BENCH-SAVE-%",))
+        db.conn.commit()
@@ -0,0 +1,37 @@
+"""send_email end-to-end (MIME build, attachment, SMTP dialogue) against a local SMTP sink."""
+
+import os
+import random
+import tempfile
+
+from benchmarks import datagen
+from benchmarks.harness import measure
+from benchmarks.smtp_sink import SMTPSink
+
+SUITE = "email"
+
+
+def run(app, recorder, config):
+    count = config["email_count"]
+    rng = random.Random(config["seed"])
+    with tempfile.TemporaryDirectory() as tmp, SMTPSink() as sink:
+        app.CONFIG.override(smtp={"host": "127.0.0.1", "port": sink.port, "username": "", "password": "",
+                                  "use_tls": False, "from_email": "bench@localhost"})
+        attachment = os.path.join(tmp, "Invoice_BENCH.pdf")
+        items = datagen.make_cart(rng, 20, "Component")
+        data = dict(datagen.make_client(rng), invoice_no="BENCH-MAIL")
+        data.update(datagen.make_totals(items, shipping=0.0))
+        app.render_document_pdf(attachment, data, items)
+
+        def send_batch():
+            for i in range(count):
+                ok, err = app.send_email("client@example.com", f"Invoice BENCH-{i}", "Please find attached.", attachment)
+                if not ok:
+                    raise RuntimeError(err)
+
+        try:
+            stats = measure(send_batch, repeat=config["repeat"], units=count)
+            recorder.add(SUITE, "send_email with PDF attachment", stats, emails_per_batch=count,
+                         attachment_bytes=os.path.getsize(attachment))
+        finally:
+            app.CONFIG.clear_override("smtp")
@@ -0,0 +1,76 @@
+"""Bulk import: CSV (one row per line item) streamed into the database, then re-run to measure idempotent skipping."""
+
+import csv
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks import datagen
+
+SUITE = "import"
+IMPORT_PREFIX = "BENCH-IMP"
+
+
+def write_import_csv(path, n_invoices, seed):
+    """One CSV row per line item, grouped by invoice; returns the number of data rows."""
+    rows = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["invoice_no", "date_issued", "client_name", "client_email", "client_address", "invoice_type",
+                         "shipping", "wht_rate", "description", "qty", "unit_price"])
+        for data, items in datagen.iter_invoices(n_invoices, seed, prefix=IMPORT_PREFIX):
+            for item in items:
+                writer.writerow([data["invoice_no"], data["date_issued"].strftime("%Y-%m-%d %H:%M:%S"), data["client_name"].lower(),
+                                 data["client_email"], data["client_address"], data["invoice_type"], data["shipping"],
+                                 data["wht_rate"], item["desc"], item["qty"], item["price"]])
+                rows += 1
+    return rows
+
+
+def clear_imported(db):
+    db.cursor.execute("DELETE FROM invoice_items WHERE invoice_number LIKE %s", (IMPORT_PREFIX + "-%",))
+    db.cursor.execute("DELETE FROM invoices WHERE invoice_number LIKE %s", (IMPORT_PREFIX + "-%",))
+    db.cursor.execute("DELETE FROM import_keys WHERE doc_number LIKE %s", (IMPORT_PREFIX + "-%",))
+    db.conn.commit()
+
+
+def timed_import(app, db, path, rows, dry_run=False):
+    started = time.perf_counter()
+    stats = app.InvoiceImporter(db, errors_path=path + ".errors.csv", dry_run=dry_run).run(path)
+    seconds = time.perf_counter() - started
+    summary = {"repeat": 1, "units": rows, "min_s": seconds, "median_s": seconds, "mean_s": seconds, "p95_s": seconds,
+               "max_s": seconds, "units_per_s": rows / seconds if seconds > 0 else None}
+    return stats, summary
+
+
+def run(app, recorder, config):
+    db = config.get("db")
+    if db is None:
+        recorder.skip(SUITE, "InvoiceImporter", config.get("db_unavailable", "no database"))
+        return
+    # ~6.5 line items per invoice, so scale // 6 invoices gives roughly `scale` CSV rows
+    n_invoices = max(100, config["scale"] // 6)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "import.csv")
+        rows = write_import_csv(path, n_invoices, config["seed"])
+        clear_imported(db)
+        try:
+            for label in ("first run", "rerun (all skipped)"):
+                stats, summary = timed_import(app, db, path, rows)
+                recorder.add(SUITE, f"InvoiceImporter CSV [{label}]", summary, csv_rows=rows, invoices=n_invoices,
+                             imported=stats["imported"], skipped=stats["skipped"], rejected=stats["rejected"],
+                             rows_per_min=round(summary["units_per_s"] * 60))
+                print(f"           {stats['imported']:,} imported, {stats['skipped']:,} skipped, {stats['rejected']:,} rejected, "
+                      f"{summary['units_per_s'] * 60:,.0f} rows/min")
+            # Memory is traced on a separate dry run: tracemalloc slows parsing several-fold
+            clear_imported(db)
+            tracemalloc.start()
+            stats, summary = timed_import(app, db, path, rows, dry_run=True)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            recorder.add(SUITE, "InvoiceImporter CSV [dry run, traced]", summary, csv_rows=rows,
+                         peak_mem_mb=round(peak / 2 ** 20, 1))
+            print(f"           peak traced memory {peak / 2 ** 20:.1f} MB for {rows:,} rows")
+        finally:
+            clear_imported(db)
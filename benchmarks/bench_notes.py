@@ -0,0 +1,86 @@
+"""Credit notes and amendments: issue_invoice_note latency (note, invoice balance and receivables in one transaction),
+and dashboard totals read from the invoices' maintained adjusted_total against joining every note back to its invoice."""
+
+import random
+
+from benchmarks import bench_db
+from benchmarks.harness import measure
+
+SUITE = "notes"
+NOTE_SHARE = 10  # one seeded invoice in NOTE_SHARE gets a credit note (and every other one of those an amendment too)
+
+
+def reset_notes(app, db):
+    """Drop the synthetic invoices' notes and put their balances back to grand total less WHT and payments."""
+    db.cursor.execute("DELETE FROM credit_note_items WHERE note_number IN (SELECT note_number FROM credit_notes WHERE invoice_number LIKE %s)",
+                      ("BENCH-INV-%",))
+    db.cursor.execute("DELETE FROM document_taxes WHERE doc_number IN (SELECT note_number FROM credit_notes WHERE invoice_number LIKE %s)",
+                      ("BENCH-INV-%",))
+    db.cursor.execute("DELETE FROM credit_notes WHERE invoice_number LIKE %s", ("BENCH-INV-%",))
+    db.cursor.execute("UPDATE invoices SET adjusted_total = 0, balance_due = grand_total - COALESCE(wht_amount, 0) - amount_paid "
+                      "WHERE invoice_number LIKE %s", ("BENCH-INV-%",))
+    db.rebuild_receivables()
+    db.conn.commit()
+
+
+def joined_totals(db):
+    """Net adjustments and balance due in the base currency worked out from the notes themselves (baseline)."""
+    db.cursor.execute("SELECT COUNT(*), SUM(COALESCE(n.adjusted, 0) * i.exchange_rate), "
+                      "SUM((i.grand_total - COALESCE(i.wht_amount, 0) - i.amount_paid + COALESCE(n.adjusted, 0)) * i.exchange_rate) "
+                      "FROM invoices i LEFT JOIN (SELECT invoice_number, SUM(adjustment) AS adjusted FROM credit_notes "
+                      "WHERE tenant_id = %s GROUP BY invoice_number) n ON n.invoice_number = i.invoice_number "
+                      "WHERE i.tenant_id = %s AND i.deleted_at IS NULL", (db.tenant_id, db.tenant_id))
+    count, adjusted, balance = db.cursor.fetchone()
+    return int(count or 0), round(float(adjusted or 0), 2), round(float(balance or 0), 2)
+
+
+def run(app, recorder, config):
+    db = config.get("db")
+    if db is None:
+        recorder.skip(SUITE, "issue_invoice_note", config.get("db_unavailable", "no database"))
+        return
+    scale, repeat = config["scale"], config["repeat"]
+    db.create_tables()
+    bench_db.ensure_seeded(db, scale, config["seed"], config.get("reseed", False))
+    reset_notes(app, db)
+    db.cursor.execute(f"SELECT invoice_number, balance_due FROM invoices WHERE invoice_number LIKE %s AND id % {NOTE_SHARE} = 0",
+                      ("BENCH-INV-%",))
+    targets = [(number, float(balance)) for number, balance in db.cursor.fetchall() if float(balance) > 10]
+    rng = random.Random(config["seed"])
+    try:
+        pending = iter(targets)
+
+        def issue():
+            number, balance = next(pending)
+            # A tenth to a half of what is owed back, as one line before VAT
+            price = round(balance * rng.uniform(0.1, 0.5) / (1 + app.COMPANY_CONFIG["vat_rate"]), 2)
+            note, err = db.issue_invoice_note("credit_notes", number, [{"desc": "Returned goods", "qty": 1, "price": price}], "bench")
+            assert note, err
+            if rng.random() < 0.5:
+                note, err = db.issue_invoice_note("amendments", number, [{"desc": "Re-rated", "qty": 1, "price": -1}], "bench")
+                assert note, err
+        stats = measure(issue, repeat=len(targets) - 1)
+        db.audit.flush()
+        db.cursor.execute("SELECT COUNT(*) FROM credit_notes WHERE invoice_number LIKE %s", ("BENCH-INV-%",))
+        params = {"invoices": scale, "notes": db.cursor.fetchone()[0], "invoices_with_notes": len(targets)}
+        recorder.add(SUITE, "issue_invoice_note [credit, half with an amendment]", stats, **params)
+
+        def maintained():
+            db.invalidate_summaries()
+            return db.summarize_documents("invoices")
+        stats = measure(maintained, repeat=repeat, units=scale)
+        recorder.add(SUITE, "summarize_documents [adjusted_total]", stats, **params)
+        stats = measure(lambda: joined_totals(db), repeat=repeat, units=scale)
+        recorder.add(SUITE, "join notes to invoices [baseline]", stats, **params)
+        summary, (count, adjusted, balance) = maintained(), joined_totals(db)
+        assert summary["count"] == count and abs(summary["adjusted"] - adjusted) < 0.01 * count, "adjusted totals agree"
+        assert abs(summary["balance_due"] - balance) < 0.01 * count, "balances agree"
+        incremental = db.aging_summary()
+        db.rebuild_receivables()
+        db.conn.commit()
+        # The synthetic balances are not rounded to the kobo, so SQL and Python rounding may differ by one per note
+        for label, rebuilt in db.aging_summary().items():
+            assert rebuilt["count"] == incremental[label]["count"], label
+            assert abs(rebuilt["balance"] - incremental[label]["balance"]) <= 0.01 * params["notes"], label
+    finally:
+        reset_notes(app, db)
@@ -0,0 +1,25 @@
+"""InvoicePDF render time versus number of line items."""
+
+import os
+import random
+import tempfile
+
+from benchmarks import datagen
+from benchmarks.harness import measure
+
+SUITE = "pdf"
+ITEM_COUNTS = (1, 10, 50, 200, 1000)
+
+
+def run(app, recorder, config):
+    rng = random.Random(config["seed"])
+    client = datagen.make_client(rng)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.pdf")
+        for n_items in ITEM_COUNTS:
+            items = datagen.make_cart(rng, n_items, "Component")
+            data = dict(client, invoice_no=f"BENCH-PDF-{n_items}")
+            data.update(datagen.make_totals(items, shipping=1500.0))
+            stats = measure(lambda: app.render_document_pdf(path, data, items), repeat=config["repeat"])
+            recorder.add(SUITE, f"render_document_pdf [{n_items} items]", stats,
+                         items=n_items, file_bytes=os.path.getsize(path))
@@ -0,0 +1,67 @@
+"""File size and render time per PDF output profile over a batch of documents (default 1,000)."""
+
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from benchmarks import datagen
+from benchmarks.harness import measure
+
+SUITE = "profiles"
+LOGO_PIXELS = 1200  # a print-resolution logo, so downsampling has something to do
+
+
+def make_logo(path, size=LOGO_PIXELS):
+    from PIL import Image, ImageDraw
+    img = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    for ring in range(0, size // 2, 6):
+        shade = (15 + ring % 200, 48 + ring % 120, 87 + ring % 160, 255)
+        draw.ellipse((ring, ring, size - ring, size - ring), outline=shade, width=3)
+    img.save(path)
+
+
+def make_documents(rng, count):
+    clients = datagen.make_clients(50, seed=rng.randint(0, 10 ** 6))
+    docs = []
+    for i in range(count):
+        items = datagen.make_cart(rng, rng.randint(1, 25), rng.choice(["Component", "Project"]))
+        data = dict(rng.choice(clients), invoice_no=f"BENCH-PROF-{i:05d}")
+        data.update(datagen.make_totals(items, shipping=rng.choice([0.0, 1500.0])))
+        docs.append((data, items))
+    return docs
+
+
+def run(app, recorder, config):
+    rng = random.Random(config["seed"])
+    docs = make_documents(rng, config.get("pdf_docs", 1000))
+    saved_logo = app.LOGO_FILENAME
+    with tempfile.TemporaryDirectory() as tmp:
+        if not saved_logo:
+            app.LOGO_FILENAME = os.path.join(tmp, "logo.png")
+            make_logo(app.LOGO_FILENAME)
+        try:
+            for name in app.PDF_PROFILES:
+                paths = [os.path.join(tmp, f"{name}_{i}.pdf") for i in range(len(docs))]
+                per_doc = []
+
+                def render_all():
+                    per_doc.clear()
+                    for path, (data, items) in zip(paths, docs):
+                        start = time.perf_counter()
+                        app.render_document_pdf(path, data, items, profile=name)
+                        per_doc.append(time.perf_counter() - start)
+
+                stats = measure(render_all, repeat=1, warmup=0, units=len(docs))
+                sizes = [os.path.getsize(p) for p in paths]
+                per_doc.sort()
+                recorder.add(SUITE, f"render {len(docs)} docs [{name}]", stats, profile=name, documents=len(docs),
+                             total_bytes=sum(sizes), mean_bytes=round(statistics.fmean(sizes)),
+                             max_bytes=max(sizes), median_doc_ms=statistics.median(per_doc) * 1000,
+                             p95_doc_ms=per_doc[int(0.95 * (len(per_doc) - 1))] * 1000)
+                for p in paths:
+                    os.remove(p)
+        finally:
+            app.LOGO_FILENAME = saved_logo
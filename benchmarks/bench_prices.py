@@ -0,0 +1,83 @@
+"""Price rules: pricing cart lines through the PriceRules (product, client) index against scanning every rule
+for every line, with a few thousand active rules (volume tiers per product, client contract prices, promotions)."""
+
+import random
+from datetime import date, timedelta
+
+from benchmarks import datagen
+from benchmarks.harness import measure
+
+SUITE = "prices"
+PRODUCTS = 2000
+CLIENTS = 400
+LINES = 100000
+BASELINE_SAMPLE = 1000
+
+
+def seed_rules(app, db, seed):
+    """Two volume tiers per product, a contract price for a client on every fourth product, and a few store-wide promotions."""
+    created, updated, rejected = db.import_products(datagen.iter_products(PRODUCTS, seed, prefix="BENCH-PRC"))
+    assert not rejected, rejected[:3]
+    rng = random.Random(seed)
+    clients = [datagen.make_client(rng)["client_name"] for _ in range(CLIENTS)]
+    today = date.today()
+    rows = []
+    for n in range(1, PRODUCTS + 1):
+        sku = f"BENCH-PRC-{n:06d}"
+        rows.append({"code": f"BP{n}-T1", "sku": sku, "kind": "percent", "value": "5", "min_qty": "10"})
+        rows.append({"code": f"BP{n}-T2", "sku": sku, "kind": "percent", "value": "12", "min_qty": "50"})
+        if n % 4 == 0:
+            rows.append({"code": f"BP{n}-C", "sku": sku, "client_name": rng.choice(clients), "kind": "fixed", "value": "75"})
+    for n in range(20):
+        rows.append({"code": f"BPROMO{n}", "kind": "percent", "value": str(rng.randint(1, 8)), "min_qty": str(rng.randint(1, 30)),
+                     "starts_on": f"{today - timedelta(days=rng.randint(0, 30)):%Y-%m-%d}",
+                     "ends_on": f"{today + timedelta(days=rng.randint(-5, 30)):%Y-%m-%d}"})
+    saved, rejected = db.save_price_rules(rows)
+    assert not rejected, rejected[:3]
+    return clients, saved
+
+
+def naive_best(app, rules, product_id, client_name, qty, list_price, today):
+    """Every rule checked against the line (baseline)."""
+    client = app.ClientMapper.normalise(client_name)
+    found, price = None, list_price
+    for rule in rules:
+        if (rule.active and rule.product_id in (product_id, None) and rule.client_key in (client, None)
+                and rule.min_qty <= qty and rule.first_day <= today <= rule.last_day):
+            unit = rule.unit_price(list_price)
+            if unit < price:
+                found, price = rule, unit
+    return found, price
+
+
+def run(app, recorder, config):
+    db = config.get("db")
+    if db is None:
+        recorder.skip(SUITE, "PriceRules", config.get("db_unavailable", "no database"))
+        return
+    repeat = config["repeat"]
+    db.create_tables()
+    clients, saved = seed_rules(app, db, config["seed"])
+    products = {p.id: p.unit_price for p in db.fetch_products() if p.sku.startswith("BENCH-PRC-")}
+    rng = random.Random(config["seed"])
+    ids = list(products)
+    lines = [(pid, rng.choice(clients), rng.choice((1, 2, 5, 12, 60)), products[pid]) for pid in (rng.choice(ids) for _ in range(LINES))]
+    params = {"rules": saved, "products": len(products), "lines": LINES}
+
+    stats = measure(lambda: app.PRICE_RULES.load(db), repeat=repeat)
+    recorder.add(SUITE, "PriceRules.load", stats, **params)
+    stats = measure(lambda: [app.PRICE_RULES.best(db, *line) for line in lines], repeat=repeat, units=LINES)
+    recorder.add(SUITE, "PriceRules.best [indexed]", stats, **params)
+    rules, today = db.fetch_price_rules(), date.today().toordinal()
+    sample = lines[:BASELINE_SAMPLE]
+    stats = measure(lambda: [naive_best(app, rules, *line, today) for line in sample], repeat=repeat, units=len(sample))
+    recorder.add(SUITE, f"scan every rule per line [{len(sample)}, baseline]", stats, **params)
+    for line in sample:
+        found, price = app.PRICE_RULES.best(db, *line)
+        expected, expected_price = naive_best(app, rules, *line, today)
+        assert abs(price - expected_price) < 1e-9, (line, found and found.code, expected and expected.code)
+
+    items = [{"sn": str(n), "desc": "x", "type": "Component", "qty": qty, "price": price, "total": qty * price, "product_id": pid}
+             for n, (pid, _, qty, price) in enumerate(lines[:1000], start=1)]
+    stats = measure(lambda: db.price_items(items, clients[0]), repeat=repeat, units=len(items))
+    recorder.add(SUITE, f"price_items [{len(items)}-line cart]", stats, discounted=db.price_items(items, clients[0]), **params)
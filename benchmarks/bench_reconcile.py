@@ -0,0 +1,113 @@
+"""Bank statement reconciliation: a synthetic statement of scale // 10 credit lines (100k against 1M invoices)
+matched to the open invoices through StatementReconciler's indexes, against a nested-loop baseline on a sample."""
+
+import csv
+import os
+import random
+import tempfile
+import time
+from datetime import timedelta
+
+from benchmarks import bench_db
+
+SUITE = "reconcile"
+NOISE = ["POS SETTLEMENT", "INTEREST CREDIT", "REVERSAL", "CASH DEPOSIT", "NIP TRANSFER"]
+BASELINE_SAMPLE = 20
+
+
+def reset_balances(app, db):
+    """Every synthetic invoice owed in full again, and no statement payments against them."""
+    db.cursor.execute("DELETE FROM payments WHERE invoice_number LIKE %s", ("BENCH-INV-%",))
+    db.cursor.execute("UPDATE invoices SET amount_paid = 0, balance_due = grand_total - COALESCE(wht_amount, 0) "
+                      "WHERE invoice_number LIKE %s", ("BENCH-INV-%",))
+    db.rebuild_receivables()
+    db.conn.commit()
+
+
+def write_statement(path, invoices, n_lines, seed):
+    """A First Bank style export: ~45% of credits quote an invoice number (a fifth of them part-pay it),
+    ~40% pay an invoice's exact balance with only the client's name, the rest match nothing; plus debits."""
+    rng = random.Random(seed)
+    picked = rng.sample(invoices, min(len(invoices), n_lines))
+    credits = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Account Name", "Nascomsoft Embedded"])
+        writer.writerow(["Account Number", "2037467351"])
+        writer.writerow([])
+        writer.writerow(["Trans Date", "Reference", "Value Date", "Debits", "Credits", "Balance", "Remarks"])
+        for n, (number, issued, client, balance) in enumerate(picked):
+            day = (issued + timedelta(days=rng.randint(0, 30))).strftime("%d-%b-%Y")
+            roll = rng.random()
+            if roll < 0.45:
+                compact = number.replace("-", "")
+                narration = rng.choice([f"TRF/{compact}/{client.upper()[:20]}", f"PAYMENT FOR {number}", f"{number.replace('-', ' ')}"])
+                amount = balance if rng.random() < 0.8 else round(balance * rng.uniform(0.2, 0.9), 2)
+            elif roll < 0.85:
+                narration, amount = f"TRANSFER FROM {client.upper()}", balance
+            else:
+                narration, amount = rng.choice(NOISE), round(rng.uniform(100, 500000), 2)
+            writer.writerow([day, f"FT{n:09d}", day, "", f"{amount:,.2f}", "", narration])
+            credits += 1
+            if rng.random() < 0.1:
+                writer.writerow([day, f"DR{n:09d}", day, f"{rng.uniform(50, 5000):,.2f}", "", "", "CHARGES"])
+    return credits
+
+
+def naive_match(app, lines, invoices, window):
+    """What matching looks like without indexes: every line scans every open invoice."""
+    matched = 0
+    for line in lines:
+        text = app._compact(f"{line['narration']} {line['reference']}")
+        cents, day = app._cents(line["amount"]), line["date"].toordinal()
+        hits = [number for number, issued, _, balance in invoices if app._compact(number) in text]
+        if not hits:
+            hits = [number for number, issued, _, balance in invoices
+                    if app._cents(balance) == cents and day - window <= issued.toordinal() <= day]
+        matched += len(hits) == 1
+    return matched
+
+
+def timed(func, units):
+    started = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - started
+    return result, {"repeat": 1, "units": units, "min_s": seconds, "median_s": seconds, "mean_s": seconds, "p95_s": seconds,
+                    "max_s": seconds, "units_per_s": units / seconds if seconds > 0 else None}
+
+
+def run(app, recorder, config):
+    db = config.get("db")
+    if db is None:
+        recorder.skip(SUITE, "StatementReconciler", config.get("db_unavailable", "no database"))
+        return
+    scale = config["scale"]
+    db.create_tables()
+    bench_db.ensure_seeded(db, scale, config["seed"], config.get("reseed", False))
+    reset_balances(app, db)
+    db.cursor.execute("SELECT invoice_number, date_issued, client_name, balance_due FROM invoices WHERE invoice_number LIKE %s",
+                      ("BENCH-INV-%",))
+    invoices = [(number, app._issue_day(issued), client, float(balance)) for number, issued, client, balance in db.cursor.fetchall()]
+    n_lines = max(1000, scale // 10)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "statement.csv")
+        credits = write_statement(path, invoices, n_lines, config["seed"])
+        params = {"invoices": scale, "statement_lines": credits}
+        try:
+            reconciler = app.StatementReconciler(db, dry_run=True)
+            _, stats = timed(reconciler.load, scale)
+            recorder.add(SUITE, "index open invoices", stats, **params)
+            for label, dry_run in (("dry run, match only", True), ("record payments", False), ("rerun, all skipped", False)):
+                reconciler = app.StatementReconciler(db, review_path=os.path.join(tmp, "review.csv"), dry_run=dry_run)
+                result, stats = timed(lambda: reconciler.run(path), credits)
+                recorder.add(SUITE, f"StatementReconciler [{label}]", stats, matched=result["matched"],
+                             by_reference=result["by_reference"], by_amount=result["by_amount"], review=result["review"],
+                             skipped=result["skipped"], **params)
+                print(f"           {result['matched']:,} matched ({result['by_reference']:,} by number, {result['by_amount']:,} by amount), "
+                      f"{result['review']:,} to review, {result['skipped']:,} skipped, {credits / stats['median_s']:,.0f} lines/s")
+            lines = [line for line, _ in zip(app.iter_statement_lines(path), range(BASELINE_SAMPLE))]
+            _, stats = timed(lambda: naive_match(app, lines, invoices, app.RECONCILE_SETTINGS["date_window_days"]), len(lines))
+            recorder.add(SUITE, f"nested-loop match [{len(lines)} lines, baseline]", stats, **params)
+            print(f"           baseline extrapolates to {stats['median_s'] / len(lines) * credits:,.0f}s for the whole statement")
+        finally:
+            reset_balances(app, db)
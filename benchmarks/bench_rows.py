@@ -0,0 +1,71 @@
+"""Rows/sec decoded for large result sets: eager dict mapping versus lazy DocumentRow tuples."""
+
+from itertools import islice
+
+from benchmarks import datagen
+from benchmarks.harness import measure
+
+SUITE = "rows"
+
+
+def eager_decode(rows):
+    """The per-row dict mapping fetch_invoices used before rows were decoded lazily (baseline)."""
+    results = []
+    for r in rows:
+        date_val = r[1]
+        try:
+            date_str = date_val.strftime('%Y-%m-%d %H:%M:%S') if hasattr(date_val, 'strftime') else str(date_val)
+        except Exception:
+            date_str = str(date_val)
+        results.append({
+            'invoice_no': r[0], 'date_issued': date_str, 'client_name': r[2], 'client_email': r[3],
+            'invoice_type': r[4],
+            'subtotal': float(r[5]) if r[5] is not None else 0.0,
+            'vat': float(r[6]) if r[6] is not None else 0.0,
+            'shipping': float(r[7]) if r[7] is not None else 0.0,
+            'wht': float(r[8]) if r[8] is not None else 0.0,
+            'wht_rate': float(r[9]) if r[9] is not None else 0.0,
+            'grand_total': float(r[10]) if r[10] is not None else 0.0,
+            'version': r[11],
+            'balance_due': float(r[12]) if r[12] is not None else None,
+            'currency': r[13] or 'NGN'
+        })
+    return results
+
+
+def raw_rows(n, seed):
+    """Tuples shaped like the invoices SELECT (datetime + numeric columns as the driver returns them)."""
+    return [(d['invoice_no'], d['date_issued'], d['client_name'], d['client_email'], d['invoice_type'],
+             d['subtotal'], d['vat'], d['shipping'], d['wht'], d['wht_rate'], d['grand_total'], 1, d['grand_total'] - d['wht'],
+             'NGN')
+            for d, _ in islice(datagen.iter_invoices(n, seed), n)]
+
+
+def run(app, recorder, config):
+    n = min(config["scale"], 200000)
+    rows = raw_rows(n, config["seed"])
+    repeat = config["repeat"]
+
+    stats = measure(lambda: eager_decode(rows), repeat=repeat, units=n)
+    recorder.add(SUITE, "decode: eager dicts", stats, rows=n)
+    stats = measure(lambda: list(map(app.DocumentRow, rows)), repeat=repeat, units=n)
+    recorder.add(SUITE, "decode: lazy DocumentRow", stats, rows=n)
+
+    # Typical dashboard use: decode the whole result, display one page of it
+    stats = measure(lambda: [app.dashboard_row_values(r) for r in eager_decode(rows)[:25]], repeat=repeat, units=n)
+    recorder.add(SUITE, "decode all + display 25: eager", stats, rows=n)
+    stats = measure(lambda: [app.dashboard_row_values(r) for r in list(map(app.DocumentRow, rows))[:25]],
+                    repeat=repeat, units=n)
+    recorder.add(SUITE, "decode all + display 25: lazy", stats, rows=n)
+
+    db = config.get("db")
+    if db is None:
+        recorder.skip(SUITE, "fetch_invoices large page", config.get("db_unavailable", "no database"))
+        return
+    db.cursor.execute("SELECT COUNT(*) FROM invoices")
+    total = db.cursor.fetchone()[0]
+    page_size = min(total, 10000) or 1
+    stats = measure(lambda: db.fetch_invoices(page=1, page_size=page_size), repeat=repeat, units=page_size)
+    recorder.add(SUITE, f"fetch_invoices [{page_size} rows]", stats, rows=page_size)
+    stats = measure(lambda: sum(1 for _ in db.iter_invoices(batch_size=2000)), repeat=repeat, units=total)
+    recorder.add(SUITE, f"iter_invoices stream [{total} rows]", stats, rows=total)
@@ -0,0 +1,65 @@
+"""Statement-of-account rendering: pages/sec and peak Python memory as the client's invoice count grows."""
+
+import os
+import tempfile
+import tracemalloc
+
+from benchmarks import datagen
+
+SUITE = "statement"
+CLIENT = "BENCH Statement Client"
+
+
+def seed_client(db, count, seed):
+    """Give CLIENT exactly `count` invoices (with line items) under the BENCH-SOA prefix."""
+    db.cursor.execute("SELECT COUNT(*) FROM invoices WHERE client_name = %s", (CLIENT,))
+    if db.cursor.fetchone()[0] == count:
+        return
+    db.cursor.execute("DELETE FROM invoice_items WHERE invoice_number LIKE %s", ("BENCH-SOA-%",))
+    db.cursor.execute("DELETE FROM invoices WHERE invoice_number LIKE %s", ("BENCH-SOA-%",))
+    headers, lines = [], []
+    for data, items in datagen.iter_invoices(count, seed, prefix="BENCH-SOA"):
+        headers.append((data['invoice_no'], CLIENT, "statement@example.com", data['client_address'], data['invoice_type'],
+                        data['date_issued'], data['subtotal'], data['vat'], data['shipping'], data['wht'],
+                        data['wht_rate'], data['grand_total'], round(data['grand_total'] - data['wht'], 2)))
+        lines.extend((data['invoice_no'], int(it['sn']), it['desc'], it['type'], it['qty'], it['price'], it['total'])
+                     for it in items)
+    db.cursor.executemany(
+        "INSERT INTO invoices (invoice_number, client_name, client_email, client_address, invoice_type, date_issued, "
+        "subtotal, vat_amount, shipping_cost, wht_amount, wht_rate, grand_total, balance_due) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+        headers)
+    db.cursor.executemany(
+        "INSERT INTO invoice_items (invoice_number, sn, description, item_type, qty, unit_price, total) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+        lines)
+    db.conn.commit()
+
+
+def run(app, recorder, config):
+    db = config.get("db")
+    if db is None:
+        recorder.skip(SUITE, "render_statement_pdf", config.get("db_unavailable", "no database"))
+        return
+    largest = config.get("statement_invoices", 2000)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "statement.pdf")
+        # Past statement_part_pages the pages go to part files, so the peak should level off rather than grow
+        for count in sorted({max(1, largest // 10), max(1, largest // 2), largest}):
+            seed_client(db, count, config["seed"])
+            result = app.render_statement_pdf(path, db, CLIENT)
+            size = os.path.getsize(path)
+
+            # Second pass under tracemalloc: peak should stay flat while the invoice count grows
+            tracemalloc.start()
+            app.render_statement_pdf(path, db, CLIENT)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            stats = {"repeat": 1, "units": result['pages'], "min_s": result['seconds'], "median_s": result['seconds'],
+                     "mean_s": result['seconds'], "p95_s": result['seconds'], "max_s": result['seconds'],
+                     "units_per_s": result['pages_per_sec']}
+            recorder.add(SUITE, f"render_statement_pdf [{count} invoices]", stats, invoices=result['invoices'],
+                         pages=result['pages'], file_bytes=size, peak_traced_mb=round(peak / 2 ** 20, 1))
+        db.cursor.execute("DELETE FROM invoice_items WHERE invoice_number LIKE %s", ("BENCH-SOA-%",))
+        db.cursor.execute("DELETE FROM invoices WHERE invoice_number LIKE %s", ("BENCH-SOA-%",))
+        db.conn.commit()
@@ -0,0 +1,62 @@
+"""Tax engine: TaxRules.compute (rules compiled to per-type lookups, each tax worked out once per rate) against
+evaluating the rule list for every line, on carts of 10 to 100,000 lines mixing exempt and withheld services."""
+
+import random
+
+from benchmarks import datagen
+from benchmarks.harness import measure
+
+SUITE = "tax"
+CART_SIZES = (10, 1000, 100000)
+EXEMPT = ["Training", "Grant Work"]
+WHT_RATES = {"Consulting": 10, "Installation": 5, "Maintenance": 5, "Design": 10, "Supervision": 2.5}
+SERVICES = ["Project"] + EXEMPT + list(WHT_RATES)
+
+
+def make_cart(rng, n_items):
+    items = datagen.make_cart(rng, n_items, "Project")
+    for item in items:
+        item["service"] = rng.choice(SERVICES)
+        if rng.random() < 0.05:
+            item["vat"] = False  # a catalog product sold without VAT
+    return items
+
+
+def naive_totals(app, rules, items, shipping, wht_rate, currency):
+    """Every line matched against the rule list and taxed on its own (baseline)."""
+    subtotal, vat, wht = 0.0, 0.0, 0.0
+    for item in items:
+        service = item.get("service") or item.get("type")
+        taxed, line_wht = item.get("vat", True), wht_rate
+        for kind, name, rate in rules:
+            if name.lower() == service.lower():
+                if kind == "exempt":
+                    taxed = False
+                else:
+                    line_wht = rate
+        line_vat = item["total"] * app.COMPANY_CONFIG["vat_rate"] if taxed else 0.0
+        subtotal += item["total"]
+        vat += line_vat
+        wht += (item["total"] + line_vat) * (line_wht / 100)
+    wht += shipping * (wht_rate / 100)
+    return {"subtotal": app.round_money(subtotal, currency), "vat": app.round_money(vat, currency),
+            "wht": app.round_money(wht, currency)}
+
+
+def run(app, recorder, config):
+    rng = random.Random(config["seed"])
+    compiled = app.TaxRules(app.COMPANY_CONFIG["vat_rate"], EXEMPT, WHT_RATES)
+    rules = [("exempt", name, 0) for name in EXEMPT] + [("wht", name, rate) for name, rate in WHT_RATES.items()]
+    stats = measure(lambda: app.TaxRules(app.COMPANY_CONFIG["vat_rate"], EXEMPT, WHT_RATES), repeat=config["repeat"] * 20)
+    recorder.add(SUITE, "compile TaxRules", stats, rules=len(rules))
+    for n_items in CART_SIZES:
+        items = make_cart(rng, n_items)
+        repeat = config["repeat"] if n_items < 100000 else max(1, config["repeat"] // 2)
+        stats = measure(lambda: compiled.compute(items, 1500.0, 5, "NGN"), repeat=repeat, units=n_items)
+        recorder.add(SUITE, f"TaxRules.compute [{n_items} lines]", stats, lines=n_items, rules=len(rules))
+        stats = measure(lambda: naive_totals(app, rules, items, 1500.0, 5, "NGN"), repeat=repeat, units=n_items)
+        recorder.add(SUITE, f"rule scan per line [{n_items} lines, baseline]", stats, lines=n_items, rules=len(rules))
+        totals, naive = compiled.compute(items, 1500.0, 5, "NGN"), naive_totals(app, rules, items, 1500.0, 5, "NGN")
+        for key in ("subtotal", "vat", "wht"):
+            # Per-line and per-rate sums round differently by at most a kobo a rate
+            assert abs(totals[key] - naive[key]) <= 0.01 * len(totals["taxes"]), (key, totals[key], naive[key])
@@ -0,0 +1,43 @@
+"""
+Compare two benchmark result files case by case.
+
+    python -m benchmarks.compare baseline.json candidate.json --threshold 0.10
+
+Exits with status 1 when any case's median got slower by more than the threshold.
+"""
+
+import argparse
+import json
+import sys
+
+
+def load_cases(path):
+    with open(path, encoding="utf-8") as f:
+        payload = json.load(f)
+    return {(c["suite"], c["name"]): c for c in payload["cases"] if "median_s" in c}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown ratio (0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    base, cand = load_cases(args.baseline), load_cases(args.candidate)
+    regressions = 0
+    for key in sorted(set(base) & set(cand)):
+        old, new = base[key]["median_s"], cand[key]["median_s"]
+        change = (new - old) / old if old else 0.0
+        flag = ""
+        if change > args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{key[0]:<8} {key[1]:<45} {old * 1000:10.2f} ms -> {new * 1000:10.2f} ms  {change:+7.1%}{flag}")
+    for key in sorted(set(base) ^ set(cand)):
+        print(f"{key[0]:<8} {key[1]:<45} only in {'baseline' if key in base else 'candidate'}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
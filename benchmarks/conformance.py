@@ -0,0 +1,1046 @@
+"""
+Storage backend conformance checks: every backend must give DatabaseManager identical behaviour.
+
+    python -m benchmarks.conformance --backend sqlite
+    python -m benchmarks.conformance --backend mysql --db-name nascomsoft_conformance_db
+
+Each check runs against a freshly migrated, empty schema. Exits non-zero on any failure.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import traceback
+from datetime import datetime, timedelta
+
+import INVOICE_GENERATOR as app
+
+TABLES = ("invoice_items", "quotation_items", "invoices", "quotations", "email_deliveries", "document_archive", "audit_log", "change_feed", "app_settings",
+          "document_sequences", "tenants", "import_keys", "products", "stock_levels", "stock_ledger", "stock_status", "payments", "receivables_daily",
+          "receivables_by_client", "exchange_rates", "document_taxes", "price_rules", "credit_notes", "credit_note_items")
+CHECKS = []
+
+
+def check(func):
+    CHECKS.append(func)
+    return func
+
+
+def sample_invoice(number, client="Conformance Client", invoice_type="Component", total=1000.0):
+    vat = total * 0.075
+    data = {"invoice_no": number, "client_name": client, "client_email": "c@example.com",
+            "client_address": "1 Test Road", "invoice_type": invoice_type, "subtotal": total,
+            "vat": vat, "shipping": 0.0, "wht": 0.0, "wht_rate": 0.0, "grand_total": total + vat}
+    items = [{"sn": "1", "desc": "Widget", "type": invoice_type, "qty": 2, "price": total / 2, "total": total}]
+    return data, items
+
+
+def sample_quote(number, client="Quote Client", total=500.0):
+    data, items = sample_invoice(number, client, "Quotation", total)
+    data["quote_no"] = data.pop("invoice_no")
+    return data, items
+
+
+@check
+def migrations_are_idempotent(db):
+    assert db.create_tables() is not False
+    assert db.create_tables() is not False
+    for table in TABLES:
+        db.cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        assert db.cursor.fetchone()[0] == (1 if table == "tenants" else 0), table  # the seeded default company
+
+
+@check
+def save_and_fetch_invoice_roundtrip(db):
+    data, items = sample_invoice("CONF-INV-0001")
+    assert db.save_invoice(data, items)
+    rows = db.fetch_invoices()
+    assert len(rows) == 1
+    row = rows[0]
+    assert row["invoice_no"] == "CONF-INV-0001"
+    assert row["client_name"] == "Conformance Client"
+    assert abs(row["grand_total"] - 1075.0) < 0.01
+    datetime.strptime(row["date_issued"], "%Y-%m-%d %H:%M:%S")
+    db.cursor.execute("SELECT COUNT(*) FROM invoice_items WHERE invoice_number = %s", ("CONF-INV-0001",))
+    assert db.cursor.fetchone()[0] == 1
+
+
+@check
+def duplicate_invoice_number_is_rejected_atomically(db):
+    data, items = sample_invoice("CONF-INV-0001")
+    assert db.save_invoice(data, items)
+    assert not db.save_invoice(data, items)
+    db.cursor.execute("SELECT COUNT(*) FROM invoice_items")
+    assert db.cursor.fetchone()[0] == 1, "failed save must not leave line items behind"
+
+
+@check
+def invoice_filters_and_pagination(db):
+    for i in range(30):
+        data, items = sample_invoice(f"CONF-INV-{i:04d}", client="Alpha Ltd" if i % 3 else "Beta Ltd",
+                                     invoice_type="Project" if i % 2 else "Component")
+        assert db.save_invoice(data, items)
+    assert len(db.fetch_invoices(page=1, page_size=25)) == 25
+    assert len(db.fetch_invoices(page=2, page_size=25)) == 5
+    assert len(db.fetch_invoices({"client_name": "Beta"}, page_size=100)) == 10
+    assert len(db.fetch_invoices({"invoice_type": "Project"}, page_size=100)) == 15
+    assert len(db.fetch_invoices({"invoice_no": "INV-001"}, page_size=100)) == 10
+    tomorrow = datetime.now() + timedelta(days=1)
+    assert len(db.fetch_invoices({"date_to": tomorrow}, page_size=100)) == 30
+    assert len(db.fetch_invoices({"date_from": tomorrow}, page_size=100)) == 0
+
+
+@check
+def date_ranges_are_inclusive_for_both_document_types(db):
+    assert db.save_invoice(*sample_invoice("CONF-INV-0001"))
+    assert db.save_quotation(*sample_quote("CONF-QTN-0001"))
+    db.cursor.execute("UPDATE invoices SET date_issued = %s", (datetime(2024, 3, 31, 18, 30),))
+    db.cursor.execute("UPDATE quotations SET date_issued = %s", (datetime(2024, 3, 31, 18, 30),))
+    db.conn.commit()
+    db.invalidate_summaries()
+    march = {"date_from": "2024-03-01", "date_to": "2024-03-31"}
+    april = {"date_from": datetime(2024, 4, 1).date(), "date_to": datetime(2024, 4, 30).date()}
+    assert len(db.fetch_invoices(march)) == 1
+    assert len(db.fetch_quotations(march)) == 1
+    assert db.fetch_invoices(april) == [] and db.fetch_quotations(april) == []
+    assert db.summarize_documents("quotations", march)["count"] == 1
+
+
+@check
+def number_generation_follows_tenant_sequence(db):
+    year = datetime.now().year
+    assert db.generate_invoice_number() == f"NSE-INV-{year}-0001"
+    assert db.save_invoice(*sample_invoice("CONF-INV-0001")), "hand-typed numbers do not advance the sequence"
+    assert db.generate_invoice_number() == f"NSE-INV-{year}-0001"
+    assert db.save_invoice(*sample_invoice(f"NSE-INV-{year}-0007"))
+    assert db.generate_invoice_number() == f"NSE-INV-{year}-0008"
+    assert db.generate_quotation_number() == f"NSE-QTN-{year}-0001"
+
+
+@check
+def sequences_seed_from_numbers_issued_before_them(db):
+    year = datetime.now().year
+    for n in (9, 10):
+        assert db.save_invoice(*sample_invoice(f"NSE-INV-{year}-{n:04d}"))
+    db.cursor.execute("DELETE FROM document_sequences")
+    db.conn.commit()
+    assert db.generate_invoice_number() == f"NSE-INV-{year}-0011"
+
+
+@check
+def tenants_see_only_their_own_documents(db):
+    branch_id, err = db.save_tenant({"code": "ABJ", "parent_id": app.DEFAULT_TENANT_ID})
+    assert branch_id, err
+    assert db.save_invoice(*sample_invoice("CONF-INV-0001", client="Shared Client"))
+    assert db.save_quotation(*sample_quote("CONF-QTN-0001", client="Shared Client"))
+    assert db.use_tenant("ABJ") and db.tenant_id == branch_id
+    assert db.fetch_invoices() == [] and db.fetch_quotations() == []
+    assert db.summarize_documents("invoices", {})["count"] == 0
+    assert db.fetch_document("invoices", "CONF-INV-0001") is None
+    assert not db.delete_invoice("CONF-INV-0001")
+    assert db.client_statement_summary("Shared Client")["count"] == 0
+    assert db.convert_quotation_to_invoice("CONF-QTN-0001")[0] is None
+    assert db.save_invoice(*sample_invoice("CONF-INV-0002", client="Shared Client"))
+    assert [r["invoice_no"] for r in db.fetch_invoices()] == ["CONF-INV-0002"]
+    assert db.use_tenant(app.DEFAULT_TENANT_ID)
+    assert [r["invoice_no"] for r in db.fetch_invoices()] == ["CONF-INV-0001"]
+    assert db.fetch_document("invoices", "CONF-INV-0001")["tenant_id"] == app.DEFAULT_TENANT_ID
+
+
+@check
+def each_tenant_numbers_its_own_documents(db):
+    year = datetime.now().year
+    assert db.save_invoice(*sample_invoice(db.generate_invoice_number()))
+    assert db.save_invoice(*sample_invoice(db.generate_invoice_number()))
+    assert db.save_tenant({"code": "KAN", "number_prefix": "NSK"})[0]
+    assert db.save_tenant({"code": "KAD", "number_prefix": "NSE"})[0] is None, "number prefixes are not shared"
+    assert db.use_tenant("KAN")
+    number = db.generate_invoice_number()
+    assert number == f"NSK-INV-{year}-0001", number
+    assert db.save_invoice(*sample_invoice(number))
+    assert db.generate_invoice_number() == f"NSK-INV-{year}-0002"
+    assert db.use_tenant("NSE")
+    assert db.generate_invoice_number() == f"NSE-INV-{year}-0003"
+
+
+@check
+def branches_inherit_their_company_letterhead(db):
+    company_id, err = db.save_tenant({"code": "ACME", "company_name": "Acme Ltd", "address": "1 Acme Way\nKano",
+                                      "bank_name": "Acme Bank", "account_number": "0001"})
+    assert company_id, err
+    branch_id, err = db.save_tenant({"code": "ACMEABJ", "parent_id": company_id, "address": "2 Branch Road\nAbuja"})
+    assert branch_id, err
+    assert db.save_tenant({"code": "SUB", "parent_id": branch_id})[0] is None, "branches cannot have branches"
+    letterhead = db.letterhead(branch_id)
+    assert letterhead.company_name == "Acme Ltd" and letterhead.bank_name == "Acme Bank"
+    assert letterhead.address_lines == ("2 Branch Road", "Abuja")
+    assert letterhead.tin == app.COMPANY_CONFIG["tin"], "unset everywhere: falls back to the company settings"
+    assert db.letterhead(branch_id) is letterhead, "letterheads are built once per tenant"
+    assert db.save_tenant({"id": company_id, "code": "ACME", "company_name": "Acme Nigeria Ltd"})[0]
+    assert db.letterhead(branch_id).company_name == "Acme Nigeria Ltd", "parent edits reach the branch"
+    assert db.letterhead().company_name == app.COMPANY_CONFIG["company_name"]
+    assert db.fetch_changes(0)[-1][1:] == ("tenants", "ACME", "update")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "branch.pdf")
+        data, items = sample_invoice("CONF-INV-0001")
+        app.render_document_pdf(path, data, items, letterhead=db.letterhead(branch_id))
+        with open(path, "rb") as f:
+            assert f.read(5) == b"%PDF-"
+
+
+@check
+def quotation_roundtrip_and_delete(db):
+    data, items = sample_quote("CONF-QTN-0001")
+    assert db.save_quotation(data, items)
+    rows = db.fetch_quotations({"client_name": "Quote"})
+    assert [r["invoice_no"] for r in rows] == ["CONF-QTN-0001"]
+    assert rows[0]["invoice_type"] == "Quotation"
+    assert db.delete_quotation("CONF-QTN-0001")
+    assert db.fetch_quotations() == []
+
+
+@check
+def convert_quotation_copies_items_once(db):
+    data, items = sample_quote("CONF-QTN-0001")
+    assert db.save_quotation(data, items)
+    invoice, err = db.convert_quotation_to_invoice("CONF-QTN-0001")
+    assert invoice and not err, err
+    assert invoice["source_quote"] == "CONF-QTN-0001"
+    db.cursor.execute("SELECT COUNT(*) FROM invoice_items WHERE invoice_number = %s", (invoice["invoice_no"],))
+    assert db.cursor.fetchone()[0] == 1
+    again, err = db.convert_quotation_to_invoice("CONF-QTN-0001")
+    assert again is None and "already converted" in err
+    missing, err = db.convert_quotation_to_invoice("CONF-QTN-9999")
+    assert missing is None and "not found" in err
+
+
+@check
+def convert_quotation_to_project_invoice_and_renumber(db):
+    data, items = sample_quote("CONF-QTN-0001")
+    assert db.save_quotation(data, items)
+    data, items = sample_quote("CONF-QTN-0002")
+    assert db.save_quotation(data, items)
+    invoice, err = db.convert_quotation_to_invoice("CONF-QTN-0001", "Project", 5.0)
+    assert invoice and not err, err
+    doc = db.fetch_document("invoices", invoice["invoice_no"])
+    assert (doc["invoice_type"], doc["wht_rate"], doc["wht"]) == ("Project", 5.0, 26.88), doc
+    assert doc["balance_due"] == round(doc["grand_total"] - doc["wht"], 2)
+    assert [t for t in doc["taxes"] if t["tax"] == "WHT"] == [{"tax": "WHT", "rate": 5.0, "taxable": 537.5, "amount": 26.88}], doc["taxes"]
+    assert db.convert_quotation_to_invoice("CONF-QTN-0002", "Quotation")[0] is None
+    # Another user saves under the number this conversion previews; it takes the next one instead of failing
+    taken = db.generate_invoice_number()
+    previews = iter([taken])
+    assert db.save_invoice(*sample_invoice(taken))
+    db.generate_invoice_number = lambda: next(previews, None) or app.DatabaseManager.generate_invoice_number(db)
+    try:
+        invoice, err = db.convert_quotation_to_invoice("CONF-QTN-0002")
+    finally:
+        del db.generate_invoice_number
+    assert invoice and invoice["invoice_no"] != taken, err
+    assert db.fetch_document("invoices", invoice["invoice_no"])["invoice_type"] == "Component"
+
+
+@check
+def summaries_aggregate_filters_and_invalidate(db):
+    for i in range(12):
+        assert db.save_invoice(*sample_invoice(f"CONF-INV-{i:04d}", invoice_type="Project" if i % 2 else "Component"))
+    summary = db.summarize_documents("invoices", {"invoice_type": "Project"})
+    assert summary["count"] == 6
+    assert abs(summary["grand_total"] - 6 * 1075.0) < 0.01
+    assert abs(summary["vat"] - 6 * 75.0) < 0.01
+    assert db.summarize_documents("invoices")["count"] == 12
+    assert db.delete_invoice("CONF-INV-0001")
+    assert db.summarize_documents("invoices", {"invoice_type": "Project"})["count"] == 5
+    assert db.summarize_documents("quotations")["count"] == 0
+
+
+@check
+def delete_invoice(db):
+    assert db.save_invoice(*sample_invoice("CONF-INV-0001"))
+    assert db.delete_invoice("CONF-INV-0001")
+    assert db.fetch_invoices() == []
+
+
+@check
+def failed_delete_leaves_nothing_pending(db):
+    assert db.save_invoice(*sample_invoice("CONF-INV-0001"))
+    assert db.save_invoice(*sample_invoice("CONF-INV-0002"))
+    before = db.aging_summary()
+
+    def fail(doc_number):
+        raise RuntimeError("stock return failed")
+    db._return_stock = fail
+    try:
+        assert not db.delete_invoice("CONF-INV-0001")
+    finally:
+        del db._return_stock
+    # The next commit on this connection must not carry a half-finished delete with it
+    assert db.record_payment("CONF-INV-0002", 100, "Cash")[0]
+    assert db.fetch_document("invoices", "CONF-INV-0001") is not None
+    assert db.aging_summary()["Total"]["count"] == before["Total"]["count"]
+    assert db.delete_invoice("CONF-INV-0001")
+
+
+@check
+def email_log_roundtrip(db):
+    assert db.save_email_log("a@example.com", "Subject", "file.pdf", "SENT")
+    assert db.save_email_log("b@example.com", "Subject", None, "FAILED", "boom")
+    logs = db.fetch_email_logs(10)
+    assert {l["status"] for l in logs} == {"SENT", "FAILED"}
+    assert any(l["error_message"] == "boom" for l in logs)
+
+
+@check
+def archive_moves_documents_and_restores_them(db):
+    for i in range(5):
+        assert db.save_invoice(*sample_invoice(f"CONF-INV-{i:04d}"))
+    assert db.save_quotation(*sample_quote("CONF-QTN-0001"))
+    old = datetime.now() - timedelta(days=400)
+    db.cursor.execute("UPDATE invoices SET date_issued = %s WHERE invoice_number IN (%s, %s, %s)",
+                      (old, "CONF-INV-0000", "CONF-INV-0001", "CONF-INV-0002"))
+    db.cursor.execute("UPDATE quotations SET date_issued = %s", (old,))
+    db.rebuild_receivables()
+    db.conn.commit()
+    for number in ("CONF-INV-0000", "CONF-INV-0001"):
+        payment_id, err = db.record_payment(number, 1075.0, "Transfer")
+        assert payment_id, err
+    aging = db.aging_summary()
+    with tempfile.TemporaryDirectory() as pdf_dir, tempfile.TemporaryDirectory() as archive_dir:
+        archiver = app.DocumentArchiver(db, {"pdf_dir": pdf_dir, "archive_dir": archive_dir,
+                                             "batch_size": 2, "pause_seconds": 0})
+        pdf = os.path.join(pdf_dir, archiver.pdf_name("invoices", "CONF-INV-0000"))
+        with open(pdf, "wb") as f:
+            f.write(b"%PDF-1.4 conformance")
+        assert archiver.run(365) == 3
+        # CONF-INV-0002 is as old but still owed, so it stays live and in the aging report
+        assert sorted(r["invoice_no"] for r in db.fetch_invoices()) == ["CONF-INV-0002", "CONF-INV-0003", "CONF-INV-0004"]
+        assert db.aging_summary() == aging
+        assert db.fetch_quotations() == []
+        archived = db.fetch_archived({"client_name": "Conformance"})
+        assert len(archived) == 2
+        assert db.summarize_documents("archive")["count"] == 3
+        assert not os.path.exists(pdf)
+        assert len(os.listdir(archive_dir)) == 1
+
+        ok, err = archiver.restore("CONF-INV-0000")
+        assert ok and not err, err
+        assert os.path.exists(pdf)
+        assert "CONF-INV-0000" in [r["invoice_no"] for r in db.fetch_invoices()]
+        db.cursor.execute("SELECT COUNT(*) FROM invoice_items WHERE invoice_number = %s", ("CONF-INV-0000",))
+        assert db.cursor.fetchone()[0] == 1
+        ok, err = archiver.restore("CONF-QTN-0001")
+        assert ok and not err, err
+        assert [r["invoice_no"] for r in db.fetch_quotations()] == ["CONF-QTN-0001"]
+        ok, err = archiver.restore("CONF-INV-0000")
+        assert not ok and "not in the archive" in err
+
+
+@check
+def deletes_are_soft_and_audited(db):
+    assert db.save_invoice(*sample_invoice("CONF-INV-0001"))
+    assert db.save_quotation(*sample_quote("CONF-QTN-0001"))
+    assert db.delete_invoice("CONF-INV-0001")
+    assert not db.delete_invoice("CONF-INV-0001"), "second delete must report nothing deleted"
+    db.cursor.execute("SELECT deleted_at FROM invoices WHERE invoice_number = %s", ("CONF-INV-0001",))
+    assert db.cursor.fetchone()[0] is not None
+    db.cursor.execute("SELECT COUNT(*) FROM invoice_items WHERE invoice_number = %s", ("CONF-INV-0001",))
+    assert db.cursor.fetchone()[0] == 1
+    assert db.fetch_document("invoices", "CONF-INV-0001") is None
+    assert db.summarize_documents("invoices")["count"] == 0
+    assert not db.save_invoice(*sample_invoice("CONF-INV-0001")), "deleted numbers are never reused"
+    invoice, err = db.convert_quotation_to_invoice("CONF-QTN-0001")
+    assert invoice, err
+
+    assert db.audit.pending() > 0
+    history = db.fetch_audit_history(doc_number="CONF-INV-0001")
+    assert db.audit.pending() == 0
+    assert [e["action"] for e in history] == ["delete", "create"]
+    assert [e["action"] for e in db.fetch_audit_history(doc_number="CONF-QTN-0001")] == ["convert", "create"]
+    actor_events = db.fetch_audit_history(actor=app.AUDIT_SETTINGS["actor"])
+    assert len(actor_events) == 5
+    try:
+        db.cursor.execute("DELETE FROM audit_log")
+        db.conn.commit()
+    except app.DB_ERRORS:
+        db._rollback()
+    else:
+        raise AssertionError("audit_log accepted a DELETE")
+
+
+@check
+def stale_versions_and_taken_numbers_are_detected(db):
+    data, items = sample_invoice("CONF-INV-0001")
+    assert db.save_invoice(data, items)
+    assert db.fetch_document("invoices", "CONF-INV-0001")["version"] == 1
+    assert db.fetch_invoices()[0]["version"] == 1
+    assert not db.delete_invoice("CONF-INV-0001", expected_version=2), "stale version must not delete"
+    assert db.delete_invoice("CONF-INV-0001", expected_version=1)
+    db.cursor.execute("SELECT version FROM invoices WHERE invoice_number = %s", ("CONF-INV-0001",))
+    assert db.cursor.fetchone()[0] == 2
+
+    taken, _ = sample_invoice(db.generate_invoice_number())
+    racing = dict(taken)
+    assert db.save_invoice(taken, items)
+    assert not db.save_invoice(dict(racing), items), "a taken number is rejected without renumber"
+    assert db.save_invoice(racing, items, renumber=True)
+    assert racing["invoice_no"] != taken["invoice_no"]
+    quote, quote_items = sample_quote(db.generate_quotation_number())
+    assert db.save_quotation(dict(quote), quote_items)
+    assert db.save_quotation(quote, quote_items, renumber=True)
+    assert db.summarize_documents("quotations")["count"] == 2
+
+
+@check
+def change_feed_records_committed_changes(db):
+    start = db.latest_change_id()
+    assert db.save_invoice(*sample_invoice("CONF-INV-0001"))
+    assert db.save_quotation(*sample_quote("CONF-QTN-0001"))
+    assert not db.save_invoice(*sample_invoice("CONF-INV-0001")), "failed saves leave no feed row"
+    invoice, err = db.convert_quotation_to_invoice("CONF-QTN-0001")
+    assert invoice, err
+    assert db.delete_invoice("CONF-INV-0001")
+    changes = db.fetch_changes(start)
+    assert [(c[1], c[2], c[3]) for c in changes] == [
+        ("invoices", "CONF-INV-0001", "create"), ("quotations", "CONF-QTN-0001", "create"),
+        ("quotations", "CONF-QTN-0001", "update"), ("invoices", invoice["invoice_no"], "create"),
+        ("invoices", "CONF-INV-0001", "delete")]
+    assert db.fetch_changes(changes[-1][0]) == []
+    assert db.latest_change_id() == changes[-1][0]
+    assert db.fetch_dashboard_row("invoices", invoice["invoice_no"])["version"] == 1
+    assert db.fetch_dashboard_row("invoices", invoice["invoice_no"], {"client_name": "Nobody"}) is None
+    assert db.fetch_dashboard_row("invoices", "CONF-INV-0001") is None
+    db.prune_change_feed(retention_hours=-1)
+    assert db.fetch_changes(start) == []
+
+
+@check
+def settings_persist_validate_and_reload(db):
+    start = db.latest_change_id()
+    assert db.load_settings() == {}
+    try:
+        ok, err = db.save_settings("smtp", {"host": "mail.example.com", "port": 2525, "use_tls": False})
+        assert ok, err
+        assert app.SMTP_SETTINGS["host"] == "mail.example.com" and app.SMTP_SETTINGS["port"] == 2525
+        assert db.load_settings()["smtp"]["use_tls"] is False
+        ok, err = db.save_settings("smtp", {"port": 2526})
+        assert ok, err
+        assert db.load_settings()["smtp"] == {"host": "mail.example.com", "port": 2526, "use_tls": False}
+        version = app.CONFIG.snapshot.version
+        ok, err = db.save_settings("smtp", {"port": 70000})
+        assert not ok and "smtp.port" in err, err
+        ok, err = db.save_settings("company", {"vat_rate": 7.5})
+        assert not ok and "vat_rate" in err, err
+        ok, err = db.save_settings("db", {"backend": "sqlite"})
+        assert not ok
+        ok, err = db.save_settings("smtp", {"host": "mail.example.com", "password": "secret"})
+        assert not ok and "smtp.password" in err, err
+        # A password saved by an older version is purged on startup and never read back
+        db.cursor.execute("INSERT INTO app_settings (section, setting, setting_value) VALUES (%s, %s, %s)",
+                          ("smtp", "password", '"secret"'))
+        assert "password" not in db.load_settings()["smtp"]
+        db.create_tables()
+        db.cursor.execute("SELECT COUNT(*) FROM app_settings WHERE setting = %s", ("password",))
+        assert db.cursor.fetchone()[0] == 0
+        assert app.CONFIG.snapshot.version == version, "rejected settings must not reload"
+        assert app.SMTP_SETTINGS["port"] == 2526
+        assert [c[1:] for c in db.fetch_changes(start)] == [("settings", "smtp", "update")] * 2
+    finally:
+        db.cursor.execute("DELETE FROM app_settings")
+        db.conn.commit()
+        app.CONFIG.reload(db)
+    assert app.SMTP_SETTINGS["port"] == app.DEFAULT_CONFIG["smtp"]["port"]
+
+
+@check
+def fetch_document_returns_header_and_items(db):
+    assert db.save_invoice(*sample_invoice("CONF-INV-0001", invoice_type="Project"))
+    assert db.save_quotation(*sample_quote("CONF-QTN-0001"))
+    invoice = db.fetch_document("invoices", "CONF-INV-0001")
+    assert invoice["invoice_no"] == "CONF-INV-0001" and invoice["invoice_type"] == "Project"
+    assert abs(invoice["grand_total"] - 1075.0) < 0.01
+    assert [i["desc"] for i in invoice["items"]] == ["Widget"]
+    quote = db.fetch_document("quotations", "CONF-QTN-0001")
+    assert quote["quote_no"] == "CONF-QTN-0001" and quote["items"][0]["type"] == "Quotation"
+    assert db.fetch_document("invoices", "CONF-INV-9999") is None
+
+
+@check
+def statement_streams_one_clients_invoices_in_range(db):
+    for i in range(5):
+        assert db.save_invoice(*sample_invoice(f"CONF-INV-{i:04d}", client="Statement Client"))
+    assert db.save_invoice(*sample_invoice("CONF-INV-0099", client="Other Client"))
+    db.cursor.execute("UPDATE invoices SET date_issued = %s WHERE invoice_number = %s",
+                      (datetime.now() - timedelta(days=90), "CONF-INV-0000"))
+    db.conn.commit()
+    chunks = list(db.iter_client_invoices("Statement Client", chunk_size=2))
+    assert [len(c) for c in chunks] == [2, 2, 1]
+    assert chunks[0][0]["invoice_no"] == "CONF-INV-0000" and len(chunks[0][0]["items"]) == 1
+    since = (datetime.now() - timedelta(days=30)).date()
+    summary = db.client_statement_summary("Statement Client", since)
+    assert summary["count"] == 4 and abs(summary["grand_total"] - 4 * 1075.0) < 0.01
+    assert summary["balance_due"] == 4 * 1075.0
+    # A paid and a credited invoice are not owed in full on the statement
+    assert db.record_payment("CONF-INV-0001", 1075.0, "Transfer")[0]
+    assert db.issue_invoice_note("credit_notes", "CONF-INV-0002", [{"desc": "Widget returned", "qty": 1, "price": 200}], "Returned")[0]
+    summary = db.client_statement_summary("Statement Client", since)
+    assert (summary["amount_paid"], summary["adjusted"], summary["balance_due"]) == (1075.0, -215.0, 2 * 1075.0 + 860.0)
+    lines = {inv["invoice_no"]: inv for chunk in db.iter_client_invoices("Statement Client", with_items=False) for inv in chunk}
+    assert (lines["CONF-INV-0001"]["balance_due"], lines["CONF-INV-0002"]["balance_due"], lines["CONF-INV-0002"]["adjusted"]) == (0.0, 860.0, -215.0)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "statement.pdf")
+        result = app.render_statement_pdf(path, db, "Statement Client", since)
+        assert result["invoices"] == 4 and result["pages"] >= 5, result
+        assert result["client_email"] == "c@example.com"
+        with open(path, "rb") as f:
+            assert f.read(5) == b"%PDF-"
+        # Written two pages per part and joined: one page tree listing every page, and no part files left behind
+        parted = app.render_statement_pdf(path, db, "Statement Client", since, part_pages=2)
+        assert parted["pages"] == result["pages"], parted
+        with open(path, "rb") as f:
+            data = f.read()
+        assert data.count(b"/Type /Page\n") == result["pages"] and f"/Count {result['pages']} ".encode() in data
+        assert os.listdir(tmp) == ["statement.pdf"]
+
+
+
+@check
+def import_is_idempotent_and_reports_conflicts(db):
+    assert db.save_invoice(*sample_invoice("CONF-INV-0001", client="Acme Ltd"))
+    rows = [("CONF-IMP-0001", "2025-03-01", "acme  ltd", "Cable", "2", "N1,500.00"),
+            ("CONF-IMP-0001", "2025-03-01", "acme  ltd", "Clips", "10", "50"),
+            ("CONF-IMP-0002", "01/03/2025", "New Client", "Repair", "1", "200"),
+            ("CONF-INV-0001", "2025-03-01", "Acme Ltd", "Taken", "1", "1"),
+            ("CONF-IMP-0003", "", "", "Broken", "x", "1")]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "import.csv")
+
+        def write(lines):
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                f.write("Invoice No,Date,Client Name,Description,Qty,Unit Price\n")
+                f.writelines(",".join(f'"{v}"' for v in line) + "\n" for line in lines)
+
+        def run():
+            return app.InvoiceImporter(db, chunk_size=2, errors_path=os.path.join(tmp, "errors.csv")).run(path)
+
+        write(rows)
+        stats = run()
+        assert (stats["documents"], stats["imported"], stats["skipped"], stats["rejected"]) == (4, 2, 0, 2), stats
+        doc = db.fetch_document("invoices", "CONF-IMP-0001")
+        assert doc["client_name"] == "Acme Ltd", "matched to the client on file"
+        assert len(doc["items"]) == 2 and abs(doc["subtotal"] - 3500.0) < 0.01 and abs(doc["grand_total"] - 3762.5) < 0.01
+        assert db.fetch_document("invoices", "CONF-IMP-0002")["date_issued"].date() == datetime(2025, 3, 1).date()
+        with open(os.path.join(tmp, "errors.csv"), encoding="utf-8") as f:
+            assert {line.split(",")[1] for line in f.read().splitlines()[1:]} == {"CONF-INV-0001", "CONF-IMP-0003"}
+        stats = run()
+        assert (stats["imported"], stats["skipped"], stats["rejected"]) == (0, 2, 2), "a rerun changes nothing"
+        write([rows[2][:4] + ("2", "200")])
+        stats = run()
+        assert (stats["imported"], stats["skipped"], stats["rejected"]) == (0, 0, 1), "changed content is not re-imported"
+    assert db.fetch_document("invoices", "CONF-IMP-0002")["items"][0]["qty"] == 1
+    assert len(db.fetch_invoices()) == 3
+    assert db.fetch_changes(0)[-1][3] == "import"
+
+
+@check
+def product_catalog_refreshes_incrementally_and_links_lines(db):
+    created, updated, rejected = db.import_products([
+        {"sku": "res-10k", "description": "Resistor 10k 1/4W", "unit_price": "5"},
+        {"sku": "CAP-100U", "description": "Capacitor 100uF 25V", "unit_price": "N1,250.00", "vat": "no"},
+        {"sku": "bad sku", "description": "", "unit_price": "x"}])
+    assert (created, updated, [r[1] for r in rejected]) == (2, 0, ["bad sku"]), rejected
+    catalog = app.ProductCatalog()
+    assert catalog.load(db) == 2
+    assert [p.sku for p in catalog.search("res 10")] == ["RES-10K"]
+    assert catalog.by_sku("cap-100u").unit_price == 1250.0 and not catalog.by_sku("CAP-100U").vat
+    assert catalog.search("capacitor 100")[0].sku == "CAP-100U" and catalog.search("zzz") == []
+    product = catalog.by_sku("RES-10K")
+    product_id, err = db.save_product({"id": product.id, "version": product.version, "sku": "RES-10K",
+                                       "description": "Resistor 10k 1% metal film", "unit_price": "7.5"})
+    assert product_id == product.id, err
+    assert db.save_product({"id": product.id, "version": product.version, "sku": "RES-10K",
+                            "description": "stale edit", "unit_price": "1"})[0] is None, "a stale version is refused"
+    assert db.save_product({"sku": "RES-10K", "description": "duplicate", "unit_price": "1"})[0] is None
+    catalog.refresh(db)
+    assert catalog.by_sku("RES-10K").unit_price == 7.5 and catalog.search("metal film")[0].id == product.id
+    assert catalog.search("1/4W") == [], "old description words leave the index"
+    assert db.save_product({"id": product.id, "sku": "RES-10K", "description": "Resistor 10k 1% metal film",
+                            "unit_price": "7.5", "active": False})[0]
+    catalog.refresh(db)
+    assert catalog.search("resistor") == [] and catalog.by_sku("RES-10K") is None
+    assert catalog.get(product.id) is not None and catalog.by_sku("RES-10K", inactive=True).id == product.id
+    data, items = sample_invoice("CONF-INV-0001")
+    items[0]["product_id"] = catalog.by_sku("CAP-100U").id
+    assert db.save_invoice(data, items)
+    assert db.fetch_document("invoices", "CONF-INV-0001")["items"][0]["product_id"] == items[0]["product_id"]
+    data, items = sample_quote("CONF-QTN-0001")
+    items[0]["product_id"] = product.id
+    assert db.save_quotation(data, items)
+    invoice, err = db.convert_quotation_to_invoice("CONF-QTN-0001")
+    assert invoice and invoice["items"][0]["product_id"] == product.id, err
+
+
+@check
+def component_sales_deduct_stock_atomically(db):
+    tracked, _ = db.save_product({"sku": "LED-RED", "description": "LED red 5mm", "unit_price": "20", "reorder_level": 5})
+    untracked, _ = db.save_product({"sku": "WIRE-1M", "description": "Hookup wire 1m", "unit_price": "50"})
+    assert db.adjust_stock(tracked, 0)[0] is None and db.adjust_stock(tracked, 12, reference="DN-1") == (12, "")
+    start = db.latest_change_id()
+
+    def sale(number, qty):
+        data, items = sample_invoice(number)
+        items = [dict(items[0], desc="LED red 5mm", qty=qty, product_id=tracked),
+                 dict(items[0], sn="2", desc="Hookup wire 1m", qty=3, product_id=untracked)]
+        return data, items
+
+    assert db.save_invoice(*sale("CONF-INV-0001", 4))
+    assert db.stock_on_hand([tracked, untracked]) == {tracked: 8}, "untracked products pass through"
+    assert db.fetch_low_stock() == []
+    data, items = sale("CONF-INV-0002", 9)
+    assert not db.save_invoice(data, items)
+    assert data["stock_shortages"] == [("LED red 5mm", 9, 8)]
+    assert db.fetch_document("invoices", "CONF-INV-0002") is None and db.stock_on_hand([tracked]) == {tracked: 8}
+    assert db.save_invoice(*sale("CONF-INV-0003", 3))
+    assert [row[:4] for row in db.fetch_low_stock()] == [(tracked, "LED-RED", "LED red 5mm", 5)]
+    assert [c[1:] for c in db.fetch_changes(start) if c[1] == "stock"] == [("stock", str(tracked), "low")]
+    assert db.delete_invoice("CONF-INV-0001")
+    assert db.stock_on_hand([tracked]) == {tracked: 9} and db.fetch_low_stock() == []
+    assert db.adjust_stock(tracked, counted=2, reason="stocktake") == (2, "")
+    db.cursor.execute("SELECT reason, SUM(qty_change) FROM stock_ledger GROUP BY reason ORDER BY reason")
+    assert [tuple(row) for row in db.cursor.fetchall()] == [("receipt", 12), ("sale", -7), ("stocktake", -7), ("void", 4)]
+    quote, items = sample_quote("CONF-QTN-0001")
+    items[0].update(product_id=tracked, qty=3)
+    assert db.save_quotation(quote, items)
+    invoice, err = db.convert_quotation_to_invoice("CONF-QTN-0001")
+    assert invoice is None and "Not enough stock" in err and db.stock_on_hand([tracked]) == {tracked: 2}
+    assert db.use_tenant(db.save_tenant({"code": "BR2", "number_prefix": "NSB"})[0])
+    assert db.stock_on_hand([tracked]) == {} and db.save_invoice(*sale("CONF-INV-0004", 50)), "stock is per company/branch"
+
+
+
+@check
+def payments_keep_balances_and_aging_in_step(db):
+    def receivables():
+        db.cursor.execute("SELECT issue_date, client_name, open_invoices, balance_due FROM receivables_by_client ORDER BY issue_date, client_name")
+        rows = [(str(day)[:10], client, count, float(due)) for day, client, count, due in db.cursor.fetchall()]
+        db.cursor.execute("SELECT issue_date, open_invoices, balance_due FROM receivables_daily ORDER BY issue_date")
+        return rows, [(str(day)[:10], count, float(due)) for day, count, due in db.cursor.fetchall()]
+
+    today = datetime.now()
+    for number, client, days_old, total in (("CONF-INV-0001", "Acme Ltd", 0, 1000.0), ("CONF-INV-0002", "Acme Ltd", 45, 2000.0),
+                                            ("CONF-INV-0003", "Beta Ltd", 75, 400.0), ("CONF-INV-0004", "Beta Ltd", 200, 100.0)):
+        data, items = sample_invoice(number, client=client, total=total)
+        assert db.save_invoice(data, items)
+        db.cursor.execute("UPDATE invoices SET date_issued = %s WHERE invoice_number = %s", (today - timedelta(days=days_old), number))
+    db.rebuild_receivables()
+    db.conn.commit()
+    aging = db.aging_summary()
+    assert [(label, s["count"], round(s["balance"], 2)) for label, s in aging.items()] == [
+        ("0-30", 1, 1075.0), ("31-60", 1, 2150.0), ("61-90", 1, 430.0), ("90+", 1, 107.5), ("Total", 4, 3762.5)]
+    assert db.record_payment("CONF-INV-0002", "N150.00", "Transfer", "TRF-1")[0]
+    assert db.record_payment("CONF-INV-0002", 2000.01, "Cash")[0] is None, "more than the balance is refused"
+    assert db.record_payment("CONF-INV-0002", 0, "Cash")[0] is None
+    assert db.record_payment("CONF-INV-9999", 10, "Cash")[0] is None
+    last, err = db.record_payment("CONF-INV-0002", 2000, "Cash")
+    assert last, err
+    doc = db.fetch_document("invoices", "CONF-INV-0002")
+    assert (doc["amount_paid"], doc["balance_due"], doc["version"]) == (2150.0, 0.0, 3)
+    assert [p["amount"] for p in db.fetch_payments("CONF-INV-0002")] == [150.0, 2000.0]
+    assert db.aging_summary()["31-60"] == {"count": 0, "balance": 0.0}
+    by_client, daily = receivables()
+    assert [r[1] for r in by_client] == ["Beta Ltd", "Beta Ltd", "Acme Ltd"] and len(daily) == 3, "settled days leave the aggregates"
+    assert db.void_payment(last) == (True, "") and db.void_payment(last)[0] is False
+    assert db.aging_summary()["31-60"] == {"count": 1, "balance": 2000.0}
+    assert [row["invoice_no"] for row in db.fetch_invoices({"balance": "31-60 days"})] == ["CONF-INV-0002"]
+    assert [row["invoice_no"] for row in db.fetch_invoices({"balance": "Unpaid", "client_name": "Beta"})] == ["CONF-INV-0003", "CONF-INV-0004"]
+    assert db.record_payment("CONF-INV-0003", 430, "POS")[0]
+    assert [row["invoice_no"] for row in db.fetch_invoices({"balance": "Paid"})] == ["CONF-INV-0003"]
+    assert db.summarize_documents("invoices", {"balance": "Unpaid"})["balance_due"] == 3182.5
+    assert db.delete_invoice("CONF-INV-0004")
+    assert db.archive_documents("invoices", ["CONF-INV-0001"]) == [], "an invoice still owed is not archived"
+    report = db.aging_by_client()
+    assert report == [("Acme Ltd", 2, [1075.0, 2000.0, 0.0, 0.0], 3075.0)], report
+    incremental = receivables()
+    db.rebuild_receivables()
+    assert receivables() == incremental, "the incrementally kept aggregate matches a rebuild"
+    assert db.record_payment("CONF-INV-0001", 1075, "Cash")[0]
+    assert db.archive_documents("invoices", ["CONF-INV-0001"]) == ["CONF-INV-0001"]
+    assert db.restore_archived("CONF-INV-0001")[0]
+    assert db.aging_summary()["Total"] == {"count": 1, "balance": 2000.0}
+
+
+
+@check
+def receivables_accrue_under_the_stored_issue_day(db):
+    # Saved a second before midnight: the accrual, the stored date and the release on delete all use that day
+    late = (datetime.now() - timedelta(days=1)).replace(hour=23, minute=59, second=59, microsecond=0)
+    data, items = sample_invoice("CONF-INV-0001")
+    data["date_issued"] = late
+    assert db.save_invoice(data, items)
+    assert str(db.fetch_document("invoices", "CONF-INV-0001")["date_issued"])[:19] == str(late)
+    db.cursor.execute("SELECT issue_date, open_invoices FROM receivables_daily")
+    assert [(str(day)[:10], count) for day, count in db.cursor.fetchall()] == [(str(late.date()), 1)]
+    assert db.delete_invoice("CONF-INV-0001")
+    db.cursor.execute("SELECT COUNT(*) FROM receivables_daily")
+    assert db.cursor.fetchone()[0] == 0, "the delete released the same day it accrued"
+
+
+@check
+def statement_reconciliation_records_matches_once(db):
+    today = datetime.now()
+    for number, client, days_old, total in (("CONF-INV-0001", "Acme Ltd", 3, 1000.0), ("CONF-INV-0002", "Beta Ltd", 10, 2000.0),
+                                            ("CONF-INV-0003", "Gamma Ltd", 5, 400.0), ("CONF-INV-0004", "Delta Ltd", 6, 400.0),
+                                            ("CONF-INV-0005", "Acme Ltd", 2, 100.0), ("CONF-INV-0006", "Old Client", 200, 300.0)):
+        assert db.save_invoice(*sample_invoice(number, client=client, total=total))
+        db.cursor.execute("UPDATE invoices SET date_issued = %s WHERE invoice_number = %s", (today - timedelta(days=days_old), number))
+    db.rebuild_receivables()
+    db.conn.commit()
+    day = today.strftime("%d-%b-%Y")
+    lines = [["Account Name", "Nascomsoft Embedded"], ["Account Number", "2037467351"], [],
+             ["Trans Date", "Reference", "Value Date", "Debits", "Credits", "Balance", "Remarks"],
+             [day, "FT001", day, "", "500.00", "", "TRF/CONFINV0001/ACME"],
+             [day, "FT002", day, "", "430.00", "", "TRANSFER FROM GAMMA LTD"],
+             [day, "FT003", day, "5,000.00", "", "", "CHARGES"],
+             [day, "FT004", day, "", "2,257.50", "", "PAYMENT CONF-INV 0002 AND CONF INV-0005"],
+             [day, "FT005", day, "", "322.50", "", "OLD CLIENT"],
+             [day, "FT006", day, "", "999.99", "", "UNKNOWN SENDER"],
+             [day, "FT007", day, "", "575.00", "", "CONF-INV-0001 BALANCE"],
+             [day, "FT008", day, "", "430.00", "", "TRANSFER"],
+             ["Total", "", "", "5,000.00", "5,514.99", "", ""]]
+    with tempfile.TemporaryDirectory() as tmp:
+        path, review = os.path.join(tmp, "statement.csv"), os.path.join(tmp, "review.csv")
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            app.csv.writer(f).writerows(lines)
+        dry = app.StatementReconciler(db, dry_run=True).run(path)
+        assert dry["matched"] == 5 and db.fetch_payments("CONF-INV-0001") == [], "a dry run records nothing"
+        stats = app.StatementReconciler(db, review_path=review).run(path)
+        assert (stats["lines"], stats["matched"], stats["by_reference"], stats["by_amount"], stats["payments"], stats["review"]) == \
+            (8, 5, 3, 2, 6, 3), stats
+        with open(review, newline="", encoding="utf-8") as f:
+            assert [row[4] for row in list(app.csv.reader(f))[1:]] == ["FT005", "FT006", ""]
+        assert [(p["amount"], p["reference"]) for p in db.fetch_payments("CONF-INV-0001")] == [(500.0, "FT001"), (575.0, "FT007")]
+        assert [p["amount"] for p in db.fetch_payments("CONF-INV-0003")] == [430.0], "same amount told apart by the client name"
+        assert [p["amount"] for p in db.fetch_payments("CONF-INV-0004")] == [430.0]
+        assert [row["invoice_no"] for row in db.fetch_invoices({"balance": "Unpaid"})] == ["CONF-INV-0006"]
+        assert db.aging_summary()["Total"] == {"count": 1, "balance": 322.5}
+        again = app.StatementReconciler(db).run(path)
+        assert (again["skipped"], again["matched"], again["review"]) == (5, 0, 3), "a rerun records nothing twice"
+        wider = app.StatementReconciler(db, date_window=365).run(path)
+        assert (wider["skipped"], wider["by_amount"]) == (5, 1), wider
+    assert db.aging_summary()["Total"] == {"count": 0, "balance": 0.0}
+    assert db.fetch_document("invoices", "CONF-INV-0002")["balance_due"] == 0.0
+
+@check
+def foreign_currency_documents_report_in_base(db):
+    today = datetime.now().date()
+    saved, rejected = db.save_exchange_rates([
+        {"currency": "USD", "rate_date": f"{today - timedelta(days=3):%Y-%m-%d}", "rate": "1500"},
+        {"currency": "usd", "rate_date": f"{today - timedelta(days=1):%Y-%m-%d}", "rate": "1,520.5"},
+        {"currency": "NGN", "rate": "1"}, {"currency": "USD", "rate": "-3"}])
+    assert saved == 2 and [row for row, _ in rejected] == [3, 4], rejected
+    assert db.exchange_rate("USD") == (1520.5, today - timedelta(days=1))
+    assert db.exchange_rate("USD", today - timedelta(days=2)) == (1500.0, today - timedelta(days=3))
+    assert db.exchange_rate("USD", today - timedelta(days=40)) == (None, None), "older than max_rate_age_days"
+    data, items = sample_invoice("CONF-INV-EUR1")
+    data["currency"] = "EUR"
+    assert not db.save_invoice(data, items) and "EUR" in data["missing_rate"], "no rate, nothing saved"
+    assert db.fetch_document("invoices", "CONF-INV-EUR1") is None
+    data, items = sample_invoice("CONF-INV-USD1")
+    data["currency"] = "usd"
+    assert db.save_invoice(data, items)
+    assert db.save_invoice(*sample_invoice("CONF-INV-0001"))
+    doc = db.fetch_document("invoices", "CONF-INV-USD1")
+    assert (doc["currency"], doc["exchange_rate"], doc["grand_total"]) == ("USD", 1520.5, 1075.0)
+    assert [row["currency"] for row in db.fetch_invoices()] == ["NGN", "USD"]
+    assert abs(db.summarize_documents("invoices")["grand_total"] - (1075.0 * 1520.5 + 1075.0)) < 0.01, "summaries are in NGN"
+    assert db.aging_summary()["Total"] == {"count": 2, "balance": 1075.0 * 1520.5 + 1075.0}
+    # A new rate applies to new documents only
+    assert db.save_exchange_rates([{"currency": "USD", "rate": "1600"}]) == (1, [])
+    assert db.exchange_rate("USD")[0] == 1600.0 and db.fetch_document("invoices", "CONF-INV-USD1")["exchange_rate"] == 1520.5
+    payment_id, err = db.record_payment("CONF-INV-USD1", 75, "Transfer", "part")
+    assert payment_id, err
+    incremental = db.aging_summary()
+    assert incremental["Total"]["balance"] == 1000.0 * 1520.5 + 1075.0
+    db.rebuild_receivables()
+    db.conn.commit()
+    assert db.aging_summary() == incremental, "base-currency receivables match a rebuild"
+    assert (app.format_money(1234.6, "JPY"), app.format_money(1234.5, "usd"), app.format_money(1234.5)) == \
+        ("\u00a51,235", "$1,234.50", "N1,234.50")
+
+
+@check
+def tax_rules_break_down_vat_and_wht_per_document(db):
+    try:
+        ok, err = db.save_settings("tax", {"exempt_types": ["Training"], "wht_rates": {"Consulting": 10}})
+        assert ok, err
+        ok, err = db.save_settings("tax", {"wht_rates": {"Consulting": 110}})
+        assert not ok and "tax.wht_rates" in err, err
+        items = [{"sn": "1", "desc": "Design", "type": "Project", "qty": 1, "price": 1000.0, "total": 1000.0},
+                 {"sn": "2", "desc": "Staff training", "type": "Project", "service": "Training", "qty": 1, "price": 500.0, "total": 500.0},
+                 {"sn": "3", "desc": "Advisory", "type": "Project", "service": "consulting", "qty": 1, "price": 2000.0, "total": 2000.0},
+                 {"sn": "4", "desc": "Manual", "type": "Project", "qty": 1, "price": 0.35, "total": 0.35, "vat": False}]
+        totals = app.document_totals(items, 100.0, 5, "NGN")
+        assert (totals["subtotal"], totals["vat"], totals["grand_total"]) == (3500.35, 225.0, 3825.35)
+        assert [(t["tax"], t["rate"], t["taxable"], t["amount"]) for t in totals["taxes"]] == [
+            ("VAT", 7.5, 3000.0, 225.0), ("VAT", 0.0, 500.35, 0.0), ("WHT", 10.0, 2150.0, 215.0), ("WHT", 5.0, 1675.35, 83.77)]
+        assert totals["wht"] == 298.77
+        data = {"invoice_no": "CONF-INV-TAX1", "client_name": "Tax Client", "client_address": "", "invoice_type": "Project",
+                "currency": "NGN", **totals}
+        assert db.save_invoice(data, items)
+        doc = db.fetch_document("invoices", "CONF-INV-TAX1")
+        assert doc["taxes"] == totals["taxes"] and doc["balance_due"] == 3526.58
+        assert [i["type"] for i in doc["items"]] == ["Project", "Training", "consulting", "Project"]
+        assert [label for label, _ in app.wht_lines(doc)] == ["Less WHT (10%) on N2,150.00:", "Less WHT (5%) on N1,675.35:"]
+        with tempfile.TemporaryDirectory() as tmp:
+            app.render_document_pdf(os.path.join(tmp, "tax.pdf"), doc, doc["items"], letterhead=db.letterhead())
+        assert db.record_payment("CONF-INV-TAX1", 3526.58, "Transfer")[0], "only settled invoices are archived"
+        assert db.archive_documents("invoices", ["CONF-INV-TAX1"]) == ["CONF-INV-TAX1"]
+        db.cursor.execute("SELECT COUNT(*) FROM document_taxes")
+        assert db.cursor.fetchone()[0] == 0, "archived with its document"
+        assert db.restore_archived("CONF-INV-TAX1")[0]
+        assert db.fetch_document("invoices", "CONF-INV-TAX1")["taxes"] == totals["taxes"]
+        # Rounding each line's VAT instead of each rate's total
+        ok, err = db.save_settings("tax", {"rounding": "line"})
+        assert ok, err
+        cents = [{"type": "Component", "total": 0.1}] * 3
+        assert app.document_totals(cents, currency="NGN")["vat"] == 0.03
+    finally:
+        db.cursor.execute("DELETE FROM app_settings")
+        db.conn.commit()
+        app.CONFIG.reload(db)
+    assert app.document_totals(cents, currency="NGN")["vat"] == 0.02
+    # Without tax rules (and catalog VAT flags) the totals are the flat VAT and WHT the forms always computed
+    totals, subtotal = app.document_totals(items[:3], 100.0, 5), sum(i["total"] for i in items[:3])
+    assert totals["vat"] == subtotal * 0.075 and totals["wht"] == (subtotal + subtotal * 0.075 + 100.0) * 0.05
+
+
+@check
+def price_rules_discount_lines_as_they_are_added(db):
+    cable, _ = db.save_product({"sku": "CAB-1", "description": "Cat6 cable", "unit_price": "1000"})
+    relay, _ = db.save_product({"sku": "RLY-1", "description": "Relay", "unit_price": "200"})
+    yesterday, today = datetime.now().date() - timedelta(days=1), datetime.now().date()
+    saved, rejected = db.save_price_rules([
+        {"code": "cab10", "sku": "cab-1", "kind": "percent", "value": "10", "min_qty": "10"},
+        {"code": "CAB25", "sku": "CAB-1", "kind": "percent", "value": "25", "min_qty": "100"},
+        {"code": "ACME-CAB", "sku": "CAB-1", "client_name": "acme  ltd", "kind": "price", "value": "850"},
+        {"code": "PROMO", "kind": "fixed", "value": "50", "ends_on": f"{yesterday:%Y-%m-%d}"},
+        {"code": "BAD", "sku": "NOPE", "kind": "percent", "value": "120"},
+        {"code": "BAD2", "kind": "gift", "value": "1"}])
+    assert saved == 4 and [row for row, _ in rejected] == [5, 6], rejected
+    assert "NOPE" in rejected[0][1] and "at most 100" in rejected[0][1]
+
+    def line(product_id, qty, price):
+        return {"sn": "1", "desc": "x", "type": "Component", "qty": qty, "price": price, "total": qty * price, "product_id": product_id}
+    items = [line(cable, 5, 1000.0), line(cable, 10, 1000.0), line(cable, 200, 1000.0), line(relay, 3, 200.0)]
+    assert db.price_items(items, "Other Client") == 2
+    assert [(i["price"], i.get("price_rule")) for i in items] == [
+        (1000.0, None), (900.0, "CAB10 (10% off)"), (750.0, "CAB25 (25% off)"), (200.0, None)]
+    assert (items[1]["list_price"], items[1]["discount"], items[2]["total"]) == (1000.0, 1000.0, 150000.0)
+    acme = [line(cable, 20, 1000.0), line(cable, 200, 1000.0)]
+    assert db.price_items(acme, "ACME LTD") == 2
+    assert [i["price_rule"] for i in acme] == ["ACME-CAB (contract price)", "CAB25 (25% off)"], "the lowest price wins"
+    # Promotions run for their dates; a change saved elsewhere reaches this cache through the feed
+    other = app.DatabaseManager(db.backend)
+    assert other.save_price_rules([{"code": "PROMO", "kind": "fixed", "value": "50", "ends_on": f"{today:%Y-%m-%d}"}]) == (1, [])
+    other.conn.close()
+    app.PRICE_RULES.refresh(db)
+    relay_line = [line(relay, 3, 200.0)]
+    assert db.price_items(relay_line, "Other Client") == 1 and relay_line[0]["price"] == 150.0
+    assert db.price_items(relay_line, "Other Client", day=today + timedelta(days=1)) == 0 and relay_line[0]["price"] == 200.0
+    # Saved with the document, copied when a quotation is converted, and shown on the PDF
+    data, _ = sample_quote("CONF-QTN-0001", client="Acme Ltd")
+    data.update(app.document_totals(acme))
+    assert data["discount"] == 20 * 150.0 + 200 * 250.0
+    assert db.save_quotation(data, acme)
+    invoice, err = db.convert_quotation_to_invoice("CONF-QTN-0001")
+    assert invoice, err
+    doc = db.fetch_document("invoices", invoice["invoice_no"])
+    assert doc["discount"] == data["discount"] and doc["subtotal"] == 20 * 850.0 + 200 * 750.0
+    assert [(i["list_price"], i["discount"], i["price_rule"]) for i in doc["items"]] == [
+        (1000.0, 3000.0, "ACME-CAB (contract price)"), (1000.0, 50000.0, "CAB25 (25% off)")]
+    assert app.discount_lines(doc) == [("Before Discounts:", 220000.0), ("Less Discounts:", 53000.0)]
+    with tempfile.TemporaryDirectory() as tmp:
+        app.render_document_pdf(os.path.join(tmp, "prices.pdf"), doc, doc["items"], letterhead=db.letterhead())
+    # Retired rules stop applying
+    assert db.save_price_rules([{"code": "CAB25", "sku": "CAB-1", "kind": "percent", "value": "25", "min_qty": "100", "active": "no"}]) == (1, [])
+    big = [line(cable, 200, 1000.0)]
+    assert db.price_items(big, "Other Client") == 1 and big[0]["price_rule"] == "CAB10 (10% off)"
+
+
+@check
+def credit_notes_and_amendments_adjust_balances_in_step(db):
+    today = datetime.now()
+    for number, days_old, total in (("CONF-INV-0001", 0, 1000.0), ("CONF-INV-0002", 45, 2000.0)):
+        data, items = sample_invoice(number, client="Acme Ltd", total=total)
+        assert db.save_invoice(data, items)
+        db.cursor.execute("UPDATE invoices SET date_issued = %s WHERE invoice_number = %s", (today - timedelta(days=days_old), number))
+    db.rebuild_receivables()
+    db.conn.commit()
+    prefix, year = db.tenant()["number_prefix"], today.year
+    returned = [{"desc": "Widget returned", "qty": 1, "price": 500}]
+    assert db.issue_invoice_note("credit_notes", "CONF-INV-0001", returned, " ")[0] is None, "a reason is required"
+    assert db.issue_invoice_note("credit_notes", "CONF-INV-0001", [{"desc": "x", "qty": -1, "price": 500}], "r")[0] is None
+    assert db.issue_invoice_note("credit_notes", "CONF-INV-9999", returned, "r")[0] is None
+    note, err = db.issue_invoice_note("credit_notes", "CONF-INV-0001", returned, "Returned  unopened")
+    assert note, err
+    assert (note["note_no"], note["grand_total"], note["adjustment"], note["balance_due"]) == (f"{prefix}-CRN-{year}-0001", 537.5, -537.5, 537.5)
+    assert "left to pay" in db.issue_invoice_note("credit_notes", "CONF-INV-0001", returned * 2, "Too much")[1]
+    # Amendments carry signed lines and are numbered in their own sequence
+    note, err = db.issue_invoice_note("amendments", "CONF-INV-0002", [{"desc": "Extra cabling", "qty": 2, "price": "100"},
+                                                                      {"desc": "Agreed discount", "qty": 1, "price": -300}], "Site visit")
+    assert note, err
+    assert (note["note_no"], note["subtotal"], note["vat"], note["adjustment"]) == (f"{prefix}-AMD-{year}-0001", -100.0, -7.5, -107.5)
+    assert [t["amount"] for t in db.fetch_invoice_note(note["note_no"])["taxes"]] == [-7.5]
+    doc = db.fetch_document("invoices", "CONF-INV-0002")
+    assert (doc["grand_total"], doc["adjusted"], doc["balance_due"], doc["version"]) == (2150.0, -107.5, 2042.5, 2)
+    # A paid invoice reopens when an amendment adds a charge
+    assert db.record_payment("CONF-INV-0001", 537.5, "Transfer")[0]
+    assert db.aging_summary()["0-30"] == {"count": 0, "balance": 0.0}
+    note, err = db.issue_invoice_note("amendments", "CONF-INV-0001", [{"desc": "Delivery", "qty": 1, "price": 200}], "Courier")
+    assert note, err
+    assert db.aging_summary()["0-30"] == {"count": 1, "balance": 215.0}
+    summary = db.summarize_documents("invoices")
+    assert (summary["adjusted"], summary["balance_due"]) == (-537.5 - 107.5 + 215.0, 215.0 + 2042.5)
+    notes = db.fetch_invoice_notes("CONF-INV-0001")
+    assert [(n["note_kind"], n["adjustment"], n["reason"]) for n in notes] == [
+        ("credit_notes", -537.5, "Returned unopened"), ("amendments", 215.0, "Courier")]
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in notes:
+            full = db.fetch_invoice_note(n["note_no"])
+            doc_type, name = app.note_pdf(full)
+            app.render_document_pdf(os.path.join(tmp, name), full, full["items"], doc_type, letterhead=db.letterhead())
+            assert app.document_for_file(name) == (full["note_kind"], full["note_no"])
+    assert app.adjustment_lines(notes[0]) == [("Taken off Invoice CONF-INV-0001:", 537.5)]
+    incremental = db.aging_summary(), db.aging_by_client()
+    db.rebuild_receivables()
+    db.conn.commit()
+    assert (db.aging_summary(), db.aging_by_client()) == incremental, "notes kept the aggregates equal to a rebuild"
+    # The adjustment survives archiving once the invoice is settled; a deleted invoice takes no more notes but keeps its record
+    assert db.archive_documents("invoices", ["CONF-INV-0002"]) == [], "still owed"
+    assert db.record_payment("CONF-INV-0002", 2042.5, "Transfer")[0]
+    assert db.archive_documents("invoices", ["CONF-INV-0002"]) == ["CONF-INV-0002"]
+    assert db.restore_archived("CONF-INV-0002")[0]
+    doc = db.fetch_document("invoices", "CONF-INV-0002")
+    assert (doc["adjusted"], doc["balance_due"]) == (-107.5, 0.0)
+    assert db.aging_summary()["31-60"] == {"count": 0, "balance": 0.0}
+    assert db.delete_invoice("CONF-INV-0001")
+    assert db.issue_invoice_note("credit_notes", "CONF-INV-0001", returned, "Late")[0] is None
+    assert len(db.fetch_invoice_notes("CONF-INV-0001")) == 2
+
+
+def api_settings(db):
+    """Settings for an ApiServer's pool on the same database as `db`."""
+    if isinstance(db.backend, app.SQLiteBackend):
+        return {"backend": "sqlite", "sqlite_path": db.backend.path}
+    return db.backend.settings
+
+
+def api_call(server, method, path, body=None, headers=None):
+    payload = json.dumps(body).encode() if body is not None else b""
+    return server.dispatch(app.HttpRequest(method, path, {}, {k.lower(): v for k, v in (headers or {}).items()}, payload, True))
+
+
+@check
+def api_writes_replay_by_idempotency_key(db):
+    doc = {"client_name": "Api Client", "client_address": "1 Test Road", "items": [{"desc": "Widget", "qty": 2, "price": 50}]}
+
+    async def scenario():
+        server = await app.ApiServer({"port": 0, "host": "127.0.0.1", "db_connections": 2}, api_settings(db)).start()
+        try:
+            first = await api_call(server, "POST", "/api/invoices", doc, {"Idempotency-Key": "order-1"})
+            again = await api_call(server, "POST", "/api/invoices", doc, {"Idempotency-Key": "order-1"})
+            reused = await api_call(server, "POST", "/api/invoices", dict(doc, client_name="Someone Else"), {"Idempotency-Key": "order-1"})
+            number = first[1]["invoice_no"]
+            paid = [await api_call(server, "POST", f"/api/invoices/{number}/payments", {"amount": 25, "method": "Cash"},
+                                   {"Idempotency-Key": "pay-1"}) for _ in range(2)]
+            return first, again, reused, paid
+        finally:
+            await server.close()
+    first, again, reused, paid = asyncio.run(scenario())
+    assert first[0] == 201 and "Idempotent-Replayed" not in first[2], first
+    assert again[0] == 201 and again[2].get("Idempotent-Replayed") == "true", again
+    assert again[1] == first[1], "a replay answers with the original result"
+    assert reused[0] == 422 and "Idempotency-Key" in reused[1]["error"], reused
+    assert [row["invoice_no"] for row in db.fetch_invoices()] == [first[1]["invoice_no"]], "one invoice saved"
+    assert paid[0][1]["id"] == paid[1][1]["id"] and paid[1][2].get("Idempotent-Replayed") == "true"
+    assert [p["amount"] for p in db.fetch_payments(first[1]["invoice_no"])] == [25.0], "one payment recorded"
+
+
+@check
+def api_timeouts_cut_off_reads_but_not_writes(db):
+    doc = {"client_name": "Api Client", "client_address": "1 Test Road", "items": [{"desc": "Widget", "qty": 1, "price": 10}]}
+
+    async def scenario():
+        # With no time at all, every read times out; a write still reports its real outcome
+        server = await app.ApiServer({"port": 0, "host": "127.0.0.1", "db_connections": 1, "request_timeout": 0}, api_settings(db)).start()
+        try:
+            read = await api_call(server, "GET", "/api/invoices")
+            write = await api_call(server, "POST", "/api/invoices", doc)
+            bad = []
+            for length in ("ten", "-1"):
+                reader = asyncio.StreamReader()
+                reader.feed_data(f"POST /api/invoices HTTP/1.1\r\nContent-Length: {length}\r\n\r\n".encode())
+                reader.feed_eof()
+                try:
+                    await server.read_request(reader)
+                except app.ApiError as e:
+                    bad.append(e.status)
+            return read, write, bad
+        finally:
+            await server.close()
+    read, write, bad = asyncio.run(scenario())
+    assert read[0] == 504, read
+    assert write[0] == 201 and db.fetch_document("invoices", write[1]["invoice_no"]), write
+    assert bad == [400, 400], bad
+
+
+def reset_schema(db):
+    db.get_connection()
+    for table in TABLES:
+        db.cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    db.conn.commit()
+    db.create_tables()
+    app.EXCHANGE_RATES.forget()  # the process-wide rate cache would outlive the dropped table
+    app.PRICE_RULES.forget()
+
+
+def run_checks(make_db):
+    failures = 0
+    for func in CHECKS:
+        db = make_db()
+        try:
+            reset_schema(db)
+            func(db)
+            print(f"PASS  {func.__name__}")
+        except Exception:
+            failures += 1
+            print(f"FAIL  {func.__name__}")
+            traceback.print_exc()
+        finally:
+            if db.conn:
+                db.conn.close()
+    print(f"{len(CHECKS) - failures}/{len(CHECKS)} checks passed")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Storage backend conformance checks")
+    parser.add_argument("--backend", choices=("sqlite", "mysql"), default="sqlite")
+    parser.add_argument("--db-host", default="localhost")
+    parser.add_argument("--db-user", default="root")
+    parser.add_argument("--db-password", default="")
+    parser.add_argument("--db-name", default="nascomsoft_conformance_db")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        settings = {"backend": args.backend, "host": args.db_host, "user": args.db_user,
+                    "password": args.db_password, "database": args.db_name,
+                    "sqlite_path": os.path.join(tmp, "conformance.db")}
+        failures = run_checks(lambda: app.DatabaseManager(app.make_backend(settings)))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
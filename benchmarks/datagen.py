@@ -0,0 +1,133 @@
+"""
+Deterministic synthetic data for benchmarks: clients, carts, invoices and quotations.
+Every generator takes a seed so two runs at the same scale see identical data.
+"""
+
+import random
+from datetime import datetime, timedelta
+
+FIRST_NAMES = ["Aisha", "Bello", "Chinedu", "Damilola", "Emeka", "Fatima", "Garba", "Halima",
+               "Ibrahim", "Jumoke", "Kabiru", "Lami", "Musa", "Ngozi", "Oluwaseun", "Sani"]
+COMPANY_WORDS = ["Tech", "Solutions", "Ventures", "Global", "Systems", "Labs", "Works", "Energy",
+                 "Foods", "Logistics", "Farms", "Networks"]
+STATES = ["Bauchi", "Kano", "Lagos", "Abuja", "Kaduna", "Gombe", "Jos", "Enugu"]
+COMPONENTS = ["Arduino Uno R3", "ESP32 DevKit", "Raspberry Pi 4", "HC-SR04 Ultrasonic Sensor",
+              "DHT22 Sensor", "16x2 LCD Module", "Relay Module 4CH", "Jumper Wires (40pcs)",
+              "Breadboard 830", "LM2596 Buck Converter", "SG90 Servo", "NEO-6M GPS Module"]
+SERVICES = ["Site survey", "Firmware development", "PCB design", "Installation", "Training session",
+            "System integration", "Maintenance visit", "Consulting (hourly)"]
+
+
+def make_client(rng):
+    first = rng.choice(FIRST_NAMES)
+    company = f"{first} {rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_WORDS)}"
+    return {
+        "client_name": company,
+        "client_email": f"{first.lower()}{rng.randint(1, 9999)}@example.com",
+        "client_address": f"{rng.randint(1, 200)} {rng.choice(STATES)} Road, {rng.choice(STATES)} State.",
+    }
+
+
+def make_clients(n, seed=42):
+    rng = random.Random(seed)
+    return [make_client(rng) for _ in range(n)]
+
+
+def make_cart(rng, n_items, item_type="Component"):
+    catalog = COMPONENTS if item_type == "Component" else SERVICES
+    items = []
+    for idx in range(n_items):
+        qty = rng.randint(1, 20)
+        price = round(rng.uniform(500, 250000), 2)
+        items.append({"sn": str(idx + 1), "desc": rng.choice(catalog), "type": item_type,
+                      "qty": qty, "price": price, "total": round(qty * price, 2)})
+    return items
+
+
+def iter_products(n, seed=42, prefix="BENCH"):
+    """Catalog rows: component names with a variant suffix, so many products share each word."""
+    rng = random.Random(seed)
+    for i in range(n):
+        yield {"sku": f"{prefix}-{i + 1:06d}", "description": f"{rng.choice(COMPONENTS)} {rng.choice(['Rev', 'Kit', 'Pack', 'Pro'])} {rng.randint(1, 999)}",
+               "unit_price": round(rng.uniform(100, 250000), 2), "vat": rng.random() < 0.8}
+
+
+def make_totals(items, shipping, vat_rate=0.075, wht_rate=0.0):
+    subtotal = sum(item['total'] for item in items)
+    vat = subtotal * vat_rate
+    grand_total = subtotal + vat + shipping
+    return {"subtotal": subtotal, "vat": vat, "shipping": shipping, "grand_total": grand_total,
+            "wht_rate": wht_rate, "wht": grand_total * (wht_rate / 100)}
+
+
+def make_invoice(rng, number, clients, max_items=12, date_issued=None):
+    invoice_type = rng.choice(["Project", "Component"])
+    items = make_cart(rng, rng.randint(1, max_items), invoice_type)
+    wht_rate = rng.choice([0.0, 2.5, 5.0, 7.5, 10.0]) if invoice_type == "Project" else 0.0
+    data = dict(rng.choice(clients))
+    data.update(make_totals(items, shipping=rng.choice([0.0, 1500.0, 3500.0]), wht_rate=wht_rate))
+    data.update({"invoice_no": number, "invoice_type": invoice_type, "date_issued": date_issued})
+    return data, items
+
+
+def iter_invoices(n, seed=42, n_clients=None, years=3, prefix="BENCH-INV"):
+    """Yield (invoice_data, items) pairs with dates spread evenly over the last `years` years."""
+    rng = random.Random(seed)
+    clients = make_clients(n_clients or max(10, n // 20), seed)
+    end = datetime(2026, 1, 1)
+    span = timedelta(days=365 * years).total_seconds()
+    for i in range(n):
+        issued = end - timedelta(seconds=span * (n - i) / n)
+        yield make_invoice(rng, f"{prefix}-{i + 1:07d}", clients, date_issued=issued)
+
+
+def iter_quotations(n, seed=43, n_clients=None, years=3, prefix="BENCH-QTN"):
+    for data, items in iter_invoices(n, seed, n_clients, years, prefix):
+        data["quote_no"] = data.pop("invoice_no")
+        yield data, items
+
+
+def seed_database(db, n_invoices, n_quotations=0, seed=42, batch=5000, with_items=False, prefix="BENCH"):
+    """Bulk-load synthetic headers (and optionally line items) through `db.cursor` with executemany,
+    into the manager's current tenant. `db` is a connected DatabaseManager. Invoices are unpaid, and
+    the receivables aggregate is rebuilt afterwards. Returns the number of header rows inserted.
+    """
+    inv_sql = ("INSERT INTO invoices (tenant_id, invoice_number, client_name, client_email, client_address, invoice_type, "
+               "date_issued, subtotal, vat_amount, shipping_cost, wht_amount, wht_rate, grand_total, balance_due) "
+               "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)")
+    item_sql = ("INSERT INTO invoice_items (invoice_number, sn, description, item_type, qty, unit_price, total) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s)")
+    quote_sql = ("INSERT INTO quotations (tenant_id, quote_number, client_name, client_email, client_address, date_issued, "
+                 "subtotal, vat_amount, shipping_cost, grand_total) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)")
+
+    def flush(sql, rows):
+        if rows:
+            db.cursor.executemany(sql, rows)
+            db.conn.commit()
+            rows.clear()
+
+    headers, lines = [], []
+    for data, items in iter_invoices(n_invoices, seed, prefix=f"{prefix}-INV"):
+        headers.append((db.tenant_id, data['invoice_no'], data['client_name'], data['client_email'], data['client_address'],
+                        data['invoice_type'], data['date_issued'], data['subtotal'], data['vat'], data['shipping'],
+                        data['wht'], data['wht_rate'], data['grand_total'], round(data['grand_total'] - data['wht'], 2)))
+        if with_items:
+            lines.extend((data['invoice_no'], int(it['sn']), it['desc'], it['type'], it['qty'], it['price'], it['total'])
+                         for it in items)
+        if len(headers) >= batch:
+            flush(inv_sql, headers)
+            flush(item_sql, lines)
+    flush(inv_sql, headers)
+    flush(item_sql, lines)
+    if n_invoices:
+        db.rebuild_receivables()
+        db.conn.commit()
+
+    quotes = []
+    for data, _ in iter_quotations(n_quotations, seed + 1, prefix=f"{prefix}-QTN"):
+        quotes.append((db.tenant_id, data['quote_no'], data['client_name'], data['client_email'], data['client_address'],
+                       data['date_issued'], data['subtotal'], data['vat'], data['shipping'], data['grand_total']))
+        if len(quotes) >= batch:
+            flush(quote_sql, quotes)
+    flush(quote_sql, quotes)
+    return n_invoices + n_quotations
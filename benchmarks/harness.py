@@ -0,0 +1,80 @@
+"""Timing helpers and the JSON result format shared by every benchmark module."""
+
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+RESULT_SCHEMA_VERSION = 1
+
+
+def measure(func, repeat=5, warmup=1, units=1):
+    """Call `func` repeat times (after `warmup` untimed calls) and summarise wall-clock seconds.
+    `units` is the amount of work one call performs (rows, documents, emails) for throughput.
+    """
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    median = statistics.median(samples)
+    return {
+        "repeat": repeat,
+        "units": units,
+        "min_s": samples[0],
+        "median_s": median,
+        "mean_s": statistics.fmean(samples),
+        "p95_s": samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))],
+        "max_s": samples[-1],
+        "units_per_s": (units / median) if median > 0 else None,
+    }
+
+
+class Recorder:
+    """Collects named benchmark cases; each case is one measure() summary plus parameters."""
+
+    def __init__(self):
+        self.cases = []
+
+    def add(self, suite, name, stats, **params):
+        case = {"suite": suite, "name": name, "params": params}
+        case.update(stats)
+        self.cases.append(case)
+        rate = f"{stats['units_per_s']:,.1f}/s" if stats.get("units_per_s") else "-"
+        print(f"  {suite:<8} {name:<50} median {stats['median_s'] * 1000:10.2f} ms   {rate}")
+        return case
+
+    def skip(self, suite, name, reason):
+        self.cases.append({"suite": suite, "name": name, "skipped": reason})
+        print(f"  {suite:<8} {name:<50} skipped: {reason}")
+
+
+def _git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=False)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def write_results(path, recorder, config):
+    payload = {
+        "schema": RESULT_SCHEMA_VERSION,
+        "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "git_revision": _git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": config,
+        "cases": recorder.cases,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, default=str)
+    return payload
@@ -0,0 +1,248 @@
+"""
+Load test for the HTTP API: requests/sec and latency percentiles from concurrent keep-alive clients.
+
+    python -m benchmarks.load_api --concurrency 16 --requests 4000
+    python -m benchmarks.load_api --url http://127.0.0.1:8765 --concurrency 32 --duration 30
+
+Without --url an ApiServer is started in this process on a temporary SQLite database seeded with
+--seed-invoices invoices (with line items). Clients then run a weighted mix of list, fetch,
+create and PDF requests (--mix list:60,get:25,create:8,retry:2,pdf:5) over one connection each and the
+run reports, per request type and overall: requests/sec, p50/p95/p99/max latency, and status
+codes (503s are backpressure refusals). A retry is a create sent with an Idempotency-Key and then
+sent again; the second answer must be the same invoice, marked Idempotent-Replayed. Exits non-zero
+if any request failed with a 4xx/5xx other than 503, or a retry created a second invoice.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+from benchmarks import datagen
+
+SEED_PREFIX = "LOAD"
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+class Client:
+    """One keep-alive HTTP/1.1 connection issuing requests one after another."""
+
+    def __init__(self, host, port, token=""):
+        self.host, self.port, self.token = host, port, token
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None, extra_headers=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload = json.dumps(body).encode() if body is not None else b""
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(payload)}\r\n"
+        if self.token:
+            head += f"Authorization: Bearer {self.token}\r\n"
+        if body is not None:
+            head += "Content-Type: application/json\r\n"
+        for name, value in (extra_headers or {}).items():
+            head += f"{name}: {value}\r\n"
+        self.writer.write(head.encode() + b"\r\n" + payload)
+        await self.writer.drain()
+        status_line = await self.reader.readuntil(b"\r\n")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = (await self.reader.readuntil(b"\r\n")).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        data = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection") == "close":
+            self.close()
+        return status, headers, data
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition(":")
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - {"list", "get", "create", "retry", "pdf"}
+    if unknown:
+        raise SystemExit(f"unknown request types in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def make_request(kind, rng, numbers, clients):
+    if kind == "list":
+        query = rng.choice(["", "?client_name=Musa", "?invoice_type=Project", "?date_from=2025-06-01&date_to=2025-06-30",
+                            "?page=3&summary=1"])
+        return "GET", "/api/invoices" + query, None
+    if kind == "get":
+        return "GET", f"/api/invoices/{rng.choice(numbers)}", None
+    if kind == "pdf":
+        return "GET", f"/api/invoices/{rng.choice(numbers)}.pdf", None
+    client = rng.choice(clients)
+    items = [{"desc": it["desc"], "qty": it["qty"], "price": it["price"]}
+             for it in datagen.make_cart(rng, rng.randint(1, 6))]
+    return "POST", "/api/invoices", dict(client, invoice_type="Component", items=items)
+
+
+async def run_load(host, port, token, args, numbers):
+    mix = parse_mix(args.mix)
+    kinds, weights = list(mix), list(mix.values())
+    clients = datagen.make_clients(50, args.seed)
+    samples = []  # (kind, status, seconds)
+    mismatches = []  # retries answered with something other than the original invoice
+    deadline = time.perf_counter() + args.duration if args.duration else None
+    remaining = [args.requests]
+
+    async def worker(worker_id):
+        rng = random.Random(args.seed + worker_id)
+        conn = Client(host, port, token)
+        try:
+            while True:
+                if deadline is not None:
+                    if time.perf_counter() >= deadline:
+                        break
+                elif remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+                kind = rng.choices(kinds, weights)[0]
+                method, path, body = make_request(kind, rng, numbers, clients)
+                key = {"Idempotency-Key": f"load-{args.seed}-{worker_id}-{rng.getrandbits(64):x}"} if kind == "retry" else None
+                started = time.perf_counter()
+                try:
+                    status, headers, data = await conn.request(method, path, body, key)
+                    if key and status == 201:
+                        # As a client would after a lost response: the same request again, which must not save twice
+                        first = json.loads(data)["invoice_no"]
+                        status, headers, data = await conn.request(method, path, body, key)
+                        if status == 201 and (json.loads(data)["invoice_no"] != first or headers.get("idempotent-replayed") != "true"):
+                            mismatches.append(first)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    conn.close()
+                    status = 0
+                samples.append((kind, status, time.perf_counter() - started))
+                if status == 503:
+                    await asyncio.sleep(float(headers.get("retry-after", 1)) / 10)
+        finally:
+            conn.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+    return samples, time.perf_counter() - started, mismatches
+
+
+def report(samples, elapsed, mismatches, concurrency):
+    print(f"{len(samples):,} requests from {concurrency} connections in {elapsed:.2f}s: "
+          f"{len(samples) / elapsed:,.0f} req/s")
+    print(f"  {'request':<8} {'count':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}  statuses")
+    groups = {}
+    for kind, status, seconds in samples:
+        groups.setdefault(kind, []).append((status, seconds))
+    groups["all"] = [(status, seconds) for _, status, seconds in samples]
+    for kind, rows in groups.items():
+        ok = [seconds * 1000 for status, seconds in rows if 200 <= status < 300]
+        statuses = {}
+        for status, _ in rows:
+            statuses[status] = statuses.get(status, 0) + 1
+        print(f"  {kind:<8} {len(rows):>7,} {len(rows) / elapsed:>8,.0f} {percentile(ok, 0.5):>8.1f} "
+              f"{percentile(ok, 0.95):>8.1f} {percentile(ok, 0.99):>8.1f} {max(ok, default=0):>8.1f}  "
+              + " ".join(f"{code}x{n}" for code, n in sorted(statuses.items())))
+    if groups["all"]:
+        mean = statistics.mean(seconds for _, seconds in groups["all"]) * 1000
+        print(f"  mean latency {mean:.1f} ms")
+    if mismatches:
+        print(f"  {len(mismatches)} retried create(s) saved a second invoice, e.g. after {mismatches[0]}")
+    return sum(1 for _, status, _ in samples if status != 503 and not 200 <= status < 300) + len(mismatches)
+
+
+def start_embedded_server(app, db_settings, api_settings):
+    """Run an ApiServer on its own event loop thread; returns (server, loop, thread)."""
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    holder = {}
+
+    def run():
+        asyncio.set_event_loop(loop)
+        try:
+            holder["server"] = loop.run_until_complete(app.ApiServer(api_settings, db_settings).start())
+        except Exception as e:  # surfaced to the main thread below
+            holder["error"] = e
+        ready.set()
+        if "server" in holder:
+            loop.run_forever()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    ready.wait()
+    if "error" in holder:
+        raise holder["error"]
+    return holder["server"], loop, thread
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP API load test")
+    parser.add_argument("--url", help="an already running API (default: start one in-process on SQLite)")
+    parser.add_argument("--token", default="")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000, help="total requests (ignored with --duration)")
+    parser.add_argument("--duration", type=float, default=0, help="run for this many seconds instead")
+    parser.add_argument("--mix", default="list:60,get:25,create:8,retry:2,pdf:5")
+    parser.add_argument("--seed-invoices", type=int, default=5000)
+    parser.add_argument("--db-connections", type=int, default=4)
+    parser.add_argument("--render-workers", type=int, default=2)
+    parser.add_argument("--max-pending", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    numbers = [f"{SEED_PREFIX}-INV-{i + 1:07d}" for i in range(args.seed_invoices)]
+    if args.url:
+        url = urlsplit(args.url)
+        failures = report(*asyncio.run(run_load(url.hostname, url.port or 80, args.token, args, numbers)), args.concurrency)
+        return 1 if failures else 0
+
+    import INVOICE_GENERATOR as app
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_settings = {"backend": "sqlite", "sqlite_path": os.path.join(tmp, "load.db")}
+        db = app.DatabaseManager(app.make_backend(db_settings))
+        db.get_connection()
+        db.create_tables()
+        started = time.perf_counter()
+        datagen.seed_database(db, args.seed_invoices, seed=args.seed, with_items=True, prefix=SEED_PREFIX)
+        db.conn.close()
+        print(f"seeded {args.seed_invoices:,} invoices in {time.perf_counter() - started:.1f}s")
+
+        api_settings = {"host": "127.0.0.1", "port": 0, "token": args.token, "db_connections": args.db_connections,
+                        "render_workers": args.render_workers, "max_pending": args.max_pending}
+        server, loop, thread = start_embedded_server(app, db_settings, api_settings)
+        try:
+            samples, elapsed, mismatches = asyncio.run(run_load("127.0.0.1", server.port, args.token, args, numbers))
+        finally:
+            asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+        failures = report(samples, elapsed, mismatches, args.concurrency)
+        print(f"server refused {server.rejected:,} request(s) with 503 (max_pending={args.max_pending})")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
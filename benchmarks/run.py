@@ -0,0 +1,91 @@
+"""
+Run the benchmark suites and write machine-readable results.
+
+    python -m benchmarks.run --scale 10000 --output bench_results.json
+    python -m benchmarks.run --suites pdf,csv,email          # no database needed
+    python -m benchmarks.run --suites profiles --pdf-docs 1000  # size/time per PDF output profile
+
+    python -m benchmarks.run --backend sqlite --scale 100000   # embedded stand-in, no server
+    python -m benchmarks.run --backend sqlite --suites import --scale 100000  # ~100k CSV rows, rows/min + peak memory
+    python -m benchmarks.run --backend sqlite --suites aging --scale 300000   # aging report vs scanning the invoices
+    python -m benchmarks.run --backend sqlite --suites reconcile --scale 1000000  # 100k statement lines vs 1M invoices
+    python -m benchmarks.run --backend sqlite --suites currency --scale 100000    # cached rate lookups, base totals in SQL
+    python -m benchmarks.run --suites tax                                          # compiled tax rules vs a rule scan per line
+    python -m benchmarks.run --backend sqlite --suites prices                      # indexed price rules vs scanning every rule
+    python -m benchmarks.run --backend sqlite --suites notes --scale 100000        # credit notes, adjusted totals vs a join
+
+DB suites use a separate benchmark database (MySQL) or file (SQLite) and are
+recorded as skipped when it cannot be reached.
+"""
+
+import argparse
+import sys
+
+import INVOICE_GENERATOR as app
+from benchmarks import bench_aging, bench_catalog, bench_csv, bench_currency, bench_dates, bench_db, bench_email, bench_import, bench_pdf, bench_pdf_profiles, bench_notes, bench_prices, bench_reconcile, bench_rows, bench_statement, bench_tax
+from benchmarks.harness import Recorder, write_results
+
+SUITES = {"db": bench_db, "dates": bench_dates, "rows": bench_rows, "pdf": bench_pdf, "profiles": bench_pdf_profiles, "statement": bench_statement, "csv": bench_csv, "import": bench_import, "catalog": bench_catalog, "aging": bench_aging, "reconcile": bench_reconcile, "currency": bench_currency, "tax": bench_tax, "prices": bench_prices, "notes": bench_notes, "email": bench_email}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Nascomsoft billing pipeline benchmarks")
+    parser.add_argument("--suites", default=",".join(SUITES), help="comma separated: " + ",".join(SUITES))
+    parser.add_argument("--scale", type=int, default=10000, help="synthetic invoices to seed (10k-1M)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save-count", type=int, default=200, help="invoices per save_invoice batch")
+    parser.add_argument("--pdf-docs", type=int, default=1000, help="documents rendered per PDF output profile")
+    parser.add_argument("--statement-invoices", type=int, default=2000, help="invoices on the largest statement")
+    parser.add_argument("--email-count", type=int, default=20, help="emails per send_email batch")
+    parser.add_argument("--reseed", action="store_true", help="drop and regenerate synthetic rows")
+    parser.add_argument("--backend", choices=("mysql", "sqlite"), default="mysql")
+    parser.add_argument("--sqlite-path", default="nascomsoft_bench.db")
+    parser.add_argument("--db-host", default="localhost")
+    parser.add_argument("--db-user", default="root")
+    parser.add_argument("--db-password", default="")
+    parser.add_argument("--db-name", default="nascomsoft_bench_db")
+    parser.add_argument("--output", default="bench_results.json")
+    return parser.parse_args(argv)
+
+
+def open_database(args):
+    app.CONFIG.override(db={"backend": args.backend, "host": args.db_host, "user": args.db_user,
+                            "password": args.db_password, "database": args.db_name,
+                            "sqlite_path": args.sqlite_path})
+    db = app.DatabaseManager()
+    if not db.get_connection():
+        return None
+    return db
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    suites = [name.strip() for name in args.suites.split(",") if name.strip()]
+    unknown = [name for name in suites if name not in SUITES]
+    if unknown:
+        print(f"Unknown suite(s): {', '.join(unknown)}")
+        return 2
+
+    config = {"backend": args.backend, "scale": args.scale, "repeat": args.repeat, "seed": args.seed, "save_count": args.save_count,
+              "email_count": args.email_count, "pdf_docs": args.pdf_docs, "statement_invoices": args.statement_invoices, "reseed": args.reseed}
+    if {"db", "dates", "rows", "statement", "import", "catalog", "aging", "reconcile", "currency", "prices", "notes"} & set(suites):
+        config["db"] = open_database(args)
+        if config["db"] is None:
+            target = args.sqlite_path if args.backend == "sqlite" else f"{args.db_host}/{args.db_name}"
+            config["db_unavailable"] = f"cannot connect to {target}"
+
+    recorder = Recorder()
+    for name in suites:
+        print(f"[{name}]")
+        SUITES[name].run(app, recorder, config)
+
+    config.pop("db", None)
+    config["suites"] = suites
+    write_results(args.output, recorder, config)
+    print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
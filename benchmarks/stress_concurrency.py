@@ -0,0 +1,155 @@
+"""
+Multi-process stress test for concurrent clerks: number races, version-checked deletes and the change feed.
+
+    python -m benchmarks.stress_concurrency --workers 8 --ops 300
+    python -m benchmarks.stress_concurrency --backend mysql --db-name nascomsoft_stress_db
+
+Every worker process opens its own DatabaseManager on the shared database and runs a mix of
+~70% invoice creates (previewed number, renumber=True), ~20% deletes carrying the version the
+worker last read (so they race other workers' deletes) and ~10% change-feed polls. Afterwards the
+database must agree with what the workers were told: one row per successful create, one feed row
+per create and per delete, deleted rows at version 2 and no document deleted twice.
+Exits non-zero if any invariant fails.
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+STRESS_CLIENT = "STRESS Client"
+
+
+def worker(settings, worker_id, ops, seed, results):
+    import INVOICE_GENERATOR as app
+
+    db = app.DatabaseManager(app.make_backend(settings))
+    rng = random.Random(seed + worker_id)
+    stats = {"created": 0, "renumbered": 0, "create_failed": 0, "deleted": 0, "conflicts": 0,
+             "polls": 0, "feed_rows": 0}
+    feed_cursor = db.latest_change_id()
+    for _ in range(ops):
+        roll = rng.random()
+        if roll < 0.7:
+            number = db.generate_invoice_number()
+            data = {"invoice_no": number, "client_name": STRESS_CLIENT, "client_email": "", "client_address": "",
+                    "invoice_type": "Component", "subtotal": 100.0, "vat": 7.5, "shipping": 0.0,
+                    "wht": 0.0, "wht_rate": 0.0, "grand_total": 107.5}
+            items = [{"sn": "1", "desc": f"worker {worker_id}", "type": "Component", "qty": 1, "price": 100.0, "total": 100.0}]
+            if db.save_invoice(data, items, renumber=True):
+                stats["created"] += 1
+                stats["renumbered"] += data["invoice_no"] != number
+            else:
+                stats["create_failed"] += 1
+        elif roll < 0.9:
+            rows = db.fetch_invoices(filters={"client_name": STRESS_CLIENT}, page=1, page_size=10)
+            if not rows:
+                continue
+            row = rng.choice(rows)
+            # Give the other workers a window to delete the same row first
+            time.sleep(rng.random() * 0.005)
+            if db.delete_invoice(row["invoice_no"], expected_version=row["version"]):
+                stats["deleted"] += 1
+            else:
+                stats["conflicts"] += 1
+        else:
+            changes = db.fetch_changes(feed_cursor)
+            if changes:
+                feed_cursor = changes[-1][0]
+            stats["polls"] += 1
+            stats["feed_rows"] += len(changes)
+    db.audit.flush()
+    results.put(stats)
+
+
+def verify(app, settings, totals):
+    db = app.DatabaseManager(app.make_backend(settings))
+    db.get_connection()
+    failures = []
+
+    def scalar(sql, params=()):
+        db.cursor.execute(sql, params)
+        return db.cursor.fetchone()[0]
+
+    stored = scalar("SELECT COUNT(*) FROM invoices WHERE client_name = %s", (STRESS_CLIENT,))
+    if stored != totals["created"]:
+        failures.append(f"{stored} invoices stored but {totals['created']} creates reported success")
+    deleted = scalar("SELECT COUNT(*) FROM invoices WHERE client_name = %s AND deleted_at IS NOT NULL", (STRESS_CLIENT,))
+    if deleted != totals["deleted"]:
+        failures.append(f"{deleted} invoices deleted but {totals['deleted']} deletes reported success")
+    bad_versions = scalar("SELECT COUNT(*) FROM invoices WHERE client_name = %s AND "
+                          "((deleted_at IS NULL AND version <> 1) OR (deleted_at IS NOT NULL AND version <> 2))", (STRESS_CLIENT,))
+    if bad_versions:
+        failures.append(f"{bad_versions} invoices have a version that does not match their history")
+    for action, expected in (("create", totals["created"]), ("delete", totals["deleted"])):
+        logged = scalar("SELECT COUNT(*) FROM change_feed WHERE doc_kind = 'invoices' AND action = %s", (action,))
+        if logged != expected:
+            failures.append(f"change feed has {logged} '{action}' rows, expected {expected}")
+    double = scalar("SELECT COUNT(*) FROM (SELECT doc_number FROM audit_log WHERE action = 'delete' AND doc_number IN "
+                    "(SELECT invoice_number FROM invoices WHERE client_name = %s) "
+                    "GROUP BY doc_number HAVING COUNT(*) > 1) d", (STRESS_CLIENT,))
+    if double:
+        failures.append(f"{double} invoices were deleted more than once")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent clerk stress test")
+    parser.add_argument("--backend", choices=("sqlite", "mysql"), default="sqlite")
+    parser.add_argument("--sqlite-path", default=None, help="defaults to a temporary file")
+    parser.add_argument("--db-host", default="localhost")
+    parser.add_argument("--db-user", default="root")
+    parser.add_argument("--db-password", default="")
+    parser.add_argument("--db-name", default="nascomsoft_stress_db")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=300, help="operations per worker")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    import INVOICE_GENERATOR as app
+
+    with tempfile.TemporaryDirectory() as tmp:
+        settings = {"backend": args.backend, "host": args.db_host, "user": args.db_user,
+                    "password": args.db_password, "database": args.db_name,
+                    "sqlite_path": args.sqlite_path or os.path.join(tmp, "stress.db")}
+        # Migrate once and start from a clean slate for the stress client
+        db = app.DatabaseManager(app.make_backend(settings))
+        db.get_connection()
+        db.create_tables()
+        db.cursor.execute("DELETE FROM invoice_items WHERE invoice_number IN "
+                          "(SELECT invoice_number FROM invoices WHERE client_name = %s)", (STRESS_CLIENT,))
+        db.cursor.execute("DELETE FROM invoices WHERE client_name = %s", (STRESS_CLIENT,))
+        db.cursor.execute("DELETE FROM change_feed")
+        db.conn.commit()
+        db.conn.close()
+
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=worker, args=(settings, i, args.ops, args.seed, results))
+                 for i in range(args.workers)]
+        started = time.perf_counter()
+        for p in procs:
+            p.start()
+        collected = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+        elapsed = time.perf_counter() - started
+
+        totals = {key: sum(s[key] for s in collected) for key in collected[0]}
+        ops = args.workers * args.ops
+        print(f"{args.workers} workers x {args.ops} ops on {args.backend}: {ops / elapsed:,.0f} ops/s ({elapsed:.2f}s)")
+        print("  " + "  ".join(f"{k}={v}" for k, v in totals.items()))
+        failures = verify(app, settings, totals)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if any(p.exitcode for p in procs):
+        print("FAIL a worker process crashed")
+        return 1
+    print("all invariants held" if not failures else f"{len(failures)} invariant(s) failed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
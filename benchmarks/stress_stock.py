@@ -0,0 +1,190 @@
+"""
+Multi-process stress test for stock: many clerks selling the same few components at once.
+
+    python -m benchmarks.stress_stock --workers 8 --sales 200
+    python -m benchmarks.stress_stock --backend mysql --db-name nascomsoft_stress_db --products 2
+
+A handful of catalog products are received into stock, then every worker process opens its own
+DatabaseManager and saves Component invoices of 1-3 random lines from those products (renumber=True),
+with occasional top-up receipts. Stock runs out part way through, so later sales are refused with a
+shortage. Afterwards the database must agree with what the workers were told: per product, the
+counters sum to received minus sold, no counter is negative, the ledger nets to the counters, each
+saved invoice has exactly its lines in the ledger, refused invoices were not saved and the low-stock
+flags match the totals. Exits non-zero if any invariant fails.
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+STRESS_CLIENT = "STRESS Stock Client"
+SKU_PREFIX = "STRESS-STK"
+
+
+def worker(settings, worker_id, sales, seed, product_ids, results):
+    import INVOICE_GENERATOR as app
+
+    db = app.DatabaseManager(app.make_backend(settings))
+    rng = random.Random(seed + worker_id)
+    stats = {"sold": {pid: 0 for pid in product_ids}, "received": {pid: 0 for pid in product_ids},
+             "invoices": 0, "short": 0, "failed": 0, "receipts": 0}
+    for _ in range(sales):
+        if rng.random() < 0.03:
+            pid, qty = rng.choice(product_ids), rng.randint(5, 20)
+            total, _ = db.adjust_stock(pid, qty, reference=f"worker {worker_id}")
+            if total is not None:
+                stats["received"][pid] += qty
+                stats["receipts"] += 1
+            continue
+        lines = {}
+        for pid in rng.sample(product_ids, rng.randint(1, min(3, len(product_ids)))):
+            lines[pid] = rng.randint(1, 4)
+        items = [{"sn": str(i + 1), "desc": f"Stress part {pid}", "type": "Component", "qty": qty, "price": 10.0,
+                  "total": qty * 10.0, "product_id": pid} for i, (pid, qty) in enumerate(lines.items())]
+        subtotal = sum(item["total"] for item in items)
+        data = {"invoice_no": db.generate_invoice_number(), "client_name": STRESS_CLIENT, "client_email": "",
+                "client_address": "", "invoice_type": "Component", "subtotal": subtotal, "vat": 0.0, "shipping": 0.0,
+                "wht": 0.0, "wht_rate": 0.0, "grand_total": subtotal}
+        if db.save_invoice(data, items, renumber=True):
+            stats["invoices"] += 1
+            for pid, qty in lines.items():
+                stats["sold"][pid] += qty
+        elif data.get("stock_shortages"):
+            stats["short"] += 1
+        else:
+            stats["failed"] += 1
+    db.audit.flush()
+    results.put(stats)
+
+
+def verify(app, settings, product_ids, opening, totals):
+    db = app.DatabaseManager(app.make_backend(settings))
+    db.get_connection()
+    failures = []
+
+    def scalar(sql, params=()):
+        db.cursor.execute(sql, params)
+        return db.cursor.fetchone()[0]
+
+    on_hand = db.stock_on_hand(product_ids)
+    low = {row[0] for row in db.fetch_low_stock()}
+    for pid in product_ids:
+        expected = opening + totals["received"][pid] - totals["sold"][pid]
+        if on_hand.get(pid) != expected:
+            failures.append(f"product {pid}: {on_hand.get(pid)} in stock, expected {expected}")
+        ledger = scalar("SELECT COALESCE(SUM(qty_change), 0) FROM stock_ledger WHERE product_id = %s", (pid,))
+        if ledger != on_hand.get(pid):
+            failures.append(f"product {pid}: ledger nets to {ledger} but the counters hold {on_hand.get(pid)}")
+        sold = -scalar("SELECT COALESCE(SUM(qty_change), 0) FROM stock_ledger WHERE product_id = %s AND reason = 'sale'", (pid,))
+        if sold != totals["sold"][pid]:
+            failures.append(f"product {pid}: ledger has {sold} sold, workers reported {totals['sold'][pid]}")
+        reorder = scalar("SELECT reorder_level FROM products WHERE id = %s", (pid,))
+        if (pid in low) != (on_hand.get(pid, 0) <= reorder):
+            failures.append(f"product {pid}: low-stock flag is {pid in low} with {on_hand.get(pid)} in stock, reorder at {reorder}")
+    negative = scalar("SELECT COUNT(*) FROM stock_levels WHERE on_hand < 0")
+    if negative:
+        failures.append(f"{negative} stock counters went negative")
+    stored = scalar("SELECT COUNT(*) FROM invoices WHERE client_name = %s", (STRESS_CLIENT,))
+    if stored != totals["invoices"]:
+        failures.append(f"{stored} invoices stored but {totals['invoices']} sales reported success")
+    mismatched = scalar(
+        "SELECT COUNT(*) FROM (SELECT i.invoice_number, i.product_id, SUM(i.qty) AS qty FROM invoice_items i "
+        "JOIN invoices v ON v.invoice_number = i.invoice_number WHERE v.client_name = %s GROUP BY i.invoice_number, i.product_id) x "
+        "LEFT JOIN stock_ledger l ON l.doc_number = x.invoice_number AND l.product_id = x.product_id "
+        "WHERE l.qty_change IS NULL OR l.qty_change <> -x.qty", (STRESS_CLIENT,))
+    if mismatched:
+        failures.append(f"{mismatched} saved invoice lines have no matching ledger row")
+    orphans = scalar("SELECT COUNT(*) FROM stock_ledger l WHERE reason = 'sale' AND NOT EXISTS "
+                     "(SELECT 1 FROM invoices v WHERE v.invoice_number = l.doc_number)")
+    if orphans:
+        failures.append(f"{orphans} ledger rows belong to invoices that were not saved")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent component sales stress test")
+    parser.add_argument("--backend", choices=("sqlite", "mysql"), default="sqlite")
+    parser.add_argument("--sqlite-path", default=None, help="defaults to a temporary file")
+    parser.add_argument("--db-host", default="localhost")
+    parser.add_argument("--db-user", default="root")
+    parser.add_argument("--db-password", default="")
+    parser.add_argument("--db-name", default="nascomsoft_stress_db")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--sales", type=int, default=200, help="sales attempted per worker")
+    parser.add_argument("--products", type=int, default=3, help="hot products every worker sells")
+    parser.add_argument("--opening", type=int, default=0, help="opening stock per product (default: enough for ~80%% of demand)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    import INVOICE_GENERATOR as app
+
+    with tempfile.TemporaryDirectory() as tmp:
+        settings = {"backend": args.backend, "host": args.db_host, "user": args.db_user,
+                    "password": args.db_password, "database": args.db_name,
+                    "sqlite_path": args.sqlite_path or os.path.join(tmp, "stress.db")}
+        # Migrate once and start from a clean slate for the stress client and products
+        db = app.DatabaseManager(app.make_backend(settings))
+        db.get_connection()
+        db.create_tables()
+        db.cursor.execute("DELETE FROM invoice_items WHERE invoice_number IN "
+                          "(SELECT invoice_number FROM invoices WHERE client_name = %s)", (STRESS_CLIENT,))
+        db.cursor.execute("DELETE FROM invoices WHERE client_name = %s", (STRESS_CLIENT,))
+        for table in ("stock_levels", "stock_ledger", "stock_status"):
+            db.cursor.execute(f"DELETE FROM {table} WHERE product_id IN (SELECT id FROM products WHERE sku LIKE %s)",
+                              (SKU_PREFIX + "-%",))
+        db.conn.commit()
+        # Each sale takes ~2.5 units of ~2 of the products; open with enough for ~80% of the demand
+        demand = args.workers * args.sales * 2.5 * min(2, args.products) / args.products
+        opening = args.opening or int(demand * 0.8)
+        product_ids = []
+        for n in range(args.products):
+            sku = f"{SKU_PREFIX}-{n + 1}"
+            existing = db.fetch_products([sku])
+            data = {"sku": sku, "description": f"Stress part {n + 1}", "unit_price": "10", "reorder_level": opening // 4}
+            if existing:
+                data["id"] = existing[0].id
+            product_id, err = db.save_product(data)
+            if not product_id:
+                raise SystemExit(f"could not create {sku}: {err}")
+            db.adjust_stock(product_id, counted=opening, reason="stocktake")
+            product_ids.append(product_id)
+        db.audit.flush()
+        db.conn.close()
+
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=worker, args=(settings, i, args.sales, args.seed, product_ids, results))
+                 for i in range(args.workers)]
+        started = time.perf_counter()
+        for p in procs:
+            p.start()
+        collected = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+        elapsed = time.perf_counter() - started
+
+        totals = {key: sum(s[key] for s in collected) for key in ("invoices", "short", "failed", "receipts")}
+        for key in ("sold", "received"):
+            totals[key] = {pid: sum(s[key][pid] for s in collected) for pid in product_ids}
+        attempts = args.workers * args.sales
+        print(f"{args.workers} workers x {args.sales} sales of {args.products} product(s) on {args.backend}: "
+              f"{attempts / elapsed:,.0f} sales/s ({elapsed:.2f}s), opening stock {opening:,} each")
+        print(f"  invoices={totals['invoices']} short={totals['short']} failed={totals['failed']} receipts={totals['receipts']}  "
+              + "  ".join(f"sold[{pid}]={totals['sold'][pid]}" for pid in product_ids))
+        failures = verify(app, settings, product_ids, opening, totals)
+        if totals["failed"]:
+            failures.append(f"{totals['failed']} sales failed for a reason other than a stock shortage")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if any(p.exitcode for p in procs):
+        print("FAIL a worker process crashed")
+        return 1
+    print("all invariants held" if not failures else f"{len(failures)} invariant(s) failed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())